@@ -30,4 +30,19 @@ CREATE TABLE IF NOT EXISTS performance_log (
     status TEXT,
     error_message TEXT,
     created_at DATETIME DEFAULT CURRENT_TIMESTAMP
-);
\ No newline at end of file
+);
+-- 一括評価のジョブキュー。複数のホスト・プロセスが同じデータベースを共有して評価を分担するために使用する
+-- status: pending (未処理), running (リース中), done (完了), failed (失敗・再試行上限到達)
+-- lease_expires_at / heartbeat_at はUNIX時刻 (秒)。リースが切れた running のジョブは他のワーカーが再取得する
+CREATE TABLE IF NOT EXISTS evaluation_jobs (
+    ticker TEXT PRIMARY KEY,
+    status TEXT NOT NULL DEFAULT 'pending',
+    worker_id TEXT,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    lease_expires_at REAL,
+    heartbeat_at REAL,
+    enqueued_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+    finished_at DATETIME,
+    last_error TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_evaluation_jobs_status ON evaluation_jobs (status, lease_expires_at);
@@ -17,7 +17,7 @@ latest_stock_updates AS (
     -- 各銘柄の最新の株価更新日を取得
     SELECT
         ticker_symbol,
-        MAX(trade_date) AS last_updated
+        date(MAX(trade_day) * 86400, 'unixepoch') AS last_updated
     FROM
         daily_stock_prices
     GROUP BY
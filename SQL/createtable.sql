@@ -6,35 +6,39 @@ DROP TABLE IF EXISTS stock_info;
 DROP TABLE IF EXISTS trained_models;
 DROP TABLE IF EXISTS target_tickers;
 DROP TABLE IF EXISTS prediction_results;
+DROP TABLE IF EXISTS model_registry;
+DROP TABLE IF EXISTS historical_scores;
+DROP TABLE IF EXISTS stale_tickers;
+DROP TABLE IF EXISTS run_metrics;
 
 -- テーブル名: daily_stock_prices
 -- 日々の株価データ（始値、高値、安値、終値、出来高など）を格納
+-- (ticker_symbol, trade_day) を主キーとする WITHOUT ROWID テーブル。行は主キーのB-treeに銘柄・日付の順で格納されるため、
+-- 銘柄ごとの期間の読み込みは主キーの連続した範囲の走査1回で済む (rowid のテーブルと重複排除用のインデックスを別に持たない)
 CREATE TABLE daily_stock_prices (
-    id INTEGER PRIMARY KEY AUTOINCREMENT,
     ticker_symbol TEXT NOT NULL,
-    trade_date TEXT NOT NULL, -- YYYY-MM-DD 形式
+    trade_day INTEGER NOT NULL, -- 1970-01-01 からの日数 (YYYY-MM-DD の日付は date(trade_day * 86400, 'unixepoch') で得られる)
     open_price REAL NOT NULL,
     high_price REAL NOT NULL,
     low_price REAL NOT NULL,
     close_price REAL NOT NULL,
     adj_close_price REAL NOT NULL,
     volume INTEGER NOT NULL,
-    created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
-    updated_at DATETIME DEFAULT CURRENT_TIMESTAMP,
-    UNIQUE(ticker_symbol, trade_date) -- 同じ銘柄の同じ日付のデータは重複しない
-);
+    updated_at INTEGER NOT NULL DEFAULT (CAST(strftime('%s', 'now') AS INTEGER)), -- 行を挿入・変更したUNIX時刻 (秒)
+    PRIMARY KEY (ticker_symbol, trade_day)
+) WITHOUT ROWID;
 
--- daily_stock_prices テーブルのインデックス
-CREATE INDEX IF NOT EXISTS idx_stock_ticker_date ON daily_stock_prices (ticker_symbol, trade_date);
-CREATE INDEX IF NOT EXISTS idx_stock_trade_date ON daily_stock_prices (trade_date);
+-- daily_stock_prices テーブルのインデックス (全銘柄の直近の期間を読み込む処理用)
+CREATE INDEX IF NOT EXISTS idx_stock_trade_day ON daily_stock_prices (trade_day);
 
 
 -- テーブル名: macro_economic_indicators
 -- FREDなどから取得するマクロ経済指標を格納
+-- 観測値は元の頻度 (月次・日次など) のまま保存し、読み込み時に取引日へ揃える (stock_utils.align_macro_to_dates)
 CREATE TABLE macro_economic_indicators (
     id INTEGER PRIMARY KEY AUTOINCREMENT,
     series_id TEXT NOT NULL, -- FREDなどのSeries ID
-    indicator_date TEXT NOT NULL, -- YYYY-MM-DD 形式
+    indicator_date TEXT NOT NULL, -- 観測日 (YYYY-MM-DD 形式)
     value REAL NOT NULL,
     created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
     updated_at DATETIME DEFAULT CURRENT_TIMESTAMP,
@@ -113,6 +117,17 @@ CREATE TABLE trained_models (
 -- trained_models テーブルのインデックス
 CREATE INDEX IF NOT EXISTS idx_trained_models_ticker_name_version ON trained_models (ticker_symbol, model_name, model_version);
 
+-- テーブル名: model_registry
+-- 銘柄・モデル名ごとに、予測で使用する稼働中(チャンピオン)のバージョンを管理
+CREATE TABLE model_registry (
+    ticker_symbol TEXT NOT NULL, -- 予測対象の銘柄
+    model_name TEXT NOT NULL, -- モデルの識別名
+    active_version INTEGER NOT NULL, -- 稼働中のモデルバージョン
+    previous_version INTEGER NULL, -- ロールバック用の直前の稼働バージョン
+    promoted_at DATETIME DEFAULT CURRENT_TIMESTAMP, -- 昇格・ロールバックが行われた日時
+    PRIMARY KEY (ticker_symbol, model_name)
+);
+
 -- テーブル名: target_tickers
 -- 予測対象とする銘柄と、その際に使用する特徴量のリストを管理
 CREATE TABLE target_tickers (
@@ -139,4 +154,46 @@ CREATE TABLE prediction_results (
 
 -- prediction_results テーブルのインデックス
 CREATE INDEX IF NOT EXISTS idx_prediction_results_ticker_date ON prediction_results (ticker, target_date);
-CREATE INDEX IF NOT EXISTS idx_prediction_results_model ON prediction_results (model_name, model_version);
\ No newline at end of file
+CREATE INDEX IF NOT EXISTS idx_prediction_results_model ON prediction_results (model_name, model_version);
+
+-- テーブル名: historical_scores
+-- 学習済みモデルで過去の全特徴量行を評価した予測確率を保存 (キャリブレーション・閾値調整・シグナルのバックテスト用)
+CREATE TABLE historical_scores (
+    ticker_symbol TEXT NOT NULL, -- 銘柄
+    model_name TEXT NOT NULL, -- モデルの識別名
+    model_version INTEGER NOT NULL, -- 評価に使用したモデルのバージョン
+    trade_date TEXT NOT NULL, -- 特徴量の基準日 (YYYY-MM-DD 形式)
+    probability REAL NOT NULL, -- 予測された確率
+    target_label INTEGER NULL, -- 実際の結果 (1 or 0)。予測期間が経過していない日はNULL
+    scored_at DATETIME DEFAULT CURRENT_TIMESTAMP, -- 評価を実行した日時
+    PRIMARY KEY (ticker_symbol, model_name, model_version, trade_date)
+) WITHOUT ROWID;
+
+-- テーブル名: stale_tickers
+-- 株式分割・配当などで過去の調整後終値が改訂され、株価履歴を取り直した銘柄を記録
+-- 派生データ (モデル・特徴量から計算した過去スコア) が古い履歴に基づいていることを示す
+CREATE TABLE stale_tickers (
+    ticker_symbol TEXT PRIMARY KEY, -- 銘柄
+    adjustment_ratio REAL NOT NULL, -- 検出した調整後終値の変化率 (新しい値 / 保存済みの値)
+    detected_at DATETIME DEFAULT CURRENT_TIMESTAMP, -- 検出して株価履歴を置き換えた日時
+    models_stale INTEGER NOT NULL DEFAULT 1, -- 1: モデルの再学習が必要
+    features_stale INTEGER NOT NULL DEFAULT 1 -- 1: 特徴量から計算したデータ (historical_scores など) の再計算が必要
+);
+
+-- テーブル名: run_metrics
+-- 各スクリプトの実行ごとの処理段階 (データ読み込み・特徴量生成・探索・学習・予測・書き込みなど) の計測結果を格納
+-- stage = 'total' の行に実行全体の時間・ピークメモリ・終了状態を記録する (instrumentation.py)
+CREATE TABLE run_metrics (
+    run_id TEXT NOT NULL, -- 実行ごとの一意なID
+    entry_point TEXT NOT NULL, -- 実行したスクリプト (predict_all, train_model など)
+    started_at DATETIME NOT NULL, -- 実行の開始日時
+    stage TEXT NOT NULL, -- 処理段階の名前
+    calls INTEGER NOT NULL, -- 処理段階が実行された回数
+    total_seconds REAL NOT NULL, -- 合計時間 (秒)。ワーカープロセスの時間は合算される
+    max_seconds REAL NOT NULL, -- 1回あたりの最長時間 (秒)
+    rows INTEGER NULL, -- 処理した行数・件数の合計
+    peak_rss_mb REAL NULL, -- ピークメモリ使用量 (MB, total の行のみ)
+    status TEXT NULL, -- 'success' または 'failed' (total の行のみ)
+    PRIMARY KEY (run_id, stage)
+);
+CREATE INDEX idx_run_metrics_entry_point ON run_metrics (entry_point, started_at);
@@ -2,21 +2,18 @@
 
 -- テーブル名: daily_stock_prices
 CREATE TABLE IF NOT EXISTS daily_stock_prices (
-    id INTEGER PRIMARY KEY AUTOINCREMENT,
     ticker_symbol TEXT NOT NULL,
-    trade_date TEXT NOT NULL,
+    trade_day INTEGER NOT NULL,
     open_price REAL NOT NULL,
     high_price REAL NOT NULL,
     low_price REAL NOT NULL,
     close_price REAL NOT NULL,
     adj_close_price REAL NOT NULL,
     volume INTEGER NOT NULL,
-    created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
-    updated_at DATETIME DEFAULT CURRENT_TIMESTAMP,
-    UNIQUE(ticker_symbol, trade_date)
-);
-CREATE INDEX IF NOT EXISTS idx_stock_ticker_date ON daily_stock_prices (ticker_symbol, trade_date);
-CREATE INDEX IF NOT EXISTS idx_stock_trade_date ON daily_stock_prices (trade_date);
+    updated_at INTEGER NOT NULL DEFAULT (CAST(strftime('%s', 'now') AS INTEGER)),
+    PRIMARY KEY (ticker_symbol, trade_day)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS idx_stock_trade_day ON daily_stock_prices (trade_day);
 
 -- テーブル名: macro_economic_indicators
 CREATE TABLE IF NOT EXISTS macro_economic_indicators (
@@ -79,6 +76,21 @@ CREATE TABLE IF NOT EXISTS trained_models (
 );
 CREATE INDEX IF NOT EXISTS idx_trained_models_ticker_name_version ON trained_models (ticker_symbol, model_name, model_version);
 
+-- テーブル名: model_registry
+CREATE TABLE IF NOT EXISTS model_registry (
+    ticker_symbol TEXT NOT NULL,
+    model_name TEXT NOT NULL,
+    active_version INTEGER NOT NULL,
+    previous_version INTEGER NULL,
+    promoted_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (ticker_symbol, model_name)
+);
+-- 稼働中モデルが未登録の組み合わせには、既存の最新バージョンを登録する (既存の登録は変更しない)
+INSERT OR IGNORE INTO model_registry (ticker_symbol, model_name, active_version)
+SELECT ticker_symbol, model_name, MAX(model_version)
+FROM trained_models
+GROUP BY ticker_symbol, model_name;
+
 -- テーブル名: target_tickers
 CREATE TABLE IF NOT EXISTS target_tickers (
     ticker TEXT PRIMARY KEY,
@@ -100,4 +112,41 @@ CREATE TABLE IF NOT EXISTS prediction_results (
     FOREIGN KEY (ticker) REFERENCES stock_info(ticker_symbol) ON DELETE CASCADE
 );
 CREATE INDEX IF NOT EXISTS idx_prediction_results_ticker_date ON prediction_results (ticker, target_date);
-CREATE INDEX IF NOT EXISTS idx_prediction_results_model ON prediction_results (model_name, model_version);
\ No newline at end of file
+CREATE INDEX IF NOT EXISTS idx_prediction_results_model ON prediction_results (model_name, model_version);
+
+-- テーブル名: historical_scores
+CREATE TABLE IF NOT EXISTS historical_scores (
+    ticker_symbol TEXT NOT NULL,
+    model_name TEXT NOT NULL,
+    model_version INTEGER NOT NULL,
+    trade_date TEXT NOT NULL,
+    probability REAL NOT NULL,
+    target_label INTEGER NULL,
+    scored_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (ticker_symbol, model_name, model_version, trade_date)
+) WITHOUT ROWID;
+
+-- テーブル名: stale_tickers
+CREATE TABLE IF NOT EXISTS stale_tickers (
+    ticker_symbol TEXT PRIMARY KEY,
+    adjustment_ratio REAL NOT NULL,
+    detected_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+    models_stale INTEGER NOT NULL DEFAULT 1,
+    features_stale INTEGER NOT NULL DEFAULT 1
+);
+
+-- テーブル名: run_metrics
+CREATE TABLE IF NOT EXISTS run_metrics (
+    run_id TEXT NOT NULL,
+    entry_point TEXT NOT NULL,
+    started_at DATETIME NOT NULL,
+    stage TEXT NOT NULL,
+    calls INTEGER NOT NULL,
+    total_seconds REAL NOT NULL,
+    max_seconds REAL NOT NULL,
+    rows INTEGER NULL,
+    peak_rss_mb REAL NULL,
+    status TEXT NULL,
+    PRIMARY KEY (run_id, stage)
+);
+CREATE INDEX IF NOT EXISTS idx_run_metrics_entry_point ON run_metrics (entry_point, started_at);
@@ -0,0 +1,155 @@
+"""
+分析用の読み込み性能のベンチマーク。
+
+一時的なSQLiteデータベースに合成データ (株価・モデル・予測結果・評価ログ・過去スコア) を書き込み、
+analytics.py の名前付きクエリと全銘柄の株価の読み込みを、SQLite と DuckDB (Parquet の複製) で比較する。
+両エンジンの結果が一致することも確認する。複製の作成にかかる時間は別に表示する。
+
+  prediction_summary : prediction_summary ビューと同じクエリ (監視銘柄ごとの最新の予測とモデルの評価指標)
+  leaderboard        : performance_log の銘柄・方向ごとの集計と順位
+  universe_snapshot  : 全銘柄の最新の株価・20日/1年リターン・出来高 (ウィンドウ関数による全期間の走査)
+  score_hit_rate     : historical_scores のモデルごとの的中率
+  price_panel        : 全銘柄の全期間の株価の読み込み (backfill_scores.py)
+
+使用例:
+  python benchmarks/bench_analytics.py
+  python benchmarks/bench_analytics.py --tickers 1000 --years 10
+"""
+import argparse
+import datetime
+import json
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+PROJECT_ROOT = os.path.dirname(BENCH_DIR)
+sys.path.append(os.path.join(PROJECT_ROOT, 'script'))
+sys.path.append(BENCH_DIR)
+
+from synthetic import synthetic_tickers, synthetic_universe, trading_days
+from update_stock_data import build_price_rows, upsert_price_rows
+from db_connector import DBConnector
+from analytics import QUERIES, AnalyticsEngine, refresh_mirror
+
+SCHEMA_PATHS = [os.path.join(PROJECT_ROOT, 'SQL', name) for name in ('ensure_schema.sql', 'create_evaluation_tables.sql')]
+DIRECTIONS = ['up', 'down']
+MODEL_NAMES = {'up': 'LGBM_10d_up_3pct', 'down': 'LGBM_10d_down_3pct'}
+
+
+def create_database(path, frames, score_days, predictions_days, evaluations, seed=0):
+    """株価と、モデル・予測結果・評価ログ・過去スコアの合成データを書き込む"""
+    rng = np.random.default_rng(seed)
+    conn = sqlite3.connect(path)
+    for schema_path in SCHEMA_PATHS:
+        with open(schema_path, 'r', encoding='utf-8') as f:
+            conn.executescript(f.read())
+    upsert_price_rows(conn, [row for ticker, df in frames.items() for row in build_price_rows(ticker, df)])
+
+    tickers = list(frames)
+    conn.executemany("INSERT INTO stock_info (ticker_symbol, company_name) VALUES (?, ?)", [(t, f"Company {t}") for t in tickers])
+    conn.executemany("INSERT INTO target_tickers (ticker, features) VALUES (?, '')", [(t,) for t in tickers])
+    models, predictions, logs, scores = [], [], [], []
+    for ticker in tickers:
+        dates = frames[ticker].index.strftime('%Y-%m-%d')
+        for direction in DIRECTIONS:
+            metrics = {k: float(rng.uniform(0.4, 0.9)) for k in ('recall', 'roc_auc', 'accuracy', 'f1_score')}
+            models.append((MODEL_NAMES[direction], 1, ticker, '[]', b'', b'', '{}', json.dumps(metrics)))
+            for date in dates[-predictions_days:]:
+                predictions.append((f"{date} 18:00:00", date, ticker, direction, float(rng.uniform()), MODEL_NAMES[direction], 1))
+            for version in range(1, evaluations + 1):
+                logs.append((ticker, direction, version, float(rng.uniform(0.4, 0.9)), float(rng.uniform(0.2, 0.8))))
+            probabilities = rng.uniform(size=score_days)
+            labels = (rng.uniform(size=score_days) < probabilities).astype(int)
+            scores.extend(zip([ticker] * score_days, [MODEL_NAMES[direction]] * score_days, [1] * score_days,
+                              dates[-score_days:], probabilities.tolist(), labels.tolist()))
+    conn.executemany(
+        "INSERT INTO trained_models (model_name, model_version, ticker_symbol, feature_list, model_object, scaler_object, hyperparameters, performance_metrics) "
+        "VALUES (?, ?, ?, ?, ?, ?, ?, ?)", models)
+    conn.executemany(
+        "INSERT INTO prediction_results (prediction_timestamp, target_date, ticker, direction, probability, model_name, model_version) "
+        "VALUES (?, ?, ?, ?, ?, ?, ?)", predictions)
+    conn.executemany(
+        "INSERT INTO performance_log (ticker, direction, model_version, roc_auc, f1_score, status) VALUES (?, ?, ?, ?, ?, 'success')", logs)
+    conn.executemany(
+        "INSERT INTO historical_scores (ticker_symbol, model_name, model_version, trade_date, probability, target_label) "
+        "VALUES (?, ?, ?, ?, ?, ?)", scores)
+    conn.commit()
+    conn.close()
+
+
+def normalize(df):
+    """エンジンによる型の違い (NULL の表現・整数型) を揃えて比較できるようにする"""
+    columns = {}
+    for column in df.columns:
+        numeric = pd.to_numeric(df[column], errors='coerce')
+        if numeric.notna().sum() == df[column].notna().sum():
+            columns[column] = numeric.astype('float64')
+        else:
+            columns[column] = df[column].astype(object).where(df[column].notna(), None).astype(str)
+    return pd.DataFrame(columns)
+
+
+def time_best(fn, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        timings.append(time.perf_counter() - start)
+    return min(timings), result
+
+
+def report(name, n_rows, sqlite_seconds, duckdb_seconds):
+    speedup = sqlite_seconds / duckdb_seconds if duckdb_seconds else float('inf')
+    print(f"{name:<20} {n_rows:>10,} {sqlite_seconds:>10.3f} {duckdb_seconds:>10.3f} {speedup:>8.1f}x")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="分析用の読み込みを SQLite と DuckDB (Parquet の複製) で比較します。")
+    parser.add_argument('--tickers', type=int, default=400, help="銘柄数 (デフォルト: 400)")
+    parser.add_argument('--years', type=int, default=10, help="銘柄ごとの株価の年数 (デフォルト: 10)")
+    parser.add_argument('--score-days', type=int, default=750, help="銘柄・方向ごとの過去スコアの日数 (デフォルト: 750)")
+    parser.add_argument('--prediction-days', type=int, default=60, help="銘柄・方向ごとの予測結果の日数 (デフォルト: 60)")
+    parser.add_argument('--evaluations', type=int, default=5, help="銘柄・方向ごとの評価ログの件数 (デフォルト: 5)")
+    parser.add_argument('--repeat', type=int, default=3, help="各エンジンの実行回数。最短時間を採用します。")
+    args = parser.parse_args()
+
+    tickers = synthetic_tickers(args.tickers)
+    frames = synthetic_universe(tickers, trading_days(years=args.years), seed=0)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        db_connector = DBConnector(os.path.join(tmp_dir, 'bench.db'))
+        create_database(db_connector.db_path, frames, args.score_days, args.prediction_days, args.evaluations)
+        mirror_dir = os.path.join(tmp_dir, 'analytics')
+
+        print(f"--- 分析用の読み込みベンチマーク: {datetime.datetime.now()} ---")
+        start = time.perf_counter()
+        refreshed = refresh_mirror(db_connector, mirror_dir)
+        mirror_mb = sum(os.path.getsize(os.path.join(mirror_dir, f)) for f in os.listdir(mirror_dir)) / 1024 / 1024
+        print(f"複製の作成: {sum(refreshed.values()):,}行, {mirror_mb:.1f}MB, {time.perf_counter() - start:.2f}秒 "
+              f"(SQLite: {os.path.getsize(db_connector.db_path) / 1024 / 1024:.1f}MB)")
+        print(f"{'scenario':<20} {'rows':>10} {'sqlite(s)':>10} {'duckdb(s)':>10} {'speedup':>9}")
+
+        with AnalyticsEngine(db_connector, 'sqlite', mirror_dir) as sqlite_engine, \
+                AnalyticsEngine(db_connector, 'duckdb', mirror_dir) as duckdb_engine:
+            for name in QUERIES:
+                sqlite_seconds, sqlite_result = time_best(lambda: sqlite_engine.query(name), args.repeat)
+                duckdb_seconds, duckdb_result = time_best(lambda: duckdb_engine.query(name), args.repeat)
+                pd.testing.assert_frame_equal(normalize(duckdb_result), normalize(sqlite_result), rtol=1e-9)
+                report(name, len(sqlite_result), sqlite_seconds, duckdb_seconds)
+
+            n_rows = sum(len(df) for df in frames.values())
+            sqlite_seconds, sqlite_panel = time_best(lambda: sqlite_engine.load_price_panel(tickers), args.repeat)
+            duckdb_seconds, duckdb_panel = time_best(lambda: duckdb_engine.load_price_panel(tickers), args.repeat)
+            for ticker in tickers:
+                pd.testing.assert_frame_equal(duckdb_panel[ticker], sqlite_panel[ticker])
+            report('price_panel', n_rows, sqlite_seconds, duckdb_seconds)
+        db_connector.close_idle()
+
+
+if __name__ == "__main__":
+    main()
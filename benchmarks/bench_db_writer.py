@@ -0,0 +1,175 @@
+"""
+同時書き込みの負荷試験。
+
+複数のプロセス・スレッドから一時的なSQLiteデータベースにモデルを保存し続け、同時に別のプロセスが読み込みを行う。
+以下の2つの方式で、ロック競合のエラー (database is locked)・バージョン番号の重複・読み込みの最大待ち時間を比較する。
+
+  legacy : 変更前の save_model_to_db と同じ手順。書き込みごとに PRAGMA 無しで接続し、
+           SELECT MAX(model_version) の後に別の INSERT でバージョンを採番する
+  writer : 現在の方式。config.ini の既定の設定 (WAL・busy_timeout) で開いた DBConnector の接続を使う DBWriter に書き込みを集約し、
+           insert_trained_model で採番と挿入を1文で行う。同時に依頼された書き込みはまとめてコミットされる
+
+使用例:
+  python benchmarks/bench_db_writer.py
+  python benchmarks/bench_db_writer.py --processes 8 --threads 8 --ops 50
+"""
+import argparse
+import datetime
+import multiprocessing
+import os
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+PROJECT_ROOT = os.path.dirname(BENCH_DIR)
+sys.path.append(os.path.join(PROJECT_ROOT, 'script'))
+
+SCHEMA_PATH = os.path.join(PROJECT_ROOT, 'SQL', 'ensure_schema.sql')
+# 全てのスレッドが同じ銘柄・モデルのバージョンを採番し合うようにして、採番の競合を最大にする
+TICKER = 'LOAD.T'
+MODEL_NAME = 'LGBM_loadtest'
+MODEL_BYTES = b'\0' * 4096
+
+
+def create_database(path):
+    conn = sqlite3.connect(path)
+    with open(SCHEMA_PATH, 'r', encoding='utf-8') as f:
+        conn.executescript(f.read())
+    conn.close()
+
+
+def legacy_save(db_path):
+    """変更前の save_model_to_db の手順 (接続を開き、MAX を読んでから INSERT する)"""
+    conn = sqlite3.connect(db_path)
+    try:
+        cur = conn.cursor()
+        cur.execute("SELECT MAX(model_version) FROM trained_models WHERE ticker_symbol = ? AND model_name = ?", (TICKER, MODEL_NAME))
+        new_version = (cur.fetchone()[0] or 0) + 1
+        cur.execute(
+            """INSERT INTO trained_models (model_name, model_version, ticker_symbol, feature_list, model_object, scaler_object, hyperparameters, performance_metrics, notes)
+               VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)""",
+            (MODEL_NAME, new_version, TICKER, '[]', MODEL_BYTES, MODEL_BYTES, '{}', '{}', 'load test')
+        )
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def classify_error(error):
+    if isinstance(error, sqlite3.IntegrityError):
+        return 'duplicate_version'
+    if 'locked' in str(error) or 'busy' in str(error):
+        return 'locked'
+    return 'other'
+
+
+def writer_process(mode, db_path, threads, ops):
+    """1つのプロセスで threads 個のスレッドから ops 件ずつ書き込み、結果の件数を返す"""
+    from db_connector import DBConnector
+    from db_writer import DBWriter
+    from train_model import insert_trained_model
+
+    counts = {'ok': 0, 'locked': 0, 'duplicate_version': 0, 'other': 0, 'commits': 0, 'seconds': 0.0}
+    lock = threading.Lock()
+    writer = DBWriter(DBConnector(db_path)).start() if mode == 'writer' else None
+
+    def work():
+        for _ in range(ops):
+            try:
+                if writer is not None:
+                    writer.call(insert_trained_model, TICKER, MODEL_NAME, '[]', MODEL_BYTES, MODEL_BYTES, '{}', '{}', 'load test')
+                else:
+                    legacy_save(db_path)
+                outcome = 'ok'
+            except Exception as e:
+                outcome = classify_error(e)
+            with lock:
+                counts[outcome] += 1
+
+    # モジュールの読み込み時間を含めないよう、書き込みの開始から計測する
+    start = time.perf_counter()
+    workers = [threading.Thread(target=work) for _ in range(threads)]
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    if writer is not None:
+        writer.close()
+        counts['commits'] = writer.stats['commits']
+    counts['seconds'] = time.perf_counter() - start
+    return counts
+
+
+def reader_process(mode, db_path, stop_event, results):
+    """書き込み中にモデル一覧の読み込みを繰り返し、最大の待ち時間とエラー数を記録する"""
+    if mode == 'writer':
+        from db_connector import DBConnector
+        conn = DBConnector(db_path).open_connection()
+    else:
+        conn = sqlite3.connect(db_path)
+    max_latency, reads, errors = 0.0, 0, 0
+    while not stop_event.is_set():
+        start = time.perf_counter()
+        try:
+            conn.execute("SELECT COUNT(*), MAX(model_version) FROM trained_models WHERE ticker_symbol = ?", (TICKER,)).fetchone()
+            reads += 1
+        except sqlite3.Error:
+            errors += 1
+        max_latency = max(max_latency, time.perf_counter() - start)
+    conn.close()
+    results.update({'reads': reads, 'read_errors': errors, 'max_read_ms': max_latency * 1000})
+
+
+def run_mode(mode, processes, threads, ops):
+    context = multiprocessing.get_context('spawn')
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        db_path = os.path.join(tmp_dir, 'bench.db')
+        create_database(db_path)
+        manager = context.Manager()
+        stop_event, read_results = manager.Event(), manager.dict()
+        reader = context.Process(target=reader_process, args=(mode, db_path, stop_event, read_results))
+        reader.start()
+
+        with context.Pool(processes) as pool:
+            per_process = pool.starmap(writer_process, [(mode, db_path, threads, ops)] * processes)
+        stop_event.set()
+        reader.join()
+
+        totals = {key: sum(counts[key] for counts in per_process) for key in per_process[0]}
+        elapsed = max(counts['seconds'] for counts in per_process)
+        conn = sqlite3.connect(db_path)
+        versions = [row[0] for row in conn.execute(
+            "SELECT model_version FROM trained_models WHERE ticker_symbol = ? ORDER BY model_version", (TICKER,))]
+        conn.close()
+        totals['contiguous'] = versions == list(range(1, len(versions) + 1))
+        totals.update(read_results)
+        manager.shutdown()
+
+    commits = totals['commits'] or totals['ok']
+    print(f"{mode:<8} {totals['ok']:>6} {totals['locked']:>7} {totals['duplicate_version']:>10} {totals['other']:>6} "
+          f"{str(totals['contiguous']):>10} {totals['ok'] / elapsed:>8.0f} {totals['ok'] / commits if commits else 0:>12.1f} "
+          f"{totals.get('max_read_ms', 0):>12.1f} {totals.get('read_errors', 0):>8}")
+    return totals
+
+
+def main():
+    parser = argparse.ArgumentParser(description="複数のプロセス・スレッドからの同時書き込みでロック競合とバージョン番号の重複を計測します。")
+    parser.add_argument('--processes', type=int, default=4, help="書き込みを行うプロセス数 (デフォルト: 4)")
+    parser.add_argument('--threads', type=int, default=8, help="プロセスごとの書き込みスレッド数 (デフォルト: 8)")
+    parser.add_argument('--ops', type=int, default=25, help="スレッドごとの書き込み回数 (デフォルト: 25)")
+    parser.add_argument('--modes', nargs='+', default=['legacy', 'writer'], choices=['legacy', 'writer'], help="計測する方式")
+    args = parser.parse_args()
+
+    print(f"--- 同時書き込みの負荷試験: {datetime.datetime.now()} ---")
+    print(f"書き込み: {args.processes}プロセス x {args.threads}スレッド x {args.ops}回 = {args.processes * args.threads * args.ops}件 (読み込み: 1プロセス)")
+    print(f"{'mode':<8} {'ok':>6} {'locked':>7} {'duplicate':>10} {'other':>6} {'contiguous':>10} {'ops/s':>8} "
+          f"{'writes/commit':>12} {'max read(ms)':>12} {'read err':>8}")
+    for mode in args.modes:
+        run_mode(mode, args.processes, args.threads, args.ops)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,139 @@
+"""
+株価取り込み処理の書き込み性能のベンチマーク。
+
+一時的なSQLiteデータベースに合成データを書き込み、以下の2つのシナリオで
+従来の方式 (銘柄ごとの MAX(trade_date) クエリ・iterrows・銘柄ごとのコミット) と
+現在の方式 (集約クエリ1回・カラム単位の変換・複数銘柄をまとめたコミット) を比較する。
+
+  daily    : 直近の履歴がある 4,000 銘柄に1日分の株価を追加する (日次更新)
+  backfill : 履歴の無い銘柄に10年分の株価を書き込む (初回取り込み)
+
+使用例:
+  python benchmarks/bench_ingestion.py
+  python benchmarks/bench_ingestion.py --daily-tickers 4000 --backfill-tickers 500
+"""
+import argparse
+import datetime
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+PROJECT_ROOT = os.path.dirname(BENCH_DIR)
+sys.path.append(os.path.join(PROJECT_ROOT, 'script'))
+sys.path.append(BENCH_DIR)
+
+from synthetic import synthetic_tickers, synthetic_universe, trading_days
+from update_stock_data import get_last_trade_dates_from_db, build_price_rows, PriceRowBuffer
+from db_connector import date_to_trade_day
+
+SCHEMA_PATH = os.path.join(PROJECT_ROOT, 'SQL', 'ensure_schema.sql')
+
+LEGACY_UPSERT = """
+    INSERT INTO daily_stock_prices (
+        ticker_symbol, trade_day, open_price, high_price, low_price,
+        close_price, adj_close_price, volume
+    )
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+    ON CONFLICT (ticker_symbol, trade_day) DO UPDATE SET
+        open_price = excluded.open_price,
+        high_price = excluded.high_price,
+        low_price = excluded.low_price,
+        close_price = excluded.close_price,
+        adj_close_price = excluded.adj_close_price,
+        volume = excluded.volume,
+        updated_at = CAST(strftime('%s', 'now') AS INTEGER);
+"""
+
+
+def create_database(path):
+    conn = sqlite3.connect(path)
+    with open(SCHEMA_PATH, 'r', encoding='utf-8') as f:
+        conn.executescript(f.read())
+    return conn
+
+
+def legacy_ingest(conn, frames):
+    """変更前の update_stock_data.py と同じ手順: 銘柄ごとに最新日を問い合わせ、iterrows で行を作り、銘柄ごとにコミットする"""
+    for ticker, df in frames.items():
+        conn.execute("SELECT MAX(trade_day) FROM daily_stock_prices WHERE ticker_symbol = ?", (ticker,)).fetchone()
+        rows = [
+            (ticker, date_to_trade_day(index.date()), row['Open'], row['High'], row['Low'],
+             row['Close'], row['Adj Close'], row['Volume'])
+            for index, row in df.iterrows()
+        ]
+        conn.executemany(LEGACY_UPSERT, rows)
+        conn.commit()
+
+
+def current_ingest(conn, frames):
+    """現在の update_stock_data.py の手順: 集約クエリ1回で最新日を取得し、カラム単位で変換して複数銘柄をまとめてコミットする"""
+    get_last_trade_dates_from_db(conn)
+    buffer = PriceRowBuffer(conn)
+    for ticker, df in frames.items():
+        buffer.add(ticker, df)
+    buffer.flush()
+
+
+def seed_history(conn, frames):
+    rows = [row for ticker, df in frames.items() for row in build_price_rows(ticker, df)]
+    conn.executemany(LEGACY_UPSERT, rows)
+    conn.commit()
+
+
+def run_scenario(name, history_frames, new_frames, repeat):
+    """シナリオごとに、各方式を新しいデータベースで repeat 回実行し、最短時間を返す"""
+    results = {}
+    n_rows = sum(len(df) for df in new_frames.values())
+    for method, ingest in (('legacy', legacy_ingest), ('current', current_ingest)):
+        timings = []
+        for _ in range(repeat):
+            with tempfile.TemporaryDirectory() as tmp_dir:
+                conn = create_database(os.path.join(tmp_dir, 'bench.db'))
+                if history_frames:
+                    seed_history(conn, history_frames)
+                # 書き込み結果が標準出力に大量に出ないよう、計測中の出力を抑制する
+                stdout, sys.stdout = sys.stdout, open(os.devnull, 'w')
+                try:
+                    start = time.perf_counter()
+                    ingest(conn, new_frames)
+                    timings.append(time.perf_counter() - start)
+                finally:
+                    sys.stdout.close()
+                    sys.stdout = stdout
+                conn.close()
+        results[method] = min(timings)
+
+    speedup = results['legacy'] / results['current'] if results['current'] else float('inf')
+    print(f"{name:<10} {len(new_frames):>8,} {n_rows:>12,} "
+          f"{results['legacy']:>10.2f} {results['current']:>10.2f} {n_rows / results['current']:>14,.0f} {speedup:>8.1f}x")
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="株価取り込み処理の書き込み性能を合成データで計測します。")
+    parser.add_argument('--daily-tickers', type=int, default=4000, help="日次更新シナリオの銘柄数 (デフォルト: 4000)")
+    parser.add_argument('--history-days', type=int, default=20, help="日次更新シナリオで事前に書き込んでおく履歴の日数 (デフォルト: 20)")
+    parser.add_argument('--backfill-tickers', type=int, default=200, help="10年分の取り込みシナリオの銘柄数 (デフォルト: 200)")
+    parser.add_argument('--backfill-years', type=int, default=10, help="取り込みシナリオの年数 (デフォルト: 10)")
+    parser.add_argument('--repeat', type=int, default=1, help="各方式の実行回数。最短時間を採用します。")
+    args = parser.parse_args()
+
+    print(f"--- 株価取り込みベンチマーク: {datetime.datetime.now()} ---")
+    print(f"{'scenario':<10} {'tickers':>8} {'rows':>12} {'legacy(s)':>10} {'current(s)':>10} {'current rows/s':>14} {'speedup':>9}")
+
+    daily_tickers = synthetic_tickers(args.daily_tickers)
+    days = trading_days(years=1)[-(args.history_days + 1):]
+    universe = synthetic_universe(daily_tickers, days, seed=0)
+    history = {ticker: df.iloc[:-1] for ticker, df in universe.items()}
+    latest_day = {ticker: df.iloc[-1:] for ticker, df in universe.items()}
+    run_scenario('daily', history, latest_day, args.repeat)
+
+    backfill = synthetic_universe(synthetic_tickers(args.backfill_tickers), trading_days(years=args.backfill_years), seed=1)
+    run_scenario('backfill', None, backfill, args.repeat)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,331 @@
+"""
+パイプライン全体のベンチマーク。
+
+合成の市場データ (synthetic.seed_market_database: N銘柄 × M年の株価・指数・マクロ経済指標・target_tickers) を
+規模ごとに一時的なSQLiteデータベースに作成し、ネットワークを使わずに以下の処理の時間を計測する。
+
+  ingest_backfill   : 空のデータベースへの全銘柄・全期間の株価のUPSERT (update_stock_data.py の初回取り込み)
+  ingest_daily      : 全銘柄への1日分の株価のUPSERT (日次更新)
+  load_all_data     : 監視銘柄ごとの株価・指数・マクロ経済指標の読み込み
+  create_features   : 監視銘柄ごとの特徴量の生成
+  search_<method>   : 1銘柄のハイパーパラメータ探索と最終学習 (train_model.py の全ての探索方法。config.ini のテストモードの探索範囲)
+  predict_ticker    : 監視銘柄ごとの predict.py の予測 (モデルの読み込み・特徴量の生成を含む)
+  predict_all       : 全監視銘柄の一括予測と予測結果の書き込み (predict_all.py の1プロセスでの処理)
+
+結果は JSON で benchmarks/results/ に保存する。--save-baseline を指定すると基準値 (ベースライン) としても保存し、
+compare コマンドで最新の結果をベースラインと比較して、しきい値を超えて遅くなった処理を報告する (該当がある場合は終了コード 1)。
+処理時間は実行環境に依存するため、ベースラインは比較に使うのと同じ環境で作成すること。
+
+使用例:
+  python benchmarks/bench_pipeline.py run --scales small medium --save-baseline
+  python benchmarks/bench_pipeline.py run --scales small medium
+  python benchmarks/bench_pipeline.py compare --threshold 0.2
+"""
+import argparse
+import contextlib
+import datetime
+import glob
+import io
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+PROJECT_ROOT = os.path.dirname(BENCH_DIR)
+sys.path.append(os.path.join(PROJECT_ROOT, 'script'))
+sys.path.append(PROJECT_ROOT)
+sys.path.append(BENCH_DIR)
+
+import lightgbm as lgb
+import optuna
+from sklearn.preprocessing import StandardScaler
+
+from synthetic import SYNTHETIC_INDEX_TICKERS, seed_market_database, synthetic_universe, trading_days
+from db_connector import DBConnector
+from update_stock_data import build_price_rows, upsert_price_rows
+from stock_utils import load_all_data, create_features
+from train_model import (
+    PREDICTION_HORIZON, RETURN_THRESHOLD, SEARCH_STRATEGIES,
+    create_classification_target, train_and_evaluate_classification, save_model_to_db, update_model_registry
+)
+from model_registry import get_model_name
+from predict import predict_ticker
+from batch_predict import load_prediction_targets, predict_targets
+from predict_all import save_results_to_db
+
+SCHEMA_PATH = os.path.join(PROJECT_ROOT, 'SQL', 'ensure_schema.sql')
+RESULTS_DIR = os.path.join(BENCH_DIR, 'results')
+BASELINE_PATH = os.path.join(BENCH_DIR, 'baselines', 'pipeline.json')
+
+# 規模ごとの (銘柄数, 年数)
+SCALES = {
+    'small': (10, 3),
+    'medium': (50, 5),
+    'large': (200, 10),
+}
+SEARCH_METHODS = list(SEARCH_STRATEGIES)
+# 銘柄ごとの処理 (load_all_data, create_features, predict_ticker) を計測する監視銘柄の数
+SAMPLE_TICKERS = 5
+# 学習に使う期間 (train_model.py の --training-years のデフォルトと同じ)
+TRAINING_YEARS = 5
+TEST_SIZE = 0.2
+
+
+def time_best(fn, repeat):
+    """fn を repeat 回実行し、最短の実行時間 (秒) と最後の戻り値を返す。各処理の表示は計測結果の表示の妨げになるため抑止する"""
+    timings = []
+    result = None
+    for _ in range(repeat):
+        with contextlib.redirect_stdout(io.StringIO()):
+            start = time.perf_counter()
+            result = fn()
+            timings.append(time.perf_counter() - start)
+    return min(timings), result
+
+
+def prepare_training_data(db_connector, ticker):
+    """train_model.py の main() と同じ手順で、1銘柄の学習用データとテスト用データを作成する"""
+    main_data, external_data, macro_data = load_all_data(db_connector, ticker, SYNTHETIC_INDEX_TICKERS)
+    features_df = create_features(main_data, external_data, macro_data)
+    targets_df, target_col = create_classification_target(features_df, PREDICTION_HORIZON, RETURN_THRESHOLD, 'up')
+    final_df = targets_df.dropna()
+    window_df = final_df.loc[final_df.index.max() - pd.DateOffset(years=TRAINING_YEARS):]
+    X = window_df[features_df.columns.intersection(window_df.columns)]
+    y = window_df[target_col]
+    train_size = int(len(X) * (1 - TEST_SIZE))
+    return X.iloc[:train_size], y.iloc[:train_size], X.iloc[train_size:], y.iloc[train_size:], target_col
+
+
+def register_quick_models(db_connector, tickers):
+    """予測の計測用に、監視銘柄ごと・方向ごとに小さなモデルを学習して稼働中モデルとして登録する"""
+    for ticker in tickers:
+        main_data, external_data, macro_data = load_all_data(db_connector, ticker, SYNTHETIC_INDEX_TICKERS)
+        features_df = create_features(main_data, external_data, macro_data)
+        for direction in ('up', 'down'):
+            targets_df, target_col = create_classification_target(features_df, PREDICTION_HORIZON, RETURN_THRESHOLD, direction)
+            final_df = targets_df.dropna()
+            X, y = final_df[features_df.columns], final_df[target_col]
+            scaler = StandardScaler()
+            X_scaled = X.copy()
+            X_scaled[X.columns.tolist()] = scaler.fit_transform(X)
+            model = lgb.LGBMClassifier(n_estimators=20, random_state=42, verbose=-1, n_jobs=1).fit(X_scaled, y)
+            model_name = get_model_name(direction)
+            version = save_model_to_db(db_connector, ticker, model_name, model, scaler, X.columns.tolist(), {}, {})
+            update_model_registry(db_connector, ticker, model_name, version, promote=True)
+
+
+def bench_ingestion(tmp_dir, n_tickers, years, repeat):
+    """空のデータベースへの全期間の書き込みと、1日分の追加の書き込みを計測する"""
+    tickers = [f"{2000 + i}.T" for i in range(n_tickers)]
+    dates = trading_days(years=years)
+    frames = synthetic_universe(tickers, dates, seed=0)
+    history_rows = [row for ticker, df in frames.items() for row in build_price_rows(ticker, df.iloc[:-1])]
+    daily_rows = [row for ticker, df in frames.items() for row in build_price_rows(ticker, df.iloc[-1:])]
+
+    def backfill():
+        db_connector = DBConnector(os.path.join(tmp_dir, f"ingest_{time.perf_counter_ns()}.db"))
+        with db_connector.connect() as conn:
+            with open(SCHEMA_PATH, 'r', encoding='utf-8') as f:
+                conn.executescript(f.read())
+            upsert_price_rows(conn, history_rows)
+        return db_connector
+
+    backfill_seconds, db_connector = time_best(backfill, repeat)
+    with db_connector.connect() as conn:
+        # 同じ行の2回目以降の書き込みは値が変わらないため更新されない。毎回新しい日として書き込む
+        daily_timings = []
+        for i in range(repeat):
+            rows = [row[:1] + (row[1] + i,) + row[2:] for row in daily_rows]
+            seconds, _ = time_best(lambda: upsert_price_rows(conn, rows), 1)
+            daily_timings.append(seconds)
+    return {
+        'ingest_backfill': {'seconds': backfill_seconds, 'rows': len(history_rows)},
+        'ingest_daily': {'seconds': min(daily_timings), 'rows': len(daily_rows)},
+    }
+
+
+def bench_scale(name, n_tickers, years, repeat, search_repeat):
+    """1つの規模の合成データベースを作成し、全ての処理を計測する"""
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        start = time.perf_counter()
+        db_connector = DBConnector(os.path.join(tmp_dir, 'bench.db'))
+        tickers = seed_market_database(db_connector.db_path, SCHEMA_PATH, n_tickers, years)
+        print(f"\n=== {name}: {n_tickers}銘柄 × {years}年 (データベースの作成: {time.perf_counter() - start:.1f}秒) ===")
+        sample = tickers[:SAMPLE_TICKERS]
+
+        results.update(bench_ingestion(tmp_dir, n_tickers, years, repeat))
+
+        seconds, loaded = time_best(
+            lambda: [load_all_data(db_connector, ticker, SYNTHETIC_INDEX_TICKERS) for ticker in sample], repeat)
+        results['load_all_data'] = {'seconds': seconds, 'calls': len(sample), 'rows': sum(len(data[0]) for data in loaded)}
+
+        seconds, features = time_best(lambda: [create_features(*data) for data in loaded], repeat)
+        results['create_features'] = {'seconds': seconds, 'calls': len(sample), 'rows': sum(len(df) for df in features)}
+
+        with contextlib.redirect_stdout(io.StringIO()):
+            X_train, y_train, X_test, y_test, target_col = prepare_training_data(db_connector, sample[0])
+        for method in SEARCH_METHODS:
+            seconds, (_, _, _, metrics, _) = time_best(
+                lambda: train_and_evaluate_classification(
+                    db_connector, X_train, y_train, X_test, y_test, target_col, sample[0], 'up',
+                    test_mode=True, search_method=method, save_model=False, n_jobs=1),
+                search_repeat)
+            results[f"search_{method}"] = {'seconds': seconds, 'rows': len(X_train), 'roc_auc': metrics['roc_auc']}
+
+        with contextlib.redirect_stdout(io.StringIO()):
+            register_quick_models(db_connector, tickers)
+
+        seconds, predictions = time_best(lambda: [predict_ticker(db_connector, ticker, 'up') for ticker in sample], repeat)
+        results['predict_ticker'] = {'seconds': seconds, 'calls': len(sample),
+                                     'rows': sum(prediction is not None for prediction in predictions)}
+
+        def predict_all():
+            all_results, _ = predict_targets(db_connector, load_prediction_targets(db_connector))
+            save_results_to_db(db_connector, all_results)
+            return all_results
+        seconds, all_results = time_best(predict_all, repeat)
+        results['predict_all'] = {'seconds': seconds, 'rows': len(all_results)}
+
+    print(f"{'benchmark':<20} {'seconds':>10} {'rows':>12}")
+    for benchmark, result in results.items():
+        rows = f"{result['rows']:,}" if 'rows' in result else '-'
+        print(f"{benchmark:<20} {result['seconds']:>10.3f} {rows:>12}")
+    return results
+
+
+def get_git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=PROJECT_ROOT,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def write_json(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, indent=2, ensure_ascii=False)
+        f.write('\n')
+
+
+def latest_result_path():
+    paths = sorted(glob.glob(os.path.join(RESULTS_DIR, 'pipeline_*.json')))
+    return paths[-1] if paths else None
+
+
+def run(args):
+    optuna.logging.set_verbosity(optuna.logging.WARNING)
+    print(f"--- パイプラインのベンチマーク: {datetime.datetime.now()} ---")
+    report = {
+        'created_at': datetime.datetime.now().isoformat(timespec='seconds'),
+        'git_commit': get_git_commit(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'repeat': args.repeat,
+        'scales': {},
+    }
+    for name in args.scales:
+        n_tickers, years = SCALES[name]
+        results = bench_scale(name, n_tickers, years, args.repeat, args.search_repeat)
+        report['scales'][name] = {'tickers': n_tickers, 'years': years, 'results': results}
+
+    output = args.output or os.path.join(RESULTS_DIR, f"pipeline_{datetime.datetime.now():%Y%m%d_%H%M%S}.json")
+    write_json(output, report)
+    print(f"\n結果を保存しました: {output}")
+    if args.save_baseline:
+        write_json(args.baseline, report)
+        print(f"ベースラインとして保存しました: {args.baseline}")
+
+
+def compare_reports(baseline, current, threshold, min_seconds):
+    """
+    規模・処理ごとに処理時間を比較した DataFrame を返す。
+    ベースラインより threshold の割合を超えて遅く、かつ差が min_seconds 秒以上の処理を regression とする。
+    """
+    rows = []
+    for scale, entry in current['scales'].items():
+        baseline_results = baseline['scales'].get(scale, {}).get('results', {})
+        for benchmark, result in entry['results'].items():
+            base = baseline_results.get(benchmark)
+            if base is None:
+                continue
+            change = result['seconds'] / base['seconds'] - 1 if base['seconds'] > 0 else np.nan
+            rows.append({
+                'scale': scale,
+                'benchmark': benchmark,
+                'baseline_s': base['seconds'],
+                'current_s': result['seconds'],
+                'change_pct': change * 100,
+                'regression': bool(change > threshold and result['seconds'] - base['seconds'] >= min_seconds),
+            })
+    return pd.DataFrame(rows, columns=['scale', 'benchmark', 'baseline_s', 'current_s', 'change_pct', 'regression'])
+
+
+def compare(args):
+    current_path = args.current or latest_result_path()
+    if current_path is None or not os.path.exists(args.baseline):
+        print(f"比較する結果 ({current_path}) またはベースライン ({args.baseline}) がありません。先に run を実行してください。")
+        return 2
+    with open(args.baseline, 'r', encoding='utf-8') as f:
+        baseline = json.load(f)
+    with open(current_path, 'r', encoding='utf-8') as f:
+        current = json.load(f)
+
+    print(f"ベースライン: {args.baseline} ({baseline['created_at']}, {baseline['git_commit']})")
+    print(f"比較する結果: {current_path} ({current['created_at']}, {current['git_commit']})")
+    df = compare_reports(baseline, current, args.threshold, args.min_seconds)
+    if df.empty:
+        print("共通する規模・処理がありません。")
+        return 2
+    with pd.option_context('display.width', 200, 'display.float_format', '{:.3f}'.format):
+        print(df.to_string(index=False))
+
+    regressions = df[df['regression']]
+    if regressions.empty:
+        print(f"\n{args.threshold:.0%} を超えて遅くなった処理はありません。")
+        return 0
+    print(f"\n{args.threshold:.0%} を超えて遅くなった処理が {len(regressions)}件あります:")
+    for row in regressions.itertuples():
+        print(f"  {row.scale}/{row.benchmark}: {row.baseline_s:.3f}秒 -> {row.current_s:.3f}秒 ({row.change_pct:+.0f}%)")
+    return 1
+
+
+def main():
+    parser = argparse.ArgumentParser(description="合成データでパイプライン全体の処理時間を計測し、ベースラインと比較します。")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    run_parser = subparsers.add_parser('run', help="ベンチマークを実行し、結果をJSONで保存します。")
+    run_parser.add_argument('--scales', nargs='+', choices=list(SCALES), default=['small', 'medium'],
+                            help="計測する規模 (デフォルト: small medium)")
+    run_parser.add_argument('--repeat', type=int, default=3, help="各処理の実行回数。最短時間を採用します。")
+    run_parser.add_argument('--search-repeat', type=int, default=1, help="ハイパーパラメータ探索の実行回数 (デフォルト: 1)")
+    run_parser.add_argument('--output', type=str, default=None, help="結果の保存先 (デフォルト: benchmarks/results/pipeline_<日時>.json)")
+    run_parser.add_argument('--save-baseline', action='store_true', help="結果をベースラインとしても保存します。")
+    run_parser.add_argument('--baseline', type=str, default=BASELINE_PATH, help="ベースラインのファイル")
+
+    compare_parser = subparsers.add_parser('compare', help="結果をベースラインと比較し、遅くなった処理を報告します。")
+    compare_parser.add_argument('--baseline', type=str, default=BASELINE_PATH, help="ベースラインのファイル")
+    compare_parser.add_argument('--current', type=str, default=None, help="比較する結果 (デフォルト: benchmarks/results/ の最新の結果)")
+    compare_parser.add_argument('--threshold', type=float, default=0.2,
+                                help="遅くなったと判定する割合 (デフォルト: 0.2 = 20%%)")
+    compare_parser.add_argument('--min-seconds', type=float, default=0.05,
+                                help="計測のばらつきを除くため、差がこの秒数未満の処理は判定しません (デフォルト: 0.05)")
+
+    args = parser.parse_args()
+    if args.command == 'run':
+        run(args)
+    else:
+        sys.exit(compare(args))
+
+
+if __name__ == "__main__":
+    main()
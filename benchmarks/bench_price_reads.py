@@ -0,0 +1,118 @@
+"""
+株価の読み込み性能のベンチマーク。
+
+一時的なSQLiteデータベースに合成データを書き込み、以下の2つのシナリオで
+従来の方式 (pd.read_sql で全銘柄をまとめて読み込み、parse_dates で日付を解析して銘柄ごとに groupby する) と
+現在の方式 (銘柄ごとの固定のSQLを fetchmany で NumPy 配列に読み込む load_price_panel) を比較する。
+両方式の結果が一致することも確認する。
+
+  universe : 全銘柄をまとめて読み込む (batch_predict.py, backfill_scores.py)
+  ticker   : 1銘柄と共通の外部指標5銘柄を、銘柄ごとに読み込む (一括評価・学習の load_all_data)
+
+使用例:
+  python benchmarks/bench_price_reads.py
+  python benchmarks/bench_price_reads.py --tickers 1000 --years 10
+"""
+import argparse
+import datetime
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+
+import pandas as pd
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+PROJECT_ROOT = os.path.dirname(BENCH_DIR)
+sys.path.append(os.path.join(PROJECT_ROOT, 'script'))
+sys.path.append(BENCH_DIR)
+
+from synthetic import synthetic_tickers, synthetic_universe, trading_days
+from update_stock_data import build_price_rows, upsert_price_rows
+from stock_utils import load_price_panel
+
+SCHEMA_PATH = os.path.join(PROJECT_ROOT, 'SQL', 'ensure_schema.sql')
+FEATURE_TICKERS = ['^N225', '^TPX', '^GSPC', 'JPY=X', 'CL=F']
+MAX_SQL_VARIABLES = 500
+
+
+def legacy_load_price_panel(conn, tickers):
+    """変更前の load_price_panel と同じ手順 (IN句でまとめて read_sql し、銘柄ごとに groupby する)"""
+    frames = []
+    for i in range(0, len(tickers), MAX_SQL_VARIABLES):
+        chunk = tickers[i:i + MAX_SQL_VARIABLES]
+        placeholders = ', '.join(['?' for _ in chunk])
+        query = f"""
+        SELECT ticker_symbol, date(trade_day * 86400, 'unixepoch') AS trade_date,
+               open_price, high_price, low_price, adj_close_price, volume
+        FROM daily_stock_prices
+        WHERE ticker_symbol IN ({placeholders})
+        ORDER BY ticker_symbol, trade_day;
+        """
+        frames.append(pd.read_sql(query, conn, params=chunk, parse_dates=['trade_date']))
+    df_prices = pd.concat(frames, ignore_index=True)
+    return {
+        ticker: group.drop('ticker_symbol', axis=1).set_index('trade_date')
+        for ticker, group in df_prices.groupby('ticker_symbol', sort=False)
+    }
+
+
+def create_database(path, frames):
+    conn = sqlite3.connect(path)
+    with open(SCHEMA_PATH, 'r', encoding='utf-8') as f:
+        conn.executescript(f.read())
+    upsert_price_rows(conn, [row for ticker, df in frames.items() for row in build_price_rows(ticker, df)])
+    conn.commit()
+    return conn
+
+
+def time_best(fn, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        timings.append(time.perf_counter() - start)
+    return min(timings), result
+
+
+def report(name, n_rows, legacy_seconds, current_seconds):
+    speedup = legacy_seconds / current_seconds if current_seconds else float('inf')
+    print(f"{name:<10} {n_rows:>12,} {legacy_seconds:>10.2f} {current_seconds:>10.2f} "
+          f"{n_rows / current_seconds:>14,.0f} {speedup:>8.1f}x")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="株価の読み込み性能を合成データで計測します。")
+    parser.add_argument('--tickers', type=int, default=400, help="銘柄数 (デフォルト: 400)")
+    parser.add_argument('--years', type=int, default=10, help="銘柄ごとの株価の年数 (デフォルト: 10)")
+    parser.add_argument('--ticker-loads', type=int, default=100, help="ticker シナリオで読み込む銘柄数 (デフォルト: 100)")
+    parser.add_argument('--repeat', type=int, default=3, help="各方式の実行回数。最短時間を採用します。")
+    args = parser.parse_args()
+
+    tickers = synthetic_tickers(args.tickers)
+    frames = synthetic_universe(tickers + FEATURE_TICKERS, trading_days(years=args.years), seed=0)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        conn = create_database(os.path.join(tmp_dir, 'bench.db'), frames)
+        n_rows = sum(len(df) for df in frames.values())
+
+        print(f"--- 株価読み込みベンチマーク: {datetime.datetime.now()} ---")
+        print(f"{'scenario':<10} {'rows':>12} {'legacy(s)':>10} {'current(s)':>10} {'current rows/s':>14} {'speedup':>9}")
+
+        universe = tickers + FEATURE_TICKERS
+        legacy_seconds, legacy_panel = time_best(lambda: legacy_load_price_panel(conn, universe), args.repeat)
+        current_seconds, current_panel = time_best(lambda: load_price_panel(conn, universe), args.repeat)
+        for ticker in universe:
+            pd.testing.assert_frame_equal(current_panel[ticker], legacy_panel[ticker])
+        report('universe', n_rows, legacy_seconds, current_seconds)
+
+        targets = tickers[:args.ticker_loads]
+        per_ticker_rows = sum(len(frames[t]) for t in targets) + len(targets) * sum(len(frames[t]) for t in FEATURE_TICKERS)
+        legacy_seconds, _ = time_best(lambda: [legacy_load_price_panel(conn, [t] + FEATURE_TICKERS) for t in targets], args.repeat)
+        current_seconds, _ = time_best(lambda: [load_price_panel(conn, [t] + FEATURE_TICKERS) for t in targets], args.repeat)
+        report('ticker', per_ticker_rows, legacy_seconds, current_seconds)
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
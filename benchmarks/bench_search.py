@@ -0,0 +1,214 @@
+"""
+ハイパーパラメータの探索方法のコストと精度の比較。
+
+train_model.py の探索方法 (SEARCH_STRATEGIES: grid, random, optuna, optuna_pruned, optuna_warm) を、
+同じ銘柄・同じ時系列の分割で実行し、探索方法ごとに以下を比較する。
+
+  wall_s      : 探索と最終学習の時間 (秒)
+  cpu_s       : 探索と最終学習の CPU 時間 (秒)
+  fits        : 探索で学習したモデルの数 (交差検証の fold ごとに1)
+  peak_rss_mb : プロセスのピークメモリ使用量 (MB)
+  roc_auc     : 分割ごとの評価期間 (学習に使っていない直後の期間) の ROC-AUC
+
+時系列の分割は、データの末尾から評価期間 (--holdout-days 営業日) ずつずらした --splits 個の分割で、
+各分割の学習期間は評価期間の直前の TRAINING_YEARS 年 (train_model.py のデフォルトと同じ)。
+学習期間の末尾の PREDICTION_HORIZON 日は、目的変数が評価期間の株価を含むため除外する。
+optuna_warm は、1つ前の分割で optuna (実行しない場合は optuna_warm 自身) が選んだパラメータから開始する
+(毎日の再学習で前回のモデルのパラメータを使う場合を再現する)。最初の分割ではパラメータ無しで開始する。
+
+各実行は新しいプロセスで行い、ピークメモリが前の実行の影響を受けないようにする。
+LightGBM のスレッド数は --n-jobs (デフォルト 1) に固定し、CPU 時間を比較できるようにする。
+
+結果は実行ごとの表と探索方法ごとの集計を表示し、それぞれ CSV に保存する。
+
+使用例:
+  python benchmarks/bench_search.py --tickers 7203.T 6758.T
+  python benchmarks/bench_search.py --synthetic 3 --test-mode
+"""
+import argparse
+import contextlib
+import datetime
+import io
+import json
+import multiprocessing
+import os
+import resource
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import pandas as pd
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+PROJECT_ROOT = os.path.dirname(BENCH_DIR)
+sys.path.append(os.path.join(PROJECT_ROOT, 'script'))
+sys.path.append(BENCH_DIR)
+
+import optuna
+
+from synthetic import SYNTHETIC_INDEX_TICKERS, seed_market_database
+from db_connector import DBConnector
+from stock_utils import load_all_data, create_features
+from train_model import PREDICTION_HORIZON, RETURN_THRESHOLD, SEARCH_STRATEGIES, create_classification_target, train_and_evaluate_classification
+from batch_predict import load_prediction_targets
+from instrumentation import start_run, get_peak_rss_mb
+
+SCHEMA_PATH = os.path.join(PROJECT_ROOT, 'SQL', 'ensure_schema.sql')
+RESULTS_DIR = os.path.join(BENCH_DIR, 'results')
+# 学習に使う期間 (train_model.py の --training-years のデフォルトと同じ)
+TRAINING_YEARS = 5
+# --tickers を指定しない場合に使う監視銘柄の数
+DEFAULT_TICKERS = 3
+
+
+def build_time_splits(final_df, n_splits, holdout_days):
+    """データの末尾から評価期間ずつずらした [(学習用データ, 評価用データ), ...] を古い順に返す"""
+    splits = []
+    for k in range(n_splits):
+        holdout_end = len(final_df) - (n_splits - 1 - k) * holdout_days
+        holdout_start = holdout_end - holdout_days
+        train_end = holdout_start - PREDICTION_HORIZON
+        if train_end <= 0:
+            raise ValueError(f"データが不足しています ({len(final_df)}行, {n_splits}分割 × {holdout_days}日)")
+        train_df = final_df.iloc[:train_end]
+        train_df = train_df.loc[train_df.index[-1] - pd.DateOffset(years=TRAINING_YEARS):]
+        splits.append((train_df, final_df.iloc[holdout_start:holdout_end]))
+    return splits
+
+
+def run_search(db_path, ticker, feature_tickers, split_index, n_splits, holdout_days, strategy, test_mode, n_jobs, warm_start_params):
+    """新しいプロセスで1つの銘柄・分割・探索方法を実行し、計測結果を返す"""
+    optuna.logging.set_verbosity(optuna.logging.WARNING)
+    db_connector = DBConnector(db_path)
+    with contextlib.redirect_stdout(io.StringIO()):
+        main_data, external_data, macro_data = load_all_data(db_connector, ticker, feature_tickers)
+        features_df = create_features(main_data, external_data, macro_data)
+    targets_df, target_col = create_classification_target(features_df, PREDICTION_HORIZON, RETURN_THRESHOLD, 'up')
+    final_df = targets_df.dropna()
+    train_df, holdout_df = build_time_splits(final_df, n_splits, holdout_days)[split_index]
+    feature_columns = features_df.columns.intersection(final_df.columns)
+
+    run = start_run('bench_search')
+    cpu_start = resource.getrusage(resource.RUSAGE_SELF)
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        _model, _scaler, best_params, metrics, _version = train_and_evaluate_classification(
+            db_connector, train_df[feature_columns], train_df[target_col], holdout_df[feature_columns], holdout_df[target_col],
+            target_col, ticker, 'up', test_mode=test_mode, search_method=strategy, save_model=False, n_jobs=n_jobs,
+            warm_start_params=warm_start_params)
+    wall_seconds = time.perf_counter() - start
+    cpu_end = resource.getrusage(resource.RUSAGE_SELF)
+
+    return {
+        'ticker': ticker,
+        'split': split_index,
+        'strategy': strategy,
+        'train_start': train_df.index[0].date().isoformat(),
+        'holdout_start': holdout_df.index[0].date().isoformat(),
+        'train_rows': len(train_df),
+        'holdout_rows': len(holdout_df),
+        'wall_s': wall_seconds,
+        'cpu_s': (cpu_end.ru_utime - cpu_start.ru_utime) + (cpu_end.ru_stime - cpu_start.ru_stime),
+        'fits': run.stages['model_fits']['rows'],
+        'peak_rss_mb': get_peak_rss_mb(),
+        'roc_auc': metrics['roc_auc'],
+        'best_params': json.dumps(best_params),
+    }
+
+
+def summarize(df):
+    """探索方法ごとに時間・学習したモデルの数・ピークメモリ・ROC-AUC を集計する"""
+    summary = df.groupby('strategy', sort=False).agg(
+        runs=('roc_auc', 'size'),
+        wall_s=('wall_s', 'mean'),
+        cpu_s=('cpu_s', 'mean'),
+        fits=('fits', 'mean'),
+        peak_rss_mb=('peak_rss_mb', 'max'),
+        roc_auc=('roc_auc', 'mean'),
+        roc_auc_std=('roc_auc', 'std'),
+    )
+    # 探索方法ごとに、銘柄・分割ごとの ROC-AUC の順位 (1 が最良) の平均
+    summary['auc_rank'] = df.groupby(['ticker', 'split'])['roc_auc'].rank(ascending=False).groupby(df['strategy']).mean()
+    return summary.reset_index()
+
+
+def resolve_tickers(db_connector, tickers):
+    """比較に使う [(ticker, 特徴量の銘柄のリスト), ...] を返す。tickers を指定しない場合は監視銘柄の先頭から選ぶ"""
+    targets = dict(load_prediction_targets(db_connector))
+    if not tickers:
+        return list(targets.items())[:DEFAULT_TICKERS]
+    return [(ticker, targets.get(ticker, [])) for ticker in tickers]
+
+
+def run_comparison(db_path, targets, strategies, args):
+    """全ての銘柄・分割・探索方法を順に実行し、実行ごとの結果の DataFrame を返す"""
+    rows = []
+    context = multiprocessing.get_context('spawn')
+    for ticker, feature_tickers in targets:
+        previous_params = {}
+        for split_index in range(args.splits):
+            best_params = {}
+            for strategy in strategies:
+                # optuna_warm には1つ前の分割で選ばれたパラメータを渡す (空の場合は前回のモデルを探さずに開始する)
+                warm_start_params = previous_params.get('optuna', previous_params.get('optuna_warm', {})) if strategy == 'optuna_warm' else None
+                with ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+                    row = executor.submit(
+                        run_search, db_path, ticker, feature_tickers, split_index, args.splits, args.holdout_days,
+                        strategy, args.test_mode, args.n_jobs, warm_start_params).result()
+                best_params[strategy] = json.loads(row['best_params'])
+                rows.append(row)
+                print(f"{ticker} 分割{split_index} {strategy:<14} {row['wall_s']:>8.1f}秒 {row['fits']:>5}回 "
+                      f"{row['peak_rss_mb']:>7.0f}MB  ROC-AUC {row['roc_auc']:.4f}")
+            previous_params = best_params
+    return pd.DataFrame(rows)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="ハイパーパラメータの探索方法ごとの時間・学習回数・ピークメモリ・評価期間の ROC-AUC を比較します。")
+    parser.add_argument('--tickers', nargs='+', default=None, help=f"比較に使う銘柄 (デフォルト: 監視銘柄の先頭{DEFAULT_TICKERS}件)")
+    parser.add_argument('--strategies', nargs='+', choices=list(SEARCH_STRATEGIES), default=list(SEARCH_STRATEGIES),
+                        help="比較する探索方法 (デフォルト: 全て)")
+    parser.add_argument('--splits', type=int, default=3, help="時系列の分割の数 (デフォルト: 3)")
+    parser.add_argument('--holdout-days', type=int, default=120, help="分割ごとの評価期間の営業日数 (デフォルト: 120)")
+    parser.add_argument('--test-mode', action='store_true', help="config.ini のテストモードの探索回数を使用します。")
+    parser.add_argument('--n-jobs', type=int, default=1, help="LightGBM のスレッド数 (デフォルト: 1)")
+    parser.add_argument('--synthetic', type=int, default=None, metavar='N',
+                        help="stock_trader.db の代わりに、N銘柄の合成の市場データを一時的なデータベースに作成して使用します。")
+    parser.add_argument('--synthetic-years', type=int, default=8, help="合成の市場データの年数 (デフォルト: 8)")
+    parser.add_argument('--output', type=str, default=None, help="実行ごとの結果の CSV の保存先 (デフォルト: benchmarks/results/search_<日時>.csv)")
+    args = parser.parse_args()
+
+    print(f"--- 探索方法の比較: {datetime.datetime.now()} ---")
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        if args.synthetic:
+            db_connector = DBConnector(os.path.join(tmp_dir, 'bench.db'))
+            seed_market_database(db_connector.db_path, SCHEMA_PATH, args.synthetic, args.synthetic_years)
+            print(f"合成の市場データ: {args.synthetic}銘柄 × {args.synthetic_years}年 (特徴量: {SYNTHETIC_INDEX_TICKERS})")
+        else:
+            db_connector = DBConnector()
+        targets = resolve_tickers(db_connector, args.tickers)
+        if not targets:
+            print("比較に使う銘柄がありません。--tickers を指定してください。")
+            sys.exit(1)
+        print(f"銘柄: {[ticker for ticker, _ in targets]}, 探索方法: {args.strategies}, "
+              f"分割: {args.splits} × {args.holdout_days}営業日{' (テストモード)' if args.test_mode else ''}\n")
+        df = run_comparison(db_connector.db_path, targets, args.strategies, args)
+
+    summary = summarize(df)
+    with pd.option_context('display.width', 200, 'display.max_columns', None, 'display.float_format', '{:.3f}'.format):
+        print("\n--- 実行ごとの結果 ---")
+        print(df.drop(columns='best_params').to_string(index=False))
+        print("\n--- 探索方法ごとの集計 ---")
+        print(summary.to_string(index=False))
+
+    output = args.output or os.path.join(RESULTS_DIR, f"search_{datetime.datetime.now():%Y%m%d_%H%M%S}.csv")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    df.to_csv(output, index=False)
+    summary_output = os.path.splitext(output)[0] + '_summary.csv'
+    summary.to_csv(summary_output, index=False)
+    print(f"\n結果を保存しました: {output}, {summary_output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+"""ベンチマーク用の合成データ生成"""
+import sqlite3
+
+import numpy as np
+import pandas as pd
+
+PRICE_COLUMNS = ['Open', 'High', 'Low', 'Close', 'Adj Close', 'Volume']
+
+
+def synthetic_tickers(n_tickers):
+    """n_tickers 件の架空のティッカーシンボル (1000.T, 1001.T, ...) を返す"""
+    return [f"{1000 + i}.T" for i in range(n_tickers)]
+
+
+def trading_days(end='2024-12-30', years=10):
+    """end までの years 年分の営業日 (平日) を返す"""
+    end = pd.Timestamp(end)
+    return pd.bdate_range(end - pd.DateOffset(years=years), end)
+
+
+def synthetic_price_frame(dates, rng, start_price=None):
+    """幾何ブラウン運動に従う株価を、yfinance と同じカラム構成のDataFrameとして生成する"""
+    n = len(dates)
+    start_price = start_price or rng.uniform(100, 5000)
+    close = start_price * np.exp(np.cumsum(rng.normal(0, 0.02, n)))
+    spread = np.abs(rng.normal(0, 0.01, n))
+    return pd.DataFrame({
+        'Open': close * (1 + rng.normal(0, 0.005, n)),
+        'High': close * (1 + spread),
+        'Low': close * (1 - spread),
+        'Close': close,
+        'Adj Close': close,
+        'Volume': rng.integers(1_000, 10_000_000, n).astype(float),
+    }, index=pd.DatetimeIndex(dates, name='Date'))
+
+
+def synthetic_universe(tickers, dates, seed=0):
+    """各銘柄の合成株価を {ticker: DataFrame} で返す"""
+    rng = np.random.default_rng(seed)
+    return {ticker: synthetic_price_frame(dates, rng) for ticker in tickers}
+
+
+# 合成の市場データベースで、監視銘柄の特徴量として使う指数 (外部指標)
+SYNTHETIC_INDEX_TICKERS = ['^N225']
+# マクロ経済指標の系列と観測頻度 (update_economic_data.py の DEFAULT_FRED_SERIES と同じ系列名)
+SYNTHETIC_MACRO_SERIES = {
+    'cpi': 'MS',
+    'unemployment_rate': 'MS',
+    'fed_funds_rate': 'MS',
+    '10y_treasury_yield': 'B',
+}
+
+
+def synthetic_macro_rows(start, end, rng):
+    """マクロ経済指標の合成データを macro_economic_indicators の (series_id, 'YYYY-MM-DD', value) の行として返す"""
+    rows = []
+    for series_id, freq in SYNTHETIC_MACRO_SERIES.items():
+        dates = pd.date_range(start, end, freq=freq)
+        values = rng.uniform(1, 100) + np.cumsum(rng.normal(0, 0.1, len(dates)))
+        rows.extend(zip([series_id] * len(dates), dates.strftime('%Y-%m-%d'), values.tolist()))
+    return rows
+
+
+def price_table_rows(ticker, df):
+    """synthetic_price_frame の株価を daily_stock_prices の行 (trade_day は1970-01-01からの日数) に変換する"""
+    trade_days = df.index.values.astype('datetime64[D]').astype(np.int64).tolist()
+    return list(zip(
+        [ticker] * len(df), trade_days,
+        df['Open'].tolist(), df['High'].tolist(), df['Low'].tolist(), df['Close'].tolist(), df['Adj Close'].tolist(),
+        df['Volume'].astype(np.int64).tolist(),
+    ))
+
+
+def seed_market_database(path, schema_path, n_tickers, years, seed=0, end='2024-12-30'):
+    """
+    path のSQLiteデータベースに、n_tickers 銘柄 × years 年分の株価・指数・マクロ経済指標と、
+    全銘柄を監視銘柄 (特徴量は指数) とする target_tickers を書き込む。同じ引数からは常に同じデータが作られる。
+    監視銘柄のリストを返す。
+    """
+    tickers = synthetic_tickers(n_tickers)
+    dates = trading_days(end, years)
+    frames = synthetic_universe(tickers + SYNTHETIC_INDEX_TICKERS, dates, seed)
+    rng = np.random.default_rng(seed + 1)
+
+    conn = sqlite3.connect(path)
+    try:
+        with open(schema_path, 'r', encoding='utf-8') as f:
+            conn.executescript(f.read())
+        for ticker, df in frames.items():
+            conn.executemany(
+                "INSERT INTO daily_stock_prices (ticker_symbol, trade_day, open_price, high_price, low_price, "
+                "close_price, adj_close_price, volume) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                price_table_rows(ticker, df))
+        conn.executemany("INSERT INTO macro_economic_indicators (series_id, indicator_date, value) VALUES (?, ?, ?)",
+                         synthetic_macro_rows(dates[0] - pd.DateOffset(months=1), dates[-1], rng))
+        conn.executemany("INSERT INTO stock_info (ticker_symbol, company_name) VALUES (?, ?)",
+                         [(ticker, f"Company {ticker}") for ticker in tickers])
+        conn.executemany("INSERT INTO target_tickers (ticker, features) VALUES (?, ?)",
+                         [(ticker, ','.join(SYNTHETIC_INDEX_TICKERS)) for ticker in tickers])
+        conn.commit()
+    finally:
+        conn.close()
+    return tickers
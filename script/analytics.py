@@ -0,0 +1,427 @@
+import argparse
+import datetime
+import json
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+# 'script'ディレクトリをsys.pathに追加し、db_connectorなどを直接インポートできるようにする
+script_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(script_dir)
+
+from db_connector import DBConnector, trade_days_to_datetime64
+from config_loader import config_loader
+from stock_utils import PRICE_FRAME_COLUMNS, PRICE_DATE_DTYPE, load_price_panel
+
+PROJECT_ROOT = os.path.dirname(script_dir)
+SUMMARY_VIEW_PATH = os.path.join(PROJECT_ROOT, 'SQL', 'create_summary_view.sql')
+
+ENGINES = ['sqlite', 'duckdb']
+MANIFEST_FILE = 'manifest.json'
+# Parquet に書き出す1回あたりの行数 (fetchmany の件数)
+MIRROR_BATCH_ROWS = 100_000
+
+# DuckDB に複製するテーブル。モデル本体などの BLOB 列は複製しない
+MIRROR_TABLES = [
+    'daily_stock_prices',
+    'macro_economic_indicators',
+    'stock_info',
+    'target_tickers',
+    'trained_models',
+    'prediction_results',
+    'historical_scores',
+    'performance_log',
+]
+# 並び順を揃えて書き出すテーブル。Parquet の行グループごとの最小値・最大値で、銘柄を絞り込む読み込みが不要な行グループを読み飛ばせる
+MIRROR_SORT_KEYS = {
+    'daily_stock_prices': 'ticker_symbol, trade_day',
+    'macro_economic_indicators': 'series_id, indicator_date',
+    'historical_scores': 'ticker_symbol, model_name, model_version, trade_date',
+}
+# 複製後に変更されたかどうかを判定するための列 (存在する列のみ使用する)
+CHANGE_COLUMNS = ['updated_at', 'created_at', 'scored_at']
+
+LEADERBOARD_QUERY = """
+SELECT
+    ticker,
+    direction,
+    COUNT(*) AS evaluations,
+    MAX(model_version) AS latest_version,
+    AVG(roc_auc) AS mean_roc_auc,
+    MAX(roc_auc) AS best_roc_auc,
+    AVG(f1_score) AS mean_f1_score,
+    RANK() OVER (PARTITION BY direction ORDER BY AVG(roc_auc) DESC) AS rank
+FROM performance_log
+WHERE status = 'success' AND roc_auc IS NOT NULL
+GROUP BY ticker, direction
+ORDER BY direction, rank, ticker
+"""
+
+UNIVERSE_SNAPSHOT_QUERY = """
+WITH ranked AS (
+    SELECT
+        ticker_symbol, trade_day, adj_close_price, volume,
+        ROW_NUMBER() OVER (PARTITION BY ticker_symbol ORDER BY trade_day DESC) AS days_ago
+    FROM daily_stock_prices
+),
+snapshot AS (
+    SELECT
+        ticker_symbol,
+        COUNT(*) AS trading_days,
+        MAX(CASE WHEN days_ago = 1 THEN trade_day END) AS last_trade_day,
+        MAX(CASE WHEN days_ago = 1 THEN adj_close_price END) AS last_close,
+        MAX(CASE WHEN days_ago = 21 THEN adj_close_price END) AS close_20d_ago,
+        MAX(CASE WHEN days_ago = 253 THEN adj_close_price END) AS close_1y_ago,
+        AVG(CASE WHEN days_ago <= 20 THEN volume END) AS avg_volume_20d
+    FROM ranked
+    GROUP BY ticker_symbol
+)
+SELECT
+    ticker_symbol, trading_days, {last_trade_date} AS last_trade_date, last_close,
+    last_close / NULLIF(close_20d_ago, 0) - 1 AS return_20d,
+    last_close / NULLIF(close_1y_ago, 0) - 1 AS return_1y,
+    avg_volume_20d
+FROM snapshot
+ORDER BY ticker_symbol
+"""
+
+SCORE_HIT_RATE_QUERY = """
+SELECT
+    model_name,
+    COUNT(DISTINCT ticker_symbol) AS tickers,
+    COUNT(*) AS scored_days,
+    COUNT(target_label) AS labeled_days,
+    AVG(probability) AS mean_probability,
+    AVG(CASE WHEN probability >= 0.5 THEN target_label END) AS hit_rate
+FROM historical_scores
+GROUP BY model_name
+ORDER BY model_name
+"""
+
+PRICE_PANEL_QUERY = """
+SELECT ticker_symbol, trade_day, open_price, high_price, low_price, adj_close_price, volume
+FROM daily_stock_prices
+WHERE ticker_symbol IN (SELECT UNNEST(?))
+ORDER BY ticker_symbol, trade_day
+"""
+
+
+# trade_day (1970-01-01 からの日数) を 'YYYY-MM-DD' の文字列に変換する式。{} に trade_day の式が入る
+TRADE_DAY_TO_DATE = {
+    'sqlite': "date({} * 86400, 'unixepoch')",
+    'duckdb': "CAST(DATE '1970-01-01' + CAST({} AS INTEGER) AS VARCHAR)",
+}
+
+
+def trade_day_to_date_sql(engine, expression):
+    return TRADE_DAY_TO_DATE[engine].format(expression)
+
+
+def summary_query(engine):
+    """
+    prediction_summary ビューと同じ結果を返すクエリ。ビューの定義 (SQL/create_summary_view.sql) をそのまま使い、
+    ビューが作成されていないデータベースやDuckDBでも実行できるようにする。
+    DuckDB の REAL は単精度のため DOUBLE に置き換え、trade_day から日付への変換も DuckDB の式に置き換える。
+    """
+    with open(SUMMARY_VIEW_PATH, 'r', encoding='utf-8') as f:
+        body = f.read().split('CREATE VIEW prediction_summary AS', 1)[1].strip().rstrip(';')
+    if engine == 'duckdb':
+        body = body.replace(' AS REAL)', ' AS DOUBLE)')
+        body = body.replace(trade_day_to_date_sql('sqlite', 'MAX(trade_day)'), trade_day_to_date_sql('duckdb', 'MAX(trade_day)'))
+    return f"SELECT * FROM (\n{body}\n) AS summary ORDER BY ticker"
+
+
+# 名前付きの分析クエリ。両方のエンジンで同じSQLを実行する (DuckDB では Parquet の複製をテーブルと同じ名前のビューとして参照する)
+QUERIES = {
+    'prediction_summary': summary_query,
+    'leaderboard': lambda engine: LEADERBOARD_QUERY,
+    'universe_snapshot': lambda engine: UNIVERSE_SNAPSHOT_QUERY.format(
+        last_trade_date=trade_day_to_date_sql(engine, 'last_trade_day')),
+    'score_hit_rate': lambda engine: SCORE_HIT_RATE_QUERY,
+}
+
+
+def import_duckdb():
+    """DuckDB は任意の依存関係のため、使用するときにだけインポートする"""
+    try:
+        import duckdb
+    except ImportError:
+        raise ImportError("DuckDB がインストールされていません。pip install duckdb を実行するか、engine = sqlite を使用してください。")
+    return duckdb
+
+
+def get_mirror_dir(mirror_dir=None):
+    """複製の保存先ディレクトリ。未指定の場合は config.ini の [analytics] mirror_dir (プロジェクトルートからの相対パス)"""
+    if mirror_dir is None:
+        mirror_dir = config_loader.get_analytics_settings()['mirror_dir']
+    if not os.path.isabs(mirror_dir):
+        mirror_dir = os.path.join(PROJECT_ROOT, mirror_dir)
+    return mirror_dir
+
+
+def existing_tables(conn, tables):
+    names = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+    return [table for table in tables if table in names]
+
+
+def mirror_columns(conn, table):
+    """複製する列と Arrow の型の一覧。SQLite の型の親和性に従って型を決め、BLOB 列は除外する"""
+    import pyarrow as pa
+
+    columns = []
+    for _cid, name, declared, _notnull, _default, _pk in conn.execute(f"PRAGMA table_info({table})"):
+        declared = (declared or '').upper()
+        if 'INT' in declared:
+            arrow_type = pa.int64()
+        elif any(t in declared for t in ('REAL', 'FLOA', 'DOUB')):
+            arrow_type = pa.float64()
+        elif 'BLOB' in declared or not declared:
+            continue
+        else:
+            # TEXT と DATETIME (文字列で保存されている) はどちらも文字列として複製する
+            arrow_type = pa.string()
+        columns.append(pa.field(name, arrow_type))
+    return pa.schema(columns)
+
+
+def table_fingerprint(conn, table):
+    """
+    テーブルの内容が変わったかどうかを判定するための値 (行数と、更新日時などの列・rowid の最大値)。
+    行の追加・削除と、updated_at を更新するUPSERTによる変更を検出できる。
+    """
+    column_names = {row[1] for row in conn.execute(f"PRAGMA table_info({table})")}
+    aggregates = ["COUNT(*)"] + [f"MAX({c})" for c in CHANGE_COLUMNS if c in column_names]
+    without_rowid = conn.execute(
+        "SELECT sql LIKE '%WITHOUT ROWID%' FROM sqlite_master WHERE type = 'table' AND name = ?", (table,)
+    ).fetchone()[0]
+    if not without_rowid:
+        aggregates.append("MAX(rowid)")
+    return list(conn.execute(f"SELECT {', '.join(aggregates)} FROM {table}").fetchone())
+
+
+def export_table(conn, table, path, batch_rows=MIRROR_BATCH_ROWS):
+    """テーブルを zstd 圧縮の Parquet ファイルに書き出し、行数を返す。一時ファイルに書いてから置き換えるため、読み込み中の処理には影響しない"""
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    schema = mirror_columns(conn, table)
+    query = f"SELECT {', '.join(schema.names)} FROM {table}"
+    if table in MIRROR_SORT_KEYS:
+        query += f" ORDER BY {MIRROR_SORT_KEYS[table]}"
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    rows = 0
+    cur = conn.execute(query)
+    with pq.ParquetWriter(tmp_path, schema, compression='zstd') as writer:
+        while True:
+            batch = cur.fetchmany(batch_rows)
+            if not batch:
+                break
+            arrays = [pa.array(values, type=field.type) for values, field in zip(zip(*batch), schema)]
+            writer.write_table(pa.Table.from_arrays(arrays, schema=schema))
+            rows += len(batch)
+    os.replace(tmp_path, path)
+    return rows
+
+
+def load_manifest(mirror_dir):
+    path = os.path.join(mirror_dir, MANIFEST_FILE)
+    if not os.path.exists(path):
+        return {'tables': {}}
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def save_manifest(mirror_dir, manifest):
+    path = os.path.join(mirror_dir, MANIFEST_FILE)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, path)
+
+
+def mirror_status(db_connector, mirror_dir, tables=MIRROR_TABLES):
+    """テーブルごとの複製の状態 (fresh: 最新, stale: SQLite 側が変更済み, missing: 未作成) を返す"""
+    manifest = load_manifest(mirror_dir)
+    status = {}
+    with db_connector.connect() as conn:
+        for table in existing_tables(conn, tables):
+            entry = manifest['tables'].get(table)
+            if entry is None or not os.path.exists(os.path.join(mirror_dir, f"{table}.parquet")):
+                status[table] = 'missing'
+            elif entry['fingerprint'] != table_fingerprint(conn, table):
+                status[table] = 'stale'
+            else:
+                status[table] = 'fresh'
+    return status
+
+
+def refresh_mirror(db_connector, mirror_dir, tables=MIRROR_TABLES, force=False):
+    """
+    SQLite のテーブルを Parquet に複製する。内容が変わっていないテーブルは書き出さない (force=True の場合は全て書き出す)。
+    判定と書き出しは1つの読み込みトランザクションの中で行うため、書き出した内容と記録する判定値は常に一致する。
+    戻り値は書き出したテーブルごとの行数。
+    """
+    os.makedirs(mirror_dir, exist_ok=True)
+    manifest = load_manifest(mirror_dir)
+    refreshed = {}
+    with db_connector.connect() as conn:
+        conn.execute("BEGIN")
+        for table in existing_tables(conn, tables):
+            path = os.path.join(mirror_dir, f"{table}.parquet")
+            fingerprint = table_fingerprint(conn, table)
+            entry = manifest['tables'].get(table)
+            if not force and entry is not None and entry['fingerprint'] == fingerprint and os.path.exists(path):
+                continue
+            start = time.perf_counter()
+            rows = export_table(conn, table, path)
+            manifest['tables'][table] = {
+                'fingerprint': fingerprint,
+                'rows': rows,
+                'seconds': round(time.perf_counter() - start, 3),
+                'refreshed_at': datetime.datetime.now().isoformat(timespec='seconds'),
+            }
+            refreshed[table] = rows
+        conn.rollback()
+    save_manifest(mirror_dir, manifest)
+    return refreshed
+
+
+class AnalyticsEngine:
+    """
+    分析用の重い読み込み (全銘柄の集計・全期間の株価の読み込みなど) を実行するエンジン。
+    engine='sqlite' の場合は従来どおり SQLite に問い合わせる。
+    engine='duckdb' の場合は SQLite のテーブルを複製した Parquet ファイルを DuckDB で読み込む。
+    書き込みは常に SQLite に対して行い、DuckDB は読み込み専用で使用する。
+
+    auto_refresh=True の場合、DuckDB を開くときに SQLite 側で変更されたテーブルの複製を更新するため、
+    古いデータを読むことはない。複製の更新は変更されたテーブル全体の書き出しになるため、
+    DuckDB は書き込みの直後に1回だけ読む処理ではなく、同じデータを何度も集計する処理に向いている。
+    """
+
+    def __init__(self, db_connector, engine='sqlite', mirror_dir=None, auto_refresh=True):
+        if engine not in ENGINES:
+            raise ValueError(f"不明な分析エンジンです: {engine} (選択肢: {', '.join(ENGINES)})")
+        self.db_connector = db_connector
+        self.engine = engine
+        self.mirror_dir = get_mirror_dir(mirror_dir)
+        self.duck = None
+        if engine == 'duckdb':
+            duckdb = import_duckdb()
+            if auto_refresh:
+                refreshed = refresh_mirror(db_connector, self.mirror_dir)
+                if refreshed:
+                    print(f"分析用の複製を更新しました: {', '.join(f'{t} ({n:,}行)' for t, n in refreshed.items())}")
+            self.duck = duckdb.connect()
+            for table in load_manifest(self.mirror_dir)['tables']:
+                path = os.path.join(self.mirror_dir, f"{table}.parquet")
+                if os.path.exists(path):
+                    self.duck.execute(f"CREATE VIEW {table} AS SELECT * FROM read_parquet('{path.replace(chr(39), chr(39) * 2)}')")
+
+    def query(self, name):
+        """名前付きの分析クエリを実行し、結果を DataFrame で返す"""
+        if name not in QUERIES:
+            raise ValueError(f"不明なクエリです: {name} (選択肢: {', '.join(QUERIES)})")
+        sql = QUERIES[name](self.engine)
+        if self.duck is not None:
+            return self.duck.execute(sql).df()
+        with self.db_connector.connect() as conn:
+            return pd.read_sql(sql, conn)
+
+    def load_price_panel(self, tickers):
+        """stock_utils.load_price_panel と同じ形式 (銘柄ごとの DataFrame の辞書) で株価を読み込む"""
+        tickers = list(dict.fromkeys(tickers))
+        if self.duck is None:
+            with self.db_connector.connect() as conn:
+                return load_price_panel(conn, tickers)
+
+        result = self.duck.execute(PRICE_PANEL_QUERY, [tickers]).fetchnumpy()
+        symbols = np.asarray(result['ticker_symbol'], dtype=object)
+        # 銘柄順に並んでいるため、銘柄が切り替わる位置で分割する
+        starts = np.flatnonzero(np.r_[True, symbols[1:] != symbols[:-1]]) if len(symbols) else np.array([], dtype=int)
+        bounds = dict(zip(symbols[starts], zip(starts, np.r_[starts[1:], len(symbols)])))
+        dates = trade_days_to_datetime64(np.asarray(result['trade_day']), PRICE_DATE_DTYPE)
+        values = np.column_stack([np.asarray(result[c], dtype=np.float64) for c in PRICE_FRAME_COLUMNS]) if len(symbols) else None
+
+        empty_df = pd.DataFrame(columns=PRICE_FRAME_COLUMNS, index=pd.DatetimeIndex([], name='trade_date'))
+        panel = {}
+        for ticker in tickers:
+            if ticker not in bounds:
+                panel[ticker] = empty_df.copy()
+                continue
+            start, end = bounds[ticker]
+            df = pd.DataFrame(values[start:end], columns=PRICE_FRAME_COLUMNS,
+                              index=pd.DatetimeIndex(dates[start:end], name='trade_date'))
+            df['volume'] = df['volume'].astype(np.int64)
+            panel[ticker] = df
+        return panel
+
+    def close(self):
+        if self.duck is not None:
+            self.duck.close()
+            self.duck = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+        return False
+
+
+def get_analytics_engine(db_connector, engine=None):
+    """config.ini の [analytics] セクションの設定で分析エンジンを作成する。engine を指定すると設定を上書きする。"""
+    settings = config_loader.get_analytics_settings()
+    return AnalyticsEngine(db_connector, engine or settings['engine'], settings['mirror_dir'], settings['auto_refresh'])
+
+
+def show_mirror_status(db_connector, mirror_dir):
+    manifest = load_manifest(mirror_dir)
+    status = mirror_status(db_connector, mirror_dir)
+    print(f"--- 分析用の複製: {mirror_dir} ---")
+    print(f"{'TABLE':<28} {'STATUS':<8} {'ROWS':>12} {'SIZE(MB)':>9} {'SECONDS':>8}  REFRESHED AT")
+    for table, state in status.items():
+        entry = manifest['tables'].get(table, {})
+        path = os.path.join(mirror_dir, f"{table}.parquet")
+        size_mb = os.path.getsize(path) / 1024 / 1024 if os.path.exists(path) else 0.0
+        print(f"{table:<28} {state:<8} {entry.get('rows', 0):>12,} {size_mb:>9.1f} {entry.get('seconds', 0):>8.2f}  {entry.get('refreshed_at', '-')}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="分析用の読み込み (DuckDB による Parquet の複製の読み込み) を管理・実行します。")
+    subparsers = parser.add_subparsers(dest="command", required=True, help="実行するコマンド")
+    parser_refresh = subparsers.add_parser("refresh", help="SQLite で変更されたテーブルを Parquet に複製します。")
+    parser_refresh.add_argument("--force", action="store_true", help="変更の有無に関わらず全てのテーブルを書き出します。")
+    subparsers.add_parser("status", help="テーブルごとの複製の状態を表示します。")
+    parser_query = subparsers.add_parser("query", help="名前付きの分析クエリを実行して結果を表示します。")
+    parser_query.add_argument("name", choices=list(QUERIES), help="実行するクエリ")
+    parser_query.add_argument("--engine", choices=ENGINES, default=None, help="使用するエンジン。指定しない場合は config.ini の設定。")
+    parser_query.add_argument("--limit", type=int, default=50, help="表示する行数 (デフォルト: 50)")
+    args = parser.parse_args()
+
+    db_connector = DBConnector()
+    mirror_dir = get_mirror_dir()
+    if args.command == "refresh":
+        start = time.perf_counter()
+        refreshed = refresh_mirror(db_connector, mirror_dir, force=args.force)
+        for table, rows in refreshed.items():
+            print(f"{table}: {rows:,}行を書き出しました。")
+        if not refreshed:
+            print("変更されたテーブルはありません。")
+        print(f"--- 複製の更新が完了しました ({time.perf_counter() - start:.2f}秒) ---")
+    elif args.command == "status":
+        show_mirror_status(db_connector, mirror_dir)
+    elif args.command == "query":
+        with get_analytics_engine(db_connector, args.engine) as engine:
+            start = time.perf_counter()
+            df = engine.query(args.name)
+            elapsed = time.perf_counter() - start
+            with pd.option_context('display.max_columns', None, 'display.width', 200):
+                print(df.head(args.limit).to_string(index=False))
+            print(f"--- {args.name}: {len(df):,}行 ({engine.engine}, {elapsed:.3f}秒) ---")
+
+
+if __name__ == "__main__":
+    main()
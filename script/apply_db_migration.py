@@ -1,6 +1,8 @@
-
-import sys
+import argparse
+import datetime
 import os
+import sys
+import time
 
 # 'script'ディレクトリの絶対パスを取得してsys.pathに追加
 # これにより、`db_connector`モジュールを正しくインポートできる
@@ -8,68 +10,309 @@ script_dir = os.path.dirname(os.path.abspath(__file__))
 sys.path.append(script_dir)
 
 from db_connector import DBConnector
+from apply_retention import compact_database, get_storage_stats
+
+PROJECT_ROOT = os.path.dirname(script_dir)
+SUMMARY_VIEW_PATH = os.path.join(PROJECT_ROOT, 'SQL', 'create_summary_view.sql')
+
+# 既存のテーブルに追加するカラム (カラムが既に存在する場合は何も行わない)
+COLUMN_MIGRATIONS = [
+    {
+        "table": "trained_models",
+        "column": "notification_sent",
+        "query": "ALTER TABLE trained_models ADD COLUMN notification_sent INTEGER DEFAULT 0;"
+    },
+    {
+        "table": "prediction_results",
+        "column": "notification_sent",
+        "query": "ALTER TABLE prediction_results ADD COLUMN notification_sent INTEGER DEFAULT 0;"
+    }
+]
+
+# daily_stock_prices を (ticker_symbol, trade_day) を主キーとする WITHOUT ROWID テーブルに移行する。
+# 従来の形式 (AUTOINCREMENT の id・TEXT の日付・2つの日時カラム・UNIQUE制約と2つのインデックス) では、
+# 1行ごとに rowid のテーブル・UNIQUE制約・2つのインデックスの4つのB-treeにエントリがあった。
+# 移行後は主キーのB-tree (行そのもの) と trade_day のインデックスの2つになる。
+PRICE_TABLE_MIGRATION = """
+CREATE TABLE daily_stock_prices_compact (
+    ticker_symbol TEXT NOT NULL,
+    trade_day INTEGER NOT NULL,
+    open_price REAL NOT NULL,
+    high_price REAL NOT NULL,
+    low_price REAL NOT NULL,
+    close_price REAL NOT NULL,
+    adj_close_price REAL NOT NULL,
+    volume INTEGER NOT NULL,
+    updated_at INTEGER NOT NULL DEFAULT (CAST(strftime('%s', 'now') AS INTEGER)),
+    PRIMARY KEY (ticker_symbol, trade_day)
+) WITHOUT ROWID;
 
-def column_exists(cursor, table_name, column_name):
+INSERT INTO daily_stock_prices_compact (
+    ticker_symbol, trade_day, open_price, high_price, low_price, close_price, adj_close_price, volume, updated_at
+)
+SELECT
+    ticker_symbol,
+    CAST(julianday(day) - 2440587.5 AS INTEGER),
+    open_price, high_price, low_price, close_price, adj_close_price, volume,
+    COALESCE(CAST(strftime('%s', COALESCE(updated_at, created_at)) AS INTEGER), CAST(strftime('%s', 'now') AS INTEGER))
+FROM (
+    -- 日付として解釈できない行は除外し、同じ日の行は trade_date が最後 (時刻付きなど) の1行だけを移行する
+    -- (除外される行がある場合は、skip_invalid_rows を指定した場合のみ移行を行う)
+    SELECT *, date(trade_date) AS day,
+           ROW_NUMBER() OVER (PARTITION BY ticker_symbol, date(trade_date) ORDER BY trade_date DESC, id DESC) AS day_rank
+    FROM daily_stock_prices
+    WHERE date(trade_date) IS NOT NULL
+)
+WHERE day_rank = 1
+ORDER BY ticker_symbol, day;
+"""
+# 移行の前に確認する行。日付として解釈できない trade_date の行と、同じ銘柄・同じ日に正規化される行のグループ
+INVALID_DATE_ROWS = "FROM daily_stock_prices WHERE date(trade_date) IS NULL"
+DUPLICATE_DAY_GROUPS = """
+FROM (
+    SELECT ticker_symbol, date(trade_date) AS day, COUNT(*) AS n_rows
+    FROM daily_stock_prices
+    WHERE date(trade_date) IS NOT NULL
+    GROUP BY ticker_symbol, date(trade_date)
+    HAVING COUNT(*) > 1
+)
+"""
+# 移行できない行の例として表示する件数
+MAX_REPORTED_ROWS = 5
+# 移行後に新しいテーブルを daily_stock_prices にする。{replace_legacy} は古いテーブルを削除またはバックアップとして残す文
+PRICE_TABLE_SWAP = """
+{replace_legacy};
+ALTER TABLE daily_stock_prices_compact RENAME TO daily_stock_prices;
+CREATE INDEX IF NOT EXISTS idx_stock_trade_day ON daily_stock_prices (trade_day);
+"""
+# migrate-db --keep-legacy-table と、一時データベースの自動移行で古いテーブルを残す場合のテーブル名
+LEGACY_BACKUP_TABLE = 'daily_stock_prices_legacy'
+
+# 移行の前後でレイテンシを比較する株価のクエリ。日付のカラムはテーブルの形式ごとに異なる
+PRICE_LATENCY_QUERIES = {
+    'legacy': {
+        'ticker_range': "SELECT trade_date, open_price, high_price, low_price, adj_close_price, volume "
+                        "FROM daily_stock_prices WHERE ticker_symbol = ? ORDER BY trade_date",
+        'last_trade_dates': "SELECT ticker_symbol, MAX(trade_date) FROM daily_stock_prices GROUP BY ticker_symbol",
+        'recent_window': "SELECT ticker_symbol, trade_date, adj_close_price FROM daily_stock_prices "
+                         "WHERE trade_date >= date((SELECT MAX(trade_date) FROM daily_stock_prices), '-7 days')",
+    },
+    'compact': {
+        'ticker_range': "SELECT trade_day, open_price, high_price, low_price, adj_close_price, volume "
+                        "FROM daily_stock_prices WHERE ticker_symbol = ? ORDER BY trade_day",
+        'last_trade_dates': "SELECT ticker_symbol, MAX(trade_day) FROM daily_stock_prices GROUP BY ticker_symbol",
+        'recent_window': "SELECT ticker_symbol, trade_day, adj_close_price FROM daily_stock_prices "
+                         "WHERE trade_day >= (SELECT MAX(trade_day) FROM daily_stock_prices) - 7",
+    },
+}
+# 古い形式の daily_stock_prices を自動では移行しない場合のエラーメッセージ
+LEGACY_PRICE_TABLE_MESSAGE = (
+    "daily_stock_prices が古い形式 (TEXT の trade_date) のままです。"
+    "データベースファイルをバックアップしてから `make migrate-db` (python script/apply_db_migration.py) で移行してください。"
+)
+# ticker_range で読み込む銘柄数
+LATENCY_SAMPLE_TICKERS = 50
+
+
+def column_exists(conn, table_name, column_name):
     """指定されたテーブルにカラムが存在するかどうかを確認する"""
-    cursor.execute("""
-        SELECT 1
-        FROM information_schema.columns
-        WHERE table_schema = 'public'
-        AND table_name = %s
-        AND column_name = %s
-    """, (table_name, column_name))
-    return cursor.fetchone() is not None
-
-def apply_migration():
+    return any(row[1] == column_name for row in conn.execute(f"PRAGMA table_info({table_name})"))
+
+
+def table_exists(conn, table_name):
+    return conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (table_name,)).fetchone() is not None
+
+
+def get_price_table_layout(conn):
+    """daily_stock_prices の形式を返す。'legacy' (TEXT の trade_date), 'compact' (trade_day), テーブルが無い場合は None"""
+    if not table_exists(conn, 'daily_stock_prices'):
+        return None
+    return 'legacy' if column_exists(conn, 'daily_stock_prices', 'trade_date') else 'compact'
+
+
+def execute_statements(conn, sql):
+    for statement in sql.split(';'):
+        if statement.strip():
+            conn.execute(statement)
+
+
+def check_legacy_price_rows(conn):
     """
-    データベーススキーマのマイグレーションを実行する。
-    - trained_modelsテーブルにnotification_sentカラムを追加
-    - prediction_resultsテーブルにnotification_sentカラムを追加
-    カラムが既に存在する場合は、何も行わない。
+    古い形式の daily_stock_prices のうち、そのままでは移行できない行を数える。
+    invalid_dates は日付として解釈できない trade_date の行数、duplicate_days は同じ銘柄・同じ日に正規化される
+    行のグループ数、duplicate_rows はそのグループを1行にすると除かれる行数。examples は表示用の例。
+    """
+    invalid_dates = conn.execute(f"SELECT COUNT(*) {INVALID_DATE_ROWS}").fetchone()[0]
+    duplicate_days, duplicate_rows = conn.execute(
+        f"SELECT COUNT(*), COALESCE(SUM(n_rows - 1), 0) {DUPLICATE_DAY_GROUPS}").fetchone()
+    examples = [f"{ticker} trade_date={trade_date!r}" for ticker, trade_date in conn.execute(
+        f"SELECT ticker_symbol, trade_date {INVALID_DATE_ROWS} ORDER BY ticker_symbol LIMIT ?", (MAX_REPORTED_ROWS,))]
+    examples += [f"{ticker} {day} ({n_rows}行)" for ticker, day, n_rows in conn.execute(
+        f"SELECT ticker_symbol, day, n_rows {DUPLICATE_DAY_GROUPS} ORDER BY ticker_symbol, day LIMIT ?", (MAX_REPORTED_ROWS,))]
+    return {'invalid_dates': invalid_dates, 'duplicate_days': duplicate_days, 'duplicate_rows': duplicate_rows, 'examples': examples}
+
+
+def describe_legacy_price_rows(check):
+    return (f"日付として解釈できない trade_date の行: {check['invalid_dates']}行、"
+            f"同じ日に正規化される行: {check['duplicate_days']}組 (統合で除かれる行 {check['duplicate_rows']}行)。"
+            f"例: {', '.join(check['examples'])}")
+
+
+def migrate_price_table(conn, backup_table=None, skip_invalid_rows=False):
     """
-    db_connector = DBConnector()
-    
-    # ALTER TABLEクエリのリスト
-    migrations = [
-        {
-            "table": "trained_models",
-            "column": "notification_sent",
-            "query": "ALTER TABLE trained_models ADD COLUMN notification_sent BOOLEAN DEFAULT false;"
-        },
-        {
-            "table": "prediction_results",
-            "column": "notification_sent",
-            "query": "ALTER TABLE prediction_results ADD COLUMN notification_sent BOOLEAN DEFAULT false;"
-        }
-    ]
-
-    print("--- データベースマイグレーションを開始します ---")
+    daily_stock_prices を新しい形式に書き換え、移行した行数を返す。
+    prediction_summary ビューは古いカラムを参照しているため、書き換えの前に削除し、新しい定義で作り直す。
+    全ての処理は1つのトランザクションで行う。
+    backup_table を指定した場合、古いテーブルは削除せずにその名前で残す (既に存在する場合は移行しない)。
+    日付として解釈できない行や同じ日に正規化される行がある場合は、件数を表示して RuntimeError を送出する。
+    skip_invalid_rows=True の場合は、前者を除外し、後者は trade_date が最後の1行だけを移行する。
+    """
+    if backup_table is not None and table_exists(conn, backup_table):
+        raise RuntimeError(f"バックアップ先のテーブル {backup_table} が既に存在します。確認して削除してから再実行してください。")
+    if backup_table is None:
+        replace_legacy = "DROP TABLE daily_stock_prices"
+    else:
+        replace_legacy = f"ALTER TABLE daily_stock_prices RENAME TO {backup_table}"
+    with open(SUMMARY_VIEW_PATH, 'r', encoding='utf-8') as f:
+        summary_view_sql = f.read()
+    has_summary_view = conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'view' AND name = 'prediction_summary'").fetchone() is not None
+
+    check = check_legacy_price_rows(conn)
+    if check['invalid_dates'] or check['duplicate_rows']:
+        if not skip_invalid_rows:
+            raise RuntimeError(
+                f"daily_stock_prices にそのままでは移行できない行があります。{describe_legacy_price_rows(check)} "
+                "行を修正するか、除外・統合して移行する場合は --skip-invalid-rows を指定してください。")
+        print(f"  [警告] 移行できない行を除外します。{describe_legacy_price_rows(check)}")
+
+    conn.execute("BEGIN IMMEDIATE")
     try:
-        with db_connector.connect() as conn:
-            with conn.cursor() as cursor:
-                for migration in migrations:
-                    table = migration["table"]
-                    column = migration["column"]
-                    query = migration["query"]
-                    
-                    print(f"テーブル '{table}' のカラム '{column}' の存在を確認中...")
-                    if not column_exists(cursor, table, column):
-                        print(f"-> カラムが存在しません。'{table}' に '{column}' カラムを追加します。")
-                        cursor.execute(query)
-                        print(f"   '{query}' を実行しました。")
-                    else:
-                        print(f"-> カラムは既に存在します。スキップします。")
-            
-            # 変更をコミット
+        conn.execute("DROP VIEW IF EXISTS prediction_summary")
+        execute_statements(conn, PRICE_TABLE_MIGRATION)
+        execute_statements(conn, PRICE_TABLE_SWAP.format(replace_legacy=replace_legacy))
+        if has_summary_view:
+            execute_statements(conn, summary_view_sql)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    return conn.execute("SELECT COUNT(*) FROM daily_stock_prices").fetchone()[0]
+
+
+def apply_schema_migrations(conn, migrate_prices=False, backup_table=None, skip_invalid_rows=False):
+    """
+    未適用のマイグレーションを適用し、適用した内容の説明のリストを返す。
+    ensure_schema.sql を実行する前に呼び出す (古い形式の daily_stock_prices には新しいインデックスを作成できないため)。
+    daily_stock_prices の書き換えはテーブル全体を作り直すため、migrate_prices=True の場合のみ行う
+    (migrate-db で明示的に実行する)。古い形式のまま migrate_prices=False の場合は RuntimeError を送出する。
+    backup_table・skip_invalid_rows は migrate_price_table に渡す。
+    """
+    applied = []
+    for migration in COLUMN_MIGRATIONS:
+        table, column = migration["table"], migration["column"]
+        if table_exists(conn, table) and not column_exists(conn, table, column):
+            conn.execute(migration["query"])
             conn.commit()
-            print("\nマイグレーションが正常に完了しました。")
+            applied.append(f"'{table}' に '{column}' カラムを追加")
+    if get_price_table_layout(conn) == 'legacy':
+        if not migrate_prices:
+            raise RuntimeError(LEGACY_PRICE_TABLE_MESSAGE)
+        print("daily_stock_prices を WITHOUT ROWID・整数の日付の形式に移行しています...")
+        rows = migrate_price_table(conn, backup_table, skip_invalid_rows)
+        backup_note = f"、古いテーブルは {backup_table} に保存" if backup_table else ""
+        applied.append(f"daily_stock_prices を新しい形式に移行 ({rows}行{backup_note})")
+    return applied
+
+
+def measure_price_latency(conn, repeat=3):
+    """株価の代表的なクエリを複数回実行し、クエリごとの最短実行時間(ミリ秒)を返す"""
+    layout = get_price_table_layout(conn)
+    if layout is None:
+        return {}
+    tickers = [row[0] for row in conn.execute(
+        "SELECT DISTINCT ticker_symbol FROM daily_stock_prices ORDER BY ticker_symbol LIMIT ?", (LATENCY_SAMPLE_TICKERS,))]
+    latencies = {}
+    for name, query in PRICE_LATENCY_QUERIES[layout].items():
+        timings = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            if name == 'ticker_range':
+                for ticker in tickers:
+                    conn.execute(query, (ticker,)).fetchall()
+            else:
+                conn.execute(query).fetchall()
+            timings.append((time.perf_counter() - start) * 1000)
+        latencies[name] = min(timings)
+    return latencies
+
+
+def count_price_index_entries(conn):
+    """daily_stock_prices の行ごとに更新が必要なB-tree (テーブル本体とインデックス) の数"""
+    indexes = conn.execute("SELECT COUNT(*) FROM pragma_index_list('daily_stock_prices') WHERE origin != 'pk'").fetchone()[0]
+    without_rowid = conn.execute(
+        "SELECT sql LIKE '%WITHOUT ROWID%' FROM sqlite_master WHERE type = 'table' AND name = 'daily_stock_prices'").fetchone()[0]
+    # rowid のテーブルでは INTEGER PRIMARY KEY 以外の主キーも別のインデックスになる
+    pk_indexes = conn.execute("SELECT COUNT(*) FROM pragma_index_list('daily_stock_prices') WHERE origin = 'pk'").fetchone()[0]
+    return 1 + indexes + (0 if without_rowid else pk_indexes)
+
+
+def apply_migration(db_connector, compact=True, keep_legacy_table=False, skip_invalid_rows=False):
+    """
+    データベーススキーマのマイグレーションを実行し、ファイルサイズと株価のクエリのレイテンシの変化を表示する。
+    - trained_models・prediction_results テーブルに notification_sent カラムを追加
+    - daily_stock_prices を (ticker_symbol, trade_day) の WITHOUT ROWID テーブルに移行
+    compact=True の場合は、移行で空いたページをファイルから解放する。
+    keep_legacy_table=True の場合は、古い形式のテーブルを daily_stock_prices_legacy として残す。
+    skip_invalid_rows=True の場合は、日付として解釈できない株価の行を除外し、同じ日に正規化される行を統合して移行する。
+    """
+    print(f"--- データベースマイグレーションを開始します: {datetime.datetime.now()} ---")
+    with db_connector.connect() as conn:
+        layout_before = get_price_table_layout(conn)
+        before = get_storage_stats(conn, db_connector.db_path)
+        latency_before = measure_price_latency(conn)
+        entries_before = count_price_index_entries(conn) if layout_before else 0
+
+        start = time.perf_counter()
+        applied = apply_schema_migrations(conn, migrate_prices=True, backup_table=LEGACY_BACKUP_TABLE if keep_legacy_table else None,
+                                          skip_invalid_rows=skip_invalid_rows)
+        for description in applied:
+            print(f"-> {description}しました。")
+        if not applied:
+            print("-> 適用が必要なマイグレーションはありません。")
+            return
+
+        if compact:
+            print("データベースファイルを圧縮しています...")
+            compact_database(conn)
+        elapsed = time.perf_counter() - start
+
+        after = get_storage_stats(conn, db_connector.db_path)
+        latency_after = measure_price_latency(conn)
+        entries_after = count_price_index_entries(conn) if layout_before else 0
+
+    print(f"\n--- マイグレーションの結果 ({elapsed:.1f}秒) ---")
+    print(f"ファイルサイズ: {before['file_bytes'] / 1024**2:.2f} MB -> {after['file_bytes'] / 1024**2:.2f} MB "
+          f"(ページ数: {before['page_count']} -> {after['page_count']})")
+    if layout_before == 'legacy':
+        print(f"株価1行あたりのB-treeのエントリ数: {entries_before} -> {entries_after}")
+        print("株価のクエリレイテンシ (最短, ms):")
+        for name in latency_before:
+            print(f"  {name:<25} {latency_before[name]:>9.2f} -> {latency_after[name]:>9.2f}")
+    print(f"--- データベースマイグレーションが完了しました: {datetime.datetime.now()} ---")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="データベーススキーマのマイグレーションを適用し、ファイルサイズとクエリレイテンシの変化を表示します。")
+    parser.add_argument('--no-compact', action='store_true', help="移行後に VACUUM によるファイルの圧縮を行いません。")
+    parser.add_argument('--keep-legacy-table', action='store_true',
+                        help=f"古い形式の株価テーブルを削除せず、{LEGACY_BACKUP_TABLE} として残します。")
+    parser.add_argument('--skip-invalid-rows', action='store_true',
+                        help="日付として解釈できない株価の行を除外し、同じ日に正規化される行は trade_date が最後の1行だけを移行します (既定では移行を中止します)。")
+    args = parser.parse_args()
+    apply_migration(DBConnector(), compact=not args.no_compact, keep_legacy_table=args.keep_legacy_table,
+                    skip_invalid_rows=args.skip_invalid_rows)
 
-    except Exception as e:
-        print(f"\nマイグレーション中にエラーが発生しました: {e}")
-        # エラーが発生した場合はロールバック
-        if 'conn' in locals() and conn:
-            conn.rollback()
-        print("変更はロールバックされました。")
 
 if __name__ == "__main__":
-    apply_migration()
+    main()
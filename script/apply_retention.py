@@ -0,0 +1,252 @@
+import argparse
+import datetime
+import os
+import sys
+import time
+
+import pandas as pd
+
+# 'script'ディレクトリをsys.pathに追加し、db_connectorなどを直接インポートできるようにする
+script_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(script_dir)
+
+from db_connector import DBConnector
+from config_loader import config_loader
+
+PROJECT_ROOT = os.path.dirname(script_dir)
+
+# アーカイブ対象のテーブルと、経過日数の判定に使う日時カラム
+# utc: 日時カラムが UTC (SQLite の CURRENT_TIMESTAMP) で保存されている場合は True、ローカル時刻の場合は False
+# 各銘柄・方向の最新の予測結果は prediction_summary ビューが参照するため、常に残す
+# 各銘柄・方向の最新の成功した評価ログは bulk_evaluate.py の再開 (評価済み銘柄の判定) に使うため、常に残す
+ARCHIVE_TABLES = {
+    'prediction_results': {
+        'id_column': 'id',
+        'date_column': 'prediction_timestamp',
+        'utc': True,
+        'keep_latest_sql': "SELECT MAX(id) FROM prediction_results GROUP BY ticker, direction",
+    },
+    'performance_log': {
+        'id_column': 'log_id',
+        'date_column': 'evaluation_datetime',
+        # bulk_evaluate.py が datetime.now() で書き込む
+        'utc': False,
+        'keep_latest_sql': "SELECT MAX(log_id) FROM performance_log WHERE status = 'success' GROUP BY ticker, direction",
+    },
+}
+
+# 保持ポリシー適用前後でレイテンシを比較する代表的なクエリ
+LATENCY_QUERIES = {
+    'prediction_summary': "SELECT * FROM prediction_summary",
+    'active_model_lookup': """
+        SELECT t.model_version FROM model_registry r
+        JOIN trained_models t ON t.ticker_symbol = r.ticker_symbol AND t.model_name = r.model_name AND t.model_version = r.active_version
+    """,
+    'latest_predictions': "SELECT ticker, direction, MAX(prediction_timestamp) FROM prediction_results GROUP BY ticker, direction",
+    'completed_evaluations': """
+        SELECT ticker FROM performance_log WHERE status = 'success'
+        GROUP BY ticker HAVING COUNT(DISTINCT direction) = 2
+    """,
+}
+
+
+def get_storage_stats(conn, db_path):
+    """データベースファイルのサイズとページの使用状況を取得する"""
+    cur = conn.cursor()
+    page_size = cur.execute("PRAGMA page_size").fetchone()[0]
+    page_count = cur.execute("PRAGMA page_count").fetchone()[0]
+    freelist_count = cur.execute("PRAGMA freelist_count").fetchone()[0]
+    return {
+        'file_bytes': os.path.getsize(db_path) if os.path.exists(db_path) else 0,
+        'page_size': page_size,
+        'page_count': page_count,
+        'freelist_count': freelist_count,
+    }
+
+
+def measure_query_latency(conn, repeat=3):
+    """代表的なクエリを複数回実行し、クエリごとの最短実行時間(ミリ秒)を返す"""
+    latencies = {}
+    for name, query in LATENCY_QUERIES.items():
+        timings = []
+        try:
+            for _ in range(repeat):
+                start = time.perf_counter()
+                conn.execute(query).fetchall()
+                timings.append((time.perf_counter() - start) * 1000)
+            latencies[name] = min(timings)
+        except Exception as e:
+            # ビューやテーブルが存在しない環境では計測をスキップする
+            print(f"  クエリ '{name}' の計測をスキップしました: {e}")
+    return latencies
+
+
+def prune_model_versions(conn, keep_versions, dry_run=False):
+    """
+    銘柄・モデル名ごとに最新の keep_versions 件のバージョンを残し、それより古いモデルを削除する。
+    model_registry の稼働中バージョンとロールバック先のバージョンは件数に関わらず保持する。
+    削除したバージョンの historical_scores の行も同じトランザクションで削除する。
+    削除(または削除対象)のモデルの件数を返す。
+    """
+    cur = conn.cursor()
+    cur.execute(
+        """
+        SELECT model_id, ticker_symbol, model_name, model_version FROM (
+            SELECT
+                t.model_id,
+                t.ticker_symbol,
+                t.model_name,
+                t.model_version,
+                r.active_version,
+                r.previous_version,
+                ROW_NUMBER() OVER (PARTITION BY t.ticker_symbol, t.model_name ORDER BY t.model_version DESC) AS version_rank
+            FROM trained_models t
+            LEFT JOIN model_registry r
+              ON r.ticker_symbol = t.ticker_symbol AND r.model_name = t.model_name
+        )
+        WHERE version_rank > ?
+          AND (active_version IS NULL OR model_version != active_version)
+          AND (previous_version IS NULL OR model_version != previous_version)
+        """,
+        (keep_versions,)
+    )
+    models = cur.fetchall()
+    if models and not dry_run:
+        try:
+            cur.executemany("DELETE FROM trained_models WHERE model_id = ?", [(model_id,) for model_id, _, _, _ in models])
+            # 削除したバージョンで評価した過去のスコアは、参照するモデルが無くなるため残さない
+            cur.executemany(
+                "DELETE FROM historical_scores WHERE ticker_symbol = ? AND model_name = ? AND model_version = ?",
+                [(ticker, model_name, version) for _, ticker, model_name, version in models]
+            )
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+    return len(models)
+
+
+def archive_old_rows(conn, table, cutoff, archive_dir, dry_run=False):
+    """
+    cutoff より古い行を Parquet (zstd圧縮) ファイルに書き出してから、テーブルから削除する。
+    cutoff はテーブルの日時カラムの時間帯 (UTC またはローカル時刻) に変換して比較する (タイムゾーンの無い日時はローカル時刻とみなす)。
+    ファイルへの書き出しに失敗した場合は削除を行わない。アーカイブした行数を返す。
+    """
+    spec = ARCHIVE_TABLES[table]
+    cutoff = cutoff.astimezone(datetime.timezone.utc if spec['utc'] else None)
+    query = f"SELECT * FROM {table} WHERE {spec['date_column']} < ?"
+    if spec['keep_latest_sql']:
+        query += f" AND {spec['id_column']} NOT IN ({spec['keep_latest_sql']})"
+    df = pd.read_sql(query, conn, params=(cutoff.strftime('%Y-%m-%d %H:%M:%S'),))
+    if df.empty or dry_run:
+        return len(df)
+
+    table_dir = os.path.join(archive_dir, table)
+    os.makedirs(table_dir, exist_ok=True)
+    timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
+    filepath = os.path.join(table_dir, f"{table}_{timestamp}.parquet")
+    try:
+        df.to_parquet(filepath, compression='zstd', index=False)
+    except ImportError as e:
+        print(f"  Parquetの書き出しに必要なライブラリがありません ({e})。{table} のアーカイブをスキップします。")
+        return 0
+
+    cur = conn.cursor()
+    cur.executemany(
+        f"DELETE FROM {table} WHERE {spec['id_column']} = ?",
+        [(int(row_id),) for row_id in df[spec['id_column']]]
+    )
+    conn.commit()
+    print(f"  {table}: {len(df)}件を '{filepath}' にアーカイブしました。")
+    return len(df)
+
+
+def compact_database(conn):
+    """
+    空きページをファイルから解放する。
+    auto_vacuum が INCREMENTAL でない場合は、初回のみ設定を変更して VACUUM を実行する。
+    以降の実行では PRAGMA incremental_vacuum によって空きページのみを解放する。
+    """
+    cur = conn.cursor()
+    auto_vacuum = cur.execute("PRAGMA auto_vacuum").fetchone()[0]
+    if auto_vacuum != 2:
+        print("  auto_vacuum を INCREMENTAL に変更し、VACUUM を実行します (初回のみ)...")
+        cur.execute("PRAGMA auto_vacuum = INCREMENTAL")
+        cur.execute("VACUUM")
+    else:
+        cur.execute("PRAGMA incremental_vacuum")
+        cur.fetchall()
+    # WAL モードでは、チェックポイントで WAL の内容を反映するまでファイルが縮小されない
+    if cur.execute("PRAGMA journal_mode").fetchone()[0] == 'wal':
+        cur.execute("PRAGMA wal_checkpoint(TRUNCATE)").fetchall()
+
+
+def apply_retention(db_connector, keep_versions, archive_after_days, archive_dir, dry_run=False):
+    """保持ポリシーを適用し、解放された容量とクエリレイテンシの変化を表示する"""
+    print(f"--- データ保持ポリシーの適用を開始します: {datetime.datetime.now()} ---")
+    print(f"保持するモデルバージョン数: {keep_versions}, アーカイブ対象: {archive_after_days}日より前, 出力先: {archive_dir}")
+    if dry_run:
+        print("*** ドライランモード: データは変更されません ***")
+
+    # テーブルごとに日時カラムの時間帯に変換して比較する (prediction_results は UTC)
+    cutoff = datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(days=archive_after_days)
+
+    with db_connector.connect() as conn:
+        before = get_storage_stats(conn, db_connector.db_path)
+        latency_before = measure_query_latency(conn)
+
+        deleted_models = prune_model_versions(conn, keep_versions, dry_run)
+        print(f"古いモデルバージョン: {deleted_models}件{'が削除対象です' if dry_run else 'を削除しました'}。")
+
+        archived = {}
+        for table in ARCHIVE_TABLES:
+            try:
+                archived[table] = archive_old_rows(conn, table, cutoff, archive_dir, dry_run)
+            except Exception as e:
+                print(f"  {table} のアーカイブ中にエラーが発生しました: {e}")
+                conn.rollback()
+                archived[table] = 0
+            print(f"{table}: {archived[table]}件{'がアーカイブ対象です' if dry_run else 'をアーカイブしました'}。")
+
+        if dry_run:
+            return
+
+        print("データベースファイルを圧縮しています...")
+        compact_database(conn)
+
+        after = get_storage_stats(conn, db_connector.db_path)
+        latency_after = measure_query_latency(conn)
+
+    reclaimed = before['file_bytes'] - after['file_bytes']
+    print("\n--- 保持ポリシーの適用結果 ---")
+    print(f"ファイルサイズ: {before['file_bytes'] / 1024**2:.2f} MB -> {after['file_bytes'] / 1024**2:.2f} MB "
+          f"(解放: {reclaimed / 1024**2:.2f} MB)")
+    print(f"空きページ数: {before['freelist_count']} -> {after['freelist_count']}")
+    print("クエリレイテンシ (最短, ms):")
+    for name in LATENCY_QUERIES:
+        if name in latency_before and name in latency_after:
+            print(f"  {name:<25} {latency_before[name]:>9.2f} -> {latency_after[name]:>9.2f}")
+    print(f"--- データ保持ポリシーの適用が完了しました: {datetime.datetime.now()} ---")
+
+
+def main():
+    settings = config_loader.get_retention_settings()
+    parser = argparse.ArgumentParser(description="古いモデルと履歴データを整理し、データベースファイルを圧縮します。")
+    parser.add_argument('--keep-versions', type=int, default=settings['keep_model_versions'],
+                        help=f"銘柄・モデル名ごとに保持するバージョン数 (デフォルト: {settings['keep_model_versions']})")
+    parser.add_argument('--archive-days', type=int, default=settings['archive_after_days'],
+                        help=f"この日数より古い予測結果と評価ログをアーカイブします (デフォルト: {settings['archive_after_days']})")
+    parser.add_argument('--archive-dir', type=str, default=settings['archive_dir'],
+                        help="アーカイブファイルの出力先ディレクトリ")
+    parser.add_argument('--dry-run', action='store_true', help="削除・アーカイブ対象の件数のみを表示し、データを変更しません。")
+    args = parser.parse_args()
+
+    archive_dir = args.archive_dir
+    if not os.path.isabs(archive_dir):
+        archive_dir = os.path.join(PROJECT_ROOT, archive_dir)
+
+    apply_retention(DBConnector(), args.keep_versions, args.archive_days, archive_dir, args.dry_run)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,155 @@
+import argparse
+import datetime
+import os
+import sys
+
+# 'script'ディレクトリをsys.pathに追加し、db_connectorなどを直接インポートできるようにする
+script_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(script_dir)
+
+from db_connector import DBConnector
+from stock_utils import load_macro_data, load_price_panel, align_macro_to_dates, create_features
+from model_registry import get_active_models, get_model_name
+from predict import deserialize_model, predict_probabilities
+from batch_predict import DIRECTIONS, load_prediction_targets
+from stale_tickers import clear_features_stale, get_features_stale
+from train_model import PREDICTION_HORIZON, RETURN_THRESHOLD, create_classification_target
+from analytics import ENGINES, get_analytics_engine
+
+
+def load_models_for_backfill(conn, tickers, model_names, version=None):
+    """
+    評価に使用するモデルを読み込む。version 未指定の場合は稼働中(チャンピオン)のモデルを使用する。
+    戻り値は {(ticker, model_name): (model_bytes, scaler_bytes, feature_list_json, model_version)} の辞書。
+    """
+    if version is None:
+        return get_active_models(conn, tickers, model_names)
+
+    cur = conn.cursor()
+    models = {}
+    for ticker in tickers:
+        for model_name in model_names:
+            cur.execute(
+                "SELECT model_object, scaler_object, feature_list, model_version FROM trained_models "
+                "WHERE ticker_symbol = ? AND model_name = ? AND model_version = ?",
+                (ticker, model_name, version)
+            )
+            row = cur.fetchone()
+            if row:
+                models[(ticker, model_name)] = row
+    return models
+
+
+def score_history(features_df, model, scaler, feature_list, direction):
+    """
+    特徴量の全行をモデルで一括評価し、(trade_date, probability, target_label) のタプルのリストを返す。
+    予測期間が経過しておらず実際の結果が確定しない行の target_label は None とする。
+    """
+    targets_df, target_col = create_classification_target(features_df, PREDICTION_HORIZON, RETURN_THRESHOLD, direction)
+    probabilities = predict_probabilities(model, scaler, feature_list, features_df)
+
+    label_known = targets_df[f'target_return_{PREDICTION_HORIZON}d'].notna().to_numpy()
+    labels = targets_df[target_col].to_numpy()
+    dates = features_df.index.strftime('%Y-%m-%d')
+    return [
+        (date, float(probability), int(label) if known else None)
+        for date, probability, label, known in zip(dates, probabilities, labels, label_known)
+    ]
+
+
+def save_historical_scores(conn, ticker, model_name, model_version, scores):
+    """評価結果を historical_scores に一括で保存する。同じモデル・日付の行は上書きされる (冪等)。"""
+    cur = conn.cursor()
+    cur.executemany(
+        """
+        INSERT INTO historical_scores (ticker_symbol, model_name, model_version, trade_date, probability, target_label)
+        VALUES (?, ?, ?, ?, ?, ?)
+        ON CONFLICT (ticker_symbol, model_name, model_version, trade_date) DO UPDATE SET
+            probability = excluded.probability,
+            target_label = excluded.target_label,
+            scored_at = CURRENT_TIMESTAMP;
+        """,
+        [(ticker, model_name, model_version, date, probability, label) for date, probability, label in scores]
+    )
+    conn.commit()
+
+
+def backfill_scores(db_connector, tickers=None, directions=DIRECTIONS, version=None, engine=None):
+    """
+    指定銘柄 (未指定の場合は全監視銘柄) のモデルで過去の全特徴量行を評価し、historical_scores に保存する。
+    株価・マクロ指標はまとめて1回読み込み、特徴量は銘柄ごとに1回だけ生成する。
+    engine ('sqlite' または 'duckdb') を指定すると、株価を読み込むエンジンの設定を上書きする。
+    DuckDB の複製 (auto_refresh = false の場合は古い可能性がある) から読み込む場合も、株価履歴の改訂で
+    再計算待ちの銘柄は SQLite から読み込むため、features_stale フラグは現在の株価履歴で再計算した場合にのみ下ろされる。
+    """
+    print(f"--- 過去データの一括評価を開始します: {datetime.datetime.now()} ---")
+    targets = dict(load_prediction_targets(db_connector))
+    if tickers:
+        targets = {ticker: targets.get(ticker, []) for ticker in tickers}
+    if not targets:
+        print("評価対象の銘柄がありません。")
+        return
+
+    model_names = {direction: get_model_name(direction) for direction in directions}
+    panel_tickers = list(dict.fromkeys(list(targets) + [f for features in targets.values() for f in features]))
+    # 全銘柄の全期間の株価の読み込みは、設定に応じて DuckDB (Parquet の複製) から行う
+    with get_analytics_engine(db_connector, engine) as analytics:
+        panel = analytics.load_price_panel(panel_tickers)
+        from_mirror = analytics.duck is not None
+    with db_connector.connect() as conn:
+        if from_mirror:
+            # 複製は株価履歴の改訂前の内容の可能性があるため、再計算待ちの銘柄は SQLite から読み込み直す
+            stale = get_features_stale(conn)
+            reread = [ticker for ticker in panel_tickers if ticker in stale]
+            if reread:
+                print(f"株価履歴が改訂された{len(reread)}銘柄の株価を SQLite から読み込みます: {', '.join(reread)}")
+                panel.update(load_price_panel(conn, reread))
+        models = load_models_for_backfill(conn, list(targets), list(model_names.values()), version)
+        macro_df = load_macro_data(conn)
+
+        total_rows = 0
+        for ticker, feature_tickers in targets.items():
+            ticker_models = {d: models[(ticker, name)] for d, name in model_names.items() if (ticker, name) in models}
+            if not ticker_models:
+                print(f"銘柄 {ticker}: 評価に使用するモデルが見つかりません。スキップします。")
+                continue
+            if panel[ticker].empty:
+                print(f"銘柄 {ticker}: 株価データがありません。スキップします。")
+                continue
+
+            main_df = panel[ticker]
+            features_df = create_features(main_df, {f: panel[f] for f in feature_tickers}, align_macro_to_dates(macro_df, main_df.index))
+            scored_directions = 0
+            for direction, (model_bytes, scaler_bytes, feature_list_json, model_version) in ticker_models.items():
+                model, scaler, feature_list = deserialize_model(model_bytes, scaler_bytes, feature_list_json)
+                try:
+                    scores = score_history(features_df, model, scaler, feature_list, direction)
+                except KeyError as e:
+                    print(f"銘柄 {ticker} ({direction}): 評価に必要な特徴量が不足しています。{e}")
+                    continue
+                save_historical_scores(conn, ticker, model_names[direction], model_version, scores)
+                total_rows += len(scores)
+                scored_directions += 1
+                print(f"銘柄 {ticker} ({direction}, version {model_version}): {len(scores)}日分の評価結果を保存しました。")
+
+            if scored_directions == len(DIRECTIONS):
+                # 全方向のスコアを現在の株価履歴で再計算したため、株価履歴の改訂による再計算待ちを解除する
+                clear_features_stale(conn, ticker)
+
+    print(f"--- 過去データの一括評価が完了しました (合計 {total_rows}行): {datetime.datetime.now()} ---")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="学習済みモデルで過去の全特徴量行を評価し、予測確率を historical_scores テーブルに保存します。")
+    parser.add_argument('--ticker', nargs='+', default=None, help="評価対象の銘柄 (複数指定可)。指定しない場合は全監視銘柄が対象。")
+    parser.add_argument('--direction', type=str, choices=['up', 'down'], help="評価する方向。指定しない場合は両方。")
+    parser.add_argument('--version', type=int, help="評価するモデルのバージョン。指定しない場合は稼働中(チャンピオン)のモデル。")
+    parser.add_argument('--engine', choices=ENGINES, default=None, help="株価の読み込みに使用するエンジン。指定しない場合は config.ini の [analytics] の設定。")
+    args = parser.parse_args()
+
+    directions = [args.direction] if args.direction else DIRECTIONS
+    backfill_scores(DBConnector(), args.ticker, directions, args.version, args.engine)
+
+
+if __name__ == "__main__":
+    main()
@@ -17,6 +17,7 @@ from sklearn.model_selection import RandomizedSearchCV
 from stock_utils import (
     load_all_data, create_features
 )
+from profiling import add_profile_arguments, profile_run
 
 warnings.filterwarnings('ignore', category=UserWarning)
 
@@ -153,6 +154,7 @@ def main():
     parser.add_argument('--direction', type=str, default='up', choices=['up', 'down'], help="予測するトレンドの方向 ('up' または 'down')")
     parser.add_argument('--threshold', type=float, default=0.03, help='変動率の閾値 (例: 0.03は3%%)')
     parser.add_argument('--prediction-days', type=int, default=10, help='予測期間（日数）')
+    add_profile_arguments(parser)
     args = parser.parse_args()
 
     # 引数でfeature_tickersが指定されなかった場合、tickers.jsonから読み込む
@@ -174,4 +176,5 @@ def main():
     run_backtest(args.ticker, feature_tickers, args.train_end_date, args.test_start_date, args.tune, args.direction, args.threshold, args.prediction_days)
 
 if __name__ == "__main__":
-    main()
+    with profile_run('backtest'):
+        main()
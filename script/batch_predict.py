@@ -0,0 +1,132 @@
+import math
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from db_connector import DBConnector
+from stock_utils import load_price_panel, load_macro_data, align_macro_to_dates, create_features
+from model_registry import get_active_models, get_model_name
+from predict import deserialize_model, predict_probabilities, build_prediction_result
+from instrumentation import start_run, get_active_run, stage
+
+DIRECTIONS = ['up', 'down']
+
+
+def load_prediction_targets(db_connector):
+    """
+    target_tickers から全監視銘柄と、その特徴量として使う外部指標のリストを1回のクエリで取得する。
+    戻り値は [(ticker, [feature_ticker, ...]), ...] のリスト。
+    """
+    with db_connector.connect() as conn:
+        cursor = conn.cursor()
+        cursor.execute("SELECT ticker, features FROM target_tickers ORDER BY ticker")
+        return [
+            (ticker, [f.strip() for f in features.split(',') if f.strip()] if features else [])
+            for ticker, features in cursor.fetchall()
+        ]
+
+
+def build_latest_features(panel, macro_df, ticker, feature_tickers):
+    """
+    読み込み済みの株価データから銘柄の特徴量を生成し、最新日の1行をDataFrameとして返す。
+    データが不足している場合は LookupError を送出する。
+    """
+    main_df = panel[ticker]
+    if main_df.empty:
+        raise LookupError("株価データがありません。")
+
+    external_dfs = {f: panel[f] for f in feature_tickers}
+    features_df = create_features(main_df, external_dfs, align_macro_to_dates(macro_df, main_df.index))
+    if features_df.empty:
+        raise LookupError("特徴量を生成できるデータがありません。")
+    return features_df.iloc[[-1]]
+
+
+def predict_targets(db_connector, targets, directions=DIRECTIONS):
+    """
+    複数銘柄の予測をまとめて実行する。
+    稼働中モデル・株価・マクロ経済指標はそれぞれ1回のクエリで読み込み、
+    特徴量は銘柄ごとに1回だけ生成して、全方向のモデルで同じ最新行を評価する。
+    戻り値は (予測結果のリスト, [(ticker, エラーメッセージ), ...]) のタプル。
+    """
+    results = []
+    errors = []
+    if not targets:
+        return results, errors
+
+    model_names = {direction: get_model_name(direction) for direction in directions}
+    target_tickers = [ticker for ticker, _ in targets]
+    price_tickers = target_tickers + [f for _, features in targets for f in features]
+
+    with db_connector.connect() as conn, stage('load_all_data'):
+        active_models = get_active_models(conn, target_tickers, list(model_names.values()))
+        panel = load_price_panel(conn, price_tickers)
+        macro_df = load_macro_data(conn)
+    print(f"{len(target_tickers)}銘柄の株価データと{len(active_models)}件の稼働中モデルを読み込みました。")
+
+    for ticker, feature_tickers in targets:
+        try:
+            ticker_models = {
+                direction: active_models[(ticker, model_name)]
+                for direction, model_name in model_names.items()
+                if (ticker, model_name) in active_models
+            }
+            if not ticker_models:
+                raise LookupError("稼働中モデルが登録されていません。")
+
+            latest_features = build_latest_features(panel, macro_df, ticker, feature_tickers)
+
+            for direction, (model_bytes, scaler_bytes, feature_list_json, model_version) in ticker_models.items():
+                model, scaler, feature_list = deserialize_model(model_bytes, scaler_bytes, feature_list_json)
+                probability = predict_probabilities(model, scaler, feature_list, latest_features)[0]
+                results.append(build_prediction_result(
+                    ticker, direction, probability, model_names[direction], model_version, latest_features.index[0]
+                ))
+
+            missing = [d for d in directions if d not in ticker_models]
+            if missing:
+                errors.append((ticker, f"稼働中モデルが登録されていない方向があります: {missing}"))
+        except KeyError as e:
+            errors.append((ticker, f"予測に必要な特徴量が不足しています: {e}"))
+        except Exception as e:
+            errors.append((ticker, str(e)))
+
+    return results, errors
+
+
+def _predict_shard(targets, directions):
+    """
+    ワーカープロセスで実行される関数。プロセスごとに自身のDB接続で担当銘柄を予測する。
+    ワーカーでの処理段階ごとの計測結果も返し、親プロセスの実行の計測結果に合算する。
+    """
+    run = start_run('predict_all_worker')
+    results, errors = predict_targets(DBConnector(), targets, directions)
+    return results, errors, run.snapshot()
+
+
+def split_into_shards(targets, workers, shards_per_worker=4):
+    """
+    銘柄リストをワーカー数に応じたシャードに分割する。
+    負荷の偏りを抑えるため、ワーカー1つあたり複数のシャードを割り当てる。
+    """
+    shard_size = max(1, math.ceil(len(targets) / (workers * shards_per_worker)))
+    return [targets[i:i + shard_size] for i in range(0, len(targets), shard_size)]
+
+
+def predict_targets_parallel(targets, workers, directions=DIRECTIONS):
+    """
+    銘柄をシャードに分けてプロセスプールで並列に予測し、完了したシャードから順に結果を返すジェネレータ。
+    各シャードについて (予測結果のリスト, エラーのリスト) を yield する。
+    ワーカーの異常終了などでシャード全体が失敗した場合も、そのシャードの銘柄をエラーとして返し、処理を継続する。
+    """
+    shards = split_into_shards(targets, workers)
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(_predict_shard, shard, directions): shard for shard in shards}
+        for future in as_completed(futures):
+            shard = futures[future]
+            try:
+                results, errors, metrics = future.result()
+            except Exception as e:
+                yield [], [(ticker, f"ワーカーでエラーが発生しました: {e}") for ticker, _ in shard]
+                continue
+            if get_active_run() is not None:
+                get_active_run().merge(metrics)
+            yield results, errors
@@ -1,14 +1,29 @@
 import argparse
+import contextlib
+import multiprocessing
 import pandas as pd
 import datetime
 import time
 import os
 import sys
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from concurrent.futures.process import BrokenProcessPool
 
 # Add parent dir to path to allow importing other scripts
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 from script.db_connector import DBConnector
+from script.db_writer import DBWriter
+from script.config_loader import config_loader
+from script.evaluation_queue import (
+    make_worker_id, parse_shard, filter_shard, enqueue_tickers, reset_queue,
+    claim_job, complete_job, count_open_jobs, LeaseHeartbeat
+)
+from script.prefetch_pipeline import run_prefetch_pipeline, format_pipeline_stats
+# Imported under its top-level name, as stock_utils and train_model do, so that they record into the same active run
+from instrumentation import instrument_run, start_run, get_active_run, stage
+from script.profiling import add_profile_arguments, profile_run
 from script.stock_utils import load_all_data, create_features
 from script.train_model import (
     create_classification_target,
@@ -21,6 +36,13 @@ from script.train_model import (
 COMMON_FEATURES = ['^N225', '^TPX', '^GSPC', 'JPY=X', 'CL=F']
 TRAINING_YEARS = 5
 TEST_SIZE = 0.2
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+WORKER_LOG_DIR = os.path.join(PROJECT_ROOT, 'logs', 'bulk_evaluate')
+# Price history of evaluation tickers that are not in the main database is written to this separate file,
+# attached as the `scratch` schema when loading data, and deleted as a whole at the end of the run
+SCRATCH_DB_NAME = 'evaluation_scratch'
+# Environment variables that cap the native thread pools (OpenMP for LightGBM, BLAS for NumPy/scikit-learn) in worker processes
+THREAD_ENV_VARS = ['OMP_NUM_THREADS', 'OPENBLAS_NUM_THREADS', 'MKL_NUM_THREADS']
 
 def get_tickers_from_market_list(db_connector):
     """Gets the list of tickers to evaluate from the market_list table."""
@@ -48,77 +70,425 @@ def get_completed_tickers(db_connector):
         except Exception:
             return set()
 
-def prepare_data(db_connector, target_tickers):
-    """Prepares the necessary data for the evaluation."""
+def get_scratch_db_path(shard=None):
+    """
+    Returns the scratch database path. Static shards (--shard without --queue) get their own file,
+    so that a host finishing its shard does not delete data another host is still reading.
+    """
+    suffix = f"_{shard[0]}of{shard[1]}" if shard else ''
+    return os.path.join(PROJECT_ROOT, f"{SCRATCH_DB_NAME}{suffix}.db")
+
+def get_evaluation_connector(scratch_path, queue=False):
+    """
+    Returns a connector to the main database with the scratch database attached as the `scratch` schema.
+    In queue mode the databases are shared by several hosts, typically on network storage where WAL's shared memory
+    does not work, so both are switched to the DELETE journal mode (with synchronous=FULL, which DELETE needs to
+    survive a power loss); if that is not possible (e.g. another process still has them open in WAL mode), this
+    fails immediately instead of risking a corrupted queue. Every other entry point keeps the configured mode.
+    """
+    if not queue:
+        return DBConnector(attachments={'scratch': scratch_path})
+    settings = dict(config_loader.get_database_settings(), journal_mode='DELETE', synchronous='FULL',
+                    strict_journal_mode=True)
+    db_connector = DBConnector(attachments={'scratch': scratch_path}, settings=settings)
+    with db_connector.connect():
+        pass
+    return db_connector
+
+def prepare_data(db_connector, target_tickers, scratch_path):
+    """
+    Prepares the necessary data for the evaluation.
+    The common feature tickers are updated in the main database. Evaluation tickers that are not in the main
+    database are fetched into the scratch database, so the main price table is neither written to nor locked
+    for them. An existing scratch database from a previous run (--keep-scratch) is updated incrementally.
+    """
     print("--- Starting Data Preparation ---")
     existing_tickers = get_existing_data_tickers(db_connector)
-    
-    # Tickers for which we need to fetch daily price data
-    # This includes new evaluation targets and the common feature tickers (indexes, etc.)
     new_evaluation_tickers = [t for t in target_tickers if t not in existing_tickers]
-    tickers_to_update = list(set(new_evaluation_tickers + COMMON_FEATURES))
 
     script_dir = os.path.dirname(os.path.abspath(__file__))
     update_stock_script_path = os.path.join(script_dir, "update_stock_data.py")
     update_eco_script_path = os.path.join(script_dir, "update_economic_data.py")
 
-    if tickers_to_update:
-        print(f"Updating/fetching price data for {len(tickers_to_update)} tickers...")
-        ticker_str = ' '.join(tickers_to_update)
-        os.system(f"python {update_stock_script_path} --tickers {ticker_str}")
+    print(f"Updating price data for {len(COMMON_FEATURES)} common feature tickers...")
+    os.system(f"python {update_stock_script_path} --tickers {' '.join(COMMON_FEATURES)}")
+
+    if new_evaluation_tickers:
+        print(f"Fetching price data for {len(new_evaluation_tickers)} tickers into the scratch database {scratch_path}...")
+        ticker_str = ' '.join(new_evaluation_tickers)
+        os.system(f"python {update_stock_script_path} --db {scratch_path} --tickers {ticker_str}")
     else:
         print("No new stock price data to fetch.")
 
     # Update macroeconomic data from FRED
     print("Updating macroeconomic data...")
     os.system(f"python {update_eco_script_path}")
-    
+
     print("--- Data Preparation Complete ---")
-    # Return only the new tickers that are part of the evaluation, for cleanup later
     return new_evaluation_tickers
 
-def cleanup_data(db_connector, new_tickers):
-    """Removes temporarily added ticker data."""
-    if not new_tickers:
-        print("\nNo data to clean up.")
+def drop_scratch_database(scratch_path, keep=False):
+    """Deletes the scratch database file (and its journal files) unless it is kept as a cache for the next run."""
+    if keep:
+        print(f"\nKeeping the scratch database for the next run: {scratch_path}")
         return
-        
-    print(f"\n--- Starting Cleanup: Removing data for {len(new_tickers)} tickers ---")
-    try:
-        with db_connector.connect() as conn:
-            with conn.cursor() as cur:
-                tickers_tuple = tuple(new_tickers)
-                cur.execute("DELETE FROM daily_stock_prices WHERE ticker_symbol IN %s", (tickers_tuple,))
-                print(f"Cleanup complete: {cur.rowcount} rows deleted from daily_stock_prices.")
-                conn.commit()
-    except Exception as e:
-        print(f"An error occurred during cleanup: {e}")
+    removed = False
+    for suffix in ('', '-journal', '-wal', '-shm'):
+        path = scratch_path + suffix
+        if os.path.exists(path):
+            os.remove(path)
+            removed = True
+    print(f"\n{'Removed the scratch database.' if removed else 'No scratch database to remove.'}")
+
+def make_log_entry(ticker, direction, metrics, start_date, end_date, status, error_msg=""):
+    """Builds one performance_log row as a tuple in the column order used by save_performance_logs."""
+    return (
+        ticker, direction, -1,
+        datetime.datetime.now().isoformat(sep=' '),
+        metrics.get('accuracy'), metrics.get('precision'), metrics.get('recall'),
+        metrics.get('f1_score'), metrics.get('roc_auc'),
+        ','.join(COMMON_FEATURES),
+        str(start_date) if start_date else None, str(end_date) if end_date else None,
+        status, error_msg
+    )
 
-def save_performance_log(db_connector, ticker, direction, version, metrics, features, start_date, end_date, status, error_msg=""):
-    """Saves the evaluation results to the performance_log table."""
+def insert_performance_logs(conn, entries):
+    """Inserts evaluation results into the performance_log table. The caller commits."""
+    with stage('db_write', rows=len(entries)):
+        conn.executemany(
+            """
+            INSERT INTO performance_log (
+                ticker, direction, model_version, evaluation_datetime,
+                accuracy, precision_score, recall_score, f1_score, roc_auc,
+                features, training_period_start, training_period_end, status, error_message
+            ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            """,
+            entries
+        )
+
+def save_performance_logs(db_connector, entries):
+    """Saves evaluation results to the performance_log table in a single transaction."""
+    if not entries:
+        return
     with db_connector.connect() as conn:
-        with conn.cursor() as cur:
-            cur.execute(
-                """
-                INSERT INTO performance_log (
-                    ticker, direction, model_version, evaluation_datetime, 
-                    accuracy, precision_score, recall_score, f1_score, roc_auc,
-                    features, training_period_start, training_period_end, status, error_message
-                ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-                """,
-                (
-                    ticker, direction, version,
-                    datetime.datetime.now(),
-                    metrics.get('accuracy'), metrics.get('precision'), metrics.get('recall'), 
-                    metrics.get('f1_score'), metrics.get('roc_auc'),
-                    ','.join(features) if features else None,
-                    start_date, end_date, status, error_msg
-                )
+        insert_performance_logs(conn, entries)
+        conn.commit()
+
+def submit_performance_logs(writer, ticker, entries):
+    """Queues the entries on a DBWriter. A failed write is reported without stopping the evaluation."""
+    def report(future):
+        if future.exception() is not None:
+            print(f"Failed to save the performance log for {ticker}: {future.exception()}")
+    writer.submit(insert_performance_logs, entries).add_done_callback(report)
+
+def load_ticker_features(db_connector, ticker):
+    """
+    Loads the price data for one ticker and creates its features.
+    Returns None if there is not enough price history to evaluate the ticker.
+    """
+    main_data, external_data, macro_data = load_all_data(db_connector, ticker, COMMON_FEATURES)
+    if main_data.empty or len(main_data) < 200:
+        return None
+    return create_features(main_data, external_data, macro_data)
+
+def train_ticker_models(db_connector, ticker, features_df, test_mode=False, n_jobs=None):
+    """
+    Trains and evaluates the up and down models on features from load_ticker_features.
+    Returns the performance_log entries instead of writing them, so that a single process can own all writes.
+    n_jobs caps the LightGBM threads used for training (None uses LightGBM's default).
+    """
+    entries = []
+    try:
+        if features_df is None:
+            print(f"Skipping {ticker} due to insufficient data.")
+            entries.append(make_log_entry(ticker, 'N/A', {}, None, None, 'skipped', 'Insufficient data'))
+            return entries
+
+        for direction in ['up', 'down']:
+            print(f"\n==> Training {direction} model for {ticker}...")
+
+            targets_df, target_col = create_classification_target(features_df, PREDICTION_HORIZON, RETURN_THRESHOLD, direction)
+            final_df = targets_df.dropna()
+
+            if final_df.empty:
+                print(f"Skipping {ticker}/{direction} because no data remains after feature creation.")
+                entries.append(make_log_entry(ticker, direction, {}, None, None, 'skipped', 'No data after feature creation'))
+                continue
+
+            latest_date = final_df.index.max()
+            start_date = latest_date - pd.DateOffset(years=TRAINING_YEARS)
+            window_df = final_df.loc[start_date:]
+            features_columns = features_df.columns.intersection(window_df.columns)
+            X = window_df[features_columns]
+            y = window_df[target_col]
+
+            if len(X) < 100 or y.nunique() < 2:
+                print(f"Skipping {ticker}/{direction} due to insufficient training data or single class label.")
+                entries.append(make_log_entry(ticker, direction, {}, start_date.date(), latest_date.date(), 'skipped', 'Insufficient training data or single class'))
+                continue
+
+            train_size = int(len(X) * (1 - TEST_SIZE))
+            X_train, X_test = X.iloc[:train_size], X.iloc[train_size:]
+            y_train, y_test = y.iloc[:train_size], y.iloc[train_size:]
+
+            _model, _scaler, _params, metrics, _version = train_and_evaluate_classification(
+                db_connector, X_train, y_train, X_test, y_test, target_col, ticker, direction,
+                test_mode=test_mode, search_method='optuna', save_model=False, n_jobs=n_jobs
             )
-            conn.commit()
 
-def run_evaluation(db_connector, fresh_run=False, test_mode=False, source_file='list.csv'):
-    """Runs the entire evaluation pipeline."""
+            entries.append(make_log_entry(ticker, direction, metrics, start_date.date(), latest_date.date(), 'success'))
+
+    except Exception as e:
+        print(f"An error occurred while evaluating {ticker}: {e}")
+        entries.append(make_log_entry(ticker, 'N/A', {}, None, None, 'failed', str(e)))
+    return entries
+
+def failed_load_entries(ticker, error):
+    print(f"An error occurred while loading {ticker}: {error}")
+    return [make_log_entry(ticker, 'N/A', {}, None, None, 'failed', str(error))]
+
+def evaluate_ticker(db_connector, ticker, test_mode=False, n_jobs=None):
+    """Loads, trains and evaluates one ticker in the calling thread. Returns the performance_log entries."""
+    try:
+        features_df = load_ticker_features(db_connector, ticker)
+    except Exception as e:
+        return failed_load_entries(ticker, e)
+    return train_ticker_models(db_connector, ticker, features_df, test_mode, n_jobs)
+
+def run_prefetch_evaluation(db_connector, tickers, depth, loaders=1, test_mode=False, n_jobs=None):
+    """
+    Evaluates tickers in this process as a three-stage pipeline: background threads load and featurize the next
+    `depth` tickers while the current one trains, and the results are saved to performance_log on a DBWriter.
+    Prints the per-stage utilisation at the end so that the depth can be tuned.
+    """
+    position = {ticker: i for i, ticker in enumerate(tickers)}
+
+    def train(ticker, features_df):
+        print(f"\n--- Evaluating ticker {position[ticker] + 1}/{len(tickers)}: {ticker} ---")
+        return train_ticker_models(db_connector, ticker, features_df, test_mode, n_jobs)
+
+    def write(conn, ticker, entries):
+        insert_performance_logs(conn, entries)
+        print(f"Saved performance log for {ticker}: {summarize_entries(entries)}.")
+
+    with DBWriter(db_connector) as writer:
+        stats = run_prefetch_pipeline(
+            tickers, lambda ticker: load_ticker_features(db_connector, ticker), train, write, writer,
+            depth=depth, loaders=loaders, on_load_error=failed_load_entries
+        )
+    print("\n--- Pipeline stage utilisation ---")
+    print(format_pipeline_stats(stats))
+    print(writer.summary())
+    return stats
+
+def _evaluate_in_worker(db_connector, ticker, test_mode, n_jobs, log_dir):
+    """
+    Process-pool entry point. The worker's output goes to <log_dir>/<ticker>.log instead of the shared console.
+    The file descriptors are redirected (not just sys.stdout) so that logging handlers and native libraries are captured too.
+    """
+    os.makedirs(log_dir, exist_ok=True)
+    log_path = os.path.join(log_dir, f"{ticker}.log")
+    sys.stdout.flush()
+    sys.stderr.flush()
+    saved_fds = os.dup(1), os.dup(2)
+    with open(log_path, 'w', encoding='utf-8') as log_file:
+        os.dup2(log_file.fileno(), 1)
+        os.dup2(log_file.fileno(), 2)
+        try:
+            return evaluate_ticker(db_connector, ticker, test_mode, n_jobs)
+        finally:
+            sys.stdout.flush()
+            sys.stderr.flush()
+            os.dup2(saved_fds[0], 1)
+            os.dup2(saved_fds[1], 2)
+            os.close(saved_fds[0])
+            os.close(saved_fds[1])
+
+def _evaluate_in_pool_worker(db_connector, ticker, test_mode, n_jobs, log_dir):
+    """Process-pool entry point. Returns the entries with the stage metrics recorded in the worker, to be merged into the parent's run."""
+    run = start_run('bulk_evaluate_worker')
+    entries = _evaluate_in_worker(db_connector, ticker, test_mode, n_jobs, log_dir)
+    return entries, run.snapshot()
+
+@contextlib.contextmanager
+def worker_thread_budget(threads):
+    """
+    Sets the native thread-pool sizes inherited by worker processes started inside this block.
+    They must be in the environment before LightGBM and NumPy are imported, so they cannot be set in the worker itself.
+    """
+    saved = {name: os.environ.get(name) for name in THREAD_ENV_VARS}
+    os.environ.update({name: str(threads) for name in THREAD_ENV_VARS})
+    try:
+        yield
+    finally:
+        for name, value in saved.items():
+            if value is None:
+                os.environ.pop(name, None)
+            else:
+                os.environ[name] = value
+
+def summarize_entries(entries):
+    return ', '.join(f"{entry[1]}={entry[12]}" for entry in entries) or 'no result'
+
+def run_parallel_evaluation(db_connector, tickers, workers, threads_per_worker, test_mode=False, log_dir=WORKER_LOG_DIR,
+                            worker=_evaluate_in_pool_worker):
+    """
+    Evaluates tickers on a pool of worker processes, each limited to threads_per_worker threads.
+    Workers only read from the database; the results are queued on this process's DBWriter as they arrive, so the
+    scheduling loop never waits for a commit and results arriving together are committed together.
+    If a worker process dies (e.g. segfault or out of memory), the pool is rebuilt and the tickers that were running
+    are retried one at a time in a single-worker pool, so the crashing ticker is identified and logged as failed
+    while the others complete normally.
+    `worker` is the module-level function run in the pool for each ticker, with the signature of _evaluate_in_pool_worker.
+    """
+    queue = deque(tickers)
+    suspects = deque()
+    completed = 0
+    context = multiprocessing.get_context('spawn')
+    # The writer commits the queued results even if the loop is interrupted
+    with DBWriter(db_connector) as writer:
+        while queue or suspects:
+            isolate = bool(suspects)
+            source = suspects if isolate else queue
+            pool_size = 1 if isolate else workers
+            in_flight = {}
+            crashed = []
+            with worker_thread_budget(threads_per_worker), \
+                    ProcessPoolExecutor(max_workers=pool_size, mp_context=context) as executor:
+                while (source or in_flight) and not crashed:
+                    while source and len(in_flight) < pool_size:
+                        try:
+                            future = executor.submit(worker, db_connector, source[0], test_mode, threads_per_worker, log_dir)
+                        except BrokenProcessPool:
+                            break
+                        in_flight[future] = (source.popleft(), time.time())
+                    if not in_flight:
+                        break
+                    done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        ticker, started = in_flight.pop(future)
+                        try:
+                            entries, metrics = future.result()
+                            if get_active_run() is not None:
+                                get_active_run().merge(metrics)
+                        except BrokenProcessPool:
+                            crashed.append(ticker)
+                            continue
+                        except Exception as e:
+                            entries = [make_log_entry(ticker, 'N/A', {}, None, None, 'failed', str(e))]
+                        submit_performance_logs(writer, ticker, entries)
+                        completed += 1
+                        print(f"[{completed}/{len(tickers)}] {ticker}: {summarize_entries(entries)} ({time.time() - started:.1f}s)")
+                if crashed:
+                    # Every task that was running in the broken pool fails with BrokenProcessPool
+                    crashed.extend(ticker for ticker, _ in in_flight.values())
+
+            if not crashed:
+                continue
+            if isolate:
+                ticker = crashed[0]
+                submit_performance_logs(writer, ticker, [make_log_entry(ticker, 'N/A', {}, None, None, 'failed', 'Worker process crashed')])
+                completed += 1
+                print(f"[{completed}/{len(tickers)}] {ticker}: failed (worker process crashed, see {os.path.join(log_dir, ticker + '.log')})")
+            else:
+                print(f"A worker process crashed. Retrying {len(crashed)} ticker(s) one at a time: {', '.join(crashed)}")
+                suspects.extend(crashed)
+    print(writer.summary())
+
+def complete_job_with_results(conn, ticker, worker_id, entries):
+    """Marks the job done (or failed) and inserts its results in the caller's transaction, only if this worker still holds the lease."""
+    errors = [entry[13] for entry in entries if entry[12] == 'failed']
+    owned = complete_job(conn, ticker, worker_id, 'failed' if errors else 'done', errors[0] if errors else None)
+    if owned:
+        insert_performance_logs(conn, entries)
+    return owned
+
+def run_queue_worker(db_connector, test_mode=False, n_jobs=None, shard=None, settings=None, log_dir=None):
+    """
+    Claims tickers from the evaluation_jobs queue one at a time until no claimable job is left.
+    While a ticker is evaluated, a heartbeat thread keeps its lease alive; if this process dies, the lease expires
+    and another worker reclaims only that ticker. The results and the job completion are committed in one
+    transaction, and are discarded if the lease was lost to another worker in the meantime.
+    If log_dir is given, the evaluation output goes to <log_dir>/<ticker>.log.
+    Returns the number of tickers processed by this worker.
+    """
+    settings = settings or config_loader.get_evaluation_queue_settings()
+    worker_id = make_worker_id()
+    processed = 0
+    # Lease renewals from the heartbeat thread and the job completions share this process's single writer
+    with DBWriter(db_connector) as writer:
+        while True:
+            with db_connector.connect() as conn:
+                ticker = claim_job(conn, worker_id, settings['lease_seconds'], settings['max_attempts'], shard)
+                open_jobs = count_open_jobs(conn, shard) if ticker is None else 0
+            if ticker is None:
+                if not open_jobs:
+                    break
+                # Only jobs leased by other workers remain; wait for them to finish or for a lease to expire
+                time.sleep(settings['poll_seconds'])
+                continue
+
+            started = time.time()
+            with LeaseHeartbeat(db_connector, ticker, worker_id, settings['lease_seconds'], settings['heartbeat_seconds'],
+                                writer) as heartbeat:
+                if log_dir:
+                    entries = _evaluate_in_worker(db_connector, ticker, test_mode, n_jobs, log_dir)
+                else:
+                    entries = evaluate_ticker(db_connector, ticker, test_mode, n_jobs)
+
+            processed += 1
+            if heartbeat.lost:
+                # Another worker owns the job now and writes its own results
+                print(f"[{worker_id}] {ticker}: lease was lost during the evaluation, results discarded ({time.time() - started:.1f}s)")
+                continue
+            owned = writer.call(complete_job_with_results, ticker, worker_id, entries)
+            if owned:
+                print(f"[{worker_id}] {ticker}: {summarize_entries(entries)} ({time.time() - started:.1f}s)")
+            else:
+                print(f"[{worker_id}] {ticker}: lease was lost to another worker, results discarded ({time.time() - started:.1f}s)")
+    print(f"[{worker_id}] No more jobs. Processed {processed} ticker(s).")
+    return processed
+
+def _queue_worker_main(db_connector, test_mode, n_jobs, shard, settings, log_dir):
+    """Entry point of a queue worker process started by run_queue_workers. Each worker process records its own run metrics."""
+    with instrument_run('bulk_evaluate_worker', db_connector):
+        run_queue_worker(db_connector, test_mode, n_jobs, shard, settings, log_dir)
+
+def run_queue_workers(db_connector, workers, threads_per_worker, test_mode=False, shard=None):
+    """Runs one queue worker in this process, or `workers` queue worker processes with their own thread budgets."""
+    settings = config_loader.get_evaluation_queue_settings()
+    if workers <= 1:
+        run_queue_worker(db_connector, test_mode, threads_per_worker, shard, settings)
+        return
+    context = multiprocessing.get_context('spawn')
+    with worker_thread_budget(threads_per_worker):
+        processes = [
+            context.Process(target=_queue_worker_main, args=(db_connector, test_mode, threads_per_worker, shard, settings, WORKER_LOG_DIR))
+            for _ in range(workers)
+        ]
+        for process in processes:
+            process.start()
+    for process in processes:
+        process.join()
+
+def run_evaluation(db_connector, fresh_run=False, test_mode=False, source_file='list.csv', workers=1, threads_per_worker=None,
+                   queue=False, join=False, shard=None, keep_scratch=False, prefetch=0, prefetch_loaders=1):
+    """
+    Runs the entire evaluation pipeline.
+    prefetch=K (single-process mode only) loads and featurizes the next K tickers in background threads while the
+    current ticker trains, and writes the results asynchronously.
+    queue=True distributes the tickers through the evaluation_jobs queue so that other hosts can help with join=True.
+    shard=(i, N) restricts this run to the tickers whose hash falls into shard i of N (claims only, in queue mode).
+    """
+    if workers > 1:
+        threads_per_worker = threads_per_worker or max(1, (os.cpu_count() or 1) // workers)
+    scratch_path = db_connector.attachments.get('scratch', get_scratch_db_path())
+
+    if join:
+        print(f"--- Joining the evaluation queue{f' (shard {shard[0]}/{shard[1]})' if shard else ''} ---")
+        run_queue_workers(db_connector, workers, threads_per_worker, test_mode, shard)
+        return
+
     script_dir = os.path.dirname(os.path.abspath(__file__))
     prepare_script_path = os.path.join(script_dir, "prepare_evaluation_db.py")
     load_script_path = os.path.join(script_dir, "load_market_list.py")
@@ -131,85 +501,86 @@ def run_evaluation(db_connector, fresh_run=False, test_mode=False, source_file='
     if fresh_run:
         print("--- FRESH RUN: Clearing performance_log table ---")
         with db_connector.connect() as conn:
-            with conn.cursor() as cur:
-                cur.execute("TRUNCATE TABLE performance_log")
-                conn.commit()
+            conn.execute("DELETE FROM performance_log")
+            conn.commit()
+            if queue:
+                reset_queue(conn)
 
     all_tickers = get_tickers_from_market_list(db_connector)
-    newly_added_tickers = prepare_data(db_connector, all_tickers)
+    # In queue mode every ticker is enqueued and the shard only restricts which jobs this host claims
+    candidate_tickers = all_tickers if queue else filter_shard(all_tickers, shard)
+    prepare_data(db_connector, candidate_tickers, scratch_path)
     completed_tickers = get_completed_tickers(db_connector)
-    
-    target_tickers = [t for t in all_tickers if t not in completed_tickers]
-    print(f"\nTotal tickers for evaluation: {len(all_tickers)}. Already completed: {len(completed_tickers)}. Remaining: {len(target_tickers)}.")
+
+    target_tickers = [t for t in candidate_tickers if t not in completed_tickers]
+    print(f"\nTotal tickers for evaluation: {len(candidate_tickers)}. Already completed: {len(candidate_tickers) - len(target_tickers)}. Remaining: {len(target_tickers)}.")
     if test_mode:
         print("*** RUNNING IN TEST MODE ***")
 
     start_time = time.time()
-    
-    for i, ticker in enumerate(target_tickers):
-        print(f"\n--- Evaluating ticker {i+1}/{len(target_tickers)}: {ticker} ---")
-        try:
-            main_data, external_data, macro_data = load_all_data(db_connector, ticker, COMMON_FEATURES)
-            if main_data.empty or len(main_data) < 200:
-                print(f"Skipping {ticker} due to insufficient data.")
-                save_performance_log(db_connector, ticker, 'N/A', -1, {}, COMMON_FEATURES, None, None, 'skipped', 'Insufficient data')
-                continue
 
-            features_df = create_features(main_data, external_data, macro_data)
-
-            for direction in ['up', 'down']:
-                print(f"\n==> Training {direction} model for {ticker}...")
-                
-                targets_df, target_col = create_classification_target(features_df, PREDICTION_HORIZON, RETURN_THRESHOLD, direction)
-                final_df = targets_df.dropna()
-                
-                if final_df.empty:
-                    print(f"Skipping {ticker}/{direction} because no data remains after feature creation.")
-                    save_performance_log(db_connector, ticker, direction, -1, {}, COMMON_FEATURES, None, None, 'skipped', 'No data after feature creation')
-                    continue
-
-                latest_date = final_df.index.max()
-                start_date = latest_date - pd.DateOffset(years=TRAINING_YEARS)
-                window_df = final_df.loc[start_date:]
-                features_columns = features_df.columns.intersection(window_df.columns)
-                X = window_df[features_columns]
-                y = window_df[target_col]
-                
-                if len(X) < 100 or y.nunique() < 2:
-                    print(f"Skipping {ticker}/{direction} due to insufficient training data or single class label.")
-                    save_performance_log(db_connector, ticker, direction, -1, {}, COMMON_FEATURES, start_date.date(), latest_date.date(), 'skipped', 'Insufficient training data or single class')
-                    continue
-
-                train_size = int(len(X) * (1 - TEST_SIZE))
-                X_train, X_test = X.iloc[:train_size], X.iloc[train_size:]
-                y_train, y_test = y.iloc[:train_size], y.iloc[train_size:]
-
-                _model, _scaler, _params, metrics, _version = train_and_evaluate_classification(
-                    db_connector, X_train, y_train, X_test, y_test, target_col, ticker, direction, 
-                    test_mode=test_mode, search_method='optuna', save_model=False
-                )
-                
-                save_performance_log(db_connector, ticker, direction, -1, metrics, COMMON_FEATURES, start_date.date(), latest_date.date(), 'success')
-                print(f"Successfully saved performance log for {ticker}/{direction}.")
-
-        except Exception as e:
-            print(f"An error occurred while evaluating {ticker}: {e}")
-            save_performance_log(db_connector, ticker, 'N/A', -1, {}, COMMON_FEATURES, None, None, 'failed', str(e))
-
-    cleanup_data(db_connector, newly_added_tickers)
+    if queue:
+        with db_connector.connect() as conn:
+            inserted, requeued = enqueue_tickers(conn, target_tickers)
+            print(f"Enqueued {inserted} new job(s) and re-queued {requeued} finished job(s) without a completed evaluation.")
+        run_queue_workers(db_connector, workers, threads_per_worker, test_mode, shard)
+        with db_connector.connect() as conn:
+            open_jobs = count_open_jobs(conn)
+        if open_jobs:
+            # Other hosts are still reading the scratch database
+            print(f"\n{open_jobs} job(s) are still pending or running on other workers. Keeping the scratch database.")
+            keep_scratch = True
+    elif workers > 1:
+        print(f"Evaluating with {workers} worker processes, {threads_per_worker} thread(s) each. Worker logs: {WORKER_LOG_DIR}")
+        run_parallel_evaluation(db_connector, target_tickers, workers, threads_per_worker, test_mode)
+    elif prefetch > 0:
+        print(f"Evaluating in-process with a prefetch depth of {prefetch} ({prefetch_loaders} loader thread(s)).")
+        run_prefetch_evaluation(db_connector, target_tickers, prefetch, prefetch_loaders, test_mode, threads_per_worker)
+    else:
+        for i, ticker in enumerate(target_tickers):
+            print(f"\n--- Evaluating ticker {i+1}/{len(target_tickers)}: {ticker} ---")
+            entries = evaluate_ticker(db_connector, ticker, test_mode, threads_per_worker)
+            save_performance_logs(db_connector, entries)
+            print(f"Saved performance log for {ticker}: {summarize_entries(entries)}.")
+
+    # Pooled connections keep the scratch database attached
+    db_connector.close_idle()
+    drop_scratch_database(scratch_path, keep_scratch)
     end_time = time.time()
     print(f"\n--- Bulk Evaluation Complete ---")
     print(f"Total execution time: {(end_time - start_time) / 60:.2f} minutes.")
+    print(db_connector.format_stats())
 
 def main():
     parser = argparse.ArgumentParser(description="Run a bulk evaluation of models for a list of tickers.")
     parser.add_argument('--fresh', action='store_true', help='Clear the performance_log and start from scratch.')
     parser.add_argument('--test-mode', action='store_true', help='Run in test mode with simplified hyperparameter search.')
     parser.add_argument('--source-file', type=str, default='list.csv', help='The CSV file containing the list of tickers to evaluate.')
+    parser.add_argument('--workers', type=int, default=1, help='Number of worker processes evaluating tickers in parallel (default: 1, in-process).')
+    parser.add_argument('--threads-per-worker', type=int, default=None,
+                        help='LightGBM/BLAS threads per worker (default: CPU count divided by --workers).')
+    parser.add_argument('--queue', action='store_true',
+                        help='Enqueue the remaining tickers in the evaluation_jobs table and work through them with leased jobs, so other hosts can join.')
+    parser.add_argument('--join', action='store_true',
+                        help='Only work on jobs already in the evaluation_jobs queue (no ticker loading, data preparation or cleanup).')
+    parser.add_argument('--shard', type=parse_shard, default=None,
+                        help="Evaluate only the tickers in shard 'i/N' by ticker hash (e.g. 0/4). Without --queue this splits the list across hosts statically.")
+    parser.add_argument('--keep-scratch', action='store_true',
+                        help='Keep the scratch database with the fetched price data as a cache for the next run.')
+    parser.add_argument('--prefetch', type=int, default=0,
+                        help='In single-process mode, load and featurize this many upcoming tickers in the background while the current one trains (default: 0, off).')
+    parser.add_argument('--prefetch-loaders', type=int, default=1,
+                        help='Number of background threads loading tickers for --prefetch (default: 1).')
+    add_profile_arguments(parser)
     args = parser.parse_args()
 
-    db_connector = DBConnector()
-    run_evaluation(db_connector, args.fresh, args.test_mode, args.source_file)
+    # Static shards use their own scratch database; queue workers all share the default one
+    scratch_path = get_scratch_db_path(None if args.queue or args.join else args.shard)
+    db_connector = get_evaluation_connector(scratch_path, queue=args.queue or args.join)
+    with instrument_run('bulk_evaluate', db_connector), profile_run('bulk_evaluate'):
+        run_evaluation(db_connector, args.fresh, args.test_mode, args.source_file, args.workers, args.threads_per_worker,
+                       queue=args.queue or args.join, join=args.join, shard=args.shard, keep_scratch=args.keep_scratch,
+                       prefetch=args.prefetch, prefetch_loaders=args.prefetch_loaders)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
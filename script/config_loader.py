@@ -37,6 +37,8 @@ class ConfigLoader:
         settings = {
             'optuna_n_trials': self.config.getint('hyperparameter_search', 'optuna_n_trials_test' if test_mode else 'optuna_n_trials'),
             'random_n_iter': self.config.getint('hyperparameter_search', 'random_n_iter_test' if test_mode else 'random_n_iter'),
+            'optuna_pruner_startup_trials': self.config.getint('hyperparameter_search', 'optuna_pruner_startup_trials', fallback=5),
+            'optuna_warm_n_trials': self.config.getint('hyperparameter_search', 'optuna_warm_n_trials_test' if test_mode else 'optuna_warm_n_trials', fallback=30),
             'grid_params': {
                 'n_estimators': self._get_list('hyperparameter_search', 'grid_n_estimators_test' if test_mode else 'grid_n_estimators', int),
                 'learning_rate': self._get_list('hyperparameter_search', 'grid_learning_rate_test' if test_mode else 'grid_learning_rate', float),
@@ -45,5 +47,90 @@ class ConfigLoader:
         }
         return settings
 
+    def get_retention_settings(self):
+        """Get settings for the data retention policy."""
+        return {
+            'keep_model_versions': self.config.getint('retention', 'keep_model_versions', fallback=3),
+            'archive_after_days': self.config.getint('retention', 'archive_after_days', fallback=180),
+            'archive_dir': self.config.get('retention', 'archive_dir', fallback='archive'),
+        }
+
+    def get_ingestion_settings(self):
+        """Get settings for concurrent price ingestion."""
+        return {
+            'max_workers': self.config.getint('ingestion', 'max_workers', fallback=4),
+            'requests_per_second': self.config.getfloat('ingestion', 'requests_per_second', fallback=2.0),
+            'burst': self.config.getint('ingestion', 'burst', fallback=4),
+            'batch_size': self.config.getint('ingestion', 'batch_size', fallback=20),
+            'max_retries': self.config.getint('ingestion', 'max_retries', fallback=3),
+            'backoff_seconds': self.config.getfloat('ingestion', 'backoff_seconds', fallback=1.0),
+        }
+
+    def get_fetch_cache_settings(self):
+        """Get settings for the on-disk cache of market-data and reference-data fetches."""
+        return {
+            'enabled': self.config.getboolean('fetch_cache', 'enabled', fallback=True),
+            'cache_dir': self.config.get('fetch_cache', 'cache_dir', fallback='cache/fetch'),
+            'ttls': {
+                'prices': self.config.getfloat('fetch_cache', 'prices_ttl_hours', fallback=4) * 3600,
+                'info': self.config.getfloat('fetch_cache', 'info_ttl_days', fallback=30) * 86400,
+            },
+        }
+
+    def get_stock_info_sync_settings(self):
+        """Get settings for the batch stock_info sync."""
+        return {
+            'max_workers': self.config.getint('stock_info_sync', 'max_workers', fallback=8),
+            'requests_per_second': self.config.getfloat('stock_info_sync', 'requests_per_second', fallback=5.0),
+            'burst': self.config.getint('stock_info_sync', 'burst', fallback=8),
+            'refresh_ttl_days': self.config.getfloat('stock_info_sync', 'refresh_ttl_days', fallback=7),
+        }
+
+    def get_evaluation_queue_settings(self):
+        """Get settings for the leased job queue used by multi-host bulk evaluation."""
+        return {
+            'lease_seconds': self.config.getint('evaluation_queue', 'lease_seconds', fallback=600),
+            'heartbeat_seconds': self.config.getint('evaluation_queue', 'heartbeat_seconds', fallback=60),
+            'max_attempts': self.config.getint('evaluation_queue', 'max_attempts', fallback=3),
+            'poll_seconds': self.config.getint('evaluation_queue', 'poll_seconds', fallback=30),
+        }
+
+    def get_database_settings(self):
+        """Get the SQLite pragmas and connection reuse settings applied by DBConnector."""
+        return {
+            'journal_mode': self.config.get('database', 'journal_mode', fallback='WAL'),
+            'synchronous': self.config.get('database', 'synchronous', fallback='NORMAL'),
+            'mmap_size': int(self.config.getfloat('database', 'mmap_size_mb', fallback=256) * 1024 * 1024),
+            # A negative cache_size is in KiB
+            'cache_size': -int(self.config.getfloat('database', 'cache_size_mb', fallback=64) * 1024),
+            'temp_store': self.config.get('database', 'temp_store', fallback='MEMORY'),
+            'busy_timeout': self.config.getfloat('database', 'busy_timeout_seconds', fallback=30),
+            'reuse_connections': self.config.getboolean('database', 'reuse_connections', fallback=True),
+        }
+
+    def get_analytics_settings(self):
+        """Get settings for the analytical read path (SQLite or a DuckDB-read Parquet mirror)."""
+        return {
+            'engine': self.config.get('analytics', 'engine', fallback='sqlite'),
+            'mirror_dir': self.config.get('analytics', 'mirror_dir', fallback='analytics'),
+            'auto_refresh': self.config.getboolean('analytics', 'auto_refresh', fallback=True),
+        }
+
+    def get_run_metrics_settings(self):
+        """Get settings for the per-run stage metrics recorded by instrumentation.py."""
+        return {
+            'enabled': self.config.getboolean('run_metrics', 'enabled', fallback=True),
+            'trend_runs': self.config.getint('run_metrics', 'trend_runs', fallback=10),
+        }
+
+    def get_profiling_settings(self):
+        """Get settings for the --profile mode shared by the entry-point scripts (profiling.py)."""
+        return {
+            'output_dir': self.config.get('profiling', 'output_dir', fallback='profiles'),
+            'sample_interval': self.config.getfloat('profiling', 'sample_interval', fallback=0.0),
+            'top_n': self.config.getint('profiling', 'top_n', fallback=30),
+            'memory_frames': self.config.getint('profiling', 'memory_frames', fallback=10),
+        }
+
 # Create a single, global instance to be imported by other modules
 config_loader = ConfigLoader()
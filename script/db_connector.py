@@ -1,53 +1,262 @@
+import datetime
 import sqlite3
+import threading
+import numpy as np
+import time
 from contextlib import contextmanager
 import os
+import sys
+
+# 'script'ディレクトリをsys.pathに追加し、config_loaderを直接インポートできるようにする
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from config_loader import config_loader
+
+# スレッドごとに保持しておく未使用の接続の数の上限 (入れ子の connect() の分だけ接続が必要になる)
+MAX_IDLE_PER_THREAD = 2
+# fetch_numeric で fetchmany により一度に読み込む行数
+FETCH_BATCH_SIZE = 4096
+# 株価の日付 (trade_day) は、この日からの日数で保存する (datetime64 の基準日と同じ)
+TRADE_DAY_EPOCH = datetime.date(1970, 1, 1)
+
+
+class ManagedConnection(sqlite3.Connection):
+    """ATTACH 済みのスキーマを記録できるようにした接続"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.attached = set()
+
+
+def set_journal_mode(conn, mode, schema='main', strict=False):
+    """
+    ジャーナルモードを変更し、変更後のモードを返す。
+    他の接続が WAL モードで使用中の場合などは変更されないため、strict の場合は例外を送出する。
+    """
+    actual = conn.execute(f"PRAGMA {schema}.journal_mode = {mode}").fetchone()[0]
+    if strict and actual.lower() != mode.lower():
+        raise sqlite3.OperationalError(
+            f"{schema} のジャーナルモードを {mode} に変更できません (現在: {actual})。"
+            "他のプロセスが WAL モードで接続している可能性があります。")
+    return actual
+
+
+def apply_pragmas(conn, settings):
+    """config.ini の [database] セクションの PRAGMA を接続に適用する"""
+    set_journal_mode(conn, settings['journal_mode'], strict=settings.get('strict_journal_mode', False))
+    conn.execute(f"PRAGMA synchronous = {settings['synchronous']}")
+    conn.execute(f"PRAGMA mmap_size = {int(settings['mmap_size'])}")
+    conn.execute(f"PRAGMA cache_size = {int(settings['cache_size'])}")
+    conn.execute(f"PRAGMA temp_store = {settings['temp_store']}")
+
 
 class DBConnector:
     """
     SQLiteデータベースへの接続を管理するクラス。
     `with`ステートメントと組み合わせて使用することで、接続のクリーンアップを自動化する。
 
+    接続はスレッドごとに再利用され、開くときに config.ini の [database] セクションの PRAGMA
+    (journal_mode、synchronous、mmap_size、cache_size、temp_store) が適用される。
+    settings の strict_journal_mode が真の場合、ATTACH するデータベースにも journal_mode を適用し、
+    変更できない場合は接続時に例外を送出する (複数のホストで共有するデータベースが WAL で開かれるのを防ぐ)。
+    `with` ブロックを抜けるときに未コミットのトランザクションはロールバックされる (接続を閉じた場合と同じ)。
+    フォークや spawn で作成された子プロセスは、親プロセスの接続を引き継がずに自分の接続を開く。
+
     使用例:
     db_connector = DBConnector()
     with db_connector.connect() as conn:
         cursor = conn.cursor()
         cursor.execute("SELECT 1")
     """
-    def __init__(self, db_name="stock_trader.db"):
+    def __init__(self, db_name="stock_trader.db", attachments=None, settings=None):
         # プロジェクトルートにデータベースファイルを配置
         self.db_path = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), db_name)
+        # 接続ごとに ATTACH するデータベース {スキーマ名: ファイルパス} (例: 一括評価用の一時データベース)
+        # ファイルが存在しない場合は ATTACH しない
+        self.attachments = dict(attachments or {})
+        self.settings = settings or config_loader.get_database_settings()
+        self._reset_pool()
+
+    def _reset_pool(self):
+        self._pid = os.getpid()
+        self._local = threading.local()
+        self._stats_lock = threading.Lock()
+        self._stats = {'opened': 0, 'reused': 0, 'open_seconds': 0.0, 'closed': 0}
+
+    def __getstate__(self):
+        # 接続とロックはプロセス間で受け渡せないため、設定のみを渡す
+        state = self.__dict__.copy()
+        for key in ('_pid', '_local', '_stats_lock', '_stats'):
+            state.pop(key)
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._reset_pool()
+
+    def open_connection(self, check_same_thread=True):
+        """
+        PRAGMA と ATTACH を適用した新しい接続を開く。呼び出し側で conn.close() を行う。
+        check_same_thread=False の場合は複数のスレッドから使用できる (利用の直列化は呼び出し側で行う)。
+        """
+        start = time.perf_counter()
+        # timeout は busy_timeout: 他のプロセスが書き込みロックを保持している間、失敗せずに待機する秒数
+        conn = sqlite3.connect(self.db_path, timeout=self.settings['busy_timeout'], factory=ManagedConnection,
+                               check_same_thread=check_same_thread)
+        try:
+            apply_pragmas(conn, self.settings)
+            self._sync_attachments(conn)
+        except sqlite3.Error:
+            conn.close()
+            raise
+        with self._stats_lock:
+            self._stats['opened'] += 1
+            self._stats['open_seconds'] += time.perf_counter() - start
+        return conn
+
+    def _sync_attachments(self, conn):
+        """接続を開いた後に作成・削除された ATTACH 先のファイルを反映する"""
+        for schema, path in self.attachments.items():
+            exists = os.path.exists(path)
+            if exists and schema not in conn.attached:
+                conn.execute(f"ATTACH DATABASE ? AS {schema}", (path,))
+                conn.attached.add(schema)
+                if self.settings.get('strict_journal_mode'):
+                    set_journal_mode(conn, self.settings['journal_mode'], schema, strict=True)
+            elif not exists and schema in conn.attached:
+                conn.execute(f"DETACH DATABASE {schema}")
+                conn.attached.discard(schema)
+
+    def _acquire(self):
+        if os.getpid() != self._pid:
+            # フォークした子プロセスでは親プロセスの接続を使わない
+            self._reset_pool()
+        idle = getattr(self._local, 'idle', None)
+        if idle is None:
+            idle = self._local.idle = []
+        while idle:
+            conn = idle.pop()
+            try:
+                self._sync_attachments(conn)
+            except sqlite3.Error:
+                conn.close()
+                continue
+            with self._stats_lock:
+                self._stats['reused'] += 1
+            return conn
+        return self.open_connection()
+
+    def _release(self, conn):
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+            # 呼び出し側が変更した設定を元に戻してから再利用する
+            conn.row_factory = None
+        except sqlite3.ProgrammingError:
+            # 呼び出し側で閉じられた接続
+            return
+        idle = self._local.idle
+        if self.settings['reuse_connections'] and len(idle) < MAX_IDLE_PER_THREAD:
+            idle.append(conn)
+        else:
+            conn.close()
+            with self._stats_lock:
+                self._stats['closed'] += 1
+
+    def close_idle(self):
+        """現在のスレッドで保持している未使用の接続を閉じる (ATTACH 先のファイルを削除する前など)"""
+        idle = getattr(self._local, 'idle', None) or []
+        while idle:
+            idle.pop().close()
+            with self._stats_lock:
+                self._stats['closed'] += 1
+
+    def stats(self):
+        """このプロセスで接続を開いた回数・所要時間と、再利用した回数を返す"""
+        with self._stats_lock:
+            stats = dict(self._stats)
+        total = stats['opened'] + stats['reused']
+        stats['reuse_rate'] = stats['reused'] / total if total else 0.0
+        stats['mean_open_ms'] = stats['open_seconds'] / stats['opened'] * 1000 if stats['opened'] else 0.0
+        return stats
+
+    def format_stats(self):
+        s = self.stats()
+        return (f"DB接続: 新規 {s['opened']}回 (平均 {s['mean_open_ms']:.2f}ms, 合計 {s['open_seconds']:.3f}秒), "
+                f"再利用 {s['reused']}回 (再利用率 {s['reuse_rate']:.1%})")
 
     @contextmanager
     def connect(self):
         """
         データベース接続を提供するコンテキストマネージャ。
+        同じスレッドで以前に使用した接続があれば再利用する。入れ子で呼び出した場合はそれぞれ別の接続になる。
         """
         conn = None
         try:
-            # SQLiteデータベースに接続
-            conn = sqlite3.connect(self.db_path)
-            print(f"--- SQLiteデータベース '{self.db_path}' への接続が成功しました ---")
+            conn = self._acquire()
             yield conn
         except sqlite3.Error as e:
             print(f"接続エラー: {e}")
-            if conn:
-                conn.rollback()
             raise
         finally:
             if conn:
-                conn.close()
-                print("--- データベース接続を閉じました ---")
+                self._release(conn)
+
+def fetch_numeric(conn, sql, params=(), batch_size=FETCH_BATCH_SIZE):
+    """
+    数値のカラムのみを返すクエリの結果を、(行数, カラム数) の float64 配列として読み込む。
+    pd.read_sql のように全行をオブジェクト配列に変換してから型を推定するのではなく、
+    fetchmany で読み込んだ行をそのまま事前に確保した配列に書き込む (不足した場合は2倍に拡張する)。NULL は NaN になる。
+    同じ SQL の文字列で呼び出せば、接続ごとのステートメントキャッシュにより準備済みのステートメントが再利用される
+    (DBConnector の接続はスレッドごとに再利用されるため、connect() の呼び出しをまたいで有効)。
+    """
+    cursor = conn.execute(sql, params)
+    buffer = np.empty((batch_size, len(cursor.description)), dtype=np.float64)
+    n_rows = 0
+    while True:
+        rows = cursor.fetchmany(batch_size)
+        if not rows:
+            break
+        end = n_rows + len(rows)
+        if end > len(buffer):
+            grown = np.empty((max(end, 2 * len(buffer)), buffer.shape[1]), dtype=np.float64)
+            grown[:n_rows] = buffer[:n_rows]
+            buffer = grown
+        buffer[n_rows:end] = rows
+        n_rows = end
+    return buffer[:n_rows]
+
+
+def trade_days_to_datetime64(values, dtype='datetime64[ns]'):
+    """
+    trade_day (1970-01-01 からの日数) の配列を datetime64 の配列に変換する。
+    datetime64[D] と同じ基準日のため、文字列の解析をせずに型の変換のみで済む。
+    """
+    return np.rint(np.asarray(values)).astype(np.int64).astype('datetime64[D]').astype(dtype)
+
+
+def datetime64_to_trade_days(values):
+    """datetime64 の配列 (タイムゾーン無しの DatetimeIndex など) を trade_day の整数の配列に変換する"""
+    return np.asarray(values).astype('datetime64[D]').astype(np.int64)
+
+
+def trade_day_to_date(trade_day):
+    return TRADE_DAY_EPOCH + datetime.timedelta(days=int(trade_day))
+
+
+def date_to_trade_day(date):
+    return (date - TRADE_DAY_EPOCH).days
 
 # 下位互換性のための古い関数 (新しいコードではDBConnectorの使用を推奨)
 def get_db_connection():
     """
     下位互換性のために残された関数。
-    DBConnectorクラスのインスタンスを作成し、手動で接続を開始する。
+    DBConnectorの設定 (PRAGMA) を適用した新しい接続を開く。
     呼び出し側がconn.close()を管理する必要がある。
     """
     connector = DBConnector()
     try:
-        conn = sqlite3.connect(connector.db_path)
+        conn = connector.open_connection()
         print(f"--- SQLiteデータベース '{connector.db_path}' への接続が成功しました ---")
         return conn, None  # tunnelオブジェクトはNoneを返す
     except sqlite3.Error as e:
@@ -64,5 +273,7 @@ if __name__ == '__main__':
             cursor.execute("SELECT sqlite_version();")
             db_version = cursor.fetchone()
             print(f"接続成功！ SQLiteバージョン: {db_version[0]}")
+            print(f"ジャーナルモード: {cursor.execute('PRAGMA journal_mode').fetchone()[0]}")
+        print(db_connector.format_stats())
     except Exception as e:
         print(f"テスト中にエラーが発生しました: {e}")
\ No newline at end of file
@@ -0,0 +1,225 @@
+import queue
+import random
+import sqlite3
+import threading
+import time
+from concurrent.futures import Future
+
+# 書き込みスレッドの停止を表す目印
+_STOP = object()
+
+
+def is_lock_error(error):
+    """SQLite のロック競合 (database is locked / busy) による例外かどうか"""
+    return isinstance(error, sqlite3.OperationalError) and ('locked' in str(error) or 'busy' in str(error))
+
+
+class DBWriter:
+    """
+    プロセス内の全ての書き込みを1つのスレッド・1つの接続に集約する書き込みキュー。
+    複数のスレッドから submit(fn, ...) で書き込みを依頼すると、書き込みスレッドが fn(conn, ...) を順に実行する。
+    キューに溜まった依頼は最大 max_batch 件まで1つのトランザクションにまとめてコミットする (グループコミット)。
+    依頼ごとに SAVEPOINT を作るため、1件の失敗は同じトランザクションの他の依頼に影響しない。
+
+    fn の中で conn.commit() や conn.rollback() を呼び出してはならない。
+    fn の中でトランザクションが終了した場合 (SQLITE_FULL などで SQLite がロールバックした場合を含む) は、
+    同じトランザクションの依頼を全て失敗としてロールバックし、次の依頼の処理を続ける。
+    書き込みスレッドが停止した後 (接続を開けなかった場合など) は、残りの依頼も submit() も例外になる。
+    他のプロセスとの競合は BEGIN IMMEDIATE で書き込みロックを取るときにだけ発生し、busy_timeout の間待機した後、
+    それでもロックを取れない場合は指数バックオフで再試行する。
+    WAL モードでは読み込みはこの書き込みをブロックせず、書き込みも読み込みをブロックしない。
+
+    使用例:
+    with DBWriter(db_connector) as writer:
+        future = writer.submit(insert_performance_logs, entries)
+        future.result()  # 完了を待つ場合
+    """
+
+    def __init__(self, db_connector, max_batch=64, max_delay=0.005, lock_retries=5):
+        self.db_connector = db_connector
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self.lock_retries = lock_retries
+        self.requests = queue.Queue()
+        self.lock = threading.Lock()
+        self.stats = {'requests': 0, 'failed': 0, 'commits': 0, 'lock_retries': 0, 'commit_seconds': 0.0}
+        self.thread = None
+        self.closed = False
+        # 書き込みスレッドを停止させた例外
+        self.error = None
+
+    def start(self):
+        if self.thread is None:
+            self.thread = threading.Thread(target=self._run, name="db-writer", daemon=True)
+            self.thread.start()
+        return self
+
+    def submit(self, fn, *args, **kwargs):
+        """fn(conn, *args, **kwargs) の実行を依頼し、その戻り値 (または例外) を受け取る Future を返す"""
+        future = Future()
+        # 書き込みスレッドが停止時にキューを空にした後は、依頼を受け付けない
+        with self.lock:
+            if self.closed:
+                raise RuntimeError("DBWriter は既に閉じられています。") from self.error
+            self.start()
+            self.requests.put((fn, args, kwargs, future))
+        return future
+
+    def call(self, fn, *args, **kwargs):
+        """submit() してコミットまで待ち、fn の戻り値を返す"""
+        return self.submit(fn, *args, **kwargs).result()
+
+    def close(self):
+        """依頼済みの書き込みを全てコミットしてから、書き込みスレッドを停止する"""
+        with self.lock:
+            if self.closed:
+                return
+            self.closed = True
+            if self.thread is not None:
+                self.requests.put(_STOP)
+        if self.thread is not None:
+            self.thread.join()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+        return False
+
+    def summary(self):
+        with self.lock:
+            s = dict(self.stats)
+        per_commit = s['requests'] / s['commits'] if s['commits'] else 0.0
+        return (f"書き込み: {s['requests']}件 (失敗 {s['failed']}件), コミット {s['commits']}回 "
+                f"(1回あたり {per_commit:.1f}件, 合計 {s['commit_seconds']:.2f}秒), ロック待ちの再試行 {s['lock_retries']}回")
+
+    def _run(self):
+        conn = None
+        try:
+            conn = self.db_connector.open_connection()
+            stopping = False
+            while not stopping:
+                first = self.requests.get()
+                if first is _STOP:
+                    break
+                batch = [first]
+                # 少しだけ待って、同時に依頼された書き込みを同じトランザクションにまとめる
+                deadline = time.monotonic() + self.max_delay
+                while len(batch) < self.max_batch:
+                    try:
+                        request = self.requests.get(timeout=max(0.0, deadline - time.monotonic()))
+                    except queue.Empty:
+                        break
+                    if request is _STOP:
+                        stopping = True
+                        break
+                    batch.append(request)
+                try:
+                    self._commit_batch(conn, batch)
+                except Exception as e:
+                    # 想定外の失敗でも書き込みスレッドは停止させず、このバッチの依頼だけを失敗にする
+                    self._rollback(conn)
+                    for _fn, _args, _kwargs, future in batch:
+                        if not future.done():
+                            future.set_exception(e)
+        except Exception as e:
+            # 例外は残りの依頼の Future に渡す
+            self.error = e
+        finally:
+            with self.lock:
+                self.closed = True
+                pending = []
+                while True:
+                    try:
+                        request = self.requests.get_nowait()
+                    except queue.Empty:
+                        break
+                    if request is not _STOP:
+                        pending.append(request)
+            for _fn, _args, _kwargs, future in pending:
+                error = RuntimeError("DBWriter の書き込みスレッドが停止したため、書き込みは実行されませんでした。")
+                error.__cause__ = self.error
+                future.set_exception(error)
+            if conn is not None:
+                conn.close()
+
+    def _rollback(self, conn):
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+        except sqlite3.Error:
+            pass
+
+    def _begin(self, conn):
+        """書き込みロックを取得する。busy_timeout を超えてもロックを取れない場合は再試行する"""
+        attempt = 0
+        while True:
+            try:
+                conn.execute("BEGIN IMMEDIATE")
+                return
+            except sqlite3.OperationalError as e:
+                attempt += 1
+                if not is_lock_error(e) or attempt > self.lock_retries:
+                    raise
+                with self.lock:
+                    self.stats['lock_retries'] += 1
+                time.sleep(0.05 * (2 ** (attempt - 1)) * (1 + random.random()))
+
+    def _commit_batch(self, conn, batch):
+        start = time.perf_counter()
+        try:
+            self._begin(conn)
+        except Exception as e:
+            for _fn, _args, _kwargs, future in batch:
+                future.set_exception(e)
+            with self.lock:
+                self.stats['requests'] += len(batch)
+                self.stats['failed'] += len(batch)
+            return
+
+        outcomes = []
+        # 依頼の中でトランザクションが終了したときの例外 (以降の依頼は実行しない)
+        aborted = None
+        for fn, args, kwargs, future in batch:
+            if aborted is not None:
+                outcomes.append((future, None, aborted))
+                continue
+            try:
+                conn.execute("SAVEPOINT write_request")
+                try:
+                    result = fn(conn, *args, **kwargs)
+                except Exception as e:
+                    outcomes.append((future, None, e))
+                    conn.execute("ROLLBACK TO write_request")
+                    conn.execute("RELEASE write_request")
+                else:
+                    outcomes.append((future, result, None))
+                    conn.execute("RELEASE write_request")
+            except sqlite3.Error as e:
+                # SAVEPOINT がない (トランザクションが終了している) ため、既に実行した依頼の書き込みも保証できない
+                aborted = e
+                if not outcomes or outcomes[-1][0] is not future:
+                    outcomes.append((future, None, e))
+
+        if aborted is not None:
+            self._rollback(conn)
+            outcomes = [(future, None, error or aborted) for future, _result, error in outcomes]
+        else:
+            try:
+                conn.commit()
+            except Exception as e:
+                self._rollback(conn)
+                outcomes = [(future, None, e) for future, _result, _error in outcomes]
+
+        with self.lock:
+            self.stats['requests'] += len(batch)
+            self.stats['failed'] += sum(1 for _future, _result, error in outcomes if error is not None)
+            if aborted is None:
+                self.stats['commits'] += 1
+            self.stats['commit_seconds'] += time.perf_counter() - start
+        for future, result, error in outcomes:
+            if error is None:
+                future.set_result(result)
+            else:
+                future.set_exception(error)
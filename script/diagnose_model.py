@@ -23,6 +23,7 @@ from sklearn.metrics import (
     confusion_matrix
 )
 from sklearn.model_selection import TimeSeriesSplit
+from profiling import add_profile_arguments, profile_run
 
 def list_models(ticker=None):
     """学習済みモデルを一覧表示する。銘柄が指定されていれば、その銘柄のみ表示する。"""
@@ -291,6 +292,7 @@ def main():
     parser.add_argument('--version', type=int, help="評価するモデルのバージョン番号。")
     parser.add_argument('--backtest', action='store_true', help="バックテストモードで評価を実行します。")
 
+    add_profile_arguments(parser)
     args = parser.parse_args()
 
     if args.backtest:
@@ -310,4 +312,5 @@ def main():
     print("\n--- スクリプトが完了しました。 ---")
 
 if __name__ == "__main__":
-    main()
+    with profile_run('diagnose_model'):
+        main()
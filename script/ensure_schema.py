@@ -1,5 +1,7 @@
 import os
+import sys
 from db_connector import get_db_connection
+from apply_db_migration import LEGACY_PRICE_TABLE_MESSAGE, apply_schema_migrations, get_price_table_layout
 import sqlite3
 
 # SQLファイルへのパス
@@ -8,7 +10,9 @@ SQL_FILE_PATH = os.path.join(os.path.dirname(__file__), '..', 'SQL', 'ensure_sch
 def ensure_schema():
     """
     SQLファイルからDDLを読み込み、データベースのスキーマ（テーブル）が存在することを保証する。
-    テーブルが存在しない場合のみ作成する。
+    テーブルが存在しない場合のみ作成する。カラムの追加のマイグレーションが未適用であれば先に適用する。
+    株価テーブルが古い形式の場合は、テーブル全体を書き換える移行を自動では行わず、migrate-db の実行を促して中止する。
+    成功した場合は True を返す。
     """
     print("--- データベーススキーマの存在確認を開始します ---")
     conn = None
@@ -16,7 +20,17 @@ def ensure_schema():
         conn, _ = get_db_connection()
         if conn is None:
             print("データベース接続の取得に失敗したため、処理を中止します。")
-            return
+            return False
+
+        if get_price_table_layout(conn) == 'legacy':
+            print("=" * 80)
+            print(f"[エラー] {LEGACY_PRICE_TABLE_MESSAGE}")
+            print("=" * 80)
+            return False
+
+        # 新しい形式を前提とするインデックスなどを作成する前に、カラムの追加を適用する
+        for description in apply_schema_migrations(conn):
+            print(f"マイグレーションを適用しました: {description}")
 
         cursor = conn.cursor()
 
@@ -28,6 +42,7 @@ def ensure_schema():
         conn.commit()
         cursor.close()
         print("--- データベーススキーマの存在確認が完了しました ---")
+        return True
 
     except FileNotFoundError:
         print(f"エラー: SQLファイルが見つかりません: {SQL_FILE_PATH}")
@@ -37,6 +52,9 @@ def ensure_schema():
         if conn:
             conn.close()
             print("データベース接続を閉じました。")
+    return False
 
 if __name__ == "__main__":
-    ensure_schema()
\ No newline at end of file
+    # update-data の後続のステップを実行しないよう、失敗した場合は終了コード 1 で終了する
+    if not ensure_schema():
+        sys.exit(1)
\ No newline at end of file
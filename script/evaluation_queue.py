@@ -0,0 +1,270 @@
+import argparse
+import os
+import socket
+import sys
+import threading
+import time
+import zlib
+
+# 'script'ディレクトリをsys.pathに追加し、db_connectorなどを直接インポートできるようにする
+script_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(script_dir)
+
+from db_connector import DBConnector
+
+JOB_STATUSES = ['pending', 'running', 'done', 'failed']
+
+
+def make_worker_id():
+    """ホスト名とプロセスIDからワーカーを識別する文字列を作成する"""
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def parse_shard(value):
+    """'i/N' 形式の文字列を (i, N) に変換する (0 <= i < N)"""
+    try:
+        index, count = (int(x) for x in value.split('/'))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"シャードは 'i/N' の形式で指定してください: {value}")
+    if count < 1 or not 0 <= index < count:
+        raise argparse.ArgumentTypeError(f"シャード番号は 0 以上 {count} 未満で指定してください: {value}")
+    return index, count
+
+
+def ticker_shard(ticker, count):
+    """銘柄コードの CRC32 によるシャード番号。ホストやプロセスに依存せず常に同じ値になる"""
+    return zlib.crc32(ticker.encode('utf-8')) % count
+
+
+def filter_shard(tickers, shard):
+    """shard=(i, N) に割り当てられた銘柄のみを返す。shard が None の場合はそのまま返す"""
+    if shard is None:
+        return list(tickers)
+    index, count = shard
+    return [t for t in tickers if ticker_shard(t, count) == index]
+
+
+def enqueue_tickers(conn, tickers):
+    """
+    銘柄をジョブとして登録する。呼び出し側は評価が完了していない銘柄のみを渡す。
+    未登録の銘柄は新しく登録し、終了済み (done または failed) のジョブは試行回数をリセットして未処理に戻す
+    (失敗したジョブや、スキップ・失敗の結果で done になったジョブを再評価するため)。
+    未処理・実行中のジョブは変更しない。(新しく登録した件数, 未処理に戻した件数) を返す。
+    """
+    before = conn.total_changes
+    conn.executemany("INSERT OR IGNORE INTO evaluation_jobs (ticker) VALUES (?)", [(t,) for t in tickers])
+    inserted = conn.total_changes - before
+    before = conn.total_changes
+    conn.executemany(
+        """
+        UPDATE evaluation_jobs
+        SET status = 'pending', attempts = 0, worker_id = NULL, lease_expires_at = NULL, finished_at = NULL
+        WHERE ticker = ? AND status IN ('done', 'failed')
+        """,
+        [(t,) for t in tickers]
+    )
+    requeued = conn.total_changes - before
+    conn.commit()
+    return inserted, requeued
+
+
+def requeue_failed(conn):
+    """失敗したジョブを未処理に戻し、試行回数をリセットする"""
+    cursor = conn.execute(
+        "UPDATE evaluation_jobs SET status = 'pending', attempts = 0, worker_id = NULL, lease_expires_at = NULL WHERE status = 'failed'"
+    )
+    conn.commit()
+    return cursor.rowcount
+
+
+def reset_queue(conn):
+    """全てのジョブを削除する"""
+    conn.execute("DELETE FROM evaluation_jobs")
+    conn.commit()
+
+
+def claim_job(conn, worker_id, lease_seconds, max_attempts, shard=None):
+    """
+    未処理のジョブ、またはリースが切れた実行中のジョブを1件取得し、worker_id のリースを設定する。
+    BEGIN IMMEDIATE で書き込みロックを取ってから選択・更新するため、複数のホスト・プロセスが同時に呼び出しても
+    同じジョブを取得することはない。取得できるジョブが無い場合は None を返す。
+    リースが切れたジョブのうち、試行回数が max_attempts に達したものは failed にする。
+    """
+    now = time.time()
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        conn.execute(
+            """
+            UPDATE evaluation_jobs
+            SET status = 'failed', finished_at = CURRENT_TIMESTAMP,
+                last_error = 'Lease expired after ' || attempts || ' attempt(s) (last worker: ' || worker_id || ')'
+            WHERE status = 'running' AND lease_expires_at < ? AND attempts >= ?
+            """,
+            (now, max_attempts)
+        )
+        sql = """
+            SELECT ticker FROM evaluation_jobs
+            WHERE (status = 'pending' OR (status = 'running' AND lease_expires_at < ?))
+        """
+        params = [now]
+        if shard is not None:
+            sql += " AND ticker_shard(ticker, ?) = ?"
+            params += [shard[1], shard[0]]
+        # 未処理のジョブを、リースが切れたジョブより先に取得する
+        sql += " ORDER BY status = 'running', ticker LIMIT 1"
+        if shard is not None:
+            conn.create_function('ticker_shard', 2, ticker_shard, deterministic=True)
+        row = conn.execute(sql, params).fetchone()
+        if row is None:
+            conn.commit()
+            return None
+        conn.execute(
+            """
+            UPDATE evaluation_jobs
+            SET status = 'running', worker_id = ?, attempts = attempts + 1,
+                lease_expires_at = ?, heartbeat_at = ?
+            WHERE ticker = ?
+            """,
+            (worker_id, now + lease_seconds, now, row[0])
+        )
+        conn.commit()
+        return row[0]
+    except Exception:
+        conn.rollback()
+        raise
+
+
+def extend_lease(conn, ticker, worker_id, lease_seconds):
+    """renew_lease の更新のみを行う (コミットは呼び出し側で行う)。リースを保持していない場合は False を返す。"""
+    now = time.time()
+    cursor = conn.execute(
+        """
+        UPDATE evaluation_jobs SET lease_expires_at = ?, heartbeat_at = ?
+        WHERE ticker = ? AND worker_id = ? AND status = 'running'
+        """,
+        (now + lease_seconds, now, ticker, worker_id)
+    )
+    return cursor.rowcount == 1
+
+
+def renew_lease(conn, ticker, worker_id, lease_seconds):
+    """
+    リースを延長する (ハートビート)。リースが他のワーカーに再取得されていた場合は False を返す。
+    """
+    renewed = extend_lease(conn, ticker, worker_id, lease_seconds)
+    conn.commit()
+    return renewed
+
+
+def complete_job(conn, ticker, worker_id, status, error_message=None):
+    """
+    ジョブを done または failed にする。コミットは呼び出し側で行い、評価結果の書き込みと同じトランザクションにできる。
+    リースを保持していない (他のワーカーに再取得された) 場合は何も更新せずに False を返す。
+    """
+    cursor = conn.execute(
+        """
+        UPDATE evaluation_jobs
+        SET status = ?, finished_at = CURRENT_TIMESTAMP, lease_expires_at = NULL, last_error = ?
+        WHERE ticker = ? AND worker_id = ? AND status = 'running'
+        """,
+        (status, error_message, ticker, worker_id)
+    )
+    return cursor.rowcount == 1
+
+
+def count_open_jobs(conn, shard=None):
+    """未処理または実行中のジョブの件数を返す。shard を指定した場合はそのシャードの銘柄のみを数える。"""
+    tickers = [row[0] for row in conn.execute("SELECT ticker FROM evaluation_jobs WHERE status IN ('pending', 'running')")]
+    return len(filter_shard(tickers, shard))
+
+
+class LeaseHeartbeat:
+    """
+    ジョブの実行中、バックグラウンドのスレッドから定期的にリースを延長する。
+    `with` ステートメントで使用し、リースを失った (他のワーカーに再取得された) 場合は lost が True になる。
+    lost が True の場合、呼び出し側はそのジョブの評価結果を書き込まない。
+    ハートビートは専用の接続で行い、評価処理の接続とは共有しない。
+    writer (DBWriter) を指定した場合は、そのプロセスの他の書き込みと同じ書き込みスレッドで延長する。
+    """
+
+    def __init__(self, db_connector, ticker, worker_id, lease_seconds, interval, writer=None):
+        self.db_connector = db_connector
+        self.writer = writer
+        self.ticker = ticker
+        self.worker_id = worker_id
+        self.lease_seconds = lease_seconds
+        self.interval = interval
+        self.lost = False
+        self.stop_event = threading.Event()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        while not self.stop_event.wait(self.interval):
+            try:
+                if self.writer is not None:
+                    renewed = self.writer.call(extend_lease, self.ticker, self.worker_id, self.lease_seconds)
+                else:
+                    with self.db_connector.connect() as conn:
+                        renewed = renew_lease(conn, self.ticker, self.worker_id, self.lease_seconds)
+                if not renewed:
+                    self.lost = True
+                    return
+            except Exception as e:
+                # 一時的なロック競合などはリースの期限内に次のハートビートで再試行する
+                print(f"  [警告] {self.ticker} のリースの延長に失敗しました: {e}")
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.stop_event.set()
+        self.thread.join()
+        return False
+
+
+def show_queue_status(db_connector):
+    """ジョブの状態ごとの件数と、実行中のジョブを表示する"""
+    now = time.time()
+    with db_connector.connect() as conn:
+        counts = dict(conn.execute("SELECT status, COUNT(*) FROM evaluation_jobs GROUP BY status").fetchall())
+        running = conn.execute(
+            "SELECT ticker, worker_id, attempts, lease_expires_at, heartbeat_at FROM evaluation_jobs WHERE status = 'running' ORDER BY worker_id, ticker"
+        ).fetchall()
+        failed = conn.execute("SELECT ticker, attempts, last_error FROM evaluation_jobs WHERE status = 'failed' ORDER BY ticker").fetchall()
+
+    print("--- 一括評価ジョブキュー ---")
+    print("  ".join(f"{status}: {counts.get(status, 0)}" for status in JOB_STATUSES))
+    if running:
+        print(f"\n{'TICKER':<12} {'WORKER':<30} {'ATTEMPTS':>8} {'HEARTBEAT(s前)':>14} {'LEASE':>10}")
+        for ticker, worker_id, attempts, lease_expires_at, heartbeat_at in running:
+            lease = f"{lease_expires_at - now:.0f}s" if lease_expires_at >= now else 'expired'
+            print(f"{ticker:<12} {worker_id:<30} {attempts:>8} {now - heartbeat_at:>14.0f} {lease:>10}")
+    if failed:
+        print("\n失敗したジョブ:")
+        for ticker, attempts, last_error in failed:
+            print(f"  {ticker} (試行 {attempts}回): {last_error}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="一括評価のジョブキュー (evaluation_jobs) を管理します。")
+    subparsers = parser.add_subparsers(dest="command", required=True, help="実行するコマンド")
+    subparsers.add_parser("status", help="ジョブの状態ごとの件数と実行中のジョブを表示します。")
+    subparsers.add_parser("requeue-failed", help="失敗したジョブを未処理に戻します。")
+    subparsers.add_parser("reset", help="全てのジョブを削除します。")
+    args = parser.parse_args()
+
+    db_connector = DBConnector()
+    if args.command == "status":
+        show_queue_status(db_connector)
+    elif args.command == "requeue-failed":
+        with db_connector.connect() as conn:
+            print(f"{requeue_failed(conn)}件の失敗したジョブを未処理に戻しました。")
+    elif args.command == "reset":
+        with db_connector.connect() as conn:
+            reset_queue(conn)
+        print("全てのジョブを削除しました。")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,180 @@
+import argparse
+import hashlib
+import json
+import os
+import pickle
+import sys
+import tempfile
+import threading
+import time
+
+# 'script'ディレクトリをsys.pathに追加し、config_loaderなどを直接インポートできるようにする
+script_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(script_dir)
+
+from config_loader import config_loader
+
+PROJECT_ROOT = os.path.dirname(script_dir)
+STATS_FILE = 'stats.json'
+
+
+class FetchCache:
+    """
+    外部API (yfinance など) の取得結果をディスクに保存するキャッシュ。
+    エントリは種類 (prices, info など) ごとのディレクトリに1ファイルずつ保存され、種類ごとの有効期限 (秒) を持つ。
+    複数スレッドから同時に利用できる。ヒット率などの統計は、実行中の値と累計 (stats.json) の両方を保持する。
+    """
+
+    def __init__(self, cache_dir, ttls, enabled=True):
+        self.cache_dir = cache_dir
+        self.ttls = ttls
+        self.enabled = enabled
+        self.lock = threading.Lock()
+        self.stats = {}
+
+    def _path(self, kind, key):
+        digest = hashlib.sha1(key.encode('utf-8')).hexdigest()
+        return os.path.join(self.cache_dir, kind, f"{digest}.pkl")
+
+    def _count(self, kind, outcome):
+        with self.lock:
+            kind_stats = self.stats.setdefault(kind, {'hits': 0, 'misses': 0, 'expired': 0, 'stores': 0})
+            kind_stats[outcome] += 1
+
+    def get(self, kind, key, accept=None):
+        """
+        有効期限内のエントリを (値, メタデータ) のタプルで返す。無い場合や期限切れの場合は None を返す。
+        accept(meta) を指定した場合、False を返すエントリはヒットとして扱わない (例: 要求した期間を含まない株価)。
+        """
+        if not self.enabled:
+            return None
+        path = self._path(kind, key)
+        try:
+            with open(path, 'rb') as f:
+                entry = pickle.load(f)
+        except (FileNotFoundError, EOFError, pickle.UnpicklingError):
+            self._count(kind, 'misses')
+            return None
+
+        if time.time() - entry['stored_at'] > self.ttls.get(kind, 0):
+            self._count(kind, 'expired')
+            return None
+        if accept is not None and not accept(entry['meta']):
+            self._count(kind, 'misses')
+            return None
+        self._count(kind, 'hits')
+        return entry['value'], entry['meta']
+
+    def put(self, kind, key, value, meta=None):
+        """エントリを保存する。書き込み途中のファイルが読まれないよう、一時ファイルに書いてから置き換える。"""
+        if not self.enabled:
+            return
+        path = self._path(kind, key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        entry = {'key': key, 'stored_at': time.time(), 'meta': meta or {}, 'value': value}
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                pickle.dump(entry, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, path)
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        self._count(kind, 'stores')
+
+    def summary(self):
+        """実行中の統計を、種類ごとのヒット率を含む文字列で返す"""
+        lines = []
+        with self.lock:
+            for kind, s in sorted(self.stats.items()):
+                lookups = s['hits'] + s['misses'] + s['expired']
+                hit_rate = s['hits'] / lookups if lookups else 0.0
+                lines.append(f"{kind}: ヒット {s['hits']} / 参照 {lookups} (ヒット率 {hit_rate:.1%}, 期限切れ {s['expired']}, 保存 {s['stores']})")
+        return "\n".join(lines) if lines else "キャッシュは参照されませんでした。"
+
+    def save_stats(self):
+        """実行中の統計を累計 (stats.json) に加算する"""
+        if not self.enabled or not self.stats:
+            return
+        os.makedirs(self.cache_dir, exist_ok=True)
+        path = os.path.join(self.cache_dir, STATS_FILE)
+        with self.lock:
+            totals = load_stats(self.cache_dir)
+            for kind, s in self.stats.items():
+                kind_totals = totals.setdefault(kind, {})
+                for outcome, count in s.items():
+                    kind_totals[outcome] = kind_totals.get(outcome, 0) + count
+            with open(path, 'w', encoding='utf-8') as f:
+                json.dump(totals, f, indent=2)
+            self.stats = {}
+
+
+def load_stats(cache_dir):
+    path = os.path.join(cache_dir, STATS_FILE)
+    if not os.path.exists(path):
+        return {}
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def get_fetch_cache(enabled=None):
+    """config.ini の [fetch_cache] セクションの設定でキャッシュを作成する。enabled を指定すると設定を上書きする。"""
+    settings = config_loader.get_fetch_cache_settings()
+    cache_dir = settings['cache_dir']
+    if not os.path.isabs(cache_dir):
+        cache_dir = os.path.join(PROJECT_ROOT, cache_dir)
+    return FetchCache(cache_dir, settings['ttls'], settings['enabled'] if enabled is None else enabled)
+
+
+def show_cache_stats(cache):
+    """キャッシュの種類ごとのエントリ数・サイズと、累計のヒット率を表示する"""
+    print(f"--- 取得キャッシュ: {cache.cache_dir} ---")
+    totals = load_stats(cache.cache_dir)
+    kinds = sorted(set(cache.ttls) | set(totals))
+    print(f"{'KIND':<8} {'ENTRIES':>8} {'SIZE(MB)':>9} {'TTL(h)':>8} {'HITS':>8} {'LOOKUPS':>8} {'HIT RATE':>9}")
+    for kind in kinds:
+        kind_dir = os.path.join(cache.cache_dir, kind)
+        files = [os.path.join(kind_dir, name) for name in os.listdir(kind_dir)] if os.path.isdir(kind_dir) else []
+        size = sum(os.path.getsize(path) for path in files)
+        s = totals.get(kind, {})
+        lookups = s.get('hits', 0) + s.get('misses', 0) + s.get('expired', 0)
+        hit_rate = f"{s.get('hits', 0) / lookups:.1%}" if lookups else '-'
+        print(f"{kind:<8} {len(files):>8} {size / 1024**2:>9.2f} {cache.ttls.get(kind, 0) / 3600:>8.1f} "
+              f"{s.get('hits', 0):>8} {lookups:>8} {hit_rate:>9}")
+
+
+def clear_cache(cache, expired_only=False):
+    """キャッシュのエントリを削除する。expired_only=True の場合は有効期限切れのエントリのみを削除する。"""
+    removed = 0
+    now = time.time()
+    for kind in os.listdir(cache.cache_dir) if os.path.isdir(cache.cache_dir) else []:
+        kind_dir = os.path.join(cache.cache_dir, kind)
+        if not os.path.isdir(kind_dir):
+            continue
+        for name in os.listdir(kind_dir):
+            path = os.path.join(kind_dir, name)
+            if expired_only and now - os.path.getmtime(path) <= cache.ttls.get(kind, 0):
+                continue
+            os.remove(path)
+            removed += 1
+    print(f"{removed}件のキャッシュエントリを削除しました。")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="株価・銘柄情報の取得キャッシュを管理します。")
+    subparsers = parser.add_subparsers(dest="command", required=True, help="実行するコマンド")
+    subparsers.add_parser("stats", help="エントリ数・サイズと累計のヒット率を表示します。")
+    parser_clear = subparsers.add_parser("clear", help="キャッシュのエントリを削除します。")
+    parser_clear.add_argument("--expired", action="store_true", help="有効期限切れのエントリのみを削除します。")
+    args = parser.parse_args()
+
+    cache = get_fetch_cache()
+    if args.command == "stats":
+        show_cache_stats(cache)
+    elif args.command == "clear":
+        clear_cache(cache, expired_only=args.expired)
+
+
+if __name__ == "__main__":
+    main()
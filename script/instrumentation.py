@@ -0,0 +1,269 @@
+"""
+処理段階ごとの実行時間・件数・ピークメモリを計測し、run_metrics テーブルに記録する軽量な計測API。
+
+エントリポイント (predict_all.py, train_model.py など) で start_run() を呼び出すと、その実行の間、
+stage() コンテキストマネージャや @timed デコレータで囲んだ処理の時間と件数が集計される。
+計測中の実行が無い場合 (ライブラリとして呼び出された場合やテスト) は、stage() と @timed は何も記録しない。
+
+使用例:
+    run = start_run('predict_all')
+    with stage('db_write', rows=len(rows)):
+        ...
+    finish_run(db_connector)
+
+    @timed('create_features', rows=len)
+    def create_features(...):
+        ...
+
+このスクリプトを直接実行すると、記録された実行の推移を表示する。
+"""
+import argparse
+import contextlib
+import datetime
+import functools
+import os
+import resource
+import sys
+import threading
+import time
+import uuid
+
+import pandas as pd
+
+# 'script'ディレクトリをsys.pathに追加し、db_connectorなどを直接インポートできるようにする
+script_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(script_dir)
+
+from db_connector import DBConnector
+from config_loader import config_loader
+
+# 実行全体の計測結果を記録する行の stage の名前
+TOTAL_STAGE = 'total'
+
+INSERT_QUERY = """
+    INSERT OR REPLACE INTO run_metrics (
+        run_id, entry_point, started_at, stage, calls, total_seconds, max_seconds, rows, peak_rss_mb, status
+    ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+"""
+
+# 計測中の実行。プロセスごとに1つ
+_active_run = None
+
+
+def get_peak_rss_mb():
+    """このプロセスと、終了したワーカープロセスのうち最大のピークメモリ使用量 (MB)"""
+    peak_kb = max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss, resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+    # Linux では KB、macOS ではバイト単位
+    return peak_kb / 1024 / (1024 if sys.platform == 'darwin' else 1)
+
+
+class RunMetrics:
+    """
+    1回の実行の処理段階ごとの計測結果 (回数・合計時間・最長時間・件数) を集計する。
+    複数のスレッド (先読みのパイプラインなど) から同時に記録できる。
+    """
+
+    def __init__(self, entry_point):
+        self.entry_point = entry_point
+        self.run_id = uuid.uuid4().hex
+        self.started_at = datetime.datetime.now()
+        self.start = time.perf_counter()
+        self.stages = {}
+        self.lock = threading.Lock()
+
+    def record(self, name, seconds=0.0, rows=None, calls=1):
+        with self.lock:
+            entry = self.stages.setdefault(name, {'calls': 0, 'seconds': 0.0, 'max_seconds': 0.0, 'rows': None})
+            entry['calls'] += calls
+            entry['seconds'] += seconds
+            entry['max_seconds'] = max(entry['max_seconds'], seconds)
+            if rows is not None:
+                entry['rows'] = (entry['rows'] or 0) + int(rows)
+
+    def snapshot(self):
+        """ワーカープロセスから親プロセスに渡せる形式 (辞書) で計測結果を返す"""
+        with self.lock:
+            return {name: dict(entry) for name, entry in self.stages.items()}
+
+    def merge(self, snapshot):
+        """ワーカープロセスの計測結果を合算する"""
+        with self.lock:
+            for name, other in snapshot.items():
+                entry = self.stages.setdefault(name, {'calls': 0, 'seconds': 0.0, 'max_seconds': 0.0, 'rows': None})
+                entry['calls'] += other['calls']
+                entry['seconds'] += other['seconds']
+                entry['max_seconds'] = max(entry['max_seconds'], other['max_seconds'])
+                if other['rows'] is not None:
+                    entry['rows'] = (entry['rows'] or 0) + other['rows']
+
+    def summary(self):
+        """処理段階ごとの計測結果を、合計時間の長い順に表形式の文字列で返す"""
+        lines = [f"{'stage':<24} {'calls':>7} {'total(s)':>10} {'max(s)':>9} {'rows':>12}"]
+        for name, entry in sorted(self.stages.items(), key=lambda item: -item[1]['seconds']):
+            rows = f"{entry['rows']:,}" if entry['rows'] is not None else '-'
+            lines.append(f"{name:<24} {entry['calls']:>7,} {entry['seconds']:>10.2f} {entry['max_seconds']:>9.2f} {rows:>12}")
+        return '\n'.join(lines)
+
+    def to_rows(self, status):
+        """run_metrics テーブルに書き込む行のリスト。最後の行が実行全体 (total) の計測結果"""
+        started_at = self.started_at.isoformat(sep=' ', timespec='milliseconds')
+        elapsed = time.perf_counter() - self.start
+        rows = [
+            (self.run_id, self.entry_point, started_at, name, entry['calls'], entry['seconds'], entry['max_seconds'],
+             entry['rows'], None, None)
+            for name, entry in self.stages.items()
+        ]
+        rows.append((self.run_id, self.entry_point, started_at, TOTAL_STAGE, 1, elapsed, elapsed, None,
+                     round(get_peak_rss_mb(), 1), status))
+        return rows
+
+
+def start_run(entry_point):
+    """新しい実行の計測を開始し、以降の stage() と @timed の記録先にする"""
+    global _active_run
+    _active_run = RunMetrics(entry_point)
+    return _active_run
+
+
+def get_active_run():
+    return _active_run
+
+
+def finish_run(db_connector=None, status='success'):
+    """
+    計測中の実行を終了し、処理段階ごとの計測結果を表示して run_metrics テーブルに保存する。
+    保存に失敗しても、呼び出し元の処理は失敗させない。
+    """
+    global _active_run
+    run, _active_run = _active_run, None
+    if run is None:
+        return None
+    rows = run.to_rows(status)
+    print(f"\n--- 処理段階ごとの計測結果 ({run.entry_point}, {rows[-1][5]:.1f}秒, ピークメモリ {rows[-1][8]:,.0f}MB) ---")
+    print(run.summary())
+    if not config_loader.get_run_metrics_settings()['enabled']:
+        return run
+    try:
+        with (db_connector or DBConnector()).connect() as conn:
+            conn.executemany(INSERT_QUERY, rows)
+            conn.commit()
+    except Exception as e:
+        print(f"計測結果の保存に失敗しました: {e}")
+    return run
+
+
+@contextlib.contextmanager
+def instrument_run(entry_point, db_connector=None):
+    """ブロックの実行を1回の実行として計測し、終了時に保存する。例外 (sys.exit を含む) で終了した場合は failed として記録する"""
+    run = start_run(entry_point)
+    status = 'failed'
+    try:
+        yield run
+        status = 'success'
+    finally:
+        finish_run(db_connector, status)
+
+
+@contextlib.contextmanager
+def stage(name, rows=None):
+    """ブロックの実行時間を処理段階 name の時間として記録する。rows には処理した行数・件数を指定できる"""
+    run = _active_run
+    if run is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        run.record(name, time.perf_counter() - start, rows)
+
+
+def timed(name, rows=None):
+    """
+    関数の実行時間を処理段階 name の時間として記録するデコレータ。
+    rows に関数の戻り値から件数を求める関数を指定すると、その件数も記録する。
+    stage() と同じく、関数が例外で終了した場合も時間を記録する (件数は記録しない)。
+    """
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            run = _active_run
+            if run is None:
+                return fn(*args, **kwargs)
+            start = time.perf_counter()
+            n_rows = None
+            try:
+                result = fn(*args, **kwargs)
+                if rows:
+                    n_rows = rows(result)
+                return result
+            finally:
+                run.record(name, time.perf_counter() - start, n_rows)
+        return wrapper
+    return decorator
+
+
+def count(name, value=1):
+    """処理段階 name の件数に value を加算する (時間は記録しない)"""
+    if _active_run is not None:
+        _active_run.record(name, rows=value, calls=0)
+
+
+def load_run_metrics(conn, entry_point=None, runs=10):
+    """
+    スクリプトごとに直近 runs 回の実行の計測結果を読み込み、実行ごとの行・処理段階ごとの合計時間の列の DataFrame で返す。
+    wall_seconds は実行全体の時間。count() で記録した件数だけの段階は、時間の代わりに件数を列にする。
+    """
+    df = pd.read_sql(
+        f"""
+        WITH recent AS (
+            SELECT run_id, ROW_NUMBER() OVER (PARTITION BY entry_point ORDER BY started_at DESC, rowid DESC) AS recency
+            FROM run_metrics
+            WHERE stage = '{TOTAL_STAGE}' AND (? IS NULL OR entry_point = ?)
+        )
+        SELECT m.*, m.rowid AS seq FROM run_metrics m JOIN recent r ON r.run_id = m.run_id WHERE r.recency <= ?
+        """,
+        conn, params=(entry_point, entry_point, runs)
+    )
+    if df.empty:
+        return df
+    totals = (df[df['stage'] == TOTAL_STAGE].set_index('run_id')
+              [['entry_point', 'started_at', 'seq', 'status', 'peak_rss_mb', 'total_seconds']]
+              .rename(columns={'total_seconds': 'wall_seconds'}))
+    stages = df[df['stage'] != TOTAL_STAGE].assign(value=lambda d: d['total_seconds'].where(d['calls'] > 0, d['rows']))
+    stages = stages.pivot(index='run_id', columns='stage', values='value')
+    return totals.join(stages).sort_values(['entry_point', 'started_at', 'seq']).drop(columns='seq').reset_index(drop=True)
+
+
+def show_trend(db_connector, entry_point=None, runs=10):
+    """直近の実行の処理段階ごとの時間と、過去の実行の中央値に対する最新の実行の変化を表示する"""
+    with db_connector.connect() as conn:
+        df = load_run_metrics(conn, entry_point, runs)
+    if df.empty:
+        print("記録された実行がありません。")
+        return df
+    for name, group in df.groupby('entry_point', sort=False):
+        group = group.dropna(axis=1, how='all').drop(columns='entry_point')
+        print(f"\n=== {name} (直近{len(group)}回) ===")
+        with pd.option_context('display.max_columns', None, 'display.width', 200, 'display.float_format', '{:.2f}'.format):
+            print(group.to_string(index=False))
+        if len(group) >= 2:
+            values = group.drop(columns=['started_at', 'status'])
+            latest, baseline = values.iloc[-1], values.iloc[:-1].median()
+            change = ((latest / baseline - 1) * 100).dropna()
+            print("最新の実行の変化 (過去の中央値との比較): "
+                  + ', '.join(f"{column} {value:+.0f}%" for column, value in change.items()))
+    return df
+
+
+def main():
+    parser = argparse.ArgumentParser(description="run_metrics テーブルに記録された実行の処理段階ごとの時間・ピークメモリの推移を表示します。")
+    parser.add_argument('--entry-point', type=str, default=None, help="表示するスクリプト (例: predict_all)。指定しない場合は全て。")
+    parser.add_argument('--runs', type=int, default=config_loader.get_run_metrics_settings()['trend_runs'],
+                        help="スクリプトごとに表示する直近の実行の回数")
+    args = parser.parse_args()
+    show_trend(DBConnector(), args.entry_point, args.runs)
+
+
+if __name__ == "__main__":
+    main()
@@ -25,27 +25,29 @@ def load_market_list(file_path):
     db_connector = DBConnector()
     try:
         with db_connector.connect() as conn:
-            with conn.cursor() as cursor:
-                cursor.execute("TRUNCATE TABLE market_list")
-                print("Truncated market_list table.")
+            conn.execute("DELETE FROM market_list")
+            print("Truncated market_list table.")
 
-                today = date.today()
-                for _, row in df_stocks.iterrows():
-                    cursor.execute(
-                        """
-                        INSERT INTO market_list (
-                            ticker, name, market_segment, industry_code_33, industry_name_33,
-                            industry_code_17, industry_name_17, scale_code, scale_segment, load_date
-                        ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-                        ON CONFLICT (ticker) DO NOTHING;
-                        """,
-                        (
-                            row['ticker'], row['銘柄名'], row['市場・商品区分'],
-                            str(row['33業種コード']), row['33業種区分'], str(row['17業種コード']),
-                            row['17業種区分'], str(row['規模コード']), row['規模区分'], today
-                        )
-                    )
-                conn.commit()
+            today = date.today().isoformat()
+            rows = [
+                (
+                    row['ticker'], row['銘柄名'], row['市場・商品区分'],
+                    str(row['33業種コード']), row['33業種区分'], str(row['17業種コード']),
+                    row['17業種区分'], str(row['規模コード']), row['規模区分'], today
+                )
+                for _, row in df_stocks.iterrows()
+            ]
+            conn.executemany(
+                """
+                INSERT INTO market_list (
+                    ticker, name, market_segment, industry_code_33, industry_name_33,
+                    industry_code_17, industry_name_17, scale_code, scale_segment, load_date
+                ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT (ticker) DO NOTHING;
+                """,
+                rows
+            )
+            conn.commit()
         print(f"Successfully loaded {len(df_stocks)} stocks into market_list from {os.path.basename(file_path)}.")
 
     except Exception as e:
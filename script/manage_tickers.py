@@ -10,6 +10,7 @@ sys.path.append(str(project_root))
 
 from script.db_connector import DBConnector
 from script.update_stock_info import update_stock_info
+from script.fetch_cache import get_fetch_cache
 
 
 def list_tickers(connector):
@@ -55,8 +56,10 @@ def add_ticker(connector, ticker, features):
             conn.commit()
         print(f"銘柄 '{ticker}' の追加/更新が完了しました。")
 
-        # stock_infoテーブルも更新する
-        update_stock_info(connector, ticker)
+        # stock_infoテーブルも更新する (有効期限内であれば取得キャッシュの銘柄情報を使用する)
+        cache = get_fetch_cache()
+        update_stock_info(connector, ticker, cache)
+        cache.save_stats()
 
     except Exception as e:
         print(f"エラー: 銘柄の追加に失敗しました - {e}")
@@ -0,0 +1,248 @@
+import argparse
+import sys
+import os
+
+# 'script'ディレクトリをsys.pathに追加し、db_connectorなどを直接インポートできるようにする
+script_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(script_dir)
+
+from db_connector import DBConnector
+from config_loader import config_loader
+from stale_tickers import clear_models_stale
+
+PREDICTION_HORIZON, RETURN_THRESHOLD = config_loader.get_target_settings()
+
+
+def get_model_name(direction):
+    """予測方向からモデル名 (例: LGBM_10d_up_3pct) を組み立てる。"""
+    return f"LGBM_{PREDICTION_HORIZON}d_{direction}_{int(RETURN_THRESHOLD*100)}pct"
+
+
+def get_active_version(conn, ticker, model_name):
+    """
+    model_registry から、銘柄・モデル名に対応する稼働中(チャンピオン)のバージョンを取得する。
+    主キーによる1回の検索で完結する。登録が無い場合はNoneを返す。
+    """
+    cur = conn.cursor()
+    cur.execute(
+        "SELECT active_version FROM model_registry WHERE ticker_symbol = ? AND model_name = ?",
+        (ticker, model_name)
+    )
+    row = cur.fetchone()
+    return row[0] if row else None
+
+
+def get_active_models(conn, tickers=None, model_names=None):
+    """
+    稼働中の全モデル (モデル本体・スケーラー・特徴量リストを含む) を1回のクエリで取得する。
+    戻り値は {(ticker, model_name): (model_bytes, scaler_bytes, feature_list_json, model_version)} の辞書。
+    """
+    query = """
+        SELECT r.ticker_symbol, r.model_name, t.model_object, t.scaler_object, t.feature_list, t.model_version
+        FROM model_registry r
+        JOIN trained_models t
+          ON t.ticker_symbol = r.ticker_symbol
+         AND t.model_name = r.model_name
+         AND t.model_version = r.active_version
+    """
+    conditions = []
+    params = []
+    if tickers:
+        conditions.append(f"r.ticker_symbol IN ({', '.join(['?'] * len(tickers))})")
+        params.extend(tickers)
+    if model_names:
+        conditions.append(f"r.model_name IN ({', '.join(['?'] * len(model_names))})")
+        params.extend(model_names)
+    if conditions:
+        query += " WHERE " + " AND ".join(conditions)
+
+    cur = conn.cursor()
+    cur.execute(query, params)
+    return {
+        (ticker, model_name): (model_bytes, scaler_bytes, feature_list_json, model_version)
+        for ticker, model_name, model_bytes, scaler_bytes, feature_list_json, model_version in cur.fetchall()
+    }
+
+
+def activate_model_version(conn, ticker, model_name, version):
+    """
+    指定したバージョンを稼働中モデルにする (コミットは呼び出し側で行う)。
+    バージョンが trained_models に存在しない場合は ValueError を送出する。
+    直前の稼働バージョンは previous_version に退避される。
+    """
+    cur = conn.cursor()
+    cur.execute(
+        "SELECT 1 FROM trained_models WHERE ticker_symbol = ? AND model_name = ? AND model_version = ?",
+        (ticker, model_name, version)
+    )
+    if cur.fetchone() is None:
+        raise ValueError(f"銘柄 {ticker} のモデル {model_name} version {version} は trained_models に存在しません。")
+
+    cur.execute(
+        """
+        INSERT INTO model_registry (ticker_symbol, model_name, active_version, previous_version, promoted_at)
+        VALUES (?, ?, ?, NULL, CURRENT_TIMESTAMP)
+        ON CONFLICT (ticker_symbol, model_name) DO UPDATE SET
+            previous_version = CASE
+                WHEN model_registry.active_version = excluded.active_version THEN model_registry.previous_version
+                ELSE model_registry.active_version
+            END,
+            active_version = excluded.active_version,
+            promoted_at = CURRENT_TIMESTAMP;
+        """,
+        (ticker, model_name, version)
+    )
+
+
+def promote_model(conn, ticker, model_name, version):
+    """
+    指定したバージョンを稼働中モデルに昇格する。
+    バージョンの存在確認とレジストリの更新を1つのトランザクション内で行う。
+    直前の稼働バージョンは previous_version に退避され、rollback_model で戻せる。
+    """
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        activate_model_version(conn, ticker, model_name, version)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+
+
+def rollback_model(conn, ticker, model_name):
+    """
+    稼働中モデルを直前のバージョン (previous_version) に戻す。
+    戻したバージョンを返す。戻し先が無い場合は ValueError を送出する。
+    """
+    cur = conn.cursor()
+    cur.execute("BEGIN IMMEDIATE")
+    try:
+        cur.execute(
+            "SELECT active_version, previous_version FROM model_registry WHERE ticker_symbol = ? AND model_name = ?",
+            (ticker, model_name)
+        )
+        row = cur.fetchone()
+        if row is None or row[1] is None:
+            raise ValueError(f"銘柄 {ticker} のモデル {model_name} にはロールバック先のバージョンがありません。")
+
+        _active_version, previous_version = row
+        cur.execute(
+            """
+            UPDATE model_registry
+            SET active_version = previous_version, previous_version = NULL, promoted_at = CURRENT_TIMESTAMP
+            WHERE ticker_symbol = ? AND model_name = ?
+            """,
+            (ticker, model_name)
+        )
+        conn.commit()
+        return previous_version
+    except Exception:
+        conn.rollback()
+        raise
+
+
+def insert_registry_if_absent(conn, ticker, model_name, version):
+    """稼働中モデルが未登録の場合のみ、指定バージョンを登録する (コミットは呼び出し側で行う)。登録した場合はTrueを返す。"""
+    cur = conn.execute(
+        """
+        INSERT OR IGNORE INTO model_registry (ticker_symbol, model_name, active_version, previous_version, promoted_at)
+        VALUES (?, ?, ?, NULL, CURRENT_TIMESTAMP)
+        """,
+        (ticker, model_name, version)
+    )
+    return cur.rowcount > 0
+
+
+def register_if_absent(conn, ticker, model_name, version):
+    """
+    稼働中モデルが未登録の場合のみ、指定バージョンを登録する。
+    初回学習のモデルを自動的に稼働させるために使用し、既存のチャンピオンは置き換えない。
+    登録した場合はTrueを返す。
+    """
+    registered = insert_registry_if_absent(conn, ticker, model_name, version)
+    conn.commit()
+    return registered
+
+
+def list_registry(connector, ticker=None):
+    """稼働中モデルの一覧を表示する"""
+    print("--- 稼働中モデル一覧 ---")
+    try:
+        with connector.connect() as conn:
+            cur = conn.cursor()
+            sql = """
+                SELECT r.ticker_symbol, r.model_name, r.active_version, r.previous_version, r.promoted_at,
+                       (SELECT MAX(model_version) FROM trained_models t
+                         WHERE t.ticker_symbol = r.ticker_symbol AND t.model_name = r.model_name) AS latest_version
+                FROM model_registry r
+            """
+            params = ()
+            if ticker:
+                sql += " WHERE r.ticker_symbol = ?"
+                params = (ticker,)
+            sql += " ORDER BY r.ticker_symbol, r.model_name"
+            cur.execute(sql, params)
+            rows = cur.fetchall()
+            if not rows:
+                print("稼働中のモデルは登録されていません。")
+                return
+            print(f"{'TICKER':<15} {'MODEL':<25} {'ACTIVE':>6} {'PREV':>6} {'LATEST':>6}  PROMOTED_AT")
+            print("-" * 85)
+            for ticker_symbol, model_name, active_version, previous_version, promoted_at, latest_version in rows:
+                print(f"{ticker_symbol:<15} {model_name:<25} {active_version:>6} {previous_version or '-':>6} {latest_version or '-':>6}  {promoted_at}")
+    except Exception as e:
+        print(f"エラー: 稼働中モデル一覧の取得に失敗しました - {e}")
+        sys.exit(1)
+
+
+def main():
+    """コマンドライン引数を解釈して、対応する関数を呼び出す"""
+    parser = argparse.ArgumentParser(description="予測に使用する稼働中モデル (チャンピオン) を管理します。")
+    subparsers = parser.add_subparsers(dest="command", required=True, help="実行するコマンド")
+
+    parser_list = subparsers.add_parser("list", help="稼働中モデルを一覧表示します。")
+    parser_list.add_argument("--ticker", help="対象の銘柄コード (任意)")
+
+    parser_promote = subparsers.add_parser("promote", help="指定したバージョンを稼働中モデルに昇格します。")
+    parser_promote.add_argument("--ticker", required=True, help="対象の銘柄コード (例: 7203.T)")
+    parser_promote.add_argument("--direction", required=True, choices=['up', 'down'], help="予測の方向")
+    parser_promote.add_argument("--version", type=int, help="昇格するバージョン。未指定の場合は最新の学習済みバージョン。")
+
+    parser_rollback = subparsers.add_parser("rollback", help="稼働中モデルを直前のバージョンに戻します。")
+    parser_rollback.add_argument("--ticker", required=True, help="対象の銘柄コード (例: 7203.T)")
+    parser_rollback.add_argument("--direction", required=True, choices=['up', 'down'], help="予測の方向")
+
+    args = parser.parse_args()
+    db_connector = DBConnector()
+
+    if args.command == "list":
+        list_registry(db_connector, args.ticker)
+        return
+
+    model_name = get_model_name(args.direction)
+    try:
+        with db_connector.connect() as conn:
+            if args.command == "promote":
+                version = args.version
+                if version is None:
+                    cur = conn.cursor()
+                    cur.execute(
+                        "SELECT MAX(model_version) FROM trained_models WHERE ticker_symbol = ? AND model_name = ?",
+                        (args.ticker, model_name)
+                    )
+                    version = cur.fetchone()[0]
+                    if version is None:
+                        raise ValueError(f"銘柄 {args.ticker} のモデル {model_name} は学習されていません。")
+                promote_model(conn, args.ticker, model_name, version)
+                print(f"銘柄 {args.ticker} のモデル {model_name} version {version} を稼働中モデルに昇格しました。")
+                clear_models_stale(conn, args.ticker)
+            elif args.command == "rollback":
+                version = rollback_model(conn, args.ticker, model_name)
+                print(f"銘柄 {args.ticker} のモデル {model_name} を version {version} にロールバックしました。")
+    except Exception as e:
+        print(f"エラー: {e}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -15,31 +15,46 @@ from stock_utils import (
     load_all_data, create_features
 )
 from train_model import PREDICTION_HORIZON, RETURN_THRESHOLD
+from instrumentation import timed
 
 
 def load_model_from_db(db_connector, ticker, model_name, version=None):
-    """Loads a model and its metadata from the database."""
+    """
+    Loads a model and its metadata from the database.
+    If no version is given, the active (champion) version in model_registry is used.
+    """
     try:
         with db_connector.connect() as conn:
-                                    cur = conn.cursor()
-                                    if version:
-                                        query = "SELECT model_object, scaler_object, feature_list, model_version FROM trained_models WHERE ticker_symbol = ? AND model_name = ? AND model_version = ?"
-                                        cur.execute(query, (ticker, model_name, version))
-                                    else:
-                                        query = "SELECT model_object, scaler_object, feature_list, model_version FROM trained_models WHERE ticker_symbol = ? AND model_name = ? ORDER BY model_version DESC LIMIT 1"
-                                        cur.execute(query, (ticker, model_name))
-                                    result = cur.fetchone()
-                                    if not result:
-                                        print(f"エラー: データベースに銘柄 {ticker} のモデル {model_name} が見つかりません。")
-                                        return None, None, None, None
-                        
-                                    model_bytes, scaler_bytes, feature_list_json, model_version = result
-                                    model = joblib.load(io.BytesIO(model_bytes))
-                                    scaler = joblib.load(io.BytesIO(scaler_bytes))
-                                    feature_list = json.loads(feature_list_json)
-                        
-                                    print(f"データベースからモデル {ticker} (name: {model_name}, version: {model_version}) を正常に読み込みました。")
-                                    return model, scaler, feature_list, model_version
+            cur = conn.cursor()
+            if version:
+                query = "SELECT model_object, scaler_object, feature_list, model_version FROM trained_models WHERE ticker_symbol = ? AND model_name = ? AND model_version = ?"
+                cur.execute(query, (ticker, model_name, version))
+            else:
+                # model_registryの主キー検索で稼働中バージョンを特定し、trained_modelsのUNIQUEキーで本体を取得する
+                query = """
+                    SELECT t.model_object, t.scaler_object, t.feature_list, t.model_version
+                    FROM model_registry r
+                    JOIN trained_models t
+                      ON t.ticker_symbol = r.ticker_symbol
+                     AND t.model_name = r.model_name
+                     AND t.model_version = r.active_version
+                    WHERE r.ticker_symbol = ? AND r.model_name = ?
+                """
+                cur.execute(query, (ticker, model_name))
+            result = cur.fetchone()
+            if not result:
+                if version:
+                    print(f"エラー: データベースに銘柄 {ticker} のモデル {model_name} (version: {version}) が見つかりません。")
+                else:
+                    print(f"エラー: 銘柄 {ticker} のモデル {model_name} の稼働中バージョンが登録されていません。"
+                          f" model_registry.py promote で昇格してください。")
+                return None, None, None, None
+
+            model_bytes, scaler_bytes, feature_list_json, model_version = result
+            model, scaler, feature_list = deserialize_model(model_bytes, scaler_bytes, feature_list_json)
+
+            print(f"データベースからモデル {ticker} (name: {model_name}, version: {model_version}) を正常に読み込みました。")
+            return model, scaler, feature_list, model_version
     except Exception as e:
         print(f"データベースからのモデル読み込み中にエラーが発生しました: {e}")
         return None, None, None, None
@@ -75,31 +90,56 @@ def predict_ticker(db_connector, ticker, direction, version=None):
     all_features_df = create_features(main_data, external_data, macro_data)
     latest_features = all_features_df.iloc[[-1]]
 
+    try:
+        probability = predict_probabilities(model, scaler, feature_list, latest_features)[0]
+    except KeyError as e:
+        print(f"エラー: 予測に必要な特徴量が不足しています。{e}")
+        return None
+
+    return build_prediction_result(ticker, direction, probability, model_name, model_version, latest_features.index[0])
+
+
+def deserialize_model(model_bytes, scaler_bytes, feature_list_json):
+    """trained_modelsに保存されたモデル・スケーラー・特徴量リストを復元する"""
+    model = joblib.load(io.BytesIO(model_bytes))
+    scaler = joblib.load(io.BytesIO(scaler_bytes))
+    feature_list = json.loads(feature_list_json)
+    return model, scaler, feature_list
+
+
+def align_feature_columns(features_df, feature_list):
+    """
+    特徴量DataFrameのカラムを、モデルが学習時に使用した特徴量リストに揃える。
+    必要な特徴量が不足している場合は KeyError を送出する。
+    """
     # モデルが期待する特徴量リストと、現在の特徴量DataFrameのカラム名の不一致を修正
     # 主にpandas_taのバージョンアップによるボリンジャーバンドの命名規則変更に対応
-    renamed_latest_features = latest_features.copy()
+    renamed_features = features_df.copy()
     for expected_feature in feature_list:
         # 古いボリンジャーバンドの命名規則をチェック (例: BBL_20_2.0)
         if expected_feature.startswith(('BBL_', 'BBM_', 'BBU_', 'BBB_', 'BBP_')) and expected_feature.endswith('_2.0'):
             # 新しいボリンジャーバンドの命名規則 (例: BBL_20_2.0_2.0)
             new_bb_name = expected_feature + '_2.0'
-            if new_bb_name in renamed_latest_features.columns and expected_feature not in renamed_latest_features.columns:
-                renamed_latest_features.rename(columns={new_bb_name: expected_feature}, inplace=True)
-    latest_features = renamed_latest_features # 更新されたDataFrameを使用
+            if new_bb_name in renamed_features.columns and expected_feature not in renamed_features.columns:
+                renamed_features.rename(columns={new_bb_name: expected_feature}, inplace=True)
+    return renamed_features[feature_list]
 
-    try:
-        prediction_data = latest_features[feature_list]
-    except KeyError as e:
-        print(f"エラー: 予測に必要な特徴量が不足しています。{e}")
-        return None
+
+@timed('predict', rows=len)
+def predict_probabilities(model, scaler, feature_list, features_df):
+    """特徴量DataFrameの全行をスケーリングし、上昇(下落)確率の配列を返す"""
+    prediction_data = align_feature_columns(features_df, feature_list)
 
     numeric_features = prediction_data.select_dtypes(include=np.number).columns.tolist()
     prediction_data_scaled = prediction_data.copy()
     prediction_data_scaled[numeric_features] = scaler.transform(prediction_data[numeric_features])
 
-    probability = model.predict_proba(prediction_data_scaled)[:, 1][0]
+    return model.predict_proba(prediction_data_scaled)[:, 1]
+
 
-    target_date = pd.to_datetime(latest_features.index[0]) + pd.tseries.offsets.BusinessDay(n=PREDICTION_HORIZON)
+def build_prediction_result(ticker, direction, probability, model_name, model_version, latest_date):
+    """予測結果を prediction_results テーブルやCSVに保存する形式の辞書にまとめる"""
+    target_date = pd.to_datetime(latest_date) + pd.tseries.offsets.BusinessDay(n=PREDICTION_HORIZON)
 
     return {
         "ticker": ticker,
@@ -115,7 +155,7 @@ def main():
     parser = argparse.ArgumentParser(description="データベースから学習済みモデルを読み込み、最新の株価トレンドを予測します。")
     parser.add_argument('--ticker', type=str, required=True, help="予測対象のティッカーシンボル (例: 7203.T)")
     parser.add_argument('--direction', type=str, default='up', choices=['up', 'down'], help="予測するトレンドの方向 ('up' または 'down')")
-    parser.add_argument('--version', type=int, help="使用するモデルのバージョンを任意で指定。未指定の場合は最新バージョンが使われます。")
+    parser.add_argument('--version', type=int, help="使用するモデルのバージョンを任意で指定。未指定の場合は稼働中(チャンピオン)のバージョンが使われます。")
     args = parser.parse_args()
 
     db_connector = DBConnector()
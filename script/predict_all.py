@@ -3,6 +3,7 @@ import pandas as pd
 import datetime
 import csv
 import sys
+import argparse
 from pathlib import Path
 
 # Add project root to sys.path
@@ -10,35 +11,41 @@ project_root = Path(__file__).resolve().parent.parent
 sys.path.append(str(project_root))
 
 from script.db_connector import DBConnector
-from script.predict import predict_ticker # We will create this function in predict.py
+from script.batch_predict import load_prediction_targets, predict_targets, predict_targets_parallel
+from script.profiling import add_profile_arguments, profile_run
+# stock_utils などは instrumentation をトップレベルのモジュールとしてインポートするため、計測中の実行を共有できるよう同じ名前でインポートする
+from instrumentation import instrument_run, stage
 
 PREDICTIONS_DIR = project_root / "predictions"
 
 def save_results_to_db(db_connector, results):
-    """Saves a list of prediction results to the database."""
+    """Saves a list of prediction results to the database in a single transaction."""
     if not results:
         return
 
     print("--- 予測結果をデータベースに保存中 ---")
+    rows = [
+        (
+            result['target_date'],
+            result['ticker'],
+            result['direction'],
+            float(result['probability']),
+            result['model_name'],
+            result['model_version']
+        )
+        for result in results
+    ]
     try:
-        with db_connector.connect() as conn:
-            with conn.cursor() as cur:
-                for result in results:
-                    cur.execute(
-                        """
-                        INSERT INTO prediction_results (target_date, ticker, direction, probability, model_name, model_version)
-                        VALUES (%s, %s, %s, %s, %s, %s)
-                        """,
-                        (
-                            result['target_date'],
-                            result['ticker'],
-                            result['direction'],
-                            float(result['probability']),
-                            result['model_name'],
-                            result['model_version']
-                        )
-                    )
-                conn.commit()
+        with db_connector.connect() as conn, stage('db_write', rows=len(rows)):
+            cur = conn.cursor()
+            cur.executemany(
+                """
+                INSERT INTO prediction_results (target_date, ticker, direction, probability, model_name, model_version)
+                VALUES (?, ?, ?, ?, ?, ?)
+                """,
+                rows
+            )
+            conn.commit()
         print(f"{len(results)}件の予測結果をデータベースに保存しました。")
     except Exception as e:
         print(f"データベースへの結果保存中にエラーが発生しました: {e}")
@@ -63,38 +70,48 @@ def save_results_to_csv(results):
         print(f"CSVファイルへの保存中にエラーが発生しました: {e}")
 
 def main():
-    """Fetches all target tickers and runs prediction for each."""
+    """Fetches all target tickers and runs a batched prediction over them."""
+    parser = argparse.ArgumentParser(description="データベースに登録された全監視銘柄の予測を実行し、結果をDBとCSVに保存します。")
+    parser.add_argument('--workers', type=int, default=1, help="予測に使用するプロセス数。2以上を指定すると銘柄を分割して並列に予測します。")
+    add_profile_arguments(parser)
+    args = parser.parse_args()
+
     print("--- 全監視銘柄の予測を開始します ---")
     db_connector = DBConnector()
-    all_results = []
 
     try:
-        with db_connector.connect() as conn:
-            with conn.cursor() as cursor:
-                cursor.execute("SELECT ticker FROM target_tickers ORDER BY ticker")
-                tickers = [row[0] for row in cursor.fetchall()]
+        targets = load_prediction_targets(db_connector)
     except Exception as e:
         print(f"データベースからの監視銘柄リストの取得に失敗しました: {e}")
         sys.exit(1)
 
-    if not tickers:
+    if not targets:
         print("監視対象の銘柄が登録されていません。処理を終了します。")
         return
 
-    print(f"予測対象の銘柄 ({len(tickers)}件): {tickers}")
+    print(f"予測対象の銘柄 ({len(targets)}件): {[ticker for ticker, _ in targets]}")
+
+    if args.workers > 1:
+        print(f"{args.workers}プロセスで並列に予測します。")
+        all_results, errors = [], []
+        # 完了したシャードから順に結果を受け取り、書き込みはこのプロセスでまとめて行う
+        for shard_results, shard_errors in predict_targets_parallel(targets, args.workers):
+            all_results.extend(shard_results)
+            errors.extend(shard_errors)
+            print(f"進捗: {len(all_results)}件の予測が完了しました。")
+    else:
+        all_results, errors = predict_targets(db_connector, targets)
+
+    for ticker, message in errors:
+        print(f"警告: 銘柄 {ticker} の予測をスキップしました: {message}")
 
-    for ticker in tickers:
-        for direction in ['up', 'down']:
-            print(f"\n--- 銘柄: {ticker}, 方向: {direction} の予測を実行 ---")
-            result = predict_ticker(db_connector, ticker, direction)
-            if result:
-                all_results.append(result)
-    
     if all_results:
         save_results_to_db(db_connector, all_results)
         save_results_to_csv(all_results)
 
-    print("\n--- 全ての予測処理が完了しました。 ---")
+    print(f"\n--- 全ての予測処理が完了しました。(成功: {len(all_results)}件, エラー: {len(errors)}銘柄) ---")
+    print(db_connector.format_stats())
 
 if __name__ == "__main__":
-    main()
+    with instrument_run('predict_all'), profile_run('predict_all'):
+        main()
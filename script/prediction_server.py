@@ -0,0 +1,334 @@
+import argparse
+import json
+import sys
+import os
+import threading
+import time
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+import numpy as np
+
+# 'script'ディレクトリをsys.pathに追加し、db_connectorなどを直接インポートできるようにする
+script_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(script_dir)
+
+from db_connector import DBConnector
+from stock_utils import load_price_panel, load_macro_data
+from model_registry import get_active_models, get_model_name
+from predict import deserialize_model, predict_probabilities, build_prediction_result
+from batch_predict import DIRECTIONS, build_latest_features
+
+DEFAULT_HOST = '127.0.0.1'
+DEFAULT_PORT = 8765
+# レイテンシ統計の計算に保持する直近のリクエスト数
+LATENCY_WINDOW = 1000
+# 1リクエストで予測できる銘柄数の上限 (POST で tickers を省略した場合の全監視銘柄は対象外)
+MAX_TICKERS_PER_REQUEST = 500
+# POST リクエストの本文の最大サイズ (バイト)
+MAX_REQUEST_BYTES = 64 * 1024
+
+
+class PredictionCache:
+    """
+    稼働中モデル・スケーラーと銘柄ごとの最新特徴量行をメモリ上に保持するキャッシュ。
+    PRAGMA data_version で他の接続からの書き込みを検知し、変更があった場合のみ
+    モデルの昇格や株価・マクロ指標の更新を確認して、該当するエントリだけを再読み込みする。
+    株価の更新は、予測を要求された銘柄とその外部指標についてのみ主キーで最新取引日と最終更新日時を確認する
+    (新しい日付の無い当日分の足の更新や株価・マクロ指標の訂正も検知する)。
+    """
+
+    def __init__(self, db_connector):
+        # 他の読み込みと同じ PRAGMA を適用する。リクエストは複数スレッドで処理されるため、接続の利用はロックで直列化する
+        self.conn = db_connector.open_connection(check_same_thread=False)
+        self.lock = threading.RLock()
+        self.data_version = None
+        self.targets = {}          # ticker -> [feature_ticker, ...]
+        self.models = {}           # (ticker, model_name) -> (model_version, model, scaler, feature_list)
+        self.features = {}         # ticker -> (data_key, latest_features)
+        self.data_keys = {}        # ticker -> 株価・マクロ指標の最新日付・最終更新日時と株価履歴の置き換え日時の組
+        self.last_trade_days = {}  # ticker -> (最新取引日, 最終更新日時) (data_version が変わるまで再利用する)
+        self.macro_last_date = None  # マクロ指標の (最新日付, 最終更新日時)
+        self.replaced_at = {}      # ticker -> 株価履歴の置き換えを検知した日時
+        self.reload_counts = {'models': 0, 'features': 0, 'checks': 0}
+
+    def refresh(self):
+        """他の接続からの書き込みがあった場合に、変更されたモデルと特徴量のみを無効化・再読み込みする"""
+        with self.lock:
+            data_version = self.conn.execute("PRAGMA data_version").fetchone()[0]
+            if data_version == self.data_version:
+                return
+            self.data_version = data_version
+            self.reload_counts['checks'] += 1
+
+            cur = self.conn.cursor()
+            cur.execute("SELECT ticker, features FROM target_tickers")
+            self.targets = {
+                ticker: [f.strip() for f in features.split(',') if f.strip()] if features else []
+                for ticker, features in cur.fetchall()
+            }
+            # 監視銘柄から外れた銘柄のモデルと特徴量は保持しない
+            for ticker in [ticker for ticker in self.features if ticker not in self.targets]:
+                del self.features[ticker]
+
+            # 稼働中バージョンが変わったモデルのみを再読み込みする
+            cur.execute("SELECT ticker_symbol, model_name, active_version FROM model_registry")
+            active_versions = {(ticker, model_name): version for ticker, model_name, version in cur.fetchall()}
+            stale = [key for key, version in active_versions.items()
+                     if key[0] in self.targets and (key not in self.models or self.models[key][0] != version)]
+            for key in [key for key in self.models if key not in active_versions or key[0] not in self.targets]:
+                del self.models[key]
+            if stale:
+                self._load_models(sorted({ticker for ticker, _ in stale}))
+
+            # 最新取引日は株価テーブル全体を集計せず、要求された銘柄の分だけ _data_key で取得し直す
+            self.data_keys = {}
+            self.last_trade_days = {}
+            cur.execute("SELECT MAX(indicator_date), MAX(updated_at) FROM macro_economic_indicators")
+            self.macro_last_date = cur.fetchone()
+            # 株式分割・配当で株価履歴が置き換えられた場合は最新日が変わらないため、置き換えの日時も組に含める
+            cur.execute("SELECT ticker_symbol, detected_at FROM stale_tickers")
+            self.replaced_at = dict(cur.fetchall())
+
+    def _last_trade_day(self, ticker):
+        if ticker not in self.last_trade_days:
+            # (ticker_symbol, trade_day) の主キーの範囲検索で、銘柄の行だけを読む
+            # 最新日の足の書き換え (当日分の足の更新・訂正) は最新取引日が変わらないため、最終更新日時も組に含める
+            self.last_trade_days[ticker] = self.conn.execute(
+                "SELECT MAX(trade_day), MAX(updated_at) FROM daily_stock_prices WHERE ticker_symbol = ?", (ticker,)
+            ).fetchone()
+        return self.last_trade_days[ticker]
+
+    def _data_key(self, ticker):
+        """銘柄について、自身と外部指標の最新取引日・最終更新日時・置き換え日時とマクロ指標の最新日付・最終更新日時の組を返す。変化を検知するために使う"""
+        if ticker not in self.data_keys:
+            self.data_keys[ticker] = (
+                tuple((self._last_trade_day(t), self.replaced_at.get(t)) for t in [ticker] + self.targets[ticker]),
+                self.macro_last_date,
+            )
+        return self.data_keys[ticker]
+
+    def _load_models(self, tickers):
+        model_names = [get_model_name(direction) for direction in DIRECTIONS]
+        for key, (model_bytes, scaler_bytes, feature_list_json, version) in get_active_models(self.conn, tickers, model_names).items():
+            model, scaler, feature_list = deserialize_model(model_bytes, scaler_bytes, feature_list_json)
+            self.models[key] = (version, model, scaler, feature_list)
+            self.reload_counts['models'] += 1
+
+    def _ensure_features(self, tickers):
+        """最新特徴量行がキャッシュに無い、または元データが更新された銘柄のみ特徴量を再生成する"""
+        missing = [t for t in tickers if t not in self.features or self.features[t][0] != self._data_key(t)]
+        if not missing:
+            return
+        feature_tickers = [f for t in missing for f in self.targets[t]]
+        panel = load_price_panel(self.conn, missing + feature_tickers)
+        macro_df = load_macro_data(self.conn)
+        for ticker in missing:
+            try:
+                self.features[ticker] = (self._data_key(ticker), build_latest_features(panel, macro_df, ticker, self.targets[ticker]))
+                self.reload_counts['features'] += 1
+            except LookupError:
+                self.features.pop(ticker, None)
+
+    def predict(self, tickers, directions):
+        """指定された銘柄・方向の予測結果とエラーを返す"""
+        self.refresh()
+        results, errors = [], []
+        with self.lock:
+            unknown = [t for t in tickers if t not in self.targets]
+            errors.extend({'ticker': t, 'error': '監視銘柄として登録されていません。'} for t in unknown)
+            known = [t for t in tickers if t in self.targets]
+            self._ensure_features(known)
+
+            for ticker in known:
+                if ticker not in self.features:
+                    errors.append({'ticker': ticker, 'error': '特徴量を生成できるデータがありません。'})
+                    continue
+                latest_features = self.features[ticker][1]
+                for direction in directions:
+                    model_name = get_model_name(direction)
+                    if (ticker, model_name) not in self.models:
+                        errors.append({'ticker': ticker, 'direction': direction, 'error': '稼働中モデルが登録されていません。'})
+                        continue
+                    version, model, scaler, feature_list = self.models[(ticker, model_name)]
+                    try:
+                        probability = predict_probabilities(model, scaler, feature_list, latest_features)[0]
+                    except KeyError as e:
+                        errors.append({'ticker': ticker, 'direction': direction, 'error': f'予測に必要な特徴量が不足しています: {e}'})
+                        continue
+                    result = build_prediction_result(ticker, direction, probability, model_name, version, latest_features.index[0])
+                    result['probability'] = float(result['probability'])
+                    results.append(result)
+        return results, errors
+
+    def stats(self):
+        with self.lock:
+            return {
+                'cached_models': len(self.models),
+                'cached_feature_rows': len(self.features),
+                'target_tickers': len(self.targets),
+                'reloads': dict(self.reload_counts),
+            }
+
+
+class LatencyStats:
+    """エンドポイントごとのリクエスト数と直近リクエストのレイテンシを記録する"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counts = {}
+        self.latencies = {}
+
+    def record(self, endpoint, elapsed_ms):
+        with self.lock:
+            self.counts[endpoint] = self.counts.get(endpoint, 0) + 1
+            self.latencies.setdefault(endpoint, deque(maxlen=LATENCY_WINDOW)).append(elapsed_ms)
+
+    def summary(self):
+        with self.lock:
+            summary = {}
+            for endpoint, values in self.latencies.items():
+                arr = np.array(values)
+                summary[endpoint] = {
+                    'requests': self.counts[endpoint],
+                    'p50_ms': round(float(np.percentile(arr, 50)), 3),
+                    'p95_ms': round(float(np.percentile(arr, 95)), 3),
+                    'p99_ms': round(float(np.percentile(arr, 99)), 3),
+                    'max_ms': round(float(arr.max()), 3),
+                }
+            return summary
+
+
+def validate_predict_request(tickers, directions):
+    """
+    予測リクエストの銘柄と方向を検証し、重複を除いた (銘柄のリスト, 方向のリスト) を返す。
+    形式が正しくない場合や銘柄数が上限を超える場合は ValueError を送出する。
+    監視銘柄に無い銘柄は、予測結果のエラーとして銘柄ごとに返す。
+    """
+    if not isinstance(tickers, list) or not all(isinstance(t, str) and t for t in tickers):
+        raise ValueError('tickers は銘柄コードの文字列のリストで指定してください。')
+    tickers = list(dict.fromkeys(tickers))
+    if len(tickers) > MAX_TICKERS_PER_REQUEST:
+        raise ValueError(f'1リクエストで指定できる銘柄は{MAX_TICKERS_PER_REQUEST}件までです ({len(tickers)}件)。')
+    if not isinstance(directions, list) or not all(isinstance(d, str) for d in directions):
+        raise ValueError('directions は up または down のリストで指定してください。')
+    invalid = [d for d in directions if d not in DIRECTIONS]
+    if invalid:
+        raise ValueError(f'direction は up または down を指定してください: {invalid}')
+    return tickers, list(dict.fromkeys(directions))
+
+
+class PredictionRequestHandler(BaseHTTPRequestHandler):
+    """
+    GET  /predict?ticker=7203.T[&direction=up] : 単一銘柄の予測
+    POST /predict {"tickers": [...], "directions": [...]} : 複数銘柄の予測
+    GET  /stats : レイテンシ統計とキャッシュの状態
+    GET  /health : 死活確認
+    """
+    cache = None
+    latency_stats = None
+
+    def do_GET(self):
+        start = time.perf_counter()
+        parsed = urlparse(self.path)
+        if parsed.path == '/predict':
+            query = parse_qs(parsed.query)
+            tickers = query.get('ticker', [])
+            directions = query.get('direction', DIRECTIONS)
+            if not tickers:
+                self._send_json(400, {'error': 'ticker パラメータを指定してください。'})
+                return
+            try:
+                tickers, directions = validate_predict_request(tickers, directions)
+            except ValueError as e:
+                self._send_json(400, {'error': str(e)})
+                return
+            self._handle_predict('predict', tickers, directions, start)
+        elif parsed.path == '/stats':
+            self._send_json(200, {'latency': self.latency_stats.summary(), 'cache': self.cache.stats()})
+        elif parsed.path == '/health':
+            self._send_json(200, {'status': 'ok'})
+        else:
+            self._send_json(404, {'error': 'not found'})
+
+    def do_POST(self):
+        start = time.perf_counter()
+        if urlparse(self.path).path != '/predict':
+            self._send_json(404, {'error': 'not found'})
+            return
+        try:
+            length = int(self.headers.get('Content-Length', 0))
+        except ValueError:
+            length = -1
+        if not 0 <= length <= MAX_REQUEST_BYTES:
+            self._send_json(413, {'error': f'リクエストの本文は{MAX_REQUEST_BYTES}バイト以下にしてください。'})
+            self.close_connection = True
+            return
+        try:
+            body = json.loads(self.rfile.read(length) or b'{}')
+            if not isinstance(body, dict):
+                raise ValueError('JSON オブジェクトを指定してください。')
+            # tickers を省略した場合は全監視銘柄を予測する
+            if body.get('tickers') in (None, []):
+                tickers = sorted(self.cache.targets)
+                _, directions = validate_predict_request([], body.get('directions', DIRECTIONS))
+            else:
+                tickers, directions = validate_predict_request(body['tickers'], body.get('directions', DIRECTIONS))
+        except ValueError as e:
+            self._send_json(400, {'error': f'リクエストの形式が正しくありません: {e}'})
+            return
+        self._handle_predict('predict_batch', tickers, directions, start)
+
+    def _handle_predict(self, endpoint, tickers, directions, start):
+        try:
+            results, errors = self.cache.predict(tickers, directions)
+        except Exception as e:
+            self._send_json(500, {'error': str(e)})
+            return
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        self.latency_stats.record(endpoint, elapsed_ms)
+        self._send_json(200, {'results': results, 'errors': errors, 'elapsed_ms': round(elapsed_ms, 3)})
+
+    def _send_json(self, status, payload):
+        body = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # リクエストごとのアクセスログは出力しない (統計は /stats で確認する)
+        pass
+
+
+def main():
+    parser = argparse.ArgumentParser(description="モデルと最新特徴量をメモリに保持し、HTTPで予測を返す常駐サービスを起動します。")
+    parser.add_argument('--host', type=str, default=DEFAULT_HOST, help=f"待ち受けるアドレス (デフォルト: {DEFAULT_HOST})")
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT, help=f"待ち受けるポート (デフォルト: {DEFAULT_PORT})")
+    parser.add_argument('--no-warmup', action='store_true', help="起動時に全監視銘柄のモデルと特徴量を読み込みません。")
+    args = parser.parse_args()
+
+    cache = PredictionCache(DBConnector())
+    cache.refresh()
+    if not args.no_warmup:
+        print(f"--- {len(cache.targets)}銘柄のモデルと特徴量を読み込んでいます ---")
+        cache.predict(sorted(cache.targets), DIRECTIONS)
+        print(f"読み込み完了: {cache.stats()}")
+
+    PredictionRequestHandler.cache = cache
+    PredictionRequestHandler.latency_stats = LatencyStats()
+    server = ThreadingHTTPServer((args.host, args.port), PredictionRequestHandler)
+    print(f"--- 予測サービスを http://{args.host}:{args.port} で起動しました (Ctrl+Cで停止) ---")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("\n--- 予測サービスを停止します ---")
+    finally:
+        server.server_close()
+        cache.conn.close()
+
+
+if __name__ == "__main__":
+    main()
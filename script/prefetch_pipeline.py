@@ -0,0 +1,174 @@
+import queue
+import threading
+import time
+from collections import deque
+
+# キューの終端を表す目印
+_DONE = object()
+
+
+class StageStats:
+    """
+    パイプラインの1ステージの計測値。
+    busy は処理に費やした秒数、wait は入力 (または出力先の空き) を待っていた秒数。
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.items = 0
+        self.busy = 0.0
+        self.wait = 0.0
+        self.lock = threading.Lock()
+
+    def add(self, busy=0.0, wait=0.0, items=0):
+        with self.lock:
+            self.busy += busy
+            self.wait += wait
+            self.items += items
+
+    def as_dict(self, elapsed, threads=1):
+        capacity = elapsed * threads
+        return {
+            'items': self.items,
+            'threads': threads,
+            'busy_seconds': self.busy,
+            'wait_seconds': self.wait,
+            'utilization': self.busy / capacity if capacity else 0.0,
+        }
+
+
+def _put(q, item, stop_event, stats):
+    """キューに空きができるまで待つ。stop_event が設定された場合は諦めて False を返す。"""
+    start = time.perf_counter()
+    while not stop_event.is_set():
+        try:
+            q.put(item, timeout=0.1)
+            stats.add(wait=time.perf_counter() - start)
+            return True
+        except queue.Full:
+            continue
+    return False
+
+
+def run_prefetch_pipeline(items, load_fn, process_fn, write_fn, writer, depth=2, loaders=1, on_load_error=None):
+    """
+    items の各要素を「読み込み → 処理 → 書き込み」の3段階で処理する。
+    - 読み込み (load_fn(item)) はバックグラウンドの loaders 個のスレッドで行い、結果を最大 depth 件まで先読みする。
+    - 処理 (process_fn(item, loaded)) は呼び出し元のスレッドで1件ずつ行う。
+    - 書き込み (write_fn(conn, item, result)) は writer (DBWriter) に依頼し、その書き込みスレッドで処理の完了順に行う
+      (SQLite への書き込みはプロセス内の単一のライターに限定する)。write_fn はコミットしない。
+      未完了の書き込みが depth 件を超えた場合、処理ステージは最も古い書き込みの完了を待つ。
+    学習 (LightGBM) はGILを解放するため、スレッドでも読み込み・特徴量作成と学習が重なって実行される。
+
+    読み込みで例外が発生した場合は on_load_error(item, error) の戻り値を処理結果として書き込む。
+    on_load_error を指定しない場合は例外をそのまま送出する。
+    書き込みの例外は表示して続行し、件数を戻り値の 'write_errors' に記録する。
+    戻り値はステージごとの稼働率などの統計 (辞書)。
+    """
+    depth = max(1, depth)
+    loaders = max(1, loaders)
+    load_queue = queue.Queue(maxsize=depth)
+    stop_event = threading.Event()
+    item_iter = iter(items)
+    iter_lock = threading.Lock()
+    load_stats, process_stats, write_stats = StageStats('load'), StageStats('process'), StageStats('write')
+    occupancy = []
+    pending_writes = deque()
+    write_errors = []
+
+    def loader():
+        while not stop_event.is_set():
+            with iter_lock:
+                item = next(item_iter, _DONE)
+            if item is _DONE:
+                break
+            start = time.perf_counter()
+            try:
+                loaded, error = load_fn(item), None
+            except Exception as e:
+                loaded, error = None, e
+            load_stats.add(busy=time.perf_counter() - start, items=1)
+            if not _put(load_queue, (item, loaded, error), stop_event, load_stats):
+                return
+        _put(load_queue, _DONE, stop_event, load_stats)
+
+    def write(conn, item, result):
+        # 書き込みスレッドで実行される
+        start = time.perf_counter()
+        try:
+            return write_fn(conn, item, result)
+        finally:
+            write_stats.add(busy=time.perf_counter() - start, items=1)
+
+    def wait_for_oldest_write():
+        item, future = pending_writes.popleft()
+        try:
+            future.result()
+        except Exception as e:
+            print(f"  [エラー] {item} の結果の書き込みに失敗しました: {e}")
+            write_errors.append(item)
+
+    loader_threads = [threading.Thread(target=loader, name=f"prefetch-loader-{i}", daemon=True) for i in range(loaders)]
+    start_time = time.perf_counter()
+    for thread in loader_threads:
+        thread.start()
+
+    try:
+        finished_loaders = 0
+        while finished_loaders < loaders:
+            occupancy.append(load_queue.qsize())
+            start = time.perf_counter()
+            entry = load_queue.get()
+            process_stats.add(wait=time.perf_counter() - start)
+            if entry is _DONE:
+                finished_loaders += 1
+                continue
+            item, loaded, error = entry
+            start = time.perf_counter()
+            if error is None:
+                result = process_fn(item, loaded)
+            elif on_load_error is not None:
+                result = on_load_error(item, error)
+            else:
+                raise error
+            process_stats.add(busy=time.perf_counter() - start, items=1)
+            pending_writes.append((item, writer.submit(write, item, result)))
+            if len(pending_writes) > depth:
+                start = time.perf_counter()
+                wait_for_oldest_write()
+                process_stats.add(wait=time.perf_counter() - start)
+    finally:
+        # 例外で中断した場合も、処理済みの結果は書き込んでから終了する
+        stop_event.set()
+        while pending_writes:
+            wait_for_oldest_write()
+        for thread in loader_threads:
+            thread.join()
+
+    elapsed = time.perf_counter() - start_time
+    return {
+        'elapsed_seconds': elapsed,
+        'depth': depth,
+        'stages': {
+            'load': load_stats.as_dict(elapsed, loaders),
+            'process': process_stats.as_dict(elapsed),
+            'write': write_stats.as_dict(elapsed),
+        },
+        # 処理ステージが次の要素を取り出す直前に、先読み済みだった件数の平均
+        'mean_prefetched': sum(occupancy) / len(occupancy) if occupancy else 0.0,
+        'write_errors': write_errors,
+    }
+
+
+def format_pipeline_stats(stats):
+    """run_prefetch_pipeline の統計を表示用の文字列にする"""
+    lines = [f"{'STAGE':<8} {'THREADS':>7} {'ITEMS':>6} {'BUSY(s)':>9} {'WAIT(s)':>9} {'UTIL':>6}"]
+    for name, s in stats['stages'].items():
+        lines.append(f"{name:<8} {s['threads']:>7} {s['items']:>6} {s['busy_seconds']:>9.1f} {s['wait_seconds']:>9.1f} {s['utilization']:>6.1%}")
+    lines.append(f"先読みの深さ: {stats['depth']}, 処理開始時の平均先読み件数: {stats['mean_prefetched']:.2f}, 経過時間: {stats['elapsed_seconds']:.1f}秒")
+    process = stats['stages']['process']
+    if process['wait_seconds'] > 0.1 * stats['elapsed_seconds']:
+        lines.append("処理ステージが読み込みを待っています。先読みの深さまたは読み込みスレッド数を増やすと改善する可能性があります。")
+    elif stats['mean_prefetched'] >= stats['depth'] - 0.5 and stats['depth'] > 1:
+        lines.append("先読みキューが常に満杯です。先読みの深さを減らしてもスループットは変わらず、メモリ使用量を抑えられます。")
+    return "\n".join(lines)
@@ -9,18 +9,13 @@ def main():
     db_connector = DBConnector()
     try:
         with db_connector.connect() as conn:
-            with conn.cursor() as cursor:
-                sql_file_path = os.path.join(os.path.dirname(__file__), '..', 'SQL', 'create_evaluation_tables.sql')
-                
-                with open(sql_file_path, 'r') as f:
-                    sql_script = f.read()
-                
-                # SQLスクリプトを個別の文に分割して実行
-                for statement in sql_script.split(';'):
-                    if statement.strip():
-                        cursor.execute(statement)
-                
-                conn.commit()
+            sql_file_path = os.path.join(os.path.dirname(__file__), '..', 'SQL', 'create_evaluation_tables.sql')
+
+            with open(sql_file_path, 'r', encoding='utf-8') as f:
+                sql_script = f.read()
+
+            conn.executescript(sql_script)
+            conn.commit()
         print("Successfully created evaluation tables.")
 
     except Exception as e:
@@ -0,0 +1,285 @@
+import os
+import random
+from abc import ABC, abstractmethod
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import pandas as pd
+
+PRICE_COLUMNS = ['Open', 'High', 'Low', 'Close', 'Adj Close', 'Volume']
+
+
+class TokenBucket:
+    """
+    トークンバケット方式のレートリミッタ。
+    rate (トークン/秒) でトークンが補充され、最大 capacity 個まで貯められる。
+    acquire() はトークンが得られるまで呼び出し元のスレッドを待機させる。
+    """
+
+    def __init__(self, rate, capacity=None):
+        if rate <= 0:
+            raise ValueError("rate には正の値を指定してください。")
+        self.rate = rate
+        self.capacity = capacity or max(1.0, rate)
+        self.tokens = self.capacity
+        self.updated_at = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self, tokens=1):
+        """トークンを消費する。不足している場合は補充されるまで待機し、待機した秒数を返す。"""
+        waited = 0.0
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+                self.updated_at = now
+                if self.tokens >= tokens:
+                    self.tokens -= tokens
+                    return waited
+                wait = (tokens - self.tokens) / self.rate
+            time.sleep(wait)
+            waited += wait
+
+
+class PriceSource(ABC):
+    """
+    株価データの取得元の基底クラス。
+    fetch() は {ticker: DataFrame} を返す。DataFrame は日付のインデックスと PRICE_COLUMNS のカラムを持つ。
+    データが無い銘柄は結果に含めない。一時的なエラーの場合は例外を送出する (呼び出し側で再試行される)。
+    結果に含まれない銘柄も、呼び出し側でその銘柄のみ再試行される。
+    """
+    # 1回の fetch() でまとめて取得できる銘柄数
+    batch_size = 1
+
+    @abstractmethod
+    def fetch(self, tickers, start, end):
+        """tickers の start 以上 end 未満の株価を {ticker: DataFrame} で返す"""
+
+
+class YFinanceSource(PriceSource):
+    """yfinance から複数銘柄をまとめてダウンロードする取得元"""
+
+    def __init__(self, batch_size=20):
+        self.batch_size = batch_size
+
+    def fetch(self, tickers, start, end):
+        import yfinance as yf
+
+        df = yf.download(
+            tickers, start=start, end=end, group_by='ticker',
+            progress=False, auto_adjust=False, actions=False, threads=False
+        )
+        if df.empty:
+            return {}
+        return split_multi_ticker_frame(df, tickers)
+
+
+class FileReplaySource(PriceSource):
+    """
+    保存済みの株価ファイル (<directory>/<ticker>.csv) を返す取得元。
+    ネットワークに接続せずに取り込み処理のスループットを計測するために使用する。
+    latency を指定すると、1回の取得ごとにその秒数だけ待機してネットワーク遅延を再現する。
+    """
+
+    def __init__(self, directory, batch_size=20, latency=0.0):
+        self.directory = directory
+        self.batch_size = batch_size
+        self.latency = latency
+
+    def fetch(self, tickers, start, end):
+        if self.latency:
+            time.sleep(self.latency)
+        start, end = pd.Timestamp(start), pd.Timestamp(end)
+        frames = {}
+        for ticker in tickers:
+            path = replay_file_path(self.directory, ticker)
+            if not os.path.exists(path):
+                continue
+            df = pd.read_csv(path, index_col=0, parse_dates=True, float_precision='round_trip')
+            df = df[(df.index >= start) & (df.index < end)]
+            if not df.empty:
+                frames[ticker] = df
+        return frames
+
+
+class CachedPriceSource(PriceSource):
+    """
+    別の取得元の結果を銘柄ごとに FetchCache に保存し、有効期限内であれば再取得せずに返す取得元。
+    キャッシュされた期間 (取得時の開始日・終了日) が要求された期間を含む場合のみヒットとし、要求された期間に絞り込んで返す。
+    形式が正しくない取得結果はキャッシュしない。
+    """
+
+    def __init__(self, source, cache):
+        self.source = source
+        self.cache = cache
+        self.batch_size = source.batch_size
+
+    def fetch(self, tickers, start, end):
+        start_ts, end_ts = pd.Timestamp(start), pd.Timestamp(end)
+        frames = {}
+        missing = []
+        for ticker in tickers:
+            cached = self.cache.get('prices', ticker, accept=lambda meta: covers_period(meta, start_ts, end_ts))
+            if cached is None:
+                missing.append(ticker)
+                continue
+            df = cached[0]
+            df = df[(df.index >= start_ts) & (df.index < end_ts)]
+            if not df.empty:
+                frames[ticker] = df
+        if missing:
+            fetched = self.source.fetch(missing, start, end)
+            for ticker, df in fetched.items():
+                if is_valid_price_frame(df):
+                    self.cache.put('prices', ticker, df, price_cache_meta(start_ts, end_ts))
+            frames.update(fetched)
+        return frames
+
+
+def price_cache_meta(start, end):
+    """株価のキャッシュのメタデータ (取得した期間) を返す"""
+    return {'start': str(pd.Timestamp(start).date()), 'end': str(pd.Timestamp(end).date())}
+
+
+def covers_period(meta, start, end):
+    """キャッシュされた株価の取得期間が、要求された start 以上 end 未満の期間を含むかを判定する"""
+    if 'start' not in meta or 'end' not in meta:
+        return False
+    return pd.Timestamp(meta['start']) <= start and pd.Timestamp(meta['end']) >= end
+
+
+def is_valid_price_frame(df):
+    """日付のインデックス (重複なし) と PRICE_COLUMNS のカラムを持ち、調整後終値が全て欠損していない株価データかを判定する"""
+    return (
+        isinstance(df, pd.DataFrame) and not df.empty
+        and isinstance(df.index, pd.DatetimeIndex) and df.index.is_unique
+        and set(PRICE_COLUMNS) <= set(df.columns)
+        and bool(df['Adj Close'].notna().any())
+    )
+
+
+def replay_file_path(directory, ticker):
+    return os.path.join(directory, f"{ticker}.csv")
+
+
+def save_replay_file(directory, ticker, df):
+    """取得したデータを FileReplaySource で読み込める形式で保存する。既存のファイルとは日付単位で統合する。"""
+    os.makedirs(directory, exist_ok=True)
+    path = replay_file_path(directory, ticker)
+    if os.path.exists(path):
+        existing = pd.read_csv(path, index_col=0, parse_dates=True, float_precision='round_trip')
+        df = pd.concat([existing, df])
+        df = df[~df.index.duplicated(keep='last')].sort_index()
+    df[PRICE_COLUMNS].to_csv(path)
+
+
+def split_multi_ticker_frame(df, tickers):
+    """yfinance の複数銘柄ダウンロード結果 (MultiIndexカラム) を銘柄ごとのDataFrameに分割する"""
+    frames = {}
+    if not isinstance(df.columns, pd.MultiIndex):
+        # 1銘柄のみでフラットなカラムが返された場合
+        if len(tickers) == 1:
+            frames[tickers[0]] = df.dropna(how='all')
+        return frames
+
+    level0 = set(df.columns.get_level_values(0))
+    for ticker in tickers:
+        if ticker in level0:
+            sub = df[ticker]
+        elif ticker in set(df.columns.get_level_values(1)):
+            sub = df.xs(ticker, axis=1, level=1)
+        else:
+            continue
+        sub = sub.dropna(how='all')
+        if not sub.empty:
+            frames[ticker] = sub
+    return frames
+
+
+def build_fetch_batches(requests, batch_size):
+    """
+    (ticker, start) の組を、取得開始日が同じ銘柄ごとに batch_size 件ずつのバッチにまとめる。
+    差分更新では多くの銘柄の開始日が一致するため、まとめてダウンロードできる。
+    """
+    by_start = defaultdict(list)
+    for ticker, start in requests:
+        by_start[start].append(ticker)
+    batches = []
+    for start, tickers in sorted(by_start.items()):
+        for i in range(0, len(tickers), batch_size):
+            batches.append((tickers[i:i + batch_size], start))
+    return batches
+
+
+def fetch_with_retry(source, tickers, start, end, rate_limiter, max_retries, backoff_seconds):
+    """
+    レートリミッタのトークンを取得してからデータを取得する。
+    例外が発生した場合や、結果に含まれない (空の) 銘柄がある場合は、指数バックオフ (ジッター付き) で
+    最大 max_retries 回まで再試行する。yfinance は銘柄ごとの失敗を例外ではなく欠損として返すため、
+    再試行では取得できなかった銘柄のみを要求する。再試行後も取得できなかった銘柄は結果に含めない。
+    戻り値は ({ticker: DataFrame}, 試行回数)。
+    """
+    frames = {}
+    pending = list(tickers)
+    attempt = 0
+    while True:
+        attempt += 1
+        if rate_limiter:
+            rate_limiter.acquire()
+        try:
+            fetched = source.fetch(pending, start, end)
+        except Exception:
+            if attempt > max_retries:
+                # 一部の銘柄を取得済みの場合は、取得できた分を返す
+                if frames:
+                    return frames, attempt
+                raise
+        else:
+            frames.update((ticker, df) for ticker, df in fetched.items() if df is not None and not df.empty)
+            pending = [ticker for ticker in pending if ticker not in frames]
+            if not pending or attempt > max_retries:
+                return frames, attempt
+        time.sleep(backoff_seconds * (2 ** (attempt - 1)) * (1 + random.random()))
+
+
+def ingest_prices(requests, source, writer, end, max_workers=4, rate_limiter=None, max_retries=3, backoff_seconds=1.0):
+    """
+    複数銘柄の株価を並行して取得し、取得が完了したものから順に writer(ticker, df) に渡す。
+    取得はスレッドプールで最大 max_workers 件まで同時に行い、writer は呼び出し元のスレッドだけで実行される
+    (SQLite への書き込みは単一のライターに限定する)。
+    requests は (ticker, start) のリスト。取得結果の統計を辞書で返す。
+    """
+    batches = build_fetch_batches(requests, source.batch_size)
+    stats = {'tickers': len(requests), 'batches': len(batches), 'fetched': 0, 'empty': 0, 'failed': 0, 'retries': 0, 'rows': 0}
+    failed_tickers = []
+    start_time = time.perf_counter()
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {
+            executor.submit(fetch_with_retry, source, tickers, start, end, rate_limiter, max_retries, backoff_seconds): tickers
+            for tickers, start in batches
+        }
+        for future in as_completed(futures):
+            tickers = futures[future]
+            try:
+                frames, attempts = future.result()
+            except Exception as e:
+                print(f"  [エラー] {len(tickers)}銘柄の取得に失敗しました ({', '.join(tickers[:5])}{' ...' if len(tickers) > 5 else ''}): {e}")
+                stats['failed'] += len(tickers)
+                failed_tickers.extend(tickers)
+                continue
+            stats['retries'] += attempts - 1
+            for ticker in tickers:
+                df = frames.get(ticker)
+                if df is None or df.empty:
+                    print(f"  '{ticker}' のデータを取得できませんでした。")
+                    stats['empty'] += 1
+                    continue
+                stats['fetched'] += 1
+                stats['rows'] += writer(ticker, df) or 0
+
+    stats['elapsed_seconds'] = time.perf_counter() - start_time
+    stats['failed_tickers'] = failed_tickers
+    return stats
@@ -0,0 +1,231 @@
+"""
+各スクリプト共通のプロファイリングモード (--profile)。
+
+--profile を指定して実行すると、実行全体について以下を記録し、実行ごとのディレクトリ (profiles/<スクリプト名>_<日時>/) に出力する。
+  profile.pstats   : cProfile の呼び出し統計 (python -m pstats や snakeviz で開ける)
+  memory_top.txt   : tracemalloc による、実行終了時点で確保されているメモリの多い箇所と、ピーク時のメモリ使用量
+  stacks.folded    : 一定間隔で採取したスタックの集計 (--profile-sample-interval を指定した場合。flamegraph.pl・speedscope で開ける)
+  summary.txt      : 時間のかかった関数・メモリを確保した箇所・採取したスタックの上位の要約
+
+メインスレッドに加え、実行中に開始されたスレッド (取得・先読みのスレッドなど) も cProfile の対象になる。
+Python 3.12 以降の cProfile は sys.monitoring を使うため、1つのプロファイラで全スレッドが対象になり、
+同時に2つ目のプロファイラを有効にすることはできない。3.11 以前は、スレッドごとのプロファイラを開始して合算する。
+ワーカープロセス (--workers) の中の処理は対象にならないため、プロファイリングする場合は1プロセスで実行する。
+cProfile と tracemalloc のオーバーヘッドにより、実行時間は通常より長くなる。
+
+使用例 (各スクリプトの末尾):
+    if __name__ == "__main__":
+        with profile_run('predict_all'):
+            main()
+スクリプトの引数の定義には add_profile_arguments(parser) を追加し、--profile などを受け付けるようにする。
+"""
+import argparse
+import collections
+import contextlib
+import cProfile
+import datetime
+import io
+import os
+import pstats
+import sys
+import threading
+import time
+import tracemalloc
+
+# 'script'ディレクトリをsys.pathに追加し、config_loaderなどを直接インポートできるようにする
+script_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(script_dir)
+
+from config_loader import config_loader
+
+PROJECT_ROOT = os.path.dirname(script_dir)
+# 3.11 以前の cProfile はスレッドごとのフック (setprofile) で動作するため、スレッドごとにプロファイラが必要
+PER_THREAD_PROFILERS = sys.version_info < (3, 12)
+
+
+def add_profile_arguments(parser):
+    """スクリプトの引数に、プロファイリングモードの引数を追加する"""
+    settings = config_loader.get_profiling_settings()
+    group = parser.add_argument_group("プロファイリング")
+    group.add_argument('--profile', action='store_true',
+                       help="cProfile の呼び出し統計と tracemalloc のメモリ確保箇所を記録し、profiles/ 以下に出力します。")
+    group.add_argument('--profile-dir', type=str, default=settings['output_dir'],
+                       help=f"プロファイルの出力先ディレクトリ (デフォルト: {settings['output_dir']})")
+    group.add_argument('--profile-sample-interval', type=float, default=settings['sample_interval'],
+                       help="指定した秒数ごとに全スレッドのスタックを採取します (デフォルト: 0 で採取しない)。")
+    return parser
+
+
+def parse_profile_options(argv=None):
+    """コマンドライン引数からプロファイリングモードの引数だけを読み取る (他の引数はスクリプト自身の引数の解析に任せる)"""
+    parser = add_profile_arguments(argparse.ArgumentParser(add_help=False))
+    options, _ = parser.parse_known_args(sys.argv[1:] if argv is None else argv)
+    return options
+
+
+class StackSampler:
+    """一定間隔で全スレッドのスタックを採取し、同じスタックの出現回数を集計するバックグラウンドスレッド"""
+
+    def __init__(self, interval):
+        self.interval = interval
+        self.stacks = collections.Counter()
+        self.samples = 0
+        self.stop_event = threading.Event()
+        self.thread = threading.Thread(target=self._run, name="stack-sampler", daemon=True)
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.stop_event.set()
+        self.thread.join()
+
+    def _run(self):
+        own_id = threading.get_ident()
+        while not self.stop_event.wait(self.interval):
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+                    frame = frame.f_back
+                self.stacks[';'.join(reversed(stack))] += 1
+            self.samples += 1
+
+    def write_folded(self, path):
+        """flamegraph.pl・speedscope で読み込める folded 形式 (1行に「呼び出し元;...;呼び出し先 回数」) で書き出す"""
+        with open(path, 'w', encoding='utf-8') as f:
+            for stack, samples in self.stacks.most_common():
+                f.write(f"{stack} {samples}\n")
+
+    def top_frames(self, limit):
+        """採取時に実行中だった関数 (スタックの末尾) の出現回数の上位"""
+        leaves = collections.Counter()
+        for stack, samples in self.stacks.items():
+            leaves[stack.rsplit(';', 1)[-1]] += samples
+        return leaves.most_common(limit)
+
+
+class Profiler:
+    """1回の実行の cProfile・tracemalloc・スタックの採取をまとめて開始・停止し、結果をディレクトリに書き出す"""
+
+    def __init__(self, name, output_dir, sample_interval=0.0, top_n=30, memory_frames=10):
+        self.name = name
+        self.run_dir = os.path.join(PROJECT_ROOT, output_dir, f"{name}_{datetime.datetime.now():%Y%m%d_%H%M%S}")
+        self.sample_interval = sample_interval
+        self.top_n = top_n
+        self.memory_frames = memory_frames
+        self.profilers = []
+        self.sampler = None
+
+    def _profile_new_thread(self, frame, event, arg):
+        # 新しいスレッドで最初に呼ばれるフックで、そのスレッド用のプロファイラを有効にする (enable() がこのフックを置き換える)
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError:
+            # 他のプロファイラが有効な場合は、そのスレッドはスタックの採取のみの対象にする
+            sys.setprofile(None)
+            return
+        # 有効にできたプロファイラだけを合算する
+        self.profilers.append(profiler)
+
+    def start(self):
+        os.makedirs(self.run_dir, exist_ok=True)
+        tracemalloc.start(self.memory_frames)
+        if self.sample_interval > 0:
+            self.sampler = StackSampler(self.sample_interval).start()
+        if PER_THREAD_PROFILERS:
+            threading.setprofile(self._profile_new_thread)
+        self.main_profiler = cProfile.Profile()
+        self.start_time = time.perf_counter()
+        self.main_profiler.enable()
+        return self
+
+    def stop(self):
+        self.main_profiler.disable()
+        self.elapsed = time.perf_counter() - self.start_time
+        if PER_THREAD_PROFILERS:
+            threading.setprofile(None)
+        if self.sampler is not None:
+            self.sampler.stop()
+        self.snapshot = tracemalloc.take_snapshot()
+        self.traced_current, self.traced_peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+    def write(self):
+        """結果をファイルに書き出し、要約の文字列を返す"""
+        stats = pstats.Stats(self.main_profiler)
+        for profiler in list(self.profilers):
+            # 実行中のスレッドのプロファイラは、その時点までの統計を合算する (まだ何も記録していない場合は TypeError になる)
+            try:
+                stats.add(profiler)
+            except TypeError:
+                pass
+        stats.dump_stats(os.path.join(self.run_dir, 'profile.pstats'))
+
+        threads = f"スレッド {len(self.profilers) + 1}個" if PER_THREAD_PROFILERS else "全スレッド"
+        sections = [f"=== {self.name}: {self.elapsed:.1f}秒 ({threads}) ==="]
+        for sort_key, title in (('cumulative', '累積時間の上位 (cumulative)'), ('tottime', '関数自身の時間の上位 (tottime)')):
+            buffer = io.StringIO()
+            stats.stream = buffer
+            stats.sort_stats(sort_key).print_stats(self.top_n)
+            # 先頭の合計行の後の、表の部分だけを使う
+            table = buffer.getvalue()
+            sections.append(f"\n--- {title} ---\n{table[table.find('   ncalls'):].rstrip()}")
+
+        snapshot = self.snapshot.filter_traces([
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, "<frozen importlib._bootstrap*>"),
+        ])
+        memory_lines = [f"tracemalloc: 終了時 {self.traced_current / 1024**2:.1f}MB, ピーク {self.traced_peak / 1024**2:.1f}MB"]
+        memory_lines.append(f"\n--- 確保されているメモリの多い箇所 (行単位) ---")
+        for stat in snapshot.statistics('lineno')[:self.top_n]:
+            frame = stat.traceback[0]
+            memory_lines.append(f"{stat.size / 1024**2:>9.2f}MB {stat.count:>9,}個  {frame.filename}:{frame.lineno}")
+        memory_lines.append(f"\n--- 確保されているメモリの多い呼び出し経路 (上位5件) ---")
+        for stat in snapshot.statistics('traceback')[:5]:
+            memory_lines.append(f"{stat.size / 1024**2:.2f}MB ({stat.count:,}個)")
+            memory_lines.extend(f"    {line}" for line in stat.traceback.format(most_recent_first=True))
+        memory_text = '\n'.join(memory_lines)
+        with open(os.path.join(self.run_dir, 'memory_top.txt'), 'w', encoding='utf-8') as f:
+            f.write(memory_text + '\n')
+        sections.append(f"\n{memory_text}")
+
+        if self.sampler is not None:
+            self.sampler.write_folded(os.path.join(self.run_dir, 'stacks.folded'))
+            sampled = [f"\n--- 採取したスタックで実行中だった関数 ({self.sampler.samples}回, {self.sample_interval}秒ごと) ---"]
+            sampled.extend(f"{count:>7,} {frame}" for frame, count in self.sampler.top_frames(self.top_n))
+            sections.append('\n'.join(sampled))
+
+        summary = '\n'.join(sections)
+        with open(os.path.join(self.run_dir, 'summary.txt'), 'w', encoding='utf-8') as f:
+            f.write(summary + '\n')
+        return summary
+
+
+@contextlib.contextmanager
+def profile_run(name, argv=None):
+    """
+    コマンドライン引数に --profile がある場合に、ブロックの実行をプロファイリングする。
+    例外 (sys.exit を含む) で終了した場合も、それまでの結果を書き出す。
+    """
+    options = parse_profile_options(argv)
+    if not options.profile:
+        yield None
+        return
+    settings = config_loader.get_profiling_settings()
+    profiler = Profiler(name, options.profile_dir, options.profile_sample_interval, settings['top_n'], settings['memory_frames'])
+    print(f"--- プロファイリングモード: 結果は {profiler.run_dir} に出力されます ---")
+    profiler.start()
+    try:
+        yield profiler
+    finally:
+        profiler.stop()
+        summary = profiler.write()
+        # 要約の先頭 (累積時間の上位) だけを表示し、全体はファイルを参照してもらう
+        print('\n' + '\n'.join(summary.splitlines()[:25]))
+        print(f"\n--- プロファイルを出力しました: {profiler.run_dir} (summary.txt, profile.pstats, memory_top.txt) ---")
@@ -0,0 +1,96 @@
+import argparse
+import sys
+import os
+
+# 'script'ディレクトリをsys.pathに追加し、db_connectorなどを直接インポートできるようにする
+script_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(script_dir)
+
+from db_connector import DBConnector
+
+
+def mark_stale(conn, ticker, adjustment_ratio):
+    """
+    株価履歴が置き換えられた銘柄を記録し、モデルと特徴量から計算したデータを再計算が必要な状態にする。
+    既に記録がある場合は、検出日時と変化率を更新して両方のフラグを再度立てる。
+    """
+    conn.execute(
+        """
+        INSERT INTO stale_tickers (ticker_symbol, adjustment_ratio, detected_at, models_stale, features_stale)
+        VALUES (?, ?, CURRENT_TIMESTAMP, 1, 1)
+        ON CONFLICT (ticker_symbol) DO UPDATE SET
+            adjustment_ratio = excluded.adjustment_ratio,
+            detected_at = CURRENT_TIMESTAMP,
+            models_stale = 1,
+            features_stale = 1;
+        """,
+        (ticker, adjustment_ratio)
+    )
+
+
+def update_models_stale(conn, ticker):
+    """clear_models_stale の更新のみを行う (コミットは呼び出し側で行う)"""
+    conn.execute(
+        """
+        UPDATE stale_tickers SET models_stale = 0
+        WHERE ticker_symbol = ?
+          AND EXISTS (SELECT 1 FROM model_registry r WHERE r.ticker_symbol = stale_tickers.ticker_symbol)
+          AND NOT EXISTS (
+              SELECT 1 FROM model_registry r
+              JOIN trained_models t
+                ON t.ticker_symbol = r.ticker_symbol AND t.model_name = r.model_name AND t.model_version = r.active_version
+              WHERE r.ticker_symbol = stale_tickers.ticker_symbol
+                AND t.creation_timestamp < stale_tickers.detected_at
+          )
+        """,
+        (ticker,)
+    )
+
+
+def clear_models_stale(conn, ticker):
+    """
+    銘柄の全ての稼働中モデル (model_registry) が株価履歴の置き換え以降に学習されたモデルである場合に、
+    models_stale フラグを下ろす。再学習しても稼働中モデルに昇格していない場合や、
+    一方の方向のみを置き換えた場合は、フラグは立ったままになる。
+    """
+    update_models_stale(conn, ticker)
+    conn.commit()
+
+
+def get_features_stale(conn):
+    """features_stale フラグが立っている (株価履歴の改訂後に特徴量から計算したデータを再計算していない) 銘柄の集合を返す"""
+    return {row[0] for row in conn.execute("SELECT ticker_symbol FROM stale_tickers WHERE features_stale = 1")}
+
+
+def clear_features_stale(conn, ticker):
+    """特徴量から計算したデータ (historical_scores) を再計算した銘柄の features_stale フラグを下ろす"""
+    conn.execute("UPDATE stale_tickers SET features_stale = 0 WHERE ticker_symbol = ?", (ticker,))
+    conn.commit()
+
+
+def list_stale(connector, include_resolved=False):
+    """株価履歴の改訂により再計算が必要な銘柄を一覧表示する"""
+    print("--- 株価履歴が改訂された銘柄 ---")
+    with connector.connect() as conn:
+        sql = "SELECT ticker_symbol, adjustment_ratio, detected_at, models_stale, features_stale FROM stale_tickers"
+        if not include_resolved:
+            sql += " WHERE models_stale = 1 OR features_stale = 1"
+        rows = conn.execute(sql + " ORDER BY detected_at DESC").fetchall()
+    if not rows:
+        print("再計算が必要な銘柄はありません。")
+        return
+    print(f"{'TICKER':<15} {'RATIO':>10} {'MODELS':>7} {'FEATURES':>9}  DETECTED_AT")
+    print("-" * 70)
+    for ticker, ratio, detected_at, models_stale, features_stale in rows:
+        print(f"{ticker:<15} {ratio:>10.4f} {'stale' if models_stale else 'ok':>7} {'stale' if features_stale else 'ok':>9}  {detected_at}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="株式分割・配当などで株価履歴が置き換えられ、再学習・再計算が必要な銘柄を表示します。")
+    parser.add_argument('--all', action='store_true', help="再計算済みの銘柄も表示します。")
+    args = parser.parse_args()
+    list_stale(DBConnector(), include_resolved=args.all)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,8 +1,9 @@
 import pandas as pd
 import numpy as np
 import pandas_ta as ta
-from db_connector import DBConnector
+from db_connector import DBConnector, fetch_numeric, trade_days_to_datetime64
 from config_loader import config_loader
+from instrumentation import timed
 import sqlite3
 
 # --- 設定 ---
@@ -15,6 +16,89 @@ PREDICTION_OUTPUT_DIR = 'predictions'
 PLOTS_OUTPUT_DIR = 'plots'
 
 
+# 1銘柄の株価を読み込む固定のSQL。主キー (ticker_symbol, trade_day) の範囲の走査1回で、日付順に読み込まれる
+PRICE_QUERY = """
+    SELECT trade_day, open_price, high_price, low_price, adj_close_price, volume
+    FROM {table}
+    WHERE ticker_symbol = ?
+    ORDER BY trade_day
+"""
+PRICE_FRAME_COLUMNS = ['open_price', 'high_price', 'low_price', 'adj_close_price', 'volume']
+# 日付の文字列を解析した場合と同じ時間単位 (pandas 2 では ns、pandas 3 では us) で日付のインデックスを作成する
+PRICE_DATE_DTYPE = pd.to_datetime(pd.Series(['1970-01-01'])).dtype
+
+
+def get_attached_price_schemas(conn):
+    """ATTACH されたデータベースのうち、daily_stock_prices テーブルを持つもののスキーマ名を返す"""
+    schemas = [row[1] for row in conn.execute("PRAGMA database_list") if row[1] not in ('main', 'temp')]
+    return [
+        schema for schema in schemas
+        if conn.execute(f"SELECT 1 FROM {schema}.sqlite_master WHERE type = 'table' AND name = 'daily_stock_prices'").fetchone()
+    ]
+
+
+def read_price_frame(conn, ticker, table='daily_stock_prices'):
+    """
+    指定したテーブルから1銘柄の株価を、日付をインデックスとしたDataFrameとして読み込む。データが無い場合は None を返す。
+    pd.read_sql を経由せず、fetch_numeric で NumPy 配列に直接読み込む。
+    SQL はテーブルごとに固定のため、銘柄が変わっても準備済みのステートメントが再利用される。
+    """
+    values = fetch_numeric(conn, PRICE_QUERY.format(table=table), (ticker,))
+    if not len(values):
+        return None
+    df = pd.DataFrame(
+        values[:, 1:], columns=PRICE_FRAME_COLUMNS,
+        index=pd.DatetimeIndex(trade_days_to_datetime64(values[:, 0], PRICE_DATE_DTYPE), name='trade_date')
+    )
+    df['volume'] = df['volume'].astype(np.int64)
+    return df
+
+
+def load_price_panel(conn, tickers):
+    """
+    複数銘柄の株価データを読み込み、銘柄ごとのDataFrameの辞書を返す。
+    メインのデータベースに無い銘柄は、ATTACH されたデータベース (一括評価用の一時データベースなど) から読み込む。
+    """
+    tickers = list(dict.fromkeys(tickers))
+    tables = ['daily_stock_prices'] + [f"{schema}.daily_stock_prices" for schema in get_attached_price_schemas(conn)]
+    empty_df = pd.DataFrame(columns=PRICE_FRAME_COLUMNS, index=pd.DatetimeIndex([], name='trade_date'))
+    panel = {}
+    for ticker in tickers:
+        for table in tables:
+            df = read_price_frame(conn, ticker, table)
+            if df is not None:
+                panel[ticker] = df
+                break
+        else:
+            panel[ticker] = empty_df.copy()
+    return panel
+
+
+def load_macro_data(conn):
+    """マクロ経済指標を読み込み、日付をインデックスとしたピボット形式で返す"""
+    query_macro = "SELECT series_id, indicator_date, value FROM macro_economic_indicators ORDER BY indicator_date;"
+    df_macro = pd.read_sql(query_macro, conn, parse_dates=['indicator_date'])
+
+    # マクロ経済指標をピボットし、日付をインデックスにする
+    df_macro_pivot = df_macro.pivot(index='indicator_date', columns='series_id', values='value')
+    df_macro_pivot.index.name = 'trade_date'
+    return df_macro_pivot
+
+
+def align_macro_to_dates(macro_df, trade_dates):
+    """
+    元の頻度 (月次・日次など) で保存されたマクロ経済指標を、取引日のインデックスに as-of で揃える。
+    各取引日には、その日以前で最新の観測値が入る。
+    """
+    if macro_df.empty:
+        return pd.DataFrame(index=trade_dates)
+    combined_index = macro_df.index.union(trade_dates)
+    aligned = macro_df.reindex(combined_index).ffill().reindex(trade_dates)
+    aligned.index.name = 'trade_date'
+    return aligned
+
+
+@timed('load_all_data', rows=lambda result: len(result[0]))
 def load_all_data(db_connector, target_ticker, external_tickers):
     """
     予測対象銘柄、外部指標、マクロ経済指標をDBから読み込む
@@ -22,31 +106,12 @@ def load_all_data(db_connector, target_ticker, external_tickers):
     try:
         with db_connector.connect() as conn:
             # 1. 予測対象と外部指標の株価データを取得
-            all_tickers = [target_ticker] + external_tickers
-            # SQLiteのIN句用にプレースホルダを生成
-            placeholders = ', '.join(['?' for _ in all_tickers])
-            query_prices = f"""
-            SELECT ticker_symbol, trade_date, open_price, high_price, low_price, adj_close_price, volume
-            FROM daily_stock_prices
-            WHERE ticker_symbol IN ({placeholders})
-            ORDER BY trade_date;
-            """
-            df_prices = pd.read_sql(query_prices, conn, params=all_tickers, parse_dates=['trade_date'])
-            
-            # データをティッカーごとに分割
-            main_df = df_prices[df_prices['ticker_symbol'] == target_ticker].set_index('trade_date').drop('ticker_symbol', axis=1)
-            external_dfs = {
-                ticker: df_prices[df_prices['ticker_symbol'] == ticker].set_index('trade_date').drop('ticker_symbol', axis=1)
-                for ticker in external_tickers
-            }
-
-            # 2. マクロ経済指標を取得
-            query_macro = "SELECT series_id, indicator_date, value FROM macro_economic_indicators ORDER BY indicator_date;"
-            df_macro = pd.read_sql(query_macro, conn, parse_dates=['indicator_date'])
-            
-            # マクロ経済指標をピボットし、日付をインデックスにする
-            df_macro_pivot = df_macro.pivot(index='indicator_date', columns='series_id', values='value')
-            df_macro_pivot.index.name = 'trade_date'
+            panel = load_price_panel(conn, [target_ticker] + external_tickers)
+            main_df = panel[target_ticker]
+            external_dfs = {ticker: panel[ticker] for ticker in external_tickers}
+
+            # 2. マクロ経済指標を取得し、予測対象銘柄の取引日に揃える
+            df_macro_pivot = align_macro_to_dates(load_macro_data(conn), main_df.index)
 
             print("データの読み込みが完了しました。")
             return main_df, external_dfs, df_macro_pivot
@@ -55,6 +120,7 @@ def load_all_data(db_connector, target_ticker, external_tickers):
         print(f"データ読み込み中にエラーが発生しました: {e}")
         return pd.DataFrame(), {}, pd.DataFrame()
 
+@timed('create_features', rows=len)
 def create_features(main_df, external_dfs, macro_df):
     """
     すべての入力データから特徴量を作成する（データ駆動型）
@@ -86,13 +152,14 @@ def create_features(main_df, external_dfs, macro_df):
     for ticker, df_ext in external_dfs.items():
         safe_ticker_name = ticker.replace('^', '')
         # 外部指標のDFもカラム名をpandas-taが認識できる名前に変更
-        df_ext.rename(columns={
+        # (複数銘柄で同じ外部指標のDFを共有できるよう、元のDFは変更しない)
+        df_ext = df_ext.rename(columns={
             'open_price': 'open',
             'high_price': 'high',
             'low_price': 'low',
             'adj_close_price': 'close',
             'volume': 'volume'
-        }, inplace=True)
+        })
         df_ext_renamed = df_ext.add_prefix(f'{safe_ticker_name}_')
         df_copy = pd.merge(df_copy, df_ext_renamed, left_index=True, right_index=True, how='left')
         
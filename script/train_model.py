@@ -28,6 +28,10 @@ from stock_utils import (
     load_all_data, create_features
 )
 from config_loader import config_loader
+from model_registry import get_model_name, activate_model_version, insert_registry_if_absent
+from stale_tickers import update_models_stale
+from instrumentation import instrument_run, stage, timed, count
+from profiling import add_profile_arguments, profile_run
 
 # --- Classification Task Settings ---
 PREDICTION_HORIZON, RETURN_THRESHOLD = config_loader.get_target_settings()
@@ -51,50 +55,103 @@ def create_classification_target(df, horizon, threshold, direction='up'):
     return df_copy, target_col_name
 
 
-def save_model_to_db(db_connector, ticker, model_name, model, scaler, feature_list, hyperparameters, performance_metrics, notes=""):
-    """Saves a trained model and its metadata to the database."""
-    new_version = -1
+def insert_trained_model(conn, ticker, model_name, feature_list_json, model_bytes, scaler_bytes, hyperparameters_json, performance_metrics_json, notes=""):
+    """
+    trained_models に次のバージョン番号で1行を挿入し、そのバージョン番号を返す (コミットは呼び出し側で行う)。
+    バージョン番号の採番と挿入を1つの INSERT ... SELECT で行うため、書き込みロックの下で原子的に実行され、
+    複数のプロセスが同時に保存しても同じバージョン番号にはならない。
+    """
+    cur = conn.execute(
+        """INSERT INTO trained_models (model_name, model_version, ticker_symbol, feature_list, model_object, scaler_object, hyperparameters, performance_metrics, notes)
+           SELECT ?, COALESCE(MAX(model_version), 0) + 1, ?, ?, ?, ?, ?, ?, ?
+           FROM trained_models WHERE ticker_symbol = ? AND model_name = ?""",
+        (model_name, ticker, feature_list_json, model_bytes, scaler_bytes, hyperparameters_json, performance_metrics_json, notes,
+         ticker, model_name)
+    )
+    return conn.execute("SELECT model_version FROM trained_models WHERE model_id = ?", (cur.lastrowid,)).fetchone()[0]
+
+
+@timed('db_write', rows=lambda version: 1)
+def save_model_to_db(db_connector, ticker, model_name, model, scaler, feature_list, hyperparameters, performance_metrics, notes="", writer=None):
+    """
+    Saves a trained model and its metadata to the database.
+    複数のスレッドから保存する場合は writer (DBWriter) を指定し、その書き込みスレッドで挿入・コミットする。
+    """
+    # シリアライズは書き込みロックを取る前に済ませ、ロックの保持時間を短くする
+    model_buffer = io.BytesIO()
+    joblib.dump(model, model_buffer)
+    scaler_buffer = io.BytesIO()
+    joblib.dump(scaler, scaler_buffer)
+    insert_args = (
+        ticker,
+        model_name,
+        json.dumps(feature_list),
+        model_buffer.getvalue(),
+        scaler_buffer.getvalue(),
+        json.dumps(hyperparameters),
+        json.dumps(performance_metrics),
+        notes
+    )
+
     try:
-        with db_connector.connect() as conn:
-            cur = conn.cursor()
-            cur.execute("SELECT MAX(model_version) FROM trained_models WHERE ticker_symbol = ? AND model_name = ?", (ticker, model_name))
-            max_version = cur.fetchone()[0]
-            new_version = (max_version or 0) + 1
-
-            model_buffer = io.BytesIO()
-            joblib.dump(model, model_buffer)
-            model_bytes = model_buffer.getvalue()
-
-            scaler_buffer = io.BytesIO()
-            joblib.dump(scaler, scaler_buffer)
-            scaler_bytes = scaler_buffer.getvalue()
-
-            insert_data = (
-                model_name,
-                new_version,
-                ticker,
-                json.dumps(feature_list),
-                model_bytes,
-                scaler_bytes,
-                json.dumps(hyperparameters),
-                json.dumps(performance_metrics),
-                notes
-            )
-
-            cur.execute(
-                """INSERT INTO trained_models (model_name, model_version, ticker_symbol, feature_list, model_object, scaler_object, hyperparameters, performance_metrics, notes)
-                   VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)""",
-                insert_data
-            )
-            conn.commit()
-            print(f"モデル '{model_name}' version {new_version} をデータベースに保存しました。")
-            return new_version
+        if writer is not None:
+            new_version = writer.call(insert_trained_model, *insert_args)
+        else:
+            with db_connector.connect() as conn:
+                new_version = insert_trained_model(conn, *insert_args)
+                conn.commit()
+        print(f"モデル '{model_name}' version {new_version} をデータベースに保存しました。")
+        return new_version
 
     except Exception as e:
         print(f"データベースへのモデル保存中にエラーが発生しました: {e}")
         return -1
 
 
+def apply_model_registry_update(conn, ticker, model_name, model_version, promote=False):
+    """
+    update_model_registry の更新を行う (コミットは呼び出し側で行う)。
+    稼働中モデルを変更した場合は 'promoted' または 'registered' を、変更しなかった場合は None を返す。
+    """
+    if promote:
+        activate_model_version(conn, ticker, model_name, model_version)
+        outcome = 'promoted'
+    elif insert_registry_if_absent(conn, ticker, model_name, model_version):
+        outcome = 'registered'
+    else:
+        return None
+    # 稼働中モデルが変わった場合のみ、株価履歴の改訂による再学習待ちを解除できるか確認する
+    update_models_stale(conn, ticker)
+    return outcome
+
+
+def update_model_registry(db_connector, ticker, model_name, model_version, promote=False, writer=None):
+    """
+    学習したモデルを model_registry に反映する。
+    promote=True の場合は稼働中モデルに昇格し、それ以外は稼働中モデルが未登録の場合のみ登録する。
+    レジストリと models_stale フラグの更新は1つのトランザクションで行う (writer を指定した場合はその書き込みスレッドで行う)。
+    """
+    try:
+        if writer is not None:
+            outcome = writer.call(apply_model_registry_update, ticker, model_name, model_version, promote)
+        else:
+            with db_connector.connect() as conn:
+                conn.execute("BEGIN IMMEDIATE")
+                outcome = apply_model_registry_update(conn, ticker, model_name, model_version, promote)
+                conn.commit()
+    except Exception as e:
+        print(f"model_registryの更新中にエラーが発生しました: {e}")
+        return
+
+    if outcome == 'promoted':
+        print(f"モデル '{model_name}' version {model_version} を稼働中モデルに昇格しました。")
+    elif outcome == 'registered':
+        print(f"モデル '{model_name}' version {model_version} を初回の稼働中モデルとして登録しました。")
+    else:
+        print(f"モデル '{model_name}' version {model_version} は稼働中モデルに昇格されていません。"
+              f" 検証後に model_registry.py promote で昇格してください。")
+
+
 def plot_roc_curve(y_true, y_pred_proba, ticker, direction):
     # (Implementation unchanged)
     pass
@@ -110,7 +167,153 @@ def plot_feature_importance(importances, feature_names, ticker, direction):
     pass
 
 
-def train_and_evaluate_classification(db_connector, X_train, y_train, X_test, y_test, target_col, ticker, direction, test_mode=False, search_method='random', save_model=True):
+def search_grid(X, y, cv, base_params, hp_settings, search_jobs, warm_start_params=None):
+    """グリッドサーチ。(最適なパラメータ, 学習したモデルの数) を返す"""
+    print("\n--- ハイパーパラメータチューニングを開始 (Grid Search) ---")
+    searcher = GridSearchCV(estimator=lgb.LGBMClassifier(**base_params), param_grid=hp_settings['grid_params'],
+                            scoring='roc_auc', n_jobs=search_jobs, cv=cv)
+    searcher.fit(X, y)
+    return searcher.best_params_, len(searcher.cv_results_['params']) * cv.get_n_splits()
+
+
+def search_random(X, y, cv, base_params, hp_settings, search_jobs, warm_start_params=None):
+    """ランダムサーチ。(最適なパラメータ, 学習したモデルの数) を返す"""
+    print("\n--- ハイパーパラメータチューニングを開始 (Random Search) ---")
+    param_distributions = {
+        'n_estimators': randint(100, 1000),
+        'learning_rate': uniform(0.01, 0.2),
+        'num_leaves': randint(20, 100),
+        'reg_alpha': uniform(0.0, 1.0),
+        'reg_lambda': uniform(0.0, 1.0),
+    }
+    searcher = RandomizedSearchCV(estimator=lgb.LGBMClassifier(**base_params), param_distributions=param_distributions,
+                                  n_iter=hp_settings['random_n_iter'], scoring='roc_auc', n_jobs=search_jobs, cv=cv, random_state=42)
+    searcher.fit(X, y)
+    return searcher.best_params_, len(searcher.cv_results_['params']) * cv.get_n_splits()
+
+
+# Optuna の探索空間
+OPTUNA_SEARCH_SPACE = {
+    'n_estimators': optuna.distributions.IntDistribution(100, 2000),
+    'learning_rate': optuna.distributions.FloatDistribution(0.01, 0.3, log=True),
+    'num_leaves': optuna.distributions.IntDistribution(20, 300),
+    'max_depth': optuna.distributions.IntDistribution(3, 12),
+    'reg_alpha': optuna.distributions.FloatDistribution(1e-8, 10.0, log=True),
+    'reg_lambda': optuna.distributions.FloatDistribution(1e-8, 10.0, log=True),
+}
+
+
+def suggest_optuna_params(trial):
+    """OPTUNA_SEARCH_SPACE から試行のパラメータを選ぶ"""
+    params = {}
+    for name, distribution in OPTUNA_SEARCH_SPACE.items():
+        if isinstance(distribution, optuna.distributions.IntDistribution):
+            params[name] = trial.suggest_int(name, distribution.low, distribution.high)
+        else:
+            params[name] = trial.suggest_float(name, distribution.low, distribution.high, log=distribution.log)
+    return params
+
+
+def run_optuna_search(X, y, cv, base_params, n_trials, pruner=None, warm_start_params=None):
+    """
+    交差検証の平均ROC-AUCを最大化するパラメータを Optuna で探索する。(最適なパラメータ, 学習したモデルの数) を返す。
+    pruner を指定した場合は fold ごとに途中の平均スコアを報告し、見込みの無い試行を残りの fold を学習せずに打ち切る。
+    warm_start_params を指定した場合は、そのパラメータを最初の試行として評価する。
+    """
+    n_fits = 0
+
+    def objective(trial):
+        nonlocal n_fits
+        params = {**base_params, 'metric': 'roc_auc', **suggest_optuna_params(trial)}
+        scores = []
+        for step, (train_idx, val_idx) in enumerate(cv.split(X)):
+            model = lgb.LGBMClassifier(**params)
+            model.fit(X.iloc[train_idx], y.iloc[train_idx])
+            n_fits += 1
+            scores.append(roc_auc_score(y.iloc[val_idx], model.predict_proba(X.iloc[val_idx])[:, 1]))
+            if pruner is not None:
+                trial.report(np.mean(scores), step)
+                if trial.should_prune():
+                    raise optuna.TrialPruned()
+        return np.mean(scores)
+
+    study = optuna.create_study(direction='maximize', sampler=optuna.samplers.TPESampler(seed=42), pruner=pruner)
+    if warm_start_params:
+        study.enqueue_trial(warm_start_params, skip_if_exists=True)
+    study.optimize(objective, n_trials=n_trials)
+    return study.best_params, n_fits
+
+
+def search_optuna(X, y, cv, base_params, hp_settings, search_jobs, warm_start_params=None):
+    """Optuna による探索"""
+    print("\n--- ハイパーパラメータチューニングを開始 (Optuna) ---")
+    return run_optuna_search(X, y, cv, base_params, hp_settings['optuna_n_trials'])
+
+
+def search_optuna_pruned(X, y, cv, base_params, hp_settings, search_jobs, warm_start_params=None):
+    """Optuna による探索。交差検証の途中で、それまでの試行の中央値を下回った試行を打ち切る"""
+    print("\n--- ハイパーパラメータチューニングを開始 (Optuna, 枝刈りあり) ---")
+    pruner = optuna.pruners.MedianPruner(n_startup_trials=hp_settings['optuna_pruner_startup_trials'])
+    return run_optuna_search(X, y, cv, base_params, hp_settings['optuna_n_trials'], pruner=pruner)
+
+
+def search_optuna_warm(X, y, cv, base_params, hp_settings, search_jobs, warm_start_params=None):
+    """前回のモデルのパラメータを最初の試行として、少ない試行回数で Optuna による探索を行う"""
+    print(f"\n--- ハイパーパラメータチューニングを開始 (Optuna, 前回のパラメータから開始: {warm_start_params}) ---")
+    return run_optuna_search(X, y, cv, base_params, hp_settings['optuna_warm_n_trials'], warm_start_params=warm_start_params)
+
+
+# --search-method で選択できる探索方法。いずれも (X, y, cv, base_params, hp_settings, search_jobs, warm_start_params) を受け取り、
+# (最適なパラメータ, 学習したモデルの数) を返す
+SEARCH_STRATEGIES = {
+    'grid': search_grid,
+    'random': search_random,
+    'optuna': search_optuna,
+    'optuna_pruned': search_optuna_pruned,
+    'optuna_warm': search_optuna_warm,
+}
+
+
+def load_previous_hyperparameters(db_connector, ticker, model_name):
+    """
+    銘柄・モデル名の稼働中モデル (登録が無い場合は最新のバージョン) のハイパーパラメータのうち、Optuna の探索空間に含まれるものを返す。
+    モデルが無い場合は None を返す。
+    """
+    try:
+        with db_connector.connect() as conn:
+            row = conn.execute(
+                """
+                SELECT t.hyperparameters
+                FROM trained_models t
+                LEFT JOIN model_registry r
+                  ON r.ticker_symbol = t.ticker_symbol AND r.model_name = t.model_name
+                WHERE t.ticker_symbol = ? AND t.model_name = ?
+                ORDER BY t.model_version = r.active_version DESC, t.model_version DESC
+                LIMIT 1
+                """,
+                (ticker, model_name)
+            ).fetchone()
+    except sqlite3.Error as e:
+        print(f"前回のハイパーパラメータの取得中にエラーが発生しました: {e}")
+        return None
+    if not row or not row[0]:
+        return None
+    # グリッドサーチ・ランダムサーチで選ばれた値 (reg_alpha=0 など) は、探索空間の範囲に収める
+    params = {}
+    for name, value in json.loads(row[0]).items():
+        distribution = OPTUNA_SEARCH_SPACE.get(name)
+        if distribution is None or value is None:
+            continue
+        value = min(max(value, distribution.low), distribution.high)
+        params[name] = int(round(value)) if isinstance(distribution, optuna.distributions.IntDistribution) else float(value)
+    return params or None
+
+
+def train_and_evaluate_classification(db_connector, X_train, y_train, X_test, y_test, target_col, ticker, direction, test_mode=False, search_method='random', save_model=True, promote=False, n_jobs=None, warm_start_params=None, writer=None):
+    # writer (DBWriter) を指定した場合、モデルとレジストリの保存はその書き込みスレッドで行う (複数のスレッドで学習する場合)
+    # n_jobs を指定した場合は LightGBM のスレッド数をその値に制限し、交差検証の並列化は行わない (プロセスごとのスレッド数の割り当て用)
+    lgbm_threads = {} if n_jobs is None else {'n_jobs': n_jobs}
+    search_jobs = -1 if n_jobs is None else 1
     scaler = StandardScaler()
     numeric_features = X_train.select_dtypes(include=np.number).columns.tolist()
 
@@ -125,75 +328,27 @@ def train_and_evaluate_classification(db_connector, X_train, y_train, X_test, y_
     print(f"クラスの不均衡を調整します。Positive class weight: {scale_pos_weight:.2f}")
 
     tscv = TimeSeriesSplit(n_splits=3)
-    best_params = {}
     hp_settings = config_loader.get_hp_search_settings(test_mode)
+    base_params = {'objective': 'binary', 'random_state': 42, 'verbose': -1, 'scale_pos_weight': scale_pos_weight, **lgbm_threads}
+    model_name = get_model_name(direction)
 
-    if search_method == 'grid':
-        print("\n--- ハイパーパラメータチューニングを開始 (Grid Search) ---")
-        param_grid = hp_settings['grid_params']
-
-        base_model = lgb.LGBMClassifier(objective='binary', random_state=42, verbose=-1, scale_pos_weight=scale_pos_weight)
-        searcher = GridSearchCV(estimator=base_model, param_grid=param_grid, scoring='roc_auc', n_jobs=-1, cv=tscv)
-        searcher.fit(X_train_scaled, y_train)
-        best_params = searcher.best_params_
-
-    elif search_method == 'random':
-        print("\n--- ハイパーパラメータチューニングを開始 (Random Search) ---")
-        param_distributions = {
-            'n_estimators': randint(100, 1000),
-            'learning_rate': uniform(0.01, 0.2),
-            'num_leaves': randint(20, 100),
-            'reg_alpha': uniform(0.0, 1.0),
-            'reg_lambda': uniform(0.0, 1.0),
-        }
-        n_iter = hp_settings['random_n_iter']
-        base_model = lgb.LGBMClassifier(objective='binary', random_state=42, verbose=-1, scale_pos_weight=scale_pos_weight)
-        searcher = RandomizedSearchCV(estimator=base_model, param_distributions=param_distributions, n_iter=n_iter, scoring='roc_auc', n_jobs=-1, cv=tscv, random_state=42)
-        searcher.fit(X_train_scaled, y_train)
-        best_params = searcher.best_params_
-
-    elif search_method == 'optuna':
-        print("\n--- ハイパーパラメータチューニングを開始 (Optuna) ---")
-        def objective(trial):
-            params = {
-                'objective': 'binary',
-                'metric': 'roc_auc',
-                'random_state': 42,
-                'verbose': -1,
-                'scale_pos_weight': scale_pos_weight,
-                'n_estimators': trial.suggest_int('n_estimators', 100, 2000),
-                'learning_rate': trial.suggest_float('learning_rate', 0.01, 0.3, log=True),
-                'num_leaves': trial.suggest_int('num_leaves', 20, 300),
-                'max_depth': trial.suggest_int('max_depth', 3, 12),
-                'reg_alpha': trial.suggest_float('reg_alpha', 1e-8, 10.0, log=True),
-                'reg_lambda': trial.suggest_float('reg_lambda', 1e-8, 10.0, log=True),
-            }
-
-            scores = []
-            for train_idx, val_idx in tscv.split(X_train_scaled):
-                X_train_split, X_val_split = X_train_scaled.iloc[train_idx], X_train_scaled.iloc[val_idx]
-                y_train_split, y_val_split = y_train.iloc[train_idx], y_train.iloc[val_idx]
-
-                model = lgb.LGBMClassifier(**params)
-                model.fit(X_train_split, y_train_split)
-                score = roc_auc_score(y_val_split, model.predict_proba(X_val_split)[:, 1])
-                scores.append(score)
-
-            return np.mean(scores)
-
-        n_trials = hp_settings['optuna_n_trials']
-        study = optuna.create_study(direction='maximize')
-        study.optimize(objective, n_trials=n_trials)
-        best_params = study.best_params
+    if search_method == 'optuna_warm' and warm_start_params is None:
+        warm_start_params = load_previous_hyperparameters(db_connector, ticker, model_name)
 
+    search = SEARCH_STRATEGIES[search_method]
+    with stage('hp_search', rows=len(X_train_scaled)):
+        best_params, n_fits = search(X_train_scaled, y_train, tscv, base_params, hp_settings, search_jobs, warm_start_params)
+    count('model_fits', n_fits)
 
     print(f"最適なパラメータが見つかりました: {best_params}")
-    final_model = lgb.LGBMClassifier(objective='binary', random_state=42, verbose=-1, scale_pos_weight=scale_pos_weight, **best_params)
+    final_model = lgb.LGBMClassifier(objective='binary', random_state=42, verbose=-1, scale_pos_weight=scale_pos_weight, **best_params, **lgbm_threads)
 
     print(f"\n--- 最適なパラメータでモデルを学習中 ---")
-    final_model.fit(X_train_scaled, y_train)
+    with stage('final_fit', rows=len(X_train_scaled)):
+        final_model.fit(X_train_scaled, y_train)
 
-    y_pred_proba = final_model.predict_proba(X_test_scaled)[:, 1]
+    with stage('predict', rows=len(X_test_scaled)):
+        y_pred_proba = final_model.predict_proba(X_test_scaled)[:, 1]
     y_pred = (y_pred_proba > 0.5).astype(int)
 
     performance_metrics = {
@@ -214,7 +369,6 @@ def train_and_evaluate_classification(db_connector, X_train, y_train, X_test, y_
 
     model_version = -1
     if save_model:
-        model_name = f"LGBM_{PREDICTION_HORIZON}d_{direction}_{int(RETURN_THRESHOLD*100)}pct"
         feature_list = X_train.columns.tolist()
         print("\n--- モデルをデータベースに保存中 ---")
         model_version = save_model_to_db(
@@ -226,8 +380,11 @@ def train_and_evaluate_classification(db_connector, X_train, y_train, X_test, y_
             feature_list=feature_list,
             hyperparameters=best_params,
             performance_metrics=performance_metrics,
-            notes=f"Trained on {datetime.date.today().isoformat()} with {search_method} search."
+            notes=f"Trained on {datetime.date.today().isoformat()} with {search_method} search.",
+            writer=writer
         )
+        if model_version > 0:
+            update_model_registry(db_connector, ticker, model_name, model_version, promote, writer)
 
     return final_model, scaler, best_params, performance_metrics, model_version
 
@@ -235,10 +392,13 @@ def main():
     parser = argparse.ArgumentParser(description="指定された銘柄の株価がN日後にX%以上変動するかを予測する分類モデルを学習します。")
     parser.add_argument('--ticker', type=str, required=True, help="予測対象のティッカーシンボル (例: AAPL, 7203.T)")
     parser.add_argument('--direction', type=str, default='up', choices=['up', 'down'], help="予測するトレンドの方向 ('up' または 'down')")
-    parser.add_argument('--search-method', type=str, default='random', choices=['grid', 'random', 'optuna'], help="ハイパーパラメータの探索方法 ('grid', 'random', 'optuna')")
+    parser.add_argument('--search-method', type=str, default='random', choices=list(SEARCH_STRATEGIES),
+                        help="ハイパーパラメータの探索方法 ('grid', 'random', 'optuna', 'optuna_pruned': 枝刈りありの Optuna, 'optuna_warm': 前回のモデルのパラメータから開始する Optuna)")
     parser.add_argument('--test-mode', action='store_true', help="テストモードを有効にし、ハイパーパラメータの探索範囲を狭めます。")
     parser.add_argument('--training-years', type=int, default=5, help="学習に使うデータ期間を年数で指定します。")
     parser.add_argument('--test-size', type=float, default=0.2, help="学習期間内のデータのうち、テスト用として確保する割合。")
+    parser.add_argument('--promote', action='store_true', help="学習したモデルを直ちに稼働中(チャンピオン)モデルに昇格します。")
+    add_profile_arguments(parser)
     args = parser.parse_args()
     ticker = args.ticker
     direction = args.direction
@@ -285,10 +445,11 @@ def main():
 
     print(f"訓練データ: {len(X_train)}件, テストデータ: {len(X_test)}件")
 
-    train_and_evaluate_classification(db_connector, X_train, y_train, X_test, y_test, target_col, ticker, direction, args.test_mode, args.search_method)
+    train_and_evaluate_classification(db_connector, X_train, y_train, X_test, y_test, target_col, ticker, direction, args.test_mode, args.search_method, promote=args.promote)
 
     print("\n--- モデル学習スクリプトが完了しました。 ---")
 
 
 if __name__ == "__main__":
-    main()
+    with instrument_run('train_model'), profile_run('train_model'):
+        main()
@@ -1,8 +1,8 @@
 import pandas_datareader.data as web
 import datetime
+import itertools
 import pandas as pd
 import argparse
-import sqlite3
 from db_connector import get_db_connection
 
 # デフォルトの経済指標
@@ -14,48 +14,80 @@ DEFAULT_FRED_SERIES = {
 }
 
 
-def update_economic_data(fred_series_ids, start_date='2010-01-01'):
-    """FREDから経済指標データを取得し、データベースを更新する"""
+def get_last_indicator_dates(conn):
+    """全系列の保存済みの最新観測日を1回の集約クエリで取得し、{series_id: 'YYYY-MM-DD'} の辞書で返す"""
+    cursor = conn.cursor()
+    cursor.execute("SELECT series_id, MAX(indicator_date) FROM macro_economic_indicators GROUP BY series_id")
+    return dict(cursor.fetchall())
+
+
+def fetch_fred_series(fred_series_ids, last_dates, start_date, end_date):
+    """
+    系列ごとに、保存済みの最新観測日 (その日の値の改訂を反映するため当日を含む) 以降の観測値のみをFREDから取得する。
+    保存済みのデータが無い系列は start_date から取得する。
+    戻り値は (series_id, 'YYYY-MM-DD', value) のタプルのリスト。
+    """
+    # 取得開始日が同じ系列は1回のリクエストにまとめる
+    series_by_start = {}
+    for fred_id, series_id in fred_series_ids.items():
+        series_by_start.setdefault(last_dates.get(series_id, start_date), []).append(fred_id)
+
+    rows = []
+    for fetch_start, fred_ids in sorted(series_by_start.items()):
+        print(f"FREDからデータを取得中... {', '.join(fred_ids)} (期間: {fetch_start} - {end_date})")
+        df_fred = web.DataReader(fred_ids, 'fred', fetch_start, end_date)
+        df_fred = df_fred[df_fred.index >= pd.Timestamp(fetch_start)]
+        for fred_id in fred_ids:
+            # 元の頻度 (月次・日次など) の観測値のみを保存する。取引日への補完は読み込み時に行う
+            series = df_fred[fred_id].dropna()
+            rows.extend(zip(
+                itertools.repeat(fred_series_ids[fred_id]),
+                series.index.strftime('%Y-%m-%d'),
+                series.to_numpy(dtype=float).tolist(),
+            ))
+    return rows
+
+
+def update_economic_data(fred_series_ids, start_date='2010-01-01', rebuild=False):
+    """FREDから経済指標データを差分で取得し、データベースを更新する"""
     print(f"--- 経済指標データ更新スクリプト開始: {datetime.datetime.now()} ---")
 
     conn = None
     try:
-        end_date = datetime.date.today()
-        print(f"FREDからデータを取得中... (期間: {start_date} - {end_date})")
-        # 引数で渡されたIDリストを使ってデータを取得
-        df_fred = web.DataReader(list(fred_series_ids.keys()), 'fred', start_date, end_date)
-
-        df_fred.rename(columns=fred_series_ids, inplace=True)
-        df_fred.index.name = 'indicator_date'
-
-        df_daily = df_fred.resample('D').ffill()
-
         conn, _ = get_db_connection()
         if conn is None:
             print("データベース接続の取得に失敗したため、処理を中止します。")
             return
 
-        with conn:
-            cursor = conn.cursor()
-
-            print("データベースに経済指標を挿入/更新しています...")
-            insert_count = 0
-            for series_id, series in df_daily.items():
-                for date, value in series.dropna().items():
-                    cursor.execute(
-                        """
-                        INSERT INTO macro_economic_indicators (series_id, indicator_date, value)
-                        VALUES (?, ?, ?)
-                        ON CONFLICT (series_id, indicator_date) DO UPDATE SET
-                            value = EXCLUDED.value,
-                            updated_at = CURRENT_TIMESTAMP;
-                        """,
-                        (series_id, date.strftime('%Y-%m-%d'), float(value))
-                    )
-                    insert_count += 1
-
-            conn.commit()
-            print(f"{insert_count}件の経済指標データをデータベースに挿入/更新しました。")
+        # 再構築の場合は保存済みの観測日にかかわらず start_date から全て取り直す
+        last_dates = {} if rebuild else get_last_indicator_dates(conn)
+        # 取得に失敗した場合に保存済みのデータを失わないよう、削除と挿入は取得が完了してから1つのトランザクションで行う
+        rows = fetch_fred_series(fred_series_ids, last_dates, start_date, datetime.date.today())
+
+        if rebuild:
+            # 以前の形式 (日次に補完した行) を削除し、元の頻度の観測値で置き換える
+            series_ids = list(fred_series_ids.values())
+            cursor = conn.execute(
+                f"DELETE FROM macro_economic_indicators WHERE series_id IN ({', '.join(['?'] * len(series_ids))})",
+                series_ids
+            )
+            print(f"再構築のため、{cursor.rowcount}件の既存データを削除します。")
+
+        print("データベースに経済指標を挿入/更新しています...")
+        cursor = conn.cursor()
+        cursor.executemany(
+            """
+            INSERT INTO macro_economic_indicators (series_id, indicator_date, value)
+            VALUES (?, ?, ?)
+            ON CONFLICT (series_id, indicator_date) DO UPDATE SET
+                value = EXCLUDED.value,
+                updated_at = CURRENT_TIMESTAMP
+            WHERE value IS NOT EXCLUDED.value;
+            """,
+            rows
+        )
+        conn.commit()
+        print(f"{len(rows)}件の観測値のうち、新規・変更された{cursor.rowcount}件をデータベースに挿入/更新しました。")
 
     except Exception as e:
         print(f"経済指標データの更新中にエラーが発生しました: {e}")
@@ -77,6 +109,7 @@ def main():
         default=None,
         help="取得するFREDシリーズIDと名前のペアを 'ID:name' の形式で指定します (例: GDP:gdp ICSA:initial_claims)。指定がない場合はデフォルトの指標リストを使用します。"
     )
+    parser.add_argument('--rebuild', action='store_true', help="指定した指標の保存済みデータを削除し、元の頻度の観測値で取り直します (日次に補完して保存していた以前の形式からの移行用)。")
     args = parser.parse_args()
 
     if args.indicators:
@@ -92,7 +125,7 @@ def main():
         fred_series = DEFAULT_FRED_SERIES
 
     print(f"取得対象の指標: {fred_series}")
-    update_economic_data(fred_series)
+    update_economic_data(fred_series, rebuild=args.rebuild)
 
 
 if __name__ == '__main__':
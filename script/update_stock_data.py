@@ -1,15 +1,58 @@
-import yfinance as yf
+import itertools
+from collections import defaultdict
+import numpy as np
 import pandas as pd
 import sqlite3
 import datetime
-import time
 import json
 import argparse
-from db_connector import get_db_connection
+import os
+from db_connector import get_db_connection, datetime64_to_trade_days, date_to_trade_day, trade_day_to_date
+from config_loader import config_loader
+from price_ingestion import PRICE_COLUMNS, TokenBucket, YFinanceSource, FileReplaySource, CachedPriceSource, ingest_prices, price_cache_meta, save_replay_file
+from fetch_cache import get_fetch_cache
+from stale_tickers import mark_stale
+from apply_db_migration import LEGACY_BACKUP_TABLE, apply_schema_migrations, get_price_table_layout
+from instrumentation import instrument_run, stage
+from profiling import add_profile_arguments, profile_run
 
 # --- 設定 ---
-REQUEST_DELAY_SECONDS = 0.5
+SCHEMA_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'SQL', 'ensure_schema.sql')
 LOOKBACK_DAYS = 7
+# この行数に達するごとに、複数銘柄分の株価を1つのトランザクションで書き込む
+FLUSH_ROWS = 50000
+# 過去データが無い銘柄、または株価履歴を取り直す銘柄の取得期間
+HISTORY_YEARS = 10
+# 株式分割・配当による調整後終値の改訂とみなす条件
+# 保存済みの行と重複する日が MIN_ADJUSTMENT_OVERLAP 日以上あり、全ての日の変化率が
+# 中央値から ADJUSTMENT_UNIFORMITY 以内に揃っていて、中央値が1から MIN_ADJUSTMENT 以上離れていること
+MIN_ADJUSTMENT_OVERLAP = 2
+MIN_ADJUSTMENT = 5e-4
+ADJUSTMENT_UNIFORMITY = 1e-4
+
+# ON CONFLICT を使用したUPSERTクエリ
+# 値が変わらない行は更新しない (updated_at を変えず、ページも書き換えない)
+UPSERT_QUERY = """
+    INSERT INTO daily_stock_prices (
+        ticker_symbol, trade_day, open_price, high_price, low_price,
+        close_price, adj_close_price, volume
+    )
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+    ON CONFLICT (ticker_symbol, trade_day) DO UPDATE SET
+        open_price = excluded.open_price,
+        high_price = excluded.high_price,
+        low_price = excluded.low_price,
+        close_price = excluded.close_price,
+        adj_close_price = excluded.adj_close_price,
+        volume = excluded.volume,
+        updated_at = CAST(strftime('%s', 'now') AS INTEGER)
+    WHERE open_price IS NOT excluded.open_price
+       OR high_price IS NOT excluded.high_price
+       OR low_price IS NOT excluded.low_price
+       OR close_price IS NOT excluded.close_price
+       OR adj_close_price IS NOT excluded.adj_close_price
+       OR volume IS NOT excluded.volume;
+"""
 
 
 def insert_stock_info(conn):
@@ -30,17 +73,21 @@ def insert_stock_info(conn):
         print("エラー: tickers.jsonファイルの形式が正しくありません。")
         return
 
-    # データベースに挿入するために、辞書のリストをタプルのリストに変換
+    # 登録済みの銘柄は除外し、新しい銘柄のみをタプルのリストに変換する
+    # (登録済み銘柄の情報の更新は update_stock_info.py の一括同期で行う)
+    existing = {row[0] for row in conn.execute("SELECT ticker_symbol FROM stock_info")}
     stocks_to_add = [
         (
             t.get('ticker_symbol'), t.get('company_name'), t.get('exchange'),
             t.get('sector'), t.get('industry'), t.get('country'), t.get('currency')
         )
         for t in tickers_data
+        if t.get('ticker_symbol') not in existing
     ]
 
     if not stocks_to_add:
-        print("登録する銘柄情報がありません。")
+        print("新しく登録する銘柄情報はありません。")
+        print("--- 銘柄情報設定が完了 ---")
         return
 
     with conn:
@@ -64,66 +111,165 @@ def get_tickers_from_db(conn):
         return tickers
 
 
-def get_last_trade_date_from_db(conn, ticker_symbol):
-    with conn:
-        cursor = conn.cursor()
-        cursor.execute(
-            "SELECT MAX(trade_date) FROM daily_stock_prices WHERE ticker_symbol = ?",
-            (ticker_symbol,)
-        )
-        result = cursor.fetchone()[0]
-        # SQLite returns string, convert to date
-        if result:
-            return datetime.datetime.strptime(result, '%Y-%m-%d').date()
+def get_last_trade_dates_from_db(conn):
+    """全銘柄のDB上の最新取引日を1回の集約クエリで取得し、{ticker: date} の辞書で返す"""
+    cursor = conn.cursor()
+    cursor.execute("SELECT ticker_symbol, MAX(trade_day) FROM daily_stock_prices GROUP BY ticker_symbol")
+    return {ticker: trade_day_to_date(last_day) for ticker, last_day in cursor.fetchall() if last_day is not None}
+
+
+def to_trade_days(index):
+    """DatetimeIndex を trade_day (1970-01-01 からの日数) の整数の配列に変換する"""
+    if index.tz is not None:
+        index = index.tz_localize(None)
+    return datetime64_to_trade_days(index.values)
+
+
+def load_recent_adj_close(conn, since):
+    """
+    since 以降に保存されている全銘柄の調整後終値を1回のクエリで取得する。
+    戻り値は {ticker: {trade_day: adj_close_price}} の辞書。
+    """
+    cursor = conn.cursor()
+    cursor.execute(
+        "SELECT ticker_symbol, trade_day, adj_close_price FROM daily_stock_prices WHERE trade_day >= ?",
+        (date_to_trade_day(since),)
+    )
+    stored = defaultdict(dict)
+    for ticker, trade_day, adj_close in cursor.fetchall():
+        stored[ticker][trade_day] = adj_close
+    return stored
+
+
+def detect_adjustment_ratio(stored_adj_close, df_prices):
+    """
+    取得したデータと保存済みの行を重複する日で比較し、調整後終値が全ての日で同じ比率だけ変化している場合に
+    その比率を返す (株式分割・配当によって過去の調整後終値が改訂されたとみなす)。
+    変化が無い場合や、一部の日だけが変化している場合は None を返す。
+    """
+    if not stored_adj_close:
+        return None
+    dates = to_trade_days(df_prices.index).tolist()
+    fetched = df_prices['Adj Close'].to_numpy(dtype=float)
+    pairs = np.array([
+        (stored_adj_close[date], value)
+        for date, value in zip(dates, fetched)
+        if date in stored_adj_close and not np.isnan(value) and stored_adj_close[date]
+    ])
+    if len(pairs) < MIN_ADJUSTMENT_OVERLAP:
         return None
 
+    ratios = pairs[:, 1] / pairs[:, 0]
+    ratio = float(np.median(ratios))
+    if abs(ratio - 1) < MIN_ADJUSTMENT:
+        return None
+    if np.max(np.abs(ratios / ratio - 1)) > ADJUSTMENT_UNIFORMITY:
+        return None
+    return ratio
 
-def insert_or_update_daily_prices(conn, df_prices):
-    if df_prices.empty:
-        print("    更新するデータがありません。")
-        return
 
-    with conn:
-        cursor = conn.cursor()
-        # データをタプルのリストに変換
-        data_to_insert = [
-            (
-                row['ticker_symbol'],
-                index.date().strftime('%Y-%m-%d'),
-                row['Open'],
-                row['High'],
-                row['Low'],
-                row['Close'],
-                row['Adj Close'],
-                row['Volume']
-            )
-            for index, row in df_prices.iterrows()
-        ]
-
-        # ON CONFLICT を使用したUPSERTクエリ
-        upsert_query = """
-            INSERT INTO daily_stock_prices (
-                ticker_symbol, trade_date, open_price, high_price, low_price,
-                close_price, adj_close_price, volume
-            )
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-            ON CONFLICT (ticker_symbol, trade_date) DO UPDATE SET
-                open_price = excluded.open_price,
-                high_price = excluded.high_price,
-                low_price = excluded.low_price,
-                close_price = excluded.close_price,
-                adj_close_price = excluded.adj_close_price,
-                volume = excluded.volume,
-                updated_at = CURRENT_TIMESTAMP;
-        """
+def build_price_rows(ticker, df_prices):
+    """
+    DataFrameから daily_stock_prices のUPSERT用パラメータのリストを作成する。
+    行ごとのループではなくカラム単位でNumPy配列に変換し、必須カラムに欠損値がある行は除外する。
+    df_prices は PRICE_COLUMNS を含む数値のカラムのみを持つこと。
+    """
+    columns = list(df_prices.columns)
+    values = df_prices.to_numpy(dtype=float)[:, [columns.index(column) for column in PRICE_COLUMNS]]
+    valid = ~np.isnan(values).any(axis=1)
+    if not valid.all():
+        print(f"  [警告] 銘柄 {ticker}: 欠損値を含む{int((~valid).sum())}行を除外しました。")
+    dates = to_trade_days(df_prices.index)[valid].tolist()
+    values = values[valid]
+    return list(zip(
+        itertools.repeat(ticker),
+        dates,
+        values[:, 0].tolist(),
+        values[:, 1].tolist(),
+        values[:, 2].tolist(),
+        values[:, 3].tolist(),
+        values[:, 4].tolist(),
+        values[:, 5].astype(np.int64).tolist(),
+    ))
+
+
+def upsert_price_rows(conn, rows):
+    """
+    複数銘柄分のUPSERTパラメータを1つのトランザクションで書き込む。
+    保存済みの値と同じ行は更新されない。新規に挿入または変更された行数を返す。
+    書き込みに失敗した場合はロールバックしてから sqlite3.Error を送出する。
+    """
+    if not rows:
+        return 0
 
-        try:
-            cursor.executemany(upsert_query, data_to_insert)
+    cursor = conn.cursor()
+    try:
+        with stage('db_write', rows=len(rows)):
+            cursor.executemany(UPSERT_QUERY, rows)
             conn.commit()
-            print(f"    {len(data_to_insert)}件のデータをデータベースに挿入/更新しました。")
-        except sqlite3.Error as e:
-            conn.rollback()
-            print(f"    データベースへの挿入/更新中にエラーが発生しました: {e}")
+        return cursor.rowcount
+    except sqlite3.Error as e:
+        conn.rollback()
+        print(f"    データベースへの挿入/更新中にエラーが発生しました: {e}")
+        raise
+
+
+def replace_price_history(conn, ticker, df_prices, adjustment_ratio):
+    """
+    銘柄の株価履歴を取り直したデータで置き換え、stale_tickers に記録する。
+    削除・挿入・記録は1つのトランザクション内で行う。書き込んだ行数を返す。
+    """
+    rows = build_price_rows(ticker, df_prices)
+    cursor = conn.cursor()
+    try:
+        cursor.execute("DELETE FROM daily_stock_prices WHERE ticker_symbol = ?", (ticker,))
+        cursor.executemany(UPSERT_QUERY, rows)
+        mark_stale(conn, ticker, adjustment_ratio)
+        conn.commit()
+        return len(rows)
+    except sqlite3.Error as e:
+        conn.rollback()
+        print(f"    銘柄 {ticker} の株価履歴の置き換え中にエラーが発生しました: {e}")
+        return 0
+
+
+class PriceRowBuffer:
+    """
+    複数銘柄のUPSERTパラメータを溜め、flush_rows 行に達するごとに1つのトランザクションでまとめて書き込む。
+    銘柄ごとにコミットするよりもトランザクションの回数を大幅に減らせる。
+    書き込みに失敗したトランザクションの銘柄は failed_tickers に記録する。保存済みの最新日は変わらないため、
+    次回の実行で同じ期間から取得し直される。
+    """
+
+    def __init__(self, conn, flush_rows=FLUSH_ROWS):
+        self.conn = conn
+        self.flush_rows = flush_rows
+        self.rows = []
+        self.tickers = []
+        self.submitted = 0
+        self.written = 0
+        self.failed_tickers = []
+
+    def add(self, ticker, df_prices):
+        self.rows.extend(build_price_rows(ticker, df_prices))
+        self.tickers.append(ticker)
+        if len(self.rows) >= self.flush_rows:
+            self.flush()
+
+    def flush(self):
+        if not self.rows:
+            return
+        try:
+            written = upsert_price_rows(self.conn, self.rows)
+        except sqlite3.Error:
+            print(f"    {len(self.tickers)}銘柄・{len(self.rows)}件を書き込めませんでした。これらの銘柄は失敗として扱います。")
+            self.failed_tickers.extend(self.tickers)
+        else:
+            print(f"    {len(self.tickers)}銘柄・{len(self.rows)}件のうち、新規・変更された{written}件をデータベースに書き込みました。")
+            self.submitted += len(self.rows)
+            self.written += written
+        self.rows = []
+        self.tickers = []
 
 
 def validate_data_quality(df, ticker):
@@ -150,15 +296,68 @@ def validate_data_quality(df, ticker):
     return is_valid
 
 
+def connect_database(db_path=None):
+    """
+    書き込み先のデータベースに接続する。db_path を指定した場合 (一括評価用の一時データベースなど) は、
+    そのファイルに接続し、テーブルが無ければ作成する。
+    """
+    if db_path is None:
+        conn, _ = get_db_connection()
+        return conn
+    conn = sqlite3.connect(db_path)
+    if get_price_table_layout(conn) == 'legacy':
+        # 以前の実行で残された古い形式の一時データベースは、テーブルを作成する前に移行する。
+        # 移行前のテーブルは削除せずに残す (一時データベースは評価の終了時にファイルごと削除される)。
+        # 株価は取得し直せるため、移行できない行は除外する (件数は警告として表示される)
+        print("=" * 80)
+        print(f"[警告] '{db_path}' の daily_stock_prices は古い形式です。新しい形式に移行し、"
+              f"移行前のテーブルを {LEGACY_BACKUP_TABLE} として残します。")
+        print("=" * 80)
+    apply_schema_migrations(conn, migrate_prices=True, backup_table=LEGACY_BACKUP_TABLE, skip_invalid_rows=True)
+    with open(SCHEMA_PATH, 'r', encoding='utf-8') as f:
+        conn.executescript(f.read())
+    print(f"--- 書き込み先のデータベース: '{db_path}' ---")
+    return conn
+
+
+def get_fetch_start_date(last_date):
+    """DB上の最新日から LOOKBACK_DAYS 日遡った日を取得開始日とする。過去データが無い場合は HISTORY_YEARS 年前から取得する。"""
+    if last_date:
+        return last_date - datetime.timedelta(days=LOOKBACK_DAYS)
+    return get_history_start_date()
+
+
+def get_history_start_date():
+    return datetime.date.today() - datetime.timedelta(days=365 * HISTORY_YEARS)
+
+
+def create_price_source(args, settings):
+    if args.source == 'replay':
+        if not args.replay_dir:
+            raise ValueError("--source replay には --replay-dir を指定してください。")
+        return FileReplaySource(args.replay_dir, batch_size=settings['batch_size'], latency=args.replay_latency)
+    return YFinanceSource(batch_size=settings['batch_size'])
+
+
 def main():
+    settings = config_loader.get_ingestion_settings()
     parser = argparse.ArgumentParser(description="株価データをyfinanceから取得し、データベースを更新します。")
     parser.add_argument('--tickers', nargs='*', default=None, help="更新対象のティッカーシンボル（複数指定可）。指定しない場合はDB内の全銘柄が対象。）")
+    parser.add_argument('--workers', type=int, default=settings['max_workers'], help=f"同時に実行する取得処理の数 (デフォルト: {settings['max_workers']})")
+    parser.add_argument('--rate', type=float, default=settings['requests_per_second'], help=f"1秒あたりの最大リクエスト数 (デフォルト: {settings['requests_per_second']})")
+    parser.add_argument('--source', choices=['yfinance', 'replay'], default='yfinance', help="株価データの取得元。replay は保存済みファイルを読み込みます (オフラインでの性能計測用)。")
+    parser.add_argument('--replay-dir', type=str, help="--source replay で読み込むファイルのディレクトリ")
+    parser.add_argument('--replay-latency', type=float, default=0.0, help="--source replay で1回の取得ごとに待機する秒数 (ネットワーク遅延の再現)")
+    parser.add_argument('--record-dir', type=str, help="取得したデータを replay 用のファイルとしてこのディレクトリにも保存します。")
+    parser.add_argument('--no-cache', action='store_true', help="取得キャッシュを使用せず、常にダウンロードします。")
+    parser.add_argument('--db', type=str, help="書き込み先のデータベースファイル (一括評価用の一時データベースなど)。指定しない場合はメインのデータベースに書き込みます。")
+    add_profile_arguments(parser)
     args = parser.parse_args()
 
     print(f"--- 株価データ取得スクリプト開始: {datetime.datetime.now()} ---")
     conn, tunnel = None, None
     try:
-        conn, _ = get_db_connection()
+        conn = connect_database(args.db)
         if conn is None:
             print("データベース接続の取得に失敗したため、処理を中止します。")
             return
@@ -175,38 +374,78 @@ def main():
             print("取得対象の銘柄が登録されていません。")
             return
 
-        print(f"取得対象銘柄数: {len(tickers)}")
-
-        for ticker in tickers:
-            print(f"\n銘柄: {ticker} のデータを取得中...")
-            last_date = get_last_trade_date_from_db(conn, ticker)
-
-            if last_date:
-                start_date_yf = last_date - datetime.timedelta(days=LOOKBACK_DAYS)
-                print(f"  データベース上の最新データ日: {last_date.strftime('%Y-%m-%d')}")
-                print(f"  yfinanceからの取得開始日: {start_date_yf.strftime('%Y-%m-%d')}")
-            else:
-                start_date_yf = datetime.date.today() - datetime.timedelta(days=365 * 10)
-                print(f"  過去データがありません。{start_date_yf.strftime('%Y-%m-%d')} から取得します。")
-
-            end_date_yf = datetime.date.today() + datetime.timedelta(days=1)
-            df = yf.download(ticker, start=start_date_yf, end=end_date_yf, progress=False, auto_adjust=False, actions=False)
-
-            if df.empty:
-                print(f"  '{ticker}' のデータを取得できませんでした。")
-                continue
-
-            # yfinanceが返すMultiIndexをフラットなカラム名に修正
-            df.columns = df.columns.get_level_values(0)
-
-            # データ品質を検証
+        print(f"取得対象銘柄数: {len(tickers)} (同時実行数: {args.workers}, 最大 {args.rate} リクエスト/秒)")
+
+        last_dates = get_last_trade_dates_from_db(conn)
+        requests = [(ticker, get_fetch_start_date(last_dates.get(ticker))) for ticker in tickers]
+        buffer = PriceRowBuffer(conn)
+        end_date = datetime.date.today() + datetime.timedelta(days=1)
+        # 取得期間が保存済みの行と重複する銘柄について、比較用に保存済みの調整後終値を読み込む
+        overlap_starts = [start for ticker, start in requests if ticker in last_dates]
+        stored_adj_close = load_recent_adj_close(conn, min(overlap_starts)) if overlap_starts else {}
+        adjusted = {}
+
+        def write_prices(ticker, df):
+            # 取得スレッドからではなく、呼び出し元のスレッドでのみ実行される (単一ライター)
+            print(f"銘柄: {ticker} ({df.index.min():%Y-%m-%d} - {df.index.max():%Y-%m-%d}, {len(df)}日分)")
+            if args.record_dir:
+                save_replay_file(args.record_dir, ticker, df)
             if not validate_data_quality(df, ticker):
-                continue
-
-            df['ticker_symbol'] = ticker
-
-            insert_or_update_daily_prices(conn, df)
-            time.sleep(REQUEST_DELAY_SECONDS)
+                return 0
+            ratio = detect_adjustment_ratio(stored_adj_close.get(ticker), df)
+            if ratio is not None:
+                # 重複部分だけを書き込むと古い履歴が改訂前の値のまま残るため、ここでは書き込まずに履歴全体を取り直す
+                print(f"  [情報] 銘柄 {ticker}: 調整後終値が一律に {ratio:.4f} 倍に改訂されています (株式分割・配当の可能性)。株価履歴を取り直します。")
+                adjusted[ticker] = ratio
+                return 0
+            buffer.add(ticker, df)
+            return len(df)
+
+        def replace_history(ticker, df):
+            if not validate_data_quality(df, ticker):
+                return 0
+            written = replace_price_history(conn, ticker, df, adjusted[ticker])
+            if written:
+                # 改訂前の株価が次回の実行で返されないよう、キャッシュも取り直したデータで置き換える
+                cache.put('prices', ticker, df, price_cache_meta(history_start, end_date))
+                print(f"銘柄: {ticker} の株価履歴を {written}日分で置き換え、モデルと特徴量を再計算が必要な状態にしました。")
+            return written
+
+        source = create_price_source(args, settings)
+        cache = get_fetch_cache(enabled=False if args.no_cache or args.source == 'replay' else None)
+        cached_source = CachedPriceSource(source, cache)
+        rate_limiter = TokenBucket(args.rate, settings['burst'])
+        ingest_options = dict(
+            max_workers=args.workers,
+            rate_limiter=rate_limiter,
+            max_retries=settings['max_retries'],
+            backoff_seconds=settings['backoff_seconds'],
+        )
+        with stage('ingest', rows=len(requests)):
+            stats = ingest_prices(requests, cached_source, write_prices, end_date, **ingest_options)
+            buffer.flush()
+        # 取得できたが書き込めなかった銘柄は、取得の失敗と同様に扱う
+        stats['fetched'] -= len(buffer.failed_tickers)
+        stats['failed'] += len(buffer.failed_tickers)
+        stats['failed_tickers'] += buffer.failed_tickers
+
+        replaced = 0
+        if adjusted:
+            print(f"\n--- 株価履歴の取り直し: {len(adjusted)}銘柄 ---")
+            history_start = get_history_start_date()
+            # キャッシュには改訂前の株価が残っている可能性があるため、取り直しは常にダウンロードする
+            refetch_stats = ingest_prices([(ticker, history_start) for ticker in adjusted], source, replace_history, end_date, **ingest_options)
+            replaced = refetch_stats['fetched']
+            stats['failed_tickers'] += refetch_stats['failed_tickers']
+
+        print(f"\n取得結果: 成功 {stats['fetched']}銘柄, データなし {stats['empty']}銘柄, 失敗 {stats['failed']}銘柄 "
+              f"(リクエスト {stats['batches']}回, 再試行 {stats['retries']}回, {stats['elapsed_seconds']:.1f}秒)")
+        print(f"書き込み: {buffer.submitted}行のうち新規・変更 {buffer.written}行, 株価履歴の置き換え {replaced}銘柄")
+        if stats['failed_tickers']:
+            print(f"取得・書き込みに失敗した銘柄: {' '.join(stats['failed_tickers'])}")
+        if cache.enabled:
+            print(f"取得キャッシュ: {cache.summary()}")
+            cache.save_stats()
 
     except Exception as e:
         print(f"スクリプト実行中に予期せぬエラーが発生しました: {e}")
@@ -219,4 +458,5 @@ def main():
 
 
 if __name__ == "__main__":
-    main()
+    with instrument_run('update_stock_data'), profile_run('update_stock_data'):
+        main()
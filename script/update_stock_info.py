@@ -1,99 +1,206 @@
 import argparse
 import sys
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from pathlib import Path
 import yfinance as yf
-import sqlite3
 
 # プロジェクトのルートディレクトリをsys.pathに追加
 project_root = Path(__file__).resolve().parent.parent
 sys.path.append(str(project_root))
 
 from script.db_connector import DBConnector
+from script.fetch_cache import get_fetch_cache
+from script.price_ingestion import TokenBucket
+from script.config_loader import config_loader
 
 
-def update_stock_info(db_connector, ticker):
+def fetch_stock_info(ticker, cache=None, verbose=True):
     """
-    yfinanceから銘柄情報を取得し、stock_infoテーブルを更新（UPSERT）する
+    yfinanceから銘柄情報を取得する。cache が指定され、有効期限内のエントリがある場合はダウンロードを省略する。
+    会社名を含む情報のみをキャッシュする。
     """
-    print(f"--- 銘柄 {ticker} の情報を yfinance から取得しています... ---")
-    try:
-        ticker_obj = yf.Ticker(ticker)
-        info = ticker_obj.info
-
-        # yfinanceから必須情報が取得できない場合は処理を中断
-        company_name = info.get('longName') or info.get('shortName')
-        if not company_name:
-            print(f"警告: {ticker} の会社名が取得できませんでした。stock_infoテーブルの更新をスキップします。")
-            return False
-
-        # 取得した情報を辞書にまとめる
-        stock_data = {
-            'ticker_symbol': ticker,
-            'company_name': company_name,
-            'exchange': info.get('exchange'),
-            'sector': info.get('sector'),
-            'industry': info.get('industry'),
-            'country': info.get('country'),
-            'currency': info.get('currency')
-        }
-
-        # Noneの値を削除
-        stock_data = {k: v for k, v in stock_data.items() if v is not None}
-
-        print(f"取得した情報: {stock_data}")
+    cached = cache.get('info', ticker) if cache else None
+    if cached is not None:
+        if verbose:
+            print(f"--- 銘柄 {ticker} の情報をキャッシュから取得しました ---")
+        return cached[0]
 
-    except Exception as e:
-        print(f"エラー: yfinanceでの情報取得中にエラーが発生しました - {e}")
-        return False
+    if verbose:
+        print(f"--- 銘柄 {ticker} の情報を yfinance から取得しています... ---")
+    info = yf.Ticker(ticker).info
+    if cache and (info.get('longName') or info.get('shortName')):
+        cache.put('info', ticker, info)
+    return info
 
-    print(f"--- データベースの stock_info テーブルを更新しています... ---")
-    try:
+
+# stock_info テーブルのカラム一覧 ({db_path: [column, ...]})。PRAGMA table_info の問い合わせを接続ごとに繰り返さないようにする
+_table_columns = {}
+
+# yfinance の info から取得する stock_info のカラム (ticker_symbol, company_name 以外)
+INFO_FIELDS = ['exchange', 'sector', 'industry', 'country', 'currency']
+
+
+def get_stock_info_columns(conn, db_path):
+    """stock_info テーブルのカラム一覧を返す。データベースファイルごとに一度だけ問い合わせてキャッシュする。"""
+    if db_path not in _table_columns:
+        _table_columns[db_path] = [row[1] for row in conn.execute("PRAGMA table_info(stock_info);").fetchall()]
+    return _table_columns[db_path]
+
+
+def build_stock_info_record(ticker, info):
+    """yfinance の info から stock_info の1行分の辞書を作成する。会社名が取得できない場合は None を返す。"""
+    company_name = info.get('longName') or info.get('shortName')
+    if not company_name:
+        return None
+    record = {'ticker_symbol': ticker, 'company_name': company_name}
+    record.update({field: info.get(field) for field in INFO_FIELDS})
+    return record
+
+
+def get_fresh_tickers(conn, tickers, ttl_days):
+    """stock_info の updated_at が ttl_days 日以内の銘柄を、1回のクエリで集合として返す"""
+    if not tickers or ttl_days <= 0:
+        return set()
+    cursor = conn.execute(
+        "SELECT ticker_symbol FROM stock_info WHERE updated_at >= datetime('now', ?)",
+        (f"-{ttl_days} days",)
+    )
+    requested = set(tickers)
+    return {row[0] for row in cursor.fetchall() if row[0] in requested}
+
+
+def upsert_stock_info(conn, columns, records):
+    """
+    銘柄情報をまとめて1回の executemany で UPSERT し、updated_at を更新する。
+    取得できなかった項目 (None) は既存の値を保持する。テーブルに存在しないカラムは対象外とする。
+    """
+    fields = [f for f in ['ticker_symbol', 'company_name'] + INFO_FIELDS if f in columns]
+    assignments = [f"{f} = COALESCE(excluded.{f}, stock_info.{f})" for f in fields if f != 'ticker_symbol']
+    if 'updated_at' in columns:
+        assignments.append("updated_at = CURRENT_TIMESTAMP")
+    query = f"""
+        INSERT INTO stock_info ({', '.join(fields)})
+        VALUES ({', '.join(['?'] * len(fields))})
+        ON CONFLICT (ticker_symbol) DO UPDATE SET
+            {', '.join(assignments)};
+    """
+    conn.executemany(query, [[record.get(f) for f in fields] for record in records])
+    conn.commit()
+
+
+def sync_stock_info(db_connector, tickers, ttl_days=0, max_workers=8, cache=None, rate_limiter=None, verbose=False):
+    """
+    複数銘柄の銘柄情報を並行して取得し、stock_info テーブルをまとめて更新する。
+    ttl_days 日以内に更新済みの銘柄は取得を省略する (0 の場合は全銘柄を更新する)。
+    取得はスレッドプールで行い、書き込みは呼び出し元のスレッドから1回の executemany で行う。
+    戻り値は {'requested', 'skipped', 'updated', 'failed', 'failed_tickers', 'elapsed_seconds'} の辞書。
+    """
+    start_time = time.perf_counter()
+    tickers = list(dict.fromkeys(tickers))
+    with db_connector.connect() as conn:
+        fresh = get_fresh_tickers(conn, tickers, ttl_days)
+    targets = [t for t in tickers if t not in fresh]
+    stats = {'requested': len(tickers), 'skipped': len(fresh), 'updated': 0, 'failed': 0, 'failed_tickers': []}
+
+    def fetch(ticker):
+        if rate_limiter:
+            rate_limiter.acquire()
+        return fetch_stock_info(ticker, cache, verbose=verbose)
+
+    records = []
+    if targets:
+        with ThreadPoolExecutor(max_workers=max(1, max_workers)) as executor:
+            futures = {executor.submit(fetch, ticker): ticker for ticker in targets}
+            for future in as_completed(futures):
+                ticker = futures[future]
+                try:
+                    record = build_stock_info_record(ticker, future.result())
+                except Exception as e:
+                    print(f"  [エラー] {ticker} の情報取得中にエラーが発生しました - {e}")
+                    record = None
+                else:
+                    if record is None:
+                        print(f"  警告: {ticker} の会社名が取得できませんでした。stock_infoテーブルの更新をスキップします。")
+                if record is None:
+                    stats['failed'] += 1
+                    stats['failed_tickers'].append(ticker)
+                else:
+                    records.append(record)
+
+    if records:
         with db_connector.connect() as conn:
-            cursor = conn.cursor()
-            # 登録済みのカラムを取得
-            cursor.execute(f"PRAGMA table_info(stock_info);")
-            existing_columns = [row[1] for row in cursor.fetchall()]
-
-            # 登録データのうち、テーブルに存在するカラムのみを対象とする
-            update_data = {k: v for k, v in stock_data.items() if k in existing_columns}
-
-            if not update_data:
-                print("警告: データベースに登録するデータがありません。")
-                return False
-
-            columns = ", ".join(update_data.keys())
-            placeholders = ", ".join(["?"] * len(update_data))
-
-            # ON CONFLICT (UPSERT) クエリの動的生成
-            update_assignments = ", ".join([f"{key} = excluded.{key}" for key in update_data.keys() if key != 'ticker_symbol'])
-
-            query = f"""
-                INSERT INTO stock_info ({columns})
-                VALUES ({placeholders})
-                ON CONFLICT (ticker_symbol) DO UPDATE SET
-                    {update_assignments};
-            """
-
-            cursor.execute(query, list(update_data.values()))
-            conn.commit()
-        print(f"銘柄 {ticker} の情報を stock_info テーブルに正常に登録/更新しました。")
-        return True
+            upsert_stock_info(conn, get_stock_info_columns(conn, db_connector.db_path), records)
+    stats['updated'] = len(records)
+    stats['elapsed_seconds'] = time.perf_counter() - start_time
+    return stats
+
+
+def update_stock_info(db_connector, ticker, cache=None):
+    """
+    yfinanceから銘柄情報を取得し、stock_infoテーブルを更新（UPSERT）する
+    """
+    try:
+        stats = sync_stock_info(db_connector, [ticker], ttl_days=0, max_workers=1, cache=cache, verbose=True)
     except Exception as e:
         print(f"エラー: データベースの更新に失敗しました - {e}")
         return False
+    if not stats['updated']:
+        return False
+    print(f"銘柄 {ticker} の情報を stock_info テーブルに正常に登録/更新しました。")
+    return True
+
+
+def get_sync_targets(db_connector, args):
+    """コマンドライン引数から更新対象の銘柄リストを作成する"""
+    tickers = list(args.ticker or [])
+    with db_connector.connect() as conn:
+        if args.all:
+            tickers += [row[0] for row in conn.execute("SELECT ticker_symbol FROM stock_info ORDER BY ticker_symbol")]
+        if args.from_market_list:
+            tickers += [row[0] for row in conn.execute("SELECT ticker FROM market_list ORDER BY ticker")]
+    return list(dict.fromkeys(tickers))
 
 
 def main():
     """
-    コマンドライン引数からティッカーを受け取り、情報を更新する
+    コマンドライン引数から対象の銘柄を受け取り、情報を更新する
     """
-    parser = argparse.ArgumentParser(description="指定された銘柄の会社情報を yfinance から取得し、データベースを更新します。")
-    parser.add_argument("--ticker", required=True, help="更新対象の銘柄コード (例: 7203.T)")
+    parser = argparse.ArgumentParser(description="銘柄の会社情報を yfinance から取得し、データベースを更新します。")
+    parser.add_argument("--ticker", nargs='+', help="更新対象の銘柄コード (例: 7203.T)。複数指定できます。")
+    parser.add_argument("--all", action="store_true", help="stock_info に登録済みの全銘柄を更新します。")
+    parser.add_argument("--from-market-list", action="store_true", help="market_list テーブルの全銘柄を登録・更新します。")
+    parser.add_argument("--workers", type=int, default=None, help="同時に実行する取得処理の数 (デフォルト: config.ini の [stock_info_sync] max_workers)")
+    parser.add_argument("--ttl-days", type=float, default=None,
+                        help="この日数以内に更新済みの銘柄は取得を省略します (デフォルト: config.ini の [stock_info_sync] refresh_ttl_days)。0 で全銘柄を更新します。")
+    parser.add_argument("--no-cache", action="store_true", help="取得キャッシュを使用せず、常に yfinance から取得します。")
     args = parser.parse_args()
 
     db_connector = DBConnector()
-    update_stock_info(db_connector, args.ticker)
+    cache = get_fetch_cache(enabled=False if args.no_cache else None)
+
+    if args.ticker and len(args.ticker) == 1 and not (args.all or args.from_market_list):
+        # 1銘柄のみの場合は、従来どおり常に更新する
+        update_stock_info(db_connector, args.ticker[0], cache)
+    else:
+        tickers = get_sync_targets(db_connector, args)
+        if not tickers:
+            parser.error("--ticker, --all, --from-market-list のいずれかで対象の銘柄を指定してください。")
+        settings = config_loader.get_stock_info_sync_settings()
+        ttl_days = settings['refresh_ttl_days'] if args.ttl_days is None else args.ttl_days
+        max_workers = args.workers or settings['max_workers']
+        rate_limiter = TokenBucket(settings['requests_per_second'], settings['burst'])
+        print(f"--- {len(tickers)}銘柄の銘柄情報を同期します (並列数: {max_workers}, 更新間隔: {ttl_days}日) ---")
+        stats = sync_stock_info(db_connector, tickers, ttl_days, max_workers, cache, rate_limiter)
+        print(f"--- 同期完了: 更新 {stats['updated']}件, 更新不要 {stats['skipped']}件, 失敗 {stats['failed']}件 "
+              f"({stats['elapsed_seconds']:.1f}秒) ---")
+        if stats['failed_tickers']:
+            print(f"取得に失敗した銘柄: {', '.join(sorted(stats['failed_tickers']))}")
+
+    if cache.enabled:
+        print(f"取得キャッシュ: {cache.summary()}")
+        cache.save_stats()
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,60 @@
+import sqlite3
+
+import pandas as pd
+import pytest
+
+# Since we cannot import from the script directory directly, we need to add it to the path
+import sys
+from pathlib import Path
+sys.path.append(str(Path(__file__).resolve().parent.parent.parent / 'script'))
+
+from db_connector import DBConnector, datetime64_to_trade_days
+from analytics import AnalyticsEngine, mirror_status, refresh_mirror
+
+pytest.importorskip('duckdb')
+
+SCHEMA_PATH = Path(__file__).resolve().parent.parent.parent / 'SQL' / 'ensure_schema.sql'
+
+
+@pytest.fixture
+def connector(tmp_path):
+    connector = DBConnector(str(tmp_path / 'test.db'))
+    conn = sqlite3.connect(connector.db_path)
+    conn.executescript(SCHEMA_PATH.read_text(encoding='utf-8'))
+    days = datetime64_to_trade_days(pd.bdate_range('2024-01-01', periods=300)).tolist()
+    conn.executemany(
+        "INSERT INTO daily_stock_prices (ticker_symbol, trade_day, open_price, high_price, low_price, close_price, adj_close_price, volume) "
+        "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+        [(ticker, day, i, i + 1, i - 1, i, i + 0.5, 1000 + i) for ticker in ('AAA.T', 'BBB.T') for i, day in enumerate(days)]
+    )
+    conn.execute("INSERT INTO target_tickers (ticker) VALUES ('AAA.T')")
+    conn.commit()
+    conn.close()
+    return connector
+
+
+def test_duckdb_mirror_matches_sqlite(connector, tmp_path):
+    """Tests that named queries and price panels read from the DuckDB mirror match the SQLite results."""
+    mirror_dir = str(tmp_path / 'analytics')
+    with AnalyticsEngine(connector, 'sqlite', mirror_dir) as sqlite_engine, \
+            AnalyticsEngine(connector, 'duckdb', mirror_dir) as duckdb_engine:
+        pd.testing.assert_frame_equal(duckdb_engine.query('universe_snapshot'), sqlite_engine.query('universe_snapshot'),
+                                      check_dtype=False)
+        duckdb_panel = duckdb_engine.load_price_panel(['AAA.T', 'MISSING.T'])
+        sqlite_panel = sqlite_engine.load_price_panel(['AAA.T', 'MISSING.T'])
+    pd.testing.assert_frame_equal(duckdb_panel['AAA.T'], sqlite_panel['AAA.T'])
+    assert duckdb_panel['MISSING.T'].empty
+
+
+def test_only_changed_tables_are_refreshed(connector, tmp_path):
+    """Tests that the mirror detects updated rows and rewrites only the tables that changed."""
+    mirror_dir = str(tmp_path / 'analytics')
+    assert 'daily_stock_prices' in refresh_mirror(connector, mirror_dir)
+    assert refresh_mirror(connector, mirror_dir) == {}
+
+    with connector.connect() as conn:
+        conn.execute("UPDATE daily_stock_prices SET adj_close_price = 0, updated_at = 32503680000 WHERE ticker_symbol = 'BBB.T'")
+        conn.commit()
+    assert mirror_status(connector, mirror_dir)['daily_stock_prices'] == 'stale'
+    assert mirror_status(connector, mirror_dir)['target_tickers'] == 'fresh'
+    assert refresh_mirror(connector, mirror_dir) == {'daily_stock_prices': 600}
@@ -0,0 +1,126 @@
+import contextlib
+import io
+import sqlite3
+
+import numpy as np
+import pytest
+
+# Since we cannot import from the script directory directly, we need to add it to the path
+import sys
+from pathlib import Path
+sys.path.append(str(Path(__file__).resolve().parent.parent.parent / 'script'))
+
+from apply_db_migration import LEGACY_BACKUP_TABLE, SUMMARY_VIEW_PATH, apply_schema_migrations, check_legacy_price_rows, get_price_table_layout
+from db_connector import trade_days_to_datetime64
+
+SQL_DIR = Path(__file__).resolve().parent.parent.parent / 'SQL'
+
+# daily_stock_prices as created before the compact layout
+LEGACY_PRICE_TABLE = """
+DROP INDEX idx_stock_trade_day;
+DROP TABLE daily_stock_prices;
+CREATE TABLE daily_stock_prices (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    ticker_symbol TEXT NOT NULL,
+    trade_date TEXT NOT NULL,
+    open_price REAL NOT NULL,
+    high_price REAL NOT NULL,
+    low_price REAL NOT NULL,
+    close_price REAL NOT NULL,
+    adj_close_price REAL NOT NULL,
+    volume INTEGER NOT NULL,
+    created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+    updated_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+    UNIQUE(ticker_symbol, trade_date)
+);
+CREATE INDEX idx_stock_ticker_date ON daily_stock_prices (ticker_symbol, trade_date);
+CREATE INDEX idx_stock_trade_date ON daily_stock_prices (trade_date);
+"""
+# (ticker, trade_date, close price); the epoch, the day before it, a leap day and a date past 2038 round-trip exactly.
+# The same day stored with a time part is a duplicate and a date that cannot be parsed is invalid: both stop the migration
+# unless skip_invalid_rows is given, in which case the duplicate row sorting last ('... 00:00:00') is kept.
+LEGACY_ROWS = [
+    ('AAA.T', '1969-12-31', 1.0),
+    ('AAA.T', '1970-01-01', 2.0),
+    ('AAA.T', '2000-02-29', 3.0),
+    ('AAA.T', '2024-01-05', 4.0),
+    ('AAA.T', '2024-01-05 00:00:00', 5.0),
+    ('AAA.T', '2040-12-31', 6.0),
+    ('BBB.T', '2024-01-05', 7.0),
+    ('BBB.T', '2024-13-45', 8.0),
+]
+EXPECTED_PRICES = {
+    ('AAA.T', '1969-12-31'): 1.0, ('AAA.T', '1970-01-01'): 2.0, ('AAA.T', '2000-02-29'): 3.0,
+    ('AAA.T', '2024-01-05'): 5.0, ('AAA.T', '2040-12-31'): 6.0, ('BBB.T', '2024-01-05'): 7.0,
+}
+
+
+@pytest.fixture
+def conn(tmp_path):
+    """Creates a database with the legacy price table and the prediction_summary view that reads it."""
+    conn = sqlite3.connect(str(tmp_path / 'test.db'))
+    conn.executescript((SQL_DIR / 'ensure_schema.sql').read_text(encoding='utf-8'))
+    conn.executescript(LEGACY_PRICE_TABLE)
+    conn.executemany(
+        "INSERT INTO daily_stock_prices (ticker_symbol, trade_date, open_price, high_price, low_price, close_price, adj_close_price, volume) "
+        "VALUES (?, ?, ?, ?, ?, ?, ?, 100)",
+        [(ticker, date, price, price, price, price, price) for ticker, date, price in LEGACY_ROWS]
+    )
+    legacy_view = Path(SUMMARY_VIEW_PATH).read_text(encoding='utf-8').replace(
+        "date(MAX(trade_day) * 86400, 'unixepoch')", "MAX(trade_date)")
+    conn.executescript(legacy_view)
+    conn.execute("INSERT INTO target_tickers (ticker) VALUES ('AAA.T')")
+    conn.commit()
+    yield conn
+    conn.close()
+
+
+def stored_prices(conn):
+    rows = conn.execute(
+        "SELECT ticker_symbol, date(trade_day * 86400, 'unixepoch'), close_price FROM daily_stock_prices ORDER BY ticker_symbol, trade_day"
+    ).fetchall()
+    return {(ticker, date): price for ticker, date, price in rows}
+
+
+def test_legacy_price_table_is_only_migrated_on_request(conn):
+    """Tests that the price table is left untouched unless the migration is requested explicitly."""
+    with pytest.raises(RuntimeError, match='migrate-db'):
+        apply_schema_migrations(conn)
+    assert get_price_table_layout(conn) == 'legacy'
+    assert conn.execute("SELECT COUNT(*) FROM daily_stock_prices").fetchone()[0] == len(LEGACY_ROWS)
+
+
+@pytest.mark.parametrize('backup_table', [None, LEGACY_BACKUP_TABLE])
+def test_migrate_price_table_converts_dates_and_recreates_the_view(conn, backup_table):
+    """Tests that invalid and duplicate dates stop the migration unless skipped, then the trade_date to trade_day round-trip, the recreated view, the optional backup table and that a second run changes nothing."""
+    check = check_legacy_price_rows(conn)
+    assert (check['invalid_dates'], check['duplicate_days'], check['duplicate_rows']) == (1, 1, 1)
+    with pytest.raises(RuntimeError, match='skip-invalid-rows'):
+        apply_schema_migrations(conn, migrate_prices=True, backup_table=backup_table)
+    assert get_price_table_layout(conn) == 'legacy'
+    assert conn.execute("SELECT COUNT(*) FROM sqlite_master WHERE name LIKE 'daily_stock_prices%'").fetchone()[0] == 1
+
+    with contextlib.redirect_stdout(io.StringIO()) as output:
+        applied = apply_schema_migrations(conn, migrate_prices=True, backup_table=backup_table, skip_invalid_rows=True)
+    assert "'2024-13-45'" in output.getvalue()
+
+    assert len(applied) == 1
+    assert get_price_table_layout(conn) == 'compact'
+    # The invalid row is skipped and duplicate days are merged into one row
+    assert stored_prices(conn) == EXPECTED_PRICES
+    days = np.array([row[0] for row in conn.execute("SELECT trade_day FROM daily_stock_prices ORDER BY ticker_symbol, trade_day")])
+    assert list(days[:3]) == [-1, 0, 11016]
+    assert [str(d) for d in trade_days_to_datetime64(days, 'datetime64[D]')] == [date for _, date in EXPECTED_PRICES]
+    assert conn.execute("SELECT sql LIKE '%WITHOUT ROWID%' FROM sqlite_master WHERE name = 'daily_stock_prices'").fetchone()[0] == 1
+
+    # The view is recreated against the new column
+    assert conn.execute("SELECT ticker, stock_data_updated_at FROM prediction_summary").fetchall() == [('AAA.T', '2040-12-31')]
+    if backup_table:
+        assert conn.execute(f"SELECT COUNT(*) FROM {backup_table}").fetchone()[0] == len(LEGACY_ROWS)
+    else:
+        assert conn.execute("SELECT COUNT(*) FROM sqlite_master WHERE type = 'table' AND name LIKE 'daily_stock_prices%'").fetchone()[0] == 1
+
+    # The schema script runs on the migrated table and a second migration has nothing to do
+    conn.executescript((SQL_DIR / 'ensure_schema.sql').read_text(encoding='utf-8'))
+    assert apply_schema_migrations(conn, migrate_prices=True, backup_table=backup_table, skip_invalid_rows=True) == []
+    assert stored_prices(conn) == EXPECTED_PRICES
@@ -0,0 +1,132 @@
+import datetime
+import os
+import sqlite3
+import time
+
+import pandas as pd
+import pytest
+
+# Since we cannot import from the script directory directly, we need to add it to the path
+import sys
+from pathlib import Path
+sys.path.append(str(Path(__file__).resolve().parent.parent.parent / 'script'))
+
+from apply_retention import archive_old_rows, prune_model_versions
+
+SQL_DIR = Path(__file__).resolve().parent.parent.parent / 'SQL'
+OLD = '2020-01-01 00:00:00'
+NEW = datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+
+
+@pytest.fixture
+def conn(tmp_path):
+    """Creates a database with the model, prediction and evaluation tables."""
+    conn = sqlite3.connect(str(tmp_path / 'test.db'))
+    conn.executescript((SQL_DIR / 'ensure_schema.sql').read_text(encoding='utf-8'))
+    conn.executescript((SQL_DIR / 'create_evaluation_tables.sql').read_text(encoding='utf-8'))
+    yield conn
+    conn.close()
+
+
+def insert_models(conn, ticker, versions):
+    conn.executemany(
+        "INSERT INTO trained_models (model_name, model_version, ticker_symbol, feature_list, model_object, scaler_object) "
+        "VALUES ('model_up', ?, ?, '[]', x'00', x'00')",
+        [(version, ticker) for version in versions]
+    )
+
+
+def remaining_versions(conn, ticker):
+    rows = conn.execute("SELECT model_version FROM trained_models WHERE ticker_symbol = ? ORDER BY model_version", (ticker,))
+    return [row[0] for row in rows]
+
+
+def test_prune_model_versions_keeps_latest_active_and_previous(conn):
+    """Tests that only versions beyond keep_versions are deleted, except the active and rollback versions, and that dry-run deletes nothing."""
+    insert_models(conn, 'AAA.T', range(1, 7))
+    insert_models(conn, 'BBB.T', [1, 2])
+    conn.execute("INSERT INTO model_registry (ticker_symbol, model_name, active_version, previous_version) VALUES ('AAA.T', 'model_up', 2, 1)")
+    conn.executemany(
+        "INSERT INTO historical_scores (ticker_symbol, model_name, model_version, trade_date, probability) VALUES (?, 'model_up', ?, '2024-01-05', 0.5)",
+        [('AAA.T', version) for version in range(1, 7)] + [('BBB.T', 1)]
+    )
+    conn.commit()
+
+    def scored_versions(ticker):
+        rows = conn.execute("SELECT model_version FROM historical_scores WHERE ticker_symbol = ? ORDER BY model_version", (ticker,))
+        return [row[0] for row in rows]
+
+    assert prune_model_versions(conn, keep_versions=2, dry_run=True) == 2
+    assert remaining_versions(conn, 'AAA.T') == [1, 2, 3, 4, 5, 6]
+    assert scored_versions('AAA.T') == [1, 2, 3, 4, 5, 6]
+
+    assert prune_model_versions(conn, keep_versions=2) == 2
+    assert remaining_versions(conn, 'AAA.T') == [1, 2, 5, 6]
+    assert remaining_versions(conn, 'BBB.T') == [1, 2]
+    # The scores of the deleted versions are deleted with them
+    assert scored_versions('AAA.T') == [1, 2, 5, 6]
+    assert scored_versions('BBB.T') == [1]
+
+
+def test_archive_old_rows_writes_parquet_and_keeps_latest_rows(conn, tmp_path):
+    """Tests that rows older than the cutoff are archived and deleted, except the latest prediction and latest successful evaluation per ticker and direction."""
+    conn.executemany(
+        "INSERT INTO prediction_results (prediction_timestamp, target_date, ticker, direction, probability, model_name, model_version) "
+        "VALUES (?, '2020-01-02', ?, 'up', 0.5, 'model_up', 1)",
+        [(OLD, 'AAA.T'), (OLD, 'AAA.T'), (OLD, 'BBB.T'), (NEW, 'BBB.T')]
+    )
+    conn.executemany(
+        "INSERT INTO performance_log (ticker, direction, evaluation_datetime, status) VALUES (?, ?, ?, ?)",
+        [('AAA.T', 'up', OLD, 'success'), ('AAA.T', 'up', OLD, 'success'), ('AAA.T', 'down', OLD, 'success'),
+         ('AAA.T', 'down', OLD, 'failed'), ('BBB.T', 'up', NEW, 'success')]
+    )
+    conn.commit()
+    cutoff = datetime.datetime.now() - datetime.timedelta(days=30)
+    archive_dir = str(tmp_path / 'archive')
+
+    # Dry-run only counts the rows
+    assert archive_old_rows(conn, 'prediction_results', cutoff, archive_dir, dry_run=True) == 2
+    assert archive_old_rows(conn, 'performance_log', cutoff, archive_dir, dry_run=True) == 2
+    assert not os.path.exists(archive_dir)
+    assert conn.execute("SELECT COUNT(*) FROM prediction_results").fetchone()[0] == 4
+
+    assert archive_old_rows(conn, 'prediction_results', cutoff, archive_dir) == 2
+    assert archive_old_rows(conn, 'performance_log', cutoff, archive_dir) == 2
+
+    # The latest prediction per ticker/direction stays, even when it is older than the cutoff
+    assert conn.execute("SELECT id FROM prediction_results ORDER BY id").fetchall() == [(2,), (4,)]
+    archived = pd.read_parquet(os.path.join(archive_dir, 'prediction_results'))
+    assert sorted(archived['id']) == [1, 3]
+
+    # The latest successful evaluation per ticker/direction stays, so resuming still sees AAA.T as completed
+    assert conn.execute("SELECT log_id FROM performance_log ORDER BY log_id").fetchall() == [(2,), (3,), (5,)]
+    archived = pd.read_parquet(os.path.join(archive_dir, 'performance_log'))
+    assert sorted(archived['log_id']) == [1, 4]
+
+
+def test_archive_cutoff_matches_the_time_zone_of_each_table(conn, tmp_path, monkeypatch):
+    """Tests that on a host ahead of UTC the cutoff is compared in UTC for prediction_results and in local time for performance_log."""
+    monkeypatch.setenv('TZ', 'Asia/Tokyo')
+    time.tzset()
+    try:
+        cutoff = datetime.datetime(2024, 6, 1, 12, 0, tzinfo=datetime.timezone.utc)
+        hour = datetime.timedelta(hours=1)
+        utc = lambda moment: moment.strftime('%Y-%m-%d %H:%M:%S')
+        local = lambda moment: moment.astimezone().strftime('%Y-%m-%d %H:%M:%S')
+        conn.executemany(
+            "INSERT INTO prediction_results (prediction_timestamp, target_date, ticker, direction, probability, model_name, model_version) "
+            "VALUES (?, '2024-06-02', 'AAA.T', 'up', 0.5, 'model_up', 1)",
+            [(utc(cutoff - hour),), (utc(cutoff + hour),), (utc(cutoff + 2 * hour),)]
+        )
+        conn.executemany(
+            "INSERT INTO performance_log (ticker, direction, evaluation_datetime, status) VALUES ('AAA.T', 'up', ?, 'success')",
+            [(local(cutoff - hour),), (local(cutoff + hour),), (local(cutoff + 2 * hour),)]
+        )
+        conn.commit()
+
+        # Only the row written before the cutoff is archived; a local-time cutoff would also take the row one hour after it
+        assert archive_old_rows(conn, 'prediction_results', cutoff, str(tmp_path), dry_run=True) == 1
+        assert archive_old_rows(conn, 'performance_log', cutoff, str(tmp_path), dry_run=True) == 1
+    finally:
+        monkeypatch.undo()
+        time.tzset()
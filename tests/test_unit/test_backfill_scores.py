@@ -0,0 +1,95 @@
+import contextlib
+import io
+
+import pytest
+
+# Since we cannot import from the script directory directly, we need to add it to the path
+import sys
+from pathlib import Path
+PROJECT_ROOT = Path(__file__).resolve().parent.parent.parent
+sys.path.append(str(PROJECT_ROOT / 'script'))
+sys.path.append(str(PROJECT_ROOT / 'benchmarks'))
+
+from synthetic import SYNTHETIC_INDEX_TICKERS, seed_market_database
+from bench_pipeline import register_quick_models
+from db_connector import DBConnector
+from stock_utils import load_all_data, create_features
+from model_registry import get_model_name
+from predict import load_model_from_db, predict_probabilities
+from batch_predict import DIRECTIONS
+from train_model import PREDICTION_HORIZON
+import analytics
+import backfill_scores as backfill_module
+from backfill_scores import backfill_scores
+from stale_tickers import mark_stale
+
+SCHEMA_PATH = PROJECT_ROOT / 'SQL' / 'ensure_schema.sql'
+# Every n-th feature row is re-scored one row at a time
+SAMPLE_EVERY = 20
+
+
+@pytest.fixture
+def connector(tmp_path):
+    """Creates a small synthetic market database with an active up/down model for one target ticker."""
+    connector = DBConnector(str(tmp_path / 'test.db'))
+    tickers = seed_market_database(connector.db_path, SCHEMA_PATH, n_tickers=1, years=2)
+    with contextlib.redirect_stdout(io.StringIO()):
+        register_quick_models(connector, tickers)
+    return connector
+
+
+def test_backfill_scores_match_per_row_predictions(connector):
+    """Tests that the vectorized backfill stores, for every feature row, the probability predict_probabilities gives for that row alone."""
+    ticker = '1000.T'
+    with contextlib.redirect_stdout(io.StringIO()):
+        backfill_scores(connector, [ticker], engine='sqlite')
+        main_data, external_data, macro_data = load_all_data(connector, ticker, SYNTHETIC_INDEX_TICKERS)
+        features_df = create_features(main_data, external_data, macro_data)
+
+    with connector.connect() as conn:
+        for direction in DIRECTIONS:
+            model_name = get_model_name(direction)
+            with contextlib.redirect_stdout(io.StringIO()):
+                model, scaler, feature_list, _ = load_model_from_db(connector, ticker, model_name)
+            rows = conn.execute(
+                "SELECT trade_date, probability, target_label FROM historical_scores "
+                "WHERE ticker_symbol = ? AND model_name = ? ORDER BY trade_date", (ticker, model_name)
+            ).fetchall()
+
+            assert [date for date, _, _ in rows] == list(features_df.index.strftime('%Y-%m-%d'))
+            for i in list(range(0, len(features_df), SAMPLE_EVERY)) + [len(features_df) - 1]:
+                expected = predict_probabilities(model, scaler, feature_list, features_df.iloc[[i]])[0]
+                assert rows[i][1] == pytest.approx(expected)
+            # The outcome of the last PREDICTION_HORIZON days is not known yet
+            assert all(label is None for _, _, label in rows[-PREDICTION_HORIZON:])
+            assert all(label in (0, 1) for _, _, label in rows[:-PREDICTION_HORIZON])
+
+
+def test_backfill_reads_revised_prices_from_sqlite_when_the_mirror_is_stale(connector, tmp_path, monkeypatch):
+    """Tests that a ticker whose history was revised after the DuckDB mirror was written is scored from SQLite before its stale flag is cleared."""
+    pytest.importorskip('duckdb')
+    ticker = '1000.T'
+    mirror_dir = str(tmp_path / 'analytics')
+    analytics.refresh_mirror(connector, mirror_dir)
+    monkeypatch.setattr(backfill_module, 'get_analytics_engine',
+                        lambda db_connector, engine=None: analytics.AnalyticsEngine(db_connector, engine, mirror_dir, auto_refresh=False))
+
+    # A split revises the whole history in SQLite only; the mirror keeps the old prices
+    with connector.connect() as conn:
+        conn.execute("UPDATE daily_stock_prices SET adj_close_price = adj_close_price / 2, close_price = close_price / 2 WHERE ticker_symbol = ?", (ticker,))
+        mark_stale(conn, ticker, 0.5)
+        conn.commit()
+
+    def stored_scores():
+        with connector.connect() as conn:
+            return conn.execute(
+                "SELECT model_name, trade_date, probability FROM historical_scores WHERE ticker_symbol = ? ORDER BY model_name, trade_date", (ticker,)
+            ).fetchall()
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        backfill_scores(connector, [ticker], engine='duckdb')
+        from_mirror = stored_scores()
+        backfill_scores(connector, [ticker], engine='sqlite')
+    assert from_mirror == stored_scores()
+    with connector.connect() as conn:
+        assert conn.execute("SELECT features_stale FROM stale_tickers WHERE ticker_symbol = ?", (ticker,)).fetchone()[0] == 0
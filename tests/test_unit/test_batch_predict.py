@@ -0,0 +1,78 @@
+import contextlib
+import io
+
+import pytest
+
+# Since we cannot import from the script directory directly, we need to add it to the path
+import sys
+from pathlib import Path
+PROJECT_ROOT = Path(__file__).resolve().parent.parent.parent
+sys.path.append(str(PROJECT_ROOT / 'script'))
+sys.path.append(str(PROJECT_ROOT / 'benchmarks'))
+
+from synthetic import seed_market_database
+from bench_pipeline import register_quick_models
+from db_connector import DBConnector
+import batch_predict
+from batch_predict import DIRECTIONS, load_prediction_targets, predict_targets, predict_targets_parallel, split_into_shards
+from predict import predict_ticker
+
+SCHEMA_PATH = PROJECT_ROOT / 'SQL' / 'ensure_schema.sql'
+
+
+@pytest.fixture(scope='module')
+def connector(tmp_path_factory):
+    """Creates a small synthetic market database with an active up/down model for each target ticker."""
+    connector = DBConnector(str(tmp_path_factory.mktemp('batch_predict') / 'test.db'))
+    tickers = seed_market_database(connector.db_path, SCHEMA_PATH, n_tickers=2, years=3)
+    with contextlib.redirect_stdout(io.StringIO()):
+        register_quick_models(connector, tickers)
+    return connector
+
+
+def test_predict_targets_matches_predict_ticker(connector):
+    """Tests that the batched predictions equal the per-ticker predict_ticker results for every ticker and direction."""
+    targets = load_prediction_targets(connector)
+    with contextlib.redirect_stdout(io.StringIO()):
+        results, errors = predict_targets(connector, targets)
+        expected = [predict_ticker(connector, ticker, direction) for ticker, _ in targets for direction in DIRECTIONS]
+
+    assert errors == []
+    assert len(results) == len(targets) * len(DIRECTIONS)
+    key = lambda result: (result['ticker'], result['direction'])
+    for result, single in zip(sorted(results, key=key), sorted(expected, key=key)):
+        assert result == pytest.approx(single)
+
+
+def fail_shards_with_bad_tickers(db_connector, targets, directions):
+    """Stands in for predict_targets in the worker processes: a shard containing BAD.T raises."""
+    if any(ticker == 'BAD.T' for ticker, _ in targets):
+        raise RuntimeError('worker failed')
+    return [{'ticker': ticker} for ticker, _ in targets], []
+
+
+def test_split_into_shards_covers_all_targets_in_order():
+    """Tests that shards keep every target exactly once, in order, with several shards per worker."""
+    targets = [(f"{1000 + i}.T", []) for i in range(10)]
+
+    shards = split_into_shards(targets, workers=2)
+    assert [target for shard in shards for target in shard] == targets
+    assert [len(shard) for shard in shards] == [2, 2, 2, 2, 2]
+    assert split_into_shards(targets[:3], workers=4) == [[target] for target in targets[:3]]
+    assert split_into_shards([], workers=2) == []
+
+
+def test_predict_targets_parallel_reports_failed_shards_per_ticker(monkeypatch):
+    """Tests that a shard whose worker fails is returned as one error per ticker while the other shards still succeed."""
+    # The pool forks its workers, so they run the patched predict_targets
+    monkeypatch.setattr(batch_predict, 'predict_targets', fail_shards_with_bad_tickers)
+    targets = [('AAA.T', []), ('BAD.T', []), ('CCC.T', []), ('DDD.T', [])]
+
+    results, errors = [], []
+    for shard_results, shard_errors in predict_targets_parallel(targets, workers=2):
+        results.extend(shard_results)
+        errors.extend(shard_errors)
+
+    assert sorted(result['ticker'] for result in results) == ['AAA.T', 'CCC.T', 'DDD.T']
+    assert [ticker for ticker, _ in errors] == ['BAD.T']
+    assert 'worker failed' in errors[0][1]
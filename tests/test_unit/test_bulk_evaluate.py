@@ -0,0 +1,74 @@
+import os
+import sqlite3
+import time
+
+# Since we cannot import from the script directory directly, we need to add it to the path
+import sys
+from pathlib import Path
+PROJECT_ROOT = Path(__file__).resolve().parent.parent.parent
+sys.path.append(str(PROJECT_ROOT))
+sys.path.append(str(PROJECT_ROOT / 'script'))
+
+from script.db_connector import DBConnector
+from script.evaluation_queue import enqueue_tickers
+import script.bulk_evaluate as bulk_evaluate
+from script.bulk_evaluate import make_log_entry, run_parallel_evaluation, run_queue_worker
+
+SCHEMA_PATH = PROJECT_ROOT / 'SQL' / 'create_evaluation_tables.sql'
+
+
+def crash_on_ticker(db_connector, ticker, test_mode, n_jobs, log_dir):
+    """Stands in for _evaluate_in_pool_worker: kills the worker process for CRASH.T and succeeds for every other ticker."""
+    if ticker == 'CRASH.T':
+        os._exit(1)
+    return [make_log_entry(ticker, direction, {'roc_auc': 0.5}, None, None, 'success') for direction in ('up', 'down')], {}
+
+
+def make_connector(tmp_path):
+    connector = DBConnector(str(tmp_path / 'test.db'))
+    conn = sqlite3.connect(connector.db_path)
+    conn.executescript(SCHEMA_PATH.read_text(encoding='utf-8'))
+    conn.close()
+    return connector
+
+
+def test_crashing_worker_fails_only_its_own_ticker(tmp_path):
+    """Tests that when a worker process dies, the other tickers still complete and only the crashing ticker is logged as failed."""
+    connector = make_connector(tmp_path)
+    tickers = ['AAA.T', 'BBB.T', 'CRASH.T', 'DDD.T', 'EEE.T']
+
+    run_parallel_evaluation(connector, tickers, workers=2, threads_per_worker=1, log_dir=str(tmp_path / 'logs'), worker=crash_on_ticker)
+
+    conn = sqlite3.connect(connector.db_path)
+    rows = conn.execute("SELECT ticker, direction, status, error_message FROM performance_log").fetchall()
+    conn.close()
+    expected = [(ticker, direction, 'success', '') for ticker in tickers if ticker != 'CRASH.T' for direction in ('up', 'down')]
+    assert sorted(rows) == sorted(expected + [('CRASH.T', 'N/A', 'failed', 'Worker process crashed')])
+
+
+def test_queue_worker_discards_results_after_losing_the_lease(tmp_path, monkeypatch, capsys):
+    """Tests that a queue worker whose lease is taken over during an evaluation writes no results for that job."""
+    connector = make_connector(tmp_path)
+    with connector.connect() as conn:
+        enqueue_tickers(conn, ['AAA.T', 'BBB.T'])
+
+    def evaluate_ticker(db_connector, ticker, test_mode, n_jobs):
+        if ticker == 'AAA.T':
+            # The lease expires and another host reclaims the job while this worker is still evaluating it
+            with db_connector.connect() as conn:
+                conn.execute("UPDATE evaluation_jobs SET worker_id = 'other-host', attempts = attempts + 1 WHERE ticker = 'AAA.T'")
+                conn.commit()
+            time.sleep(0.1)
+        return [make_log_entry(ticker, 'up', {'roc_auc': 0.5}, None, None, 'success')]
+
+    monkeypatch.setattr(bulk_evaluate, 'evaluate_ticker', evaluate_ticker)
+    # Stop once this worker has no job to claim instead of waiting for the other host
+    monkeypatch.setattr(bulk_evaluate, 'count_open_jobs', lambda conn, shard=None: 0)
+    settings = {'lease_seconds': 60, 'heartbeat_seconds': 0.01, 'max_attempts': 3, 'poll_seconds': 0.01}
+
+    assert run_queue_worker(connector, settings=settings) == 2
+    assert 'AAA.T: lease was lost during the evaluation' in capsys.readouterr().out
+
+    with connector.connect() as conn:
+        assert conn.execute("SELECT ticker FROM performance_log").fetchall() == [('BBB.T',)]
+        assert conn.execute("SELECT status, worker_id FROM evaluation_jobs WHERE ticker = 'AAA.T'").fetchone() == ('running', 'other-host')
@@ -0,0 +1,115 @@
+import sqlite3
+import threading
+
+import numpy as np
+import pandas as pd
+import pytest
+
+# Since we cannot import from the script directory directly, we need to add it to the path
+import sys
+from pathlib import Path
+sys.path.append(str(Path(__file__).resolve().parent.parent.parent / 'script'))
+
+from config_loader import config_loader
+from db_connector import DBConnector, datetime64_to_trade_days, fetch_numeric, trade_days_to_datetime64
+
+
+def make_connector(tmp_path, **kwargs):
+    connector = DBConnector(**kwargs)
+    connector.db_path = str(tmp_path / 'test.db')
+    with connector.connect() as conn:
+        conn.execute("CREATE TABLE items (name TEXT)")
+        conn.commit()
+    return connector
+
+
+def test_connections_are_reused_per_thread_with_pragmas(tmp_path):
+    """Tests that a thread reuses its connection, nested and other-thread calls get their own, and pragmas are applied."""
+    connector = make_connector(tmp_path)
+    with connector.connect() as conn:
+        first = conn
+        assert conn.execute("PRAGMA journal_mode").fetchone()[0] == 'wal'
+        assert conn.execute("PRAGMA synchronous").fetchone()[0] == 1  # NORMAL
+        assert conn.execute("PRAGMA temp_store").fetchone()[0] == 2  # MEMORY
+        with connector.connect() as nested:
+            assert nested is not first
+    with connector.connect() as conn:
+        assert conn is first
+
+    other = []
+    thread = threading.Thread(target=lambda: other.append(connector.connect().__enter__()))
+    thread.start()
+    thread.join()
+    assert other[0] is not first
+
+    stats = connector.stats()
+    assert stats['opened'] == 3
+    assert stats['reused'] == 2
+
+
+def test_uncommitted_changes_are_rolled_back_on_release(tmp_path):
+    """Tests that a reused connection does not carry over an open transaction or a row factory."""
+    connector = make_connector(tmp_path)
+    with connector.connect() as conn:
+        conn.row_factory = sqlite3.Row
+        conn.execute("INSERT INTO items VALUES ('uncommitted')")
+    with connector.connect() as conn:
+        assert conn.row_factory is None
+        assert not conn.in_transaction
+        assert conn.execute("SELECT COUNT(*) FROM items").fetchone()[0] == 0
+
+
+def test_attachments_created_after_the_connection_was_opened(tmp_path):
+    """Tests that a pooled connection attaches a scratch database created later and detaches it once removed."""
+    scratch_path = tmp_path / 'scratch.db'
+    connector = make_connector(tmp_path, attachments={'scratch': str(scratch_path)})
+    scratch = sqlite3.connect(scratch_path)
+    scratch.execute("CREATE TABLE extra (value INTEGER)")
+    scratch.close()
+
+    with connector.connect() as conn:
+        assert conn.execute("SELECT COUNT(*) FROM scratch.extra").fetchone()[0] == 0
+    scratch_path.unlink()
+    with connector.connect() as conn:
+        assert 'scratch' not in [row[1] for row in conn.execute("PRAGMA database_list")]
+
+
+def test_strict_journal_mode_fails_while_another_process_uses_wal(tmp_path):
+    """Tests that a strict connector switches the main and attached databases out of WAL mode, and fails instead of opening them in WAL mode while they are in use."""
+    scratch_path = tmp_path / 'scratch.db'
+    for path in (tmp_path / 'test.db', scratch_path):
+        conn = sqlite3.connect(path)
+        conn.execute("PRAGMA journal_mode = WAL")
+        conn.execute("CREATE TABLE items (name TEXT)")
+        conn.close()
+    settings = dict(config_loader.get_database_settings(), journal_mode='DELETE', strict_journal_mode=True, busy_timeout=0.1)
+    connector = DBConnector(attachments={'scratch': str(scratch_path)}, settings=settings)
+    connector.db_path = str(tmp_path / 'test.db')
+
+    other = sqlite3.connect(scratch_path)
+    other.execute("SELECT COUNT(*) FROM items").fetchone()
+    with pytest.raises(sqlite3.OperationalError):
+        with connector.connect():
+            pass
+    other.close()
+
+    with connector.connect() as conn:
+        assert conn.execute("PRAGMA main.journal_mode").fetchone()[0] == 'delete'
+        assert conn.execute("PRAGMA scratch.journal_mode").fetchone()[0] == 'delete'
+
+
+def test_fetch_numeric_grows_the_buffer_and_converts_trade_days():
+    """Tests that fetch_numeric reads across several fetchmany batches and that trade_day values round-trip to dates."""
+    conn = sqlite3.connect(':memory:')
+    conn.execute("CREATE TABLE prices (trade_day INTEGER, price REAL)")
+    dates = pd.date_range('2023-12-25', periods=10, freq='D')
+    conn.executemany("INSERT INTO prices VALUES (?, ?)",
+                     [(day, None if i == 3 else float(i)) for i, day in enumerate(datetime64_to_trade_days(dates).tolist())])
+
+    values = fetch_numeric(conn, "SELECT trade_day, price FROM prices ORDER BY trade_day", batch_size=3)
+
+    assert values.shape == (10, 2)
+    assert np.isnan(values[3, 1])
+    assert values[9, 1] == 9.0
+    assert conn.execute("SELECT date(MIN(trade_day) * 86400, 'unixepoch') FROM prices").fetchone()[0] == '2023-12-25'
+    assert (trade_days_to_datetime64(values[:, 0]) == dates.values.astype('datetime64[ns]')).all()
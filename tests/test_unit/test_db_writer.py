@@ -0,0 +1,128 @@
+import sqlite3
+import threading
+
+import pytest
+
+# Since we cannot import from the script directory directly, we need to add it to the path
+import sys
+from pathlib import Path
+sys.path.append(str(Path(__file__).resolve().parent.parent.parent / 'script'))
+
+from db_connector import DBConnector
+from db_writer import DBWriter
+from train_model import insert_trained_model, save_model_to_db, update_model_registry
+
+SCHEMA_PATH = Path(__file__).resolve().parent.parent.parent / 'SQL' / 'ensure_schema.sql'
+
+
+@pytest.fixture
+def connector(tmp_path):
+    connector = DBConnector(str(tmp_path / 'test.db'))
+    conn = sqlite3.connect(connector.db_path)
+    conn.executescript(SCHEMA_PATH.read_text(encoding='utf-8'))
+    conn.close()
+    return connector
+
+
+def save_model(conn, ticker):
+    return insert_trained_model(conn, ticker, 'LGBM_test', '[]', b'model', b'scaler', '{}', '{}')
+
+
+def test_concurrent_writes_allocate_contiguous_versions_in_grouped_commits(connector):
+    """Tests that writes from many threads get distinct versions and are committed in fewer transactions."""
+    versions = []
+    lock = threading.Lock()
+
+    with DBWriter(connector, max_delay=0.05) as writer:
+        def work():
+            for _ in range(10):
+                version = writer.call(save_model, 'AAA.T')
+                with lock:
+                    versions.append(version)
+
+        threads = [threading.Thread(target=work) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    assert sorted(versions) == list(range(1, 81))
+    assert writer.stats['requests'] == 80
+    assert writer.stats['commits'] < 80
+
+
+def test_failed_request_does_not_roll_back_the_rest_of_the_group(connector):
+    """Tests that one failing request only rolls back its own changes."""
+    def fail(conn):
+        save_model(conn, 'BBB.T')
+        raise ValueError("bad request")
+
+    with DBWriter(connector, max_delay=0.05) as writer:
+        ok_before = writer.submit(save_model, 'BBB.T')
+        failed = writer.submit(fail)
+        ok_after = writer.submit(save_model, 'BBB.T')
+
+    assert ok_before.result() == 1
+    assert isinstance(failed.exception(), ValueError)
+    assert ok_after.result() == 2
+    with connector.connect() as conn:
+        assert conn.execute("SELECT COUNT(*) FROM trained_models").fetchone()[0] == 2
+
+
+def test_request_ending_the_transaction_fails_its_group_and_keeps_the_writer_running(connector):
+    """Tests that a request which closes the transaction and then raises fails without killing the writer thread."""
+    def rollback_and_fail(conn):
+        save_model(conn, 'DDD.T')
+        conn.rollback()
+        raise ValueError("bad request")
+
+    with DBWriter(connector) as writer:
+        failed = writer.submit(rollback_and_fail)
+        assert isinstance(failed.exception(timeout=10), ValueError)
+        assert writer.thread.is_alive()
+        assert writer.submit(save_model, 'DDD.T').result(timeout=10) == 1
+
+    with connector.connect() as conn:
+        assert conn.execute("SELECT COUNT(*) FROM trained_models").fetchone()[0] == 1
+
+
+def test_submit_fails_once_the_writer_thread_has_stopped(tmp_path):
+    """Tests that requests fail instead of blocking when the writer cannot open its connection."""
+    writer = DBWriter(DBConnector(str(tmp_path / 'missing' / 'test.db')))
+    future = writer.submit(save_model, 'EEE.T')
+
+    with pytest.raises(RuntimeError):
+        future.result(timeout=10)
+    assert isinstance(writer.error, sqlite3.OperationalError)
+    writer.thread.join(timeout=10)
+    assert not writer.thread.is_alive()
+    with pytest.raises(RuntimeError):
+        writer.submit(save_model, 'EEE.T')
+    writer.close()
+
+
+def test_train_model_saves_and_registry_updates_run_on_the_writer(connector):
+    """Tests that save_model_to_db and update_model_registry called from many threads with a writer commit on its thread without version conflicts."""
+    versions = []
+    lock = threading.Lock()
+
+    with DBWriter(connector, max_delay=0.05) as writer:
+        def work():
+            for _ in range(5):
+                version = save_model_to_db(connector, 'CCC.T', 'LGBM_test', {'trees': []}, {'mean': 0.0}, ['close'], {}, {}, writer=writer)
+                update_model_registry(connector, 'CCC.T', 'LGBM_test', version, writer=writer)
+                with lock:
+                    versions.append(version)
+
+        threads = [threading.Thread(target=work) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    assert sorted(versions) == list(range(1, 21))
+    assert writer.stats['requests'] == 40 and writer.stats['failed'] == 0
+    with connector.connect() as conn:
+        # Only the first registration takes effect; the other versions wait for an explicit promotion
+        rows = conn.execute("SELECT active_version, previous_version FROM model_registry WHERE ticker_symbol = 'CCC.T'").fetchall()
+        assert len(rows) == 1 and rows[0][0] in versions and rows[0][1] is None
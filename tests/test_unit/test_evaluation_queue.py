@@ -0,0 +1,87 @@
+import sqlite3
+import time
+
+import pytest
+
+# Since we cannot import from the script directory directly, we need to add it to the path
+import sys
+from pathlib import Path
+sys.path.append(str(Path(__file__).resolve().parent.parent.parent / 'script'))
+
+from evaluation_queue import claim_job, complete_job, enqueue_tickers, filter_shard, renew_lease
+
+SCHEMA_PATH = Path(__file__).resolve().parent.parent.parent / 'SQL' / 'create_evaluation_tables.sql'
+
+
+@pytest.fixture
+def db_path(tmp_path):
+    """Creates a database file with the evaluation tables and three queued tickers."""
+    path = str(tmp_path / 'queue.db')
+    conn = sqlite3.connect(path)
+    conn.executescript(SCHEMA_PATH.read_text(encoding='utf-8'))
+    enqueue_tickers(conn, ['AAA.T', 'BBB.T', 'CCC.T'])
+    conn.close()
+    return path
+
+
+def test_workers_claim_distinct_jobs_and_reclaim_expired_leases(db_path):
+    """Tests that concurrent workers never share a job and that an expired lease is taken over by another worker."""
+    host_a, host_b = sqlite3.connect(db_path), sqlite3.connect(db_path)
+
+    assert claim_job(host_a, 'host-a', lease_seconds=0, max_attempts=3) == 'AAA.T'
+    assert claim_job(host_b, 'host-b', lease_seconds=60, max_attempts=3) == 'BBB.T'
+    time.sleep(0.01)
+    # host-a's lease has expired: the pending job is preferred, then the expired one is reclaimed
+    assert claim_job(host_b, 'host-b', lease_seconds=60, max_attempts=3) == 'CCC.T'
+    assert claim_job(host_b, 'host-b', lease_seconds=60, max_attempts=3) == 'AAA.T'
+    assert claim_job(host_b, 'host-b', lease_seconds=60, max_attempts=3) is None
+
+    # The previous holder can neither renew nor complete the job any more
+    assert not renew_lease(host_a, 'AAA.T', 'host-a', 60)
+    assert not complete_job(host_a, 'AAA.T', 'host-a', 'done')
+    host_a.commit()
+    assert complete_job(host_b, 'AAA.T', 'host-b', 'done')
+    host_b.commit()
+
+    status, attempts = host_a.execute("SELECT status, attempts FROM evaluation_jobs WHERE ticker = 'AAA.T'").fetchone()
+    assert (status, attempts) == ('done', 2)
+
+
+def test_expired_job_fails_after_max_attempts(db_path):
+    """Tests that a job whose lease keeps expiring is marked failed instead of being reclaimed forever."""
+    conn = sqlite3.connect(db_path)
+    conn.execute("DELETE FROM evaluation_jobs WHERE ticker <> 'AAA.T'")
+    conn.commit()
+    assert claim_job(conn, 'w1', lease_seconds=0, max_attempts=1) == 'AAA.T'
+    time.sleep(0.01)
+    assert claim_job(conn, 'w2', lease_seconds=0, max_attempts=1) is None
+    assert conn.execute("SELECT status FROM evaluation_jobs").fetchone()[0] == 'failed'
+
+
+def test_shards_partition_tickers_and_restrict_claims(db_path):
+    """Tests that hash shards cover every ticker exactly once and that claims stay within the shard."""
+    tickers = [f"{code}.T" for code in range(1300, 1400)]
+    shards = [filter_shard(tickers, (i, 3)) for i in range(3)]
+    assert sorted(sum(shards, [])) == tickers
+    assert all(shards)
+
+    conn = sqlite3.connect(db_path)
+    shard = (1, 2)
+    claimed = []
+    while (ticker := claim_job(conn, 'w', lease_seconds=60, max_attempts=3, shard=shard)) is not None:
+        claimed.append(ticker)
+    assert claimed == filter_shard(['AAA.T', 'BBB.T', 'CCC.T'], shard)
+
+
+def test_enqueue_requeues_finished_jobs_but_not_open_ones(db_path):
+    """Tests that enqueueing again resets failed and done jobs to pending, adds new tickers and leaves running jobs alone."""
+    conn = sqlite3.connect(db_path)
+    for ticker, status in (('AAA.T', 'failed'), ('BBB.T', 'done')):
+        assert claim_job(conn, 'w', lease_seconds=60, max_attempts=3) == ticker
+        complete_job(conn, ticker, 'w', status, 'Insufficient data')
+        conn.commit()
+    assert claim_job(conn, 'w', lease_seconds=60, max_attempts=3) == 'CCC.T'
+
+    assert enqueue_tickers(conn, ['AAA.T', 'BBB.T', 'CCC.T', 'DDD.T']) == (1, 2)
+    rows = conn.execute("SELECT ticker, status, attempts, worker_id FROM evaluation_jobs ORDER BY ticker").fetchall()
+    assert rows == [('AAA.T', 'pending', 0, None), ('BBB.T', 'pending', 0, None), ('CCC.T', 'running', 1, 'w'), ('DDD.T', 'pending', 0, None)]
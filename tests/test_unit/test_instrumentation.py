@@ -0,0 +1,79 @@
+import sqlite3
+
+import pytest
+
+# Since we cannot import from the script directory directly, we need to add it to the path
+import sys
+from pathlib import Path
+sys.path.append(str(Path(__file__).resolve().parent.parent.parent / 'script'))
+
+import instrumentation
+from db_connector import DBConnector
+from instrumentation import count, get_active_run, instrument_run, load_run_metrics, stage, start_run, timed
+
+SCHEMA_PATH = Path(__file__).resolve().parent.parent.parent / 'SQL' / 'ensure_schema.sql'
+
+
+@pytest.fixture
+def connector(tmp_path):
+    connector = DBConnector(str(tmp_path / 'test.db'))
+    conn = sqlite3.connect(connector.db_path)
+    conn.executescript(SCHEMA_PATH.read_text(encoding='utf-8'))
+    conn.close()
+    return connector
+
+
+@timed('double', rows=len)
+def double(values):
+    return values * 2
+
+
+def test_stages_are_recorded_only_during_a_run():
+    """Tests that stages, decorated calls (including ones that raise) and counters are aggregated for the active run and ignored without one."""
+    with stage('load'):
+        double([1])
+    assert get_active_run() is None
+
+    run = start_run('test')
+    try:
+        with stage('load', rows=10):
+            pass
+        with stage('load', rows=5):
+            pass
+        assert double([1, 2]) == [1, 2, 1, 2]
+        # A call that raises is still timed, without rows
+        with pytest.raises(TypeError):
+            double(None)
+        count('fits', 3)
+        worker = {'load': {'calls': 2, 'seconds': 1.5, 'max_seconds': 1.0, 'rows': 20}}
+        run.merge(worker)
+    finally:
+        instrumentation._active_run = None
+
+    assert run.stages['load']['calls'] == 4
+    assert run.stages['load']['rows'] == 35
+    assert run.stages['load']['max_seconds'] == 1.0
+    assert run.stages['double']['calls'] == 2
+    assert run.stages['double']['rows'] == 4
+    assert run.stages['fits'] == {'calls': 0, 'seconds': 0.0, 'max_seconds': 0.0, 'rows': 3}
+
+
+def test_runs_are_saved_and_pivoted_per_entry_point(connector):
+    """Tests that finished runs are stored with a total row, failed runs are marked, and only the latest runs are read back."""
+    for _ in range(3):
+        with instrument_run('nightly', connector):
+            with stage('predict', rows=2):
+                pass
+            count('fits', 4)
+    with pytest.raises(SystemExit):
+        with instrument_run('nightly', connector):
+            sys.exit(1)
+
+    with connector.connect() as conn:
+        df = load_run_metrics(conn, 'nightly', runs=2)
+        assert conn.execute("SELECT COUNT(*) FROM run_metrics WHERE stage = 'total'").fetchone()[0] == 4
+    assert get_active_run() is None
+    assert len(df) == 2
+    assert df['status'].tolist() == ['success', 'failed']
+    assert df['fits'].iloc[0] == 4
+    assert (df['peak_rss_mb'] > 0).all()
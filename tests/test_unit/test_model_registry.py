@@ -0,0 +1,56 @@
+import sqlite3
+import pytest
+
+# Since we cannot import from the script directory directly, we need to add it to the path
+import sys
+from pathlib import Path
+sys.path.append(str(Path(__file__).resolve().parent.parent.parent / 'script'))
+
+from model_registry import get_active_version, promote_model, rollback_model, register_if_absent
+
+SCHEMA_PATH = Path(__file__).resolve().parent.parent.parent / 'SQL' / 'ensure_schema.sql'
+MODEL_NAME = "LGBM_10d_up_3pct"
+
+
+@pytest.fixture
+def conn():
+    """Creates an in-memory database with the project schema and three model versions."""
+    connection = sqlite3.connect(":memory:")
+    connection.executescript(SCHEMA_PATH.read_text(encoding='utf-8'))
+    for version in (1, 2, 3):
+        connection.execute(
+            "INSERT INTO trained_models (model_name, model_version, ticker_symbol, feature_list, model_object, scaler_object) VALUES (?, ?, ?, ?, ?, ?)",
+            (MODEL_NAME, version, "TEST.T", "[]", b"", b"")
+        )
+    connection.commit()
+    yield connection
+    connection.close()
+
+
+def test_register_if_absent_does_not_replace_champion(conn):
+    """Tests that only the first registration becomes the champion."""
+    assert register_if_absent(conn, "TEST.T", MODEL_NAME, 1)
+    assert not register_if_absent(conn, "TEST.T", MODEL_NAME, 3)
+    assert get_active_version(conn, "TEST.T", MODEL_NAME) == 1
+
+
+def test_promote_and_rollback(conn):
+    """Tests that promotion keeps the previous version and rollback restores it."""
+    promote_model(conn, "TEST.T", MODEL_NAME, 2)
+    promote_model(conn, "TEST.T", MODEL_NAME, 3)
+    assert get_active_version(conn, "TEST.T", MODEL_NAME) == 3
+
+    assert rollback_model(conn, "TEST.T", MODEL_NAME) == 2
+    assert get_active_version(conn, "TEST.T", MODEL_NAME) == 2
+
+    # A second rollback has no target
+    with pytest.raises(ValueError):
+        rollback_model(conn, "TEST.T", MODEL_NAME)
+
+
+def test_promote_unknown_version_is_rejected(conn):
+    """Tests that a version missing from trained_models cannot be promoted."""
+    promote_model(conn, "TEST.T", MODEL_NAME, 1)
+    with pytest.raises(ValueError):
+        promote_model(conn, "TEST.T", MODEL_NAME, 99)
+    assert get_active_version(conn, "TEST.T", MODEL_NAME) == 1
@@ -0,0 +1,194 @@
+import contextlib
+import io
+import json
+import sqlite3
+import threading
+import urllib.error
+import urllib.request
+from http.server import ThreadingHTTPServer
+
+import pytest
+
+# Since we cannot import from the script directory directly, we need to add it to the path
+import sys
+from pathlib import Path
+PROJECT_ROOT = Path(__file__).resolve().parent.parent.parent
+sys.path.append(str(PROJECT_ROOT / 'script'))
+sys.path.append(str(PROJECT_ROOT / 'benchmarks'))
+
+from synthetic import SYNTHETIC_INDEX_TICKERS, seed_market_database
+from bench_pipeline import register_quick_models
+from db_connector import DBConnector
+from model_registry import get_model_name, promote_model
+from batch_predict import DIRECTIONS
+from update_stock_data import UPSERT_QUERY
+from prediction_server import MAX_REQUEST_BYTES, MAX_TICKERS_PER_REQUEST, LatencyStats, PredictionCache, PredictionRequestHandler
+
+SCHEMA_PATH = PROJECT_ROOT / 'SQL' / 'ensure_schema.sql'
+
+
+@pytest.fixture(scope='module')
+def seeded_db(tmp_path_factory):
+    """Creates a small synthetic market database with an active up/down model for each target ticker."""
+    connector = DBConnector(str(tmp_path_factory.mktemp('prediction_server') / 'test.db'))
+    tickers = seed_market_database(connector.db_path, SCHEMA_PATH, n_tickers=2, years=3)
+    with contextlib.redirect_stdout(io.StringIO()):
+        register_quick_models(connector, tickers)
+    return connector, tickers
+
+
+@pytest.fixture
+def server(seeded_db):
+    """Serves predictions from the seeded database on a free local port."""
+    cache = PredictionCache(seeded_db[0])
+    handler = type('Handler', (PredictionRequestHandler,), {'cache': cache, 'latency_stats': LatencyStats()})
+    httpd = ThreadingHTTPServer(('127.0.0.1', 0), handler)
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{httpd.server_address[1]}"
+    httpd.shutdown()
+    httpd.server_close()
+    cache.conn.close()
+
+
+def request(url, body=None, data=None):
+    """Sends a GET (or a POST with a JSON body) and returns the status and the decoded JSON response."""
+    if body is not None:
+        data = json.dumps(body).encode('utf-8')
+    try:
+        with urllib.request.urlopen(urllib.request.Request(url, data=data)) as response:
+            return response.status, json.loads(response.read())
+    except urllib.error.HTTPError as e:
+        return e.code, json.loads(e.read())
+
+
+def test_handlers_return_predictions_and_reject_invalid_requests(server, seeded_db):
+    """Tests the GET/POST prediction, stats and health endpoints, including per-ticker errors and request validation."""
+    ticker, other = seeded_db[1]
+    assert request(f"{server}/health") == (200, {'status': 'ok'})
+
+    status, payload = request(f"{server}/predict?ticker={ticker}&direction=up")
+    assert status == 200 and payload['errors'] == []
+    assert [(r['ticker'], r['direction']) for r in payload['results']] == [(ticker, 'up')]
+    assert 0.0 <= payload['results'][0]['probability'] <= 1.0
+
+    status, payload = request(f"{server}/predict", {'tickers': [ticker, other, ticker, 'UNKNOWN.T']})
+    assert status == 200
+    assert sorted((r['ticker'], r['direction']) for r in payload['results']) == sorted((t, d) for t in (ticker, other) for d in DIRECTIONS)
+    assert [e['ticker'] for e in payload['errors']] == ['UNKNOWN.T']
+
+    # Omitting tickers predicts every target ticker
+    status, payload = request(f"{server}/predict", {'directions': ['down']})
+    assert status == 200 and sorted(r['ticker'] for r in payload['results']) == [ticker, other]
+
+    for body in ({'tickers': ticker}, {'tickers': [ticker, 7203]}, {'tickers': [ticker], 'directions': ['sideways']},
+                 {'tickers': [ticker], 'directions': 'up'}, [ticker],
+                 {'tickers': [f"{i}.T" for i in range(MAX_TICKERS_PER_REQUEST + 1)]}):
+        status, payload = request(f"{server}/predict", body)
+        assert status == 400, body
+    assert request(f"{server}/predict", data=b'{not json')[0] == 400
+    assert request(f"{server}/predict", data=b' ' * (MAX_REQUEST_BYTES + 1))[0] == 413
+    assert request(f"{server}/predict?direction=up")[0] == 400
+    assert request(f"{server}/missing")[0] == 404
+
+    status, payload = request(f"{server}/stats")
+    assert status == 200
+    assert payload['latency']['predict']['requests'] == 1
+    assert payload['latency']['predict_batch']['requests'] == 2
+    assert payload['cache']['cached_models'] == 4
+
+
+def test_cache_reloads_only_changed_models_and_features(seeded_db):
+    """Tests that the cache reuses models and features until another connection promotes a model or adds prices for a ticker or its index."""
+    connector, (ticker, other) = seeded_db
+    cache = PredictionCache(connector)
+    writer = sqlite3.connect(connector.db_path)
+
+    def add_next_price(symbol):
+        last_day = writer.execute("SELECT MAX(trade_day) FROM daily_stock_prices WHERE ticker_symbol = ?", (symbol,)).fetchone()[0]
+        writer.execute(
+            "INSERT INTO daily_stock_prices (ticker_symbol, trade_day, open_price, high_price, low_price, close_price, adj_close_price, volume) "
+            "SELECT ticker_symbol, trade_day + 1, open_price, high_price, low_price, close_price, adj_close_price, volume "
+            "FROM daily_stock_prices WHERE ticker_symbol = ? AND trade_day = ?", (symbol, last_day))
+        writer.commit()
+
+    try:
+        results, errors = cache.predict([ticker, other], DIRECTIONS)
+        assert errors == [] and len(results) == 4
+        assert cache.reload_counts == {'models': 4, 'features': 2, 'checks': 1}
+
+        cache.predict([ticker, other], DIRECTIONS)
+        assert cache.reload_counts == {'models': 4, 'features': 2, 'checks': 1}
+
+        # New prices for one ticker rebuild only that ticker's features
+        add_next_price(ticker)
+        cache.predict([ticker, other], DIRECTIONS)
+        assert cache.reload_counts == {'models': 4, 'features': 3, 'checks': 2}
+
+        # New prices for the shared index rebuild the features of every ticker that uses it
+        add_next_price(SYNTHETIC_INDEX_TICKERS[0])
+        cache.predict([ticker, other], DIRECTIONS)
+        assert cache.reload_counts == {'models': 4, 'features': 5, 'checks': 3}
+
+        # Promoting a new version reloads the models of that ticker only
+        model_name = get_model_name('up')
+        writer.execute(
+            "INSERT INTO trained_models (model_name, model_version, ticker_symbol, feature_list, model_object, scaler_object) "
+            "SELECT model_name, model_version + 1, ticker_symbol, feature_list, model_object, scaler_object "
+            "FROM trained_models WHERE ticker_symbol = ? AND model_name = ?", (other, model_name))
+        writer.commit()
+        promote_model(writer, other, model_name, 2)
+        results, _ = cache.predict([ticker, other], DIRECTIONS)
+        assert cache.reload_counts == {'models': 6, 'features': 5, 'checks': 4}
+        assert {(r['ticker'], r['direction']): r['model_version'] for r in results}[(other, 'up')] == 2
+    finally:
+        writer.close()
+        cache.conn.close()
+
+
+def test_cache_reloads_features_after_a_restated_bar_or_macro_value(seeded_db):
+    """Tests that rewriting the last bar or a macro value without a new date rebuilds the features, and untracked tickers are evicted."""
+    connector, (ticker, other) = seeded_db
+    cache = PredictionCache(connector)
+    writer = sqlite3.connect(connector.db_path)
+    # The stored rows were written earlier than the restatements below (updated_at has a resolution of one second)
+    writer.execute("UPDATE daily_stock_prices SET updated_at = updated_at - 3600")
+    writer.execute("UPDATE macro_economic_indicators SET updated_at = datetime(updated_at, '-1 hour')")
+    writer.commit()
+
+    try:
+        cache.predict([ticker, other], DIRECTIONS)
+        assert cache.reload_counts['features'] == 2
+        last_adj_close = cache.features[ticker][1]['adj_close_price'].iloc[0]
+
+        # The last bar is restated through the change-only UPSERT of update_stock_data
+        row = writer.execute(
+            "SELECT ticker_symbol, trade_day, open_price, high_price, low_price, close_price, adj_close_price, volume "
+            "FROM daily_stock_prices WHERE ticker_symbol = ? ORDER BY trade_day DESC LIMIT 1", (ticker,)).fetchone()
+        writer.execute(UPSERT_QUERY, row[:5] + (row[5] * 1.1, row[6] * 1.1, row[7]))
+        writer.commit()
+        cache.predict([ticker, other], DIRECTIONS)
+        assert cache.reload_counts['features'] == 3
+        assert cache.features[ticker][1]['adj_close_price'].iloc[0] == pytest.approx(last_adj_close * 1.1)
+
+        # A revised macro value rebuilds the features of every ticker
+        writer.execute(
+            "UPDATE macro_economic_indicators SET value = value + 1, updated_at = CURRENT_TIMESTAMP "
+            "WHERE id = (SELECT MAX(id) FROM macro_economic_indicators)")
+        writer.commit()
+        cache.predict([ticker, other], DIRECTIONS)
+        assert cache.reload_counts['features'] == 5
+
+        # A ticker removed from the targets is evicted on the next refresh
+        target_row = writer.execute("SELECT * FROM target_tickers WHERE ticker = ?", (other,)).fetchone()
+        writer.execute("DELETE FROM target_tickers WHERE ticker = ?", (other,))
+        writer.commit()
+        cache.refresh()
+        assert set(cache.features) == {ticker}
+        assert {key[0] for key in cache.models} == {ticker}
+
+        writer.execute(f"INSERT INTO target_tickers VALUES ({', '.join('?' * len(target_row))})", target_row)
+        writer.commit()
+    finally:
+        writer.close()
+        cache.conn.close()
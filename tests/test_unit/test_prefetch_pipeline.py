@@ -0,0 +1,61 @@
+import threading
+
+# Since we cannot import from the script directory directly, we need to add it to the path
+import sys
+from pathlib import Path
+sys.path.append(str(Path(__file__).resolve().parent.parent.parent / 'script'))
+
+from db_connector import DBConnector
+from db_writer import DBWriter
+from prefetch_pipeline import run_prefetch_pipeline
+
+# Upper bound for waiting on another stage; the events are normally set within milliseconds
+TIMEOUT = 10
+
+
+def test_prefetch_pipeline_overlaps_loading_with_processing(tmp_path):
+    """Tests that loads run ahead of processing, results are written on the DBWriter thread and load and write errors are reported."""
+    connector = DBConnector(str(tmp_path / 'test.db'))
+    with connector.connect() as conn:
+        conn.execute("CREATE TABLE results (item TEXT PRIMARY KEY, result TEXT NOT NULL)")
+        conn.commit()
+    caller = threading.get_ident()
+    loaded_events = {item: threading.Event() for item in ['A', 'B', 'BAD', 'C', 'D', 'E']}
+    prefetched_while_processing = {}
+    process_threads = set()
+    writer_threads = set()
+
+    def load(item):
+        loaded_events[item].set()
+        if item == 'BAD':
+            raise ValueError("no data")
+        return item.lower()
+
+    def process(item, loaded):
+        process_threads.add(threading.get_ident())
+        # The loader must fetch the next item while this one is still being processed
+        following = {'A': 'B', 'B': 'BAD', 'C': 'D'}.get(item)
+        if following:
+            prefetched_while_processing[item] = loaded_events[following].wait(TIMEOUT)
+        return loaded + '!'
+
+    def write(conn, item, result):
+        writer_threads.add(threading.get_ident())
+        if item == 'E':
+            raise ValueError("disk full")
+        conn.execute("INSERT INTO results (item, result) VALUES (?, ?)", (item, result))
+
+    with DBWriter(connector) as writer:
+        stats = run_prefetch_pipeline(['A', 'B', 'BAD', 'C', 'D', 'E'], load, process, write, writer, depth=2,
+                                      on_load_error=lambda item, error: f"failed: {error}")
+
+    with connector.connect() as conn:
+        written = dict(conn.execute("SELECT item, result FROM results").fetchall())
+    assert written == {'A': 'a!', 'B': 'b!', 'BAD': 'failed: no data', 'C': 'c!', 'D': 'd!'}
+    assert prefetched_while_processing == {'A': True, 'B': True, 'C': True}
+    assert process_threads == {caller}
+    assert writer_threads == {writer.thread.ident}
+    assert stats['stages']['load']['items'] == 6
+    assert stats['stages']['process']['items'] == 6
+    assert stats['stages']['write']['items'] == 6
+    assert stats['write_errors'] == ['E']
@@ -0,0 +1,180 @@
+import datetime
+import threading
+import time
+
+import pandas as pd
+import pytest
+
+# Since we cannot import from the script directory directly, we need to add it to the path
+import sys
+from pathlib import Path
+sys.path.append(str(Path(__file__).resolve().parent.parent.parent / 'script'))
+
+from price_ingestion import PriceSource, CachedPriceSource, TokenBucket, ingest_prices, split_multi_ticker_frame, PRICE_COLUMNS
+from fetch_cache import FetchCache
+
+
+def make_prices(days=3):
+    index = pd.date_range('2024-01-01', periods=days, freq='D')
+    return pd.DataFrame({column: range(1, days + 1) for column in PRICE_COLUMNS}, index=index, dtype=float)
+
+
+class FlakySource(PriceSource):
+    """A source that fails the first request for each batch, then returns data for every ticker except 'EMPTY'."""
+    batch_size = 2
+
+    def __init__(self):
+        self.calls = {}
+        self.lock = threading.Lock()
+
+    def fetch(self, tickers, start, end):
+        key = tuple(tickers)
+        with self.lock:
+            self.calls[key] = self.calls.get(key, 0) + 1
+            if self.calls[key] == 1:
+                raise ConnectionError("temporary failure")
+        return {ticker: make_prices() for ticker in tickers if ticker != 'EMPTY'}
+
+
+def test_token_bucket_limits_request_rate():
+    """Tests that requests beyond the burst capacity wait for new tokens."""
+    bucket = TokenBucket(rate=20, capacity=2)
+    start = time.monotonic()
+    for _ in range(6):
+        bucket.acquire()
+    # 2 tokens are available immediately, the remaining 4 need at least 4 / 20 seconds
+    assert time.monotonic() - start >= 0.18
+
+
+def test_ingest_prices_retries_and_writes_from_a_single_thread():
+    """Tests that failed batches are retried and that every write happens on the calling thread."""
+    start = datetime.date(2024, 1, 1)
+    requests = [('AAA.T', start), ('BBB.T', start), ('EMPTY', start)]
+    writer_threads = set()
+    written = {}
+
+    def writer(ticker, df):
+        writer_threads.add(threading.get_ident())
+        written[ticker] = len(df)
+        return len(df)
+
+    stats = ingest_prices(requests, FlakySource(), writer, datetime.date(2024, 2, 1),
+                          max_workers=2, max_retries=2, backoff_seconds=0.001)
+
+    assert written == {'AAA.T': 3, 'BBB.T': 3}
+    assert writer_threads == {threading.get_ident()}
+    assert stats['batches'] == 2
+    # One retry per batch after the failure, plus one more for the ticker that never returns data
+    assert stats['retries'] == 3
+    assert stats['empty'] == 1
+    assert stats['rows'] == 6
+
+
+class PartialSource(PriceSource):
+    """A source that, like yf.download, silently leaves out a ticker on the first request instead of raising."""
+    batch_size = 3
+
+    def __init__(self):
+        self.requested = []
+
+    def fetch(self, tickers, start, end):
+        self.requested.append(list(tickers))
+        frames = {ticker: make_prices() for ticker in tickers}
+        if len(self.requested) == 1:
+            frames['BBB.T'] = make_prices().iloc[0:0]
+            del frames['CCC.T']
+        return frames
+
+
+def test_ingest_prices_retries_only_missing_tickers():
+    """Tests that tickers missing or empty in a batch result are requested again on their own."""
+    start = datetime.date(2024, 1, 1)
+    source = PartialSource()
+    written = {}
+
+    stats = ingest_prices([('AAA.T', start), ('BBB.T', start), ('CCC.T', start)], source,
+                          lambda ticker, df: written.setdefault(ticker, len(df)), datetime.date(2024, 2, 1),
+                          max_retries=2, backoff_seconds=0.001)
+
+    assert source.requested == [['AAA.T', 'BBB.T', 'CCC.T'], ['BBB.T', 'CCC.T']]
+    assert written == {'AAA.T': 3, 'BBB.T': 3, 'CCC.T': 3}
+    assert (stats['fetched'], stats['empty'], stats['retries']) == (3, 0, 1)
+
+
+def test_price_source_requires_fetch():
+    """Tests that a price source without fetch() cannot be instantiated."""
+    class NoFetchSource(PriceSource):
+        pass
+
+    with pytest.raises(TypeError):
+        NoFetchSource()
+
+
+def test_split_multi_ticker_frame():
+    """Tests splitting a yfinance multi-ticker download into per-ticker frames."""
+    frames = {'AAA.T': make_prices(), 'BBB.T': make_prices()}
+    combined = pd.concat(frames, axis=1)
+    combined.loc[:, ('BBB.T', slice(None))] = float('nan')
+
+    result = split_multi_ticker_frame(combined, ['AAA.T', 'BBB.T', 'CCC.T'])
+
+    assert list(result) == ['AAA.T']
+    pd.testing.assert_frame_equal(result['AAA.T'], frames['AAA.T'], check_names=False)
+
+
+class CountingSource(PriceSource):
+    """A source that records which tickers were requested."""
+    batch_size = 10
+
+    def __init__(self):
+        self.requested = []
+
+    def fetch(self, tickers, start, end):
+        self.requested.extend(tickers)
+        return {ticker: make_prices(days=10) for ticker in tickers}
+
+
+def test_cached_price_source_skips_fresh_entries_covering_the_request(tmp_path):
+    """Tests that cached prices are reused only while fresh and when they cover the requested period."""
+    inner = CountingSource()
+    cache = FetchCache(str(tmp_path), {'prices': 3600})
+    source = CachedPriceSource(inner, cache)
+
+    source.fetch(['AAA.T', 'BBB.T'], '2024-01-01', '2024-02-01')
+    # A later start date is covered by the cached frame and is served from disk, trimmed to the request
+    frames = source.fetch(['AAA.T', 'BBB.T'], '2024-01-05', '2024-02-01')
+    assert inner.requested == ['AAA.T', 'BBB.T']
+    assert frames['AAA.T'].index.min() == pd.Timestamp('2024-01-05')
+
+    # An earlier start date than the cached one is fetched again
+    source.fetch(['AAA.T'], '2023-12-01', '2024-02-01')
+    assert inner.requested == ['AAA.T', 'BBB.T', 'AAA.T']
+    # A later end date than the cached one is fetched again
+    source.fetch(['BBB.T'], '2024-01-05', '2024-03-01')
+    assert inner.requested == ['AAA.T', 'BBB.T', 'AAA.T', 'BBB.T']
+    assert cache.stats['prices']['hits'] == 2
+
+    # Expired entries are fetched again
+    expired_source = CachedPriceSource(inner, FetchCache(str(tmp_path), {'prices': 0}))
+    expired_source.fetch(['BBB.T'], '2024-01-05', '2024-02-01')
+    assert inner.requested[-1] == 'BBB.T'
+
+
+class MalformedSource(CountingSource):
+    """A source that returns a frame whose adjusted close is missing for every row."""
+
+    def fetch(self, tickers, start, end):
+        frames = super().fetch(tickers, start, end)
+        for df in frames.values():
+            df['Adj Close'] = float('nan')
+        return frames
+
+
+def test_cached_price_source_does_not_store_malformed_frames(tmp_path):
+    """Tests that a frame failing validation is returned but not cached."""
+    inner = MalformedSource()
+    source = CachedPriceSource(inner, FetchCache(str(tmp_path), {'prices': 3600}))
+
+    assert 'AAA.T' in source.fetch(['AAA.T'], '2024-01-01', '2024-02-01')
+    source.fetch(['AAA.T'], '2024-01-01', '2024-02-01')
+    assert inner.requested == ['AAA.T', 'AAA.T']
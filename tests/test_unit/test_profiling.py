@@ -0,0 +1,75 @@
+import cProfile
+import os
+import pstats
+import threading
+import time
+
+# Since we cannot import from the script directory directly, we need to add it to the path
+import sys
+from pathlib import Path
+sys.path.append(str(Path(__file__).resolve().parent.parent.parent / 'script'))
+
+import profiling
+from profiling import profile_run
+
+
+def busy_worker():
+    deadline = time.perf_counter() + 0.05
+    while time.perf_counter() < deadline:
+        sum(range(1000))
+
+
+def test_profile_run_is_a_no_op_without_the_flag():
+    """Tests that profile_run does nothing unless --profile is given."""
+    with profile_run('test', argv=['--ticker', '7203.T']) as profiler:
+        pass
+    assert profiler is None
+
+
+def test_profile_run_writes_stats_for_all_threads(tmp_path):
+    """Tests that a profiled run writes pstats, memory and sampled stacks, including functions run in other threads."""
+    argv = ['--profile', '--profile-dir', str(tmp_path), '--profile-sample-interval', '0.005']
+    with profile_run('test', argv=argv) as profiler:
+        thread = threading.Thread(target=busy_worker)
+        thread.start()
+        thread.join()
+        buffer = [bytearray(1024) for _ in range(100)]
+
+    files = set(os.listdir(profiler.run_dir))
+    assert {'profile.pstats', 'summary.txt', 'memory_top.txt', 'stacks.folded'} <= files
+    functions = {name for _, _, name in pstats.Stats(os.path.join(profiler.run_dir, 'profile.pstats')).stats}
+    assert 'busy_worker' in functions
+    assert 'tracemalloc:' in (Path(profiler.run_dir) / 'memory_top.txt').read_text(encoding='utf-8')
+    assert 'busy_worker' in (Path(profiler.run_dir) / 'stacks.folded').read_text(encoding='utf-8')
+    assert len(buffer) == 100
+
+
+class MainThreadOnlyProfile(cProfile.Profile):
+    """Stands in for cProfile.Profile on Python 3.12+, where a second profiler cannot be enabled while another is active."""
+
+    def enable(self, *args, **kwargs):
+        if threading.current_thread() is not threading.main_thread():
+            raise ValueError("Another profiling tool is already active")
+        return super().enable(*args, **kwargs)
+
+
+def test_profile_run_skips_thread_profilers_that_cannot_be_enabled(tmp_path, monkeypatch):
+    """Tests that a thread whose profiler cannot be enabled still runs, is left out of the merged stats and is still sampled."""
+    monkeypatch.setattr(profiling, 'PER_THREAD_PROFILERS', True)
+    monkeypatch.setattr(profiling.cProfile, 'Profile', MainThreadOnlyProfile)
+    argv = ['--profile', '--profile-dir', str(tmp_path), '--profile-sample-interval', '0.005']
+    calls = []
+    with profile_run('test', argv=argv) as profiler:
+        thread = threading.Thread(target=lambda: calls.append(busy_worker()))
+        thread.start()
+        thread.join()
+
+    assert calls == [None]
+    assert profiler.profilers == []
+    assert 'profile.pstats' in os.listdir(profiler.run_dir)
+    assert 'busy_worker' in (Path(profiler.run_dir) / 'stacks.folded').read_text(encoding='utf-8')
+
+
+def test_per_thread_profilers_are_only_used_before_python_3_12():
+    """Tests that per-thread profilers are only started where cProfile does not already cover every thread."""
+    assert profiling.PER_THREAD_PROFILERS == (sys.version_info < (3, 12))
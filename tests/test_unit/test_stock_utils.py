@@ -1,6 +1,10 @@
 # This file will contain unit tests for stock_utils.py
 # We will start by testing the create_features function.
 
+import datetime
+import sqlite3
+
+import numpy as np
 import pandas as pd
 import pytest
 
@@ -9,7 +13,10 @@ import sys
 from pathlib import Path
 sys.path.append(str(Path(__file__).resolve().parent.parent.parent / 'script'))
 
-from stock_utils import create_features
+from stock_utils import create_features, align_macro_to_dates, load_price_panel
+from db_connector import date_to_trade_day
+
+SCHEMA_PATH = Path(__file__).resolve().parent.parent.parent / 'SQL' / 'ensure_schema.sql'
 
 
 @pytest.fixture
@@ -59,3 +66,45 @@ def test_create_features_calculates_rsi(sample_stock_data):
     
     # For a constantly increasing price, RSI should be 100.
     assert features_df['RSI_14'].iloc[-1] == 100.0
+
+
+def test_align_macro_to_dates_uses_latest_observation_as_of_each_trading_day():
+    """Tests that native-frequency macro observations are carried forward onto trading dates."""
+    # Monthly observations dated on the 1st, which may fall on a non-trading day
+    macro_df = pd.DataFrame(
+        {'cpi': [100.0, 101.0, 102.0]},
+        index=pd.to_datetime(['2024-05-01', '2024-06-01', '2024-07-01'])
+    )
+    trade_dates = pd.to_datetime(['2024-04-30', '2024-05-31', '2024-06-03', '2024-07-01', '2024-07-02'])
+
+    aligned = align_macro_to_dates(macro_df, trade_dates)
+
+    assert aligned.index.equals(trade_dates)
+    assert np.isnan(aligned.loc['2024-04-30', 'cpi'])
+    # 2024-06-01 is a Saturday: its value is used from the next trading day
+    assert aligned['cpi'].tolist()[1:] == [100.0, 101.0, 102.0, 102.0]
+
+
+def test_load_price_panel_falls_back_to_attached_scratch_database(tmp_path):
+    """Tests that tickers missing from the main database are read from an attached database, and that the main database wins."""
+    paths = {name: str(tmp_path / f"{name}.db") for name in ('main', 'scratch')}
+    for name, rows in (('main', [('AAA.T', '2024-01-04', 10.0)]),
+                       ('scratch', [('AAA.T', '2024-01-04', 99.0), ('NEW.T', '2024-01-04', 20.0), ('NEW.T', '2024-01-05', 21.0)])):
+        conn = sqlite3.connect(paths[name])
+        conn.executescript(SCHEMA_PATH.read_text(encoding='utf-8'))
+        conn.executemany(
+            "INSERT INTO daily_stock_prices (ticker_symbol, trade_day, open_price, high_price, low_price, close_price, adj_close_price, volume) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, 100)",
+            [(ticker, date_to_trade_day(datetime.date.fromisoformat(date)), price, price, price, price, price) for ticker, date, price in rows]
+        )
+        conn.commit()
+        conn.close()
+
+    conn = sqlite3.connect(paths['main'])
+    conn.execute("ATTACH DATABASE ? AS scratch", (paths['scratch'],))
+    panel = load_price_panel(conn, ['AAA.T', 'NEW.T', 'NONE.T'])
+
+    assert panel['AAA.T']['adj_close_price'].tolist() == [10.0]
+    assert panel['NEW.T']['adj_close_price'].tolist() == [20.0, 21.0]
+    assert panel['NEW.T'].index.strftime('%Y-%m-%d').tolist() == ['2024-01-04', '2024-01-05']
+    assert panel['NONE.T'].empty
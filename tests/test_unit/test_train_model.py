@@ -1,3 +1,6 @@
+import json
+import sqlite3
+
 import pandas as pd
 import pytest
 
@@ -6,7 +9,11 @@ import sys
 from pathlib import Path
 sys.path.append(str(Path(__file__).resolve().parent.parent.parent / 'script'))
 
-from train_model import create_classification_target
+from db_connector import DBConnector
+from train_model import create_classification_target, load_previous_hyperparameters, update_model_registry
+from stale_tickers import mark_stale
+
+SCHEMA_PATH = Path(__file__).resolve().parent.parent.parent / 'SQL' / 'ensure_schema.sql'
 
 @pytest.fixture
 def price_data_for_targeting():
@@ -65,3 +72,51 @@ def test_create_classification_target_down(price_data_for_targeting):
     # The price at day 10 is 110. 10 days later (day 20) it's 95. Return is (95-110)/110 = -0.136 (-13.6%)
     # This is <= -5% threshold, so target should be 1.
     assert result_df[target_col_name].iloc[10] == 1
+
+
+def test_load_previous_hyperparameters_prefers_the_active_model(tmp_path):
+    """Tests that warm-start parameters come from the active version and are clipped to the Optuna search space."""
+    connector = DBConnector(str(tmp_path / 'test.db'))
+    conn = sqlite3.connect(connector.db_path)
+    conn.executescript(SCHEMA_PATH.read_text(encoding='utf-8'))
+    insert = ("INSERT INTO trained_models (model_name, model_version, ticker_symbol, feature_list, model_object, scaler_object, hyperparameters) "
+              "VALUES ('LGBM', ?, '7203.T', '[]', x'', x'', ?)")
+    conn.execute(insert, (1, json.dumps({'n_estimators': 150, 'reg_alpha': 0.0, 'subsample': 0.8})))
+    conn.execute(insert, (2, json.dumps({'n_estimators': 5000, 'learning_rate': 0.05})))
+    conn.execute("INSERT INTO model_registry (ticker_symbol, model_name, active_version) VALUES ('7203.T', 'LGBM', 1)")
+    conn.commit()
+    conn.close()
+
+    assert load_previous_hyperparameters(connector, '7203.T', 'LGBM') == {'n_estimators': 150, 'reg_alpha': 1e-8}
+    assert load_previous_hyperparameters(connector, '6758.T', 'LGBM') is None
+
+
+def test_models_stale_is_cleared_only_when_the_active_models_change(tmp_path):
+    """Tests that retraining after a price-history replacement clears models_stale only once every active model is a retrained one."""
+    connector = DBConnector(str(tmp_path / 'test.db'))
+    conn = sqlite3.connect(connector.db_path)
+    conn.executescript(SCHEMA_PATH.read_text(encoding='utf-8'))
+    insert = ("INSERT INTO trained_models (model_name, model_version, ticker_symbol, feature_list, model_object, scaler_object, creation_timestamp) "
+              "VALUES (?, ?, '7203.T', '[]', x'', x'', ?)")
+    for model_name in ('LGBM_up', 'LGBM_down'):
+        conn.execute(insert, (model_name, 1, '2024-01-01 00:00:00'))
+        conn.execute("INSERT INTO model_registry (ticker_symbol, model_name, active_version) VALUES ('7203.T', ?, 1)", (model_name,))
+    mark_stale(conn, '7203.T', 0.5)
+    # Both directions are retrained after the replacement
+    for model_name in ('LGBM_up', 'LGBM_down'):
+        conn.execute(insert, (model_name, 2, '2999-01-01 00:00:00'))
+    conn.commit()
+
+    def models_stale():
+        return conn.execute("SELECT models_stale FROM stale_tickers WHERE ticker_symbol = '7203.T'").fetchone()[0]
+
+    # Retrained but not promoted: the active models still predate the replacement
+    for model_name in ('LGBM_up', 'LGBM_down'):
+        update_model_registry(connector, '7203.T', model_name, 2)
+    assert models_stale() == 1
+
+    update_model_registry(connector, '7203.T', 'LGBM_up', 2, promote=True)
+    assert models_stale() == 1
+    update_model_registry(connector, '7203.T', 'LGBM_down', 2, promote=True)
+    assert models_stale() == 0
+    conn.close()
@@ -0,0 +1,67 @@
+import contextlib
+import io
+import sqlite3
+
+import pytest
+
+# Since we cannot import from the script directory directly, we need to add it to the path
+import sys
+from pathlib import Path
+PROJECT_ROOT = Path(__file__).resolve().parent.parent.parent
+sys.path.append(str(PROJECT_ROOT / 'script'))
+
+import update_economic_data
+from update_economic_data import update_economic_data as run_update
+
+SCHEMA_PATH = PROJECT_ROOT / 'SQL' / 'ensure_schema.sql'
+SERIES = {'CPIAUCSL': 'cpi'}
+STORED_ROWS = [('cpi', '2024-01-01', 300.0), ('cpi', '2024-01-02', 300.0)]
+
+
+@pytest.fixture
+def db_path(tmp_path, monkeypatch):
+    """Creates a database with daily-filled macro rows and points update_economic_data at it."""
+    db_path = str(tmp_path / 'test.db')
+    conn = sqlite3.connect(db_path)
+    conn.executescript(SCHEMA_PATH.read_text(encoding='utf-8'))
+    conn.executemany("INSERT INTO macro_economic_indicators (series_id, indicator_date, value) VALUES (?, ?, ?)", STORED_ROWS)
+    conn.commit()
+    conn.close()
+    monkeypatch.setattr(update_economic_data, 'get_db_connection', lambda: (sqlite3.connect(db_path), None))
+    return db_path
+
+
+def stored_rows(db_path):
+    conn = sqlite3.connect(db_path)
+    try:
+        return conn.execute("SELECT series_id, indicator_date, value FROM macro_economic_indicators ORDER BY indicator_date").fetchall()
+    finally:
+        conn.close()
+
+
+def test_rebuild_keeps_stored_rows_when_the_fetch_fails(db_path, monkeypatch):
+    """Tests that a rebuild whose FRED request fails leaves the stored observations in place."""
+    def fail(fred_series_ids, last_dates, start_date, end_date):
+        raise TimeoutError("FRED timed out")
+
+    monkeypatch.setattr(update_economic_data, 'fetch_fred_series', fail)
+    with contextlib.redirect_stdout(io.StringIO()):
+        run_update(SERIES, rebuild=True)
+
+    assert stored_rows(db_path) == STORED_ROWS
+
+
+def test_rebuild_replaces_stored_rows_with_fetched_observations(db_path, monkeypatch):
+    """Tests that a rebuild fetches every series from the start date and replaces the stored rows in one transaction."""
+    fetched = []
+
+    def fetch(fred_series_ids, last_dates, start_date, end_date):
+        fetched.append(last_dates)
+        return [('cpi', '2024-01-01', 301.0), ('cpi', '2024-02-01', 302.0)]
+
+    monkeypatch.setattr(update_economic_data, 'fetch_fred_series', fetch)
+    with contextlib.redirect_stdout(io.StringIO()):
+        run_update(SERIES, rebuild=True)
+
+    assert fetched == [{}]
+    assert stored_rows(db_path) == [('cpi', '2024-01-01', 301.0), ('cpi', '2024-02-01', 302.0)]
@@ -0,0 +1,83 @@
+import datetime
+import sqlite3
+
+import numpy as np
+import pandas as pd
+import pytest
+
+# Since we cannot import from the script directory directly, we need to add it to the path
+import sys
+from pathlib import Path
+sys.path.append(str(Path(__file__).resolve().parent.parent.parent / 'script'))
+
+SCHEMA_PATH = Path(__file__).resolve().parent.parent.parent / 'SQL' / 'ensure_schema.sql'
+
+from db_connector import date_to_trade_day, datetime64_to_trade_days
+from update_stock_data import PriceRowBuffer, build_price_rows, detect_adjustment_ratio
+
+
+def test_build_price_rows_converts_columns_and_skips_missing_values():
+    """Tests that upsert parameters follow the table column order and rows with missing prices are dropped."""
+    df = pd.DataFrame({
+        # yfinance returns the columns in a different order from the table
+        'Adj Close': [10.0, np.nan, 12.0],
+        'Close': [10.5, 11.5, 12.5],
+        'High': [11.0, 12.0, 13.0],
+        'Low': [9.0, 10.0, 11.0],
+        'Open': [9.5, 10.5, 11.5],
+        'Volume': [100.0, 200.0, 300.0],
+    }, index=pd.to_datetime(['2024-01-04', '2024-01-05', '2024-01-09']))
+
+    rows = build_price_rows('TEST.T', df)
+
+    assert rows == [
+        ('TEST.T', date_to_trade_day(datetime.date(2024, 1, 4)), 9.5, 11.0, 9.0, 10.5, 10.0, 100),
+        ('TEST.T', date_to_trade_day(datetime.date(2024, 1, 9)), 11.5, 13.0, 11.0, 12.5, 12.0, 300),
+    ]
+    assert rows[0][1] == 19726
+    assert all(type(value) in (str, float, int) for row in rows for value in row)
+
+
+def test_detect_adjustment_ratio_requires_a_uniform_shift():
+    """Tests that only a uniform adj-close shift over the stored overlap is treated as a corporate action."""
+    index = pd.to_datetime(['2024-01-04', '2024-01-05', '2024-01-09', '2024-01-10'])
+    stored = dict(zip(datetime64_to_trade_days(index[:3]).tolist(), [100.0, 102.0, 101.0]))
+    fetched = pd.DataFrame({'Adj Close': [98.0, 99.96, 98.98, 97.0]}, index=index)
+
+    # Every stored day moved by the same ratio; the new day (2024-01-10) is ignored
+    assert detect_adjustment_ratio(stored, fetched) == pytest.approx(0.98)
+
+    # Only a single day was revised: a plain change, not a corporate action
+    revised_one_day = pd.DataFrame({'Adj Close': [100.0, 102.0, 99.0, 97.0]}, index=index)
+    assert detect_adjustment_ratio(stored, revised_one_day) is None
+
+    # Unchanged overlap, or no stored rows at all
+    unchanged = pd.DataFrame({'Adj Close': [100.0, 102.0, 101.0, 97.0]}, index=index)
+    assert detect_adjustment_ratio(stored, unchanged) is None
+    assert detect_adjustment_ratio({}, fetched) is None
+
+
+def test_price_row_buffer_marks_tickers_of_a_failed_flush_as_failed():
+    """Tests that a failed transaction writes nothing, reports its tickers as failed and does not affect later flushes."""
+    conn = sqlite3.connect(':memory:')
+    conn.executescript(SCHEMA_PATH.read_text(encoding='utf-8'))
+    conn.execute("""
+        CREATE TRIGGER reject_bad BEFORE INSERT ON daily_stock_prices WHEN NEW.ticker_symbol = 'BAD.T'
+        BEGIN SELECT RAISE(ABORT, 'disk I/O error'); END
+    """)
+    df = pd.DataFrame({column: [10.0, 11.0] for column in ['Open', 'High', 'Low', 'Close', 'Adj Close', 'Volume']},
+                      index=pd.to_datetime(['2024-01-04', '2024-01-05']))
+    buffer = PriceRowBuffer(conn, flush_rows=100)
+
+    buffer.add('GOOD.T', df)
+    buffer.add('BAD.T', df)
+    buffer.flush()
+    assert buffer.failed_tickers == ['GOOD.T', 'BAD.T']
+    assert (buffer.submitted, buffer.written, buffer.rows) == (0, 0, [])
+    assert conn.execute("SELECT COUNT(*) FROM daily_stock_prices").fetchone()[0] == 0
+
+    buffer.add('GOOD.T', df)
+    buffer.flush()
+    assert buffer.failed_tickers == ['GOOD.T', 'BAD.T']
+    assert (buffer.submitted, buffer.written) == (2, 2)
+    conn.close()
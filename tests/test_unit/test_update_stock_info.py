@@ -0,0 +1,55 @@
+import sqlite3
+import threading
+
+import pytest
+
+# Since we cannot import from the script directory directly, we need to add it to the path
+import sys
+from pathlib import Path
+sys.path.append(str(Path(__file__).resolve().parent.parent.parent / 'script'))
+
+import update_stock_info
+from db_connector import DBConnector
+
+SCHEMA_PATH = Path(__file__).resolve().parent.parent.parent / 'SQL' / 'ensure_schema.sql'
+
+
+@pytest.fixture
+def connector(tmp_path):
+    """Creates a database file with the project schema and one recently refreshed ticker."""
+    connector = DBConnector()
+    connector.db_path = str(tmp_path / 'test.db')
+    conn = sqlite3.connect(connector.db_path)
+    conn.executescript(SCHEMA_PATH.read_text(encoding='utf-8'))
+    conn.execute("INSERT INTO stock_info (ticker_symbol, company_name, sector) VALUES ('FRESH.T', 'Fresh', 'Old sector')")
+    conn.execute("INSERT INTO stock_info (ticker_symbol, company_name, sector, updated_at) VALUES ('STALE.T', 'Stale', 'Kept', '2000-01-01')")
+    conn.commit()
+    conn.close()
+    return connector
+
+
+def test_sync_stock_info_skips_fresh_tickers_and_upserts_in_one_batch(connector, monkeypatch):
+    """Tests that recently refreshed tickers are skipped, missing fields keep stored values and failures are reported."""
+    fetched = []
+    lock = threading.Lock()
+
+    def fake_fetch(ticker, cache=None, verbose=True):
+        with lock:
+            fetched.append(ticker)
+        if ticker == 'NONAME.T':
+            return {}
+        return {'longName': f"{ticker} Corp", 'currency': 'JPY'}
+
+    monkeypatch.setattr(update_stock_info, 'fetch_stock_info', fake_fetch)
+    stats = update_stock_info.sync_stock_info(connector, ['FRESH.T', 'STALE.T', 'NEW.T', 'NONAME.T'], ttl_days=7, max_workers=4)
+
+    assert sorted(fetched) == ['NEW.T', 'NONAME.T', 'STALE.T']
+    assert (stats['skipped'], stats['updated'], stats['failed_tickers']) == (1, 2, ['NONAME.T'])
+
+    conn = sqlite3.connect(connector.db_path)
+    rows = {row[0]: row[1:] for row in conn.execute(
+        "SELECT ticker_symbol, company_name, sector, currency, updated_at > '2000-01-01' FROM stock_info")}
+    conn.close()
+    assert rows['STALE.T'] == ('STALE.T Corp', 'Kept', 'JPY', 1)
+    assert rows['NEW.T'] == ('NEW.T Corp', None, 'JPY', 1)
+    assert rows['FRESH.T'][:2] == ('Fresh', 'Old sector')